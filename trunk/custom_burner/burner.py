@@ -30,10 +30,162 @@ import time
 import socket
 import SocketServer
 import optparse
+import threading
+import select
+import errno
+import signal
+import subprocess
 import dbus
 
 import common
 
+# The media each class stands for, as named by UDisks
+# (DriveMediaCompatibility) and by HAL (boolean properties)
+UDISKS_MEDIA = ((common.MEDIA_CLASS_CD, ("optical_cd_r", "optical_cd_rw")),
+                (common.MEDIA_CLASS_DVD, ("optical_dvd_r", "optical_dvd_rw",
+                                          "optical_dvd_plus_r",
+                                          "optical_dvd_plus_rw")),
+                (common.MEDIA_CLASS_DVD_DL, ("optical_dvd_r_dl",
+                                             "optical_dvd_plus_r_dl")))
+HAL_MEDIA = ((common.MEDIA_CLASS_CD, ("storage.cdrom.cdr",)),
+             (common.MEDIA_CLASS_DVD, ("storage.cdrom.dvdr",
+                                       "storage.cdrom.dvdplusr")),
+             (common.MEDIA_CLASS_DVD_DL, ("storage.cdrom.dvdplusrdl",)))
+
+# File systems whose storage may be shared with other burners
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smbfs", "smb3")
+
+
+def findHalDevice(systemBus, device):
+    """Looks for a burner in HAL.
+
+    device: the device file of the drive, or its SCSI address under
+    FreeBSD.
+
+    Returns the tuple (manager, interface, deviceFile): the HAL
+    manager, the interface of the device and its actual device file.
+
+    Raises dbus.exceptions.DBusException or common.BurnerException
+    in case of error.
+    """
+    proxy = systemBus.get_object("org.freedesktop.Hal", 
+                                 "/org/freedesktop/Hal/Manager")
+    manager = dbus.Interface(proxy, "org.freedesktop.Hal.Manager")
+    # First check: FreeBSD requires a SCSI address x,y,z for CAM
+    objectPaths = manager.FindDeviceStringMatch("block.freebsd.cam_path",
+                                                device)
+    if objectPaths:
+        # We are under FreeBSD
+        objectPath = objectPaths[0]
+        isCAMPath = True
+    else:
+        isCAMPath = False
+        objectPath = None
+        objectPaths = manager.FindDeviceStringMatch("block.device",
+                                                    device)
+        if not objectPaths:
+            raise common.BurnerException("Device %s not in HAL database" %
+                                         device)
+        # We only like names containing "storage_serial" because they
+        # are persistent
+        for p in objectPaths:
+            if "storage_serial" in p:
+                objectPath = p
+                break
+        if not objectPath:
+            raise common.BurnerException("Cannot find a suitable device "
+                                         "for %s" % device)
+    drive = systemBus.get_object("org.freedesktop.Hal", objectPath)
+    interface = dbus.Interface(drive, "org.freedesktop.Hal.Device")
+    if isCAMPath:
+        # We need the actual device file
+        deviceFile = interface.GetProperty("block.device")
+    else:
+        deviceFile = device
+    if interface.GetProperty("info.category") != "storage.cdrom":
+        raise common.BurnerException("Device %s is not a CD/DVD drive" %
+                                     deviceFile)
+    if ((not interface.GetProperty("storage.cdrom.cdr")) and
+        (not interface.GetProperty("storage.cdrom.dvdr"))):
+        raise common.BurnerException("Device %s is not a burner" % 
+                                     deviceFile)
+    return (manager, interface, deviceFile)
+
+
+def detectCapabilities(device):
+    """Asks UDisks or HAL which classes of media a drive can burn.
+
+    device: the device file of the drive.
+
+    Returns a list of common.MEDIA_CLASS_* constants, or None if neither
+    UDisks nor HAL could tell."""
+    logger = logging.getLogger("CustomBurnerClient")
+    retval = None
+    try:
+        systemBus = dbus.SystemBus()
+        names = systemBus.list_names()
+        if "org.freedesktop.UDisks" in names:
+            proxy = systemBus.get_object("org.freedesktop.UDisks",
+                                         "/org/freedesktop/UDisks")
+            interface = dbus.Interface(proxy, "org.freedesktop.UDisks")
+            objectPath = interface.FindDeviceByDeviceFile(device)
+            drive = systemBus.get_object("org.freedesktop.UDisks", objectPath)
+            compatibility = drive.Get("", "DriveMediaCompatibility")
+            retval = [mediaClass for (mediaClass, media) in UDISKS_MEDIA
+                      if [m for m in media if m in compatibility]]
+        elif "org.freedesktop.Hal" in names:
+            # The same device that the client burns on
+            (manager, interface, deviceFile) = findHalDevice(systemBus,
+                                                             device)
+            hasMedia = lambda p: interface.PropertyExists(p) and \
+                       interface.GetProperty(p)
+            retval = [mediaClass for (mediaClass, media) in HAL_MEDIA
+                      if [p for p in media if hasMedia(p)]]
+    except (dbus.exceptions.DBusException, common.BurnerException), e:
+        logger.warning("Cannot detect the media of %s: %s" % (device, e))
+    if retval == []:
+        # Nothing known: the server must not think it burns nothing
+        logger.warning("No known media reported for %s: its media are "
+                       "unknown." % device)
+        return None
+    return retval
+
+
+def detectStorage(directory):
+    """Finds out which network storage a directory is on.
+
+    Returns the device the directory is mounted from, like
+    "nas:/export/isos", if it is on a network file system, otherwise (or
+    if /proc/mounts cannot be read) an empty string."""
+    path = os.path.realpath(os.path.expanduser(directory))
+    best = None
+    try:
+        f = open("/proc/mounts")
+        try:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                (device, mountPoint, fsType) = fields[:3]
+                mountPoint = mountPoint.replace("\\040", " ")
+                if path != mountPoint and \
+                       not path.startswith(mountPoint.rstrip("/") + "/"):
+                    continue
+                if best is None or len(mountPoint) >= len(best[1]):
+                    best = (device, mountPoint, fsType)
+        finally:
+            f.close()
+    except IOError:
+        return ""
+    if best is not None and best[2] in NETWORK_FILESYSTEMS:
+        return best[0]
+    return ""
+
+
+class BurnCancelled(Exception):
+    """Raised when the server cancels the iso being worked on."""
+    pass
+
 
 def handshake(connection):
     """Handshake to a server.
@@ -61,6 +213,25 @@ class TCPServer(SocketServer.TCPServer):
     allow_reuse_address = True
 
 
+class ListenerThread(threading.Thread):
+    """Thread that waits continuously for requests from the server, until
+    the burner is quitting, so that jobs can be queued while burning."""
+
+    def __init__(self, tcpServer, burner):
+        """Constructor."""
+        threading.Thread.__init__(self)
+        self.tcpServer = tcpServer
+        self.burner = burner
+
+    def run(self):
+        """Main loop."""
+        while not self.burner.quitting:
+            socks = (self.tcpServer.socket, )
+            a = select.select(socks, (), socks, 1)
+            if len(a[0]) > 0 or len(a[2]) > 0:
+                self.tcpServer.handle_request()
+
+
 class RequestHandler(common.RequestHandler):
     """Handles network requests from the server.
 
@@ -81,8 +252,25 @@ class RequestHandler(common.RequestHandler):
                 date = self.readLine()
                 iso = self.readLine()
                 committer = self.readLine()
-                if burner.hasIso(iso):
-                    burner.queue(date, iso, committer)
+                if not burner.hasIso(iso):
+                    self.request.send(common.MSG_NO_SUCH_ISO + "\n")
+                elif burner.queue(date, iso, committer):
+                    self.request.send(common.MSG_ACK + "\n")
+                else:
+                    self.request.send(common.MSG_QUEUE_FULL + "\n")
+            elif data == common.MSG_REVOKE_BURN:
+                date = self.readLine()
+                iso = self.readLine()
+                committer = self.readLine()
+                if burner.revoke(date, iso, committer):
+                    self.request.send(common.MSG_ACK + "\n")
+                else:
+                    self.request.send(common.MSG_ALREADY_STARTED + "\n")
+            elif data == common.MSG_CANCEL_BURN:
+                date = self.readLine()
+                iso = self.readLine()
+                committer = self.readLine()
+                if burner.cancel(date, iso, committer):
                     self.request.send(common.MSG_ACK + "\n")
                 else:
                     self.request.send(common.MSG_NO_SUCH_ISO + "\n")
@@ -124,16 +312,60 @@ class CustomBurnerClient:
     burnCmdForced: if True, the value of burnCmd must not be rewritten
     by setBurnParameters().
 
+    mediaPollInterval: seconds between two checks of the media in the
+    drive, while idle
+
+    heartbeatInterval: seconds between two heartbeats sent to the server
+    while working, so that it does not take our isos back
+
+    jobs: list of the (date, iso, committer) tuples queued by the server,
+    not started yet
+
+    jobsCondition: condition protecting jobs and the start of a burn
+
+    maxQueue: maximum length of jobs
+
+    isoToBurn, isoDate, isoCommitter: the job being worked on; isoToBurn
+    is False when idle
+
+    cancelled: True if the server cancelled or took back the job being
+    worked on
+
+    writing: True once the burn command has been started on the job being
+    worked on: from then on, the server cannot take the job back
+
+    burnProcess: the subprocess.Popen object of the burn command, while
+    it runs
+
+    capabilities: the classes of media (common.MEDIA_CLASS_*) the drive
+    can burn, as reported to the server
+
+    labels: tuple of (key, value) pairs, the labels reported to the
+    server; jobs can ask for burners with given labels
+
+    storage: name of the shared storage the isos are read from, or an
+    empty string if they are on a local disk. The server limits how many
+    burners read from the same storage at the same time.
+
     You shold immediately call forceBurnCommand() and/or
     setBurnParameters().
     """
 
     def __init__(self, name, isoDirectory, port, serverIP,
-                 serverPort=1234):
+                 serverPort=1234, capabilities=None, labels=(),
+                 storage=None):
         """Initializes the client.
 
         isoDirectory: path to the directory containing the ISO images.
 
+        capabilities: the classes of media the drive can burn; all of them
+        if None.
+
+        labels: the labels of the burner, as (key, value) pairs.
+
+        storage: the shared storage the isos are read from; detected from
+        the mount point of isoDirectory if None.
+
         """
         self.name = name
         self.isoDirectory = os.path.expanduser(isoDirectory)
@@ -144,10 +376,27 @@ class CustomBurnerClient:
         self.device = None
         self.speed = None
         self.isoToBurn = False
+        self.cancelled = False
+        self.writing = False
+        self.burnProcess = None
         self.quitting = False
+        self.mediaPollInterval = 5
+        self.heartbeatInterval = 60
+        self.jobs = []
+        self.jobsCondition = threading.Condition()
+        self.maxQueue = 3
+        if capabilities is None:
+            capabilities = [c for (c, capacity) in common.MEDIA_CLASSES]
+        self.capabilities = capabilities
+        self.labels = labels
         # Initialize logging
         self.logger = logging.getLogger("CustomBurnerClient")
         self.logger.info("Starting")
+        if storage is None:
+            storage = detectStorage(self.isoDirectory)
+            if storage:
+                self.logger.info("Isos are read from %s" % storage)
+        self.storage = storage
         # Scan self.isodirectory for image files.
         self.isos = os.listdir(os.path.expanduser(self.isoDirectory))
         self.logger.debug("I can burn the following isos:" + str(self.isos))
@@ -225,6 +474,23 @@ class CustomBurnerClient:
             if data != common.MSG_ACK:
                 raise common.BurnerException, \
                       "Server doesn't like our isos: \"%s\"" % data
+            sizes = []
+            for iso in self.isos:
+                size = os.path.getsize(os.path.join(self.isoDirectory, iso))
+                sizes.append("%s\t%d" % (iso, size))
+            labels = [common.formatLabels([label]) for label in self.labels]
+            if self.storage:
+                storage = [self.storage]
+            else:
+                storage = [] # Local disk
+            sections = ((common.MSG_CLIENT_ISO_SIZES, sizes, "iso sizes"),
+                        (common.MSG_CLIENT_CAN_BURN, self.capabilities,
+                         "media"),
+                        (common.MSG_CLIENT_LABELS, labels, "labels"),
+                        (common.MSG_CLIENT_STORAGE, storage, "storage"))
+            for (header, lines, what) in sections:
+                if not self.__sendSection(connection, header, lines, what):
+                    break # An older server, that ignores the others
             self.logger.info("Registered to server.")
             connection.close()
         except common.BurnerException, e:
@@ -234,6 +500,35 @@ class CustomBurnerClient:
             self.logger.error(e)
             sys.exit(1)
 
+    def __sendSection(self, connection, header, lines, what):
+        """Sends an optional section of the registration: its header, the
+        number of lines and the lines.
+
+        what: what the section describes, for the messages.
+
+        Returns False if the server closed the connection instead of
+        answering: it is an older version, that registered us with our
+        isos only. The following sections must not be sent.
+
+        Throws BurnerException if the server refuses the section."""
+        try:
+            connection.send("%s\n%d\n" % (header, len(lines)))
+            for line in lines:
+                connection.send(line + "\n")
+            data = connection.readLineOrEnd()
+        except socket.error, e:
+            if e.args[0] not in (errno.EPIPE, errno.ECONNRESET):
+                raise
+            data = None
+        if data is None:
+            self.logger.warning("The server does not know about our %s: it "
+                                "must be an older version." % what)
+            return False
+        if data != common.MSG_ACK:
+            raise common.BurnerException, \
+                  "Server doesn't like our %s: \"%s\"" % (what, data)
+        return True
+
     def hasIso(self, name):
         """Return True if this burner has a copy of an iso file."""
         if name in self.isos:
@@ -243,15 +538,135 @@ class CustomBurnerClient:
                               name)                              
             return False
 
+    def setMaxQueue(self, maxQueue):
+        """Sets how many jobs can wait in the local queue."""
+        self.maxQueue = maxQueue
+
     def queue(self, date, iso, committer):
-        """Get ready to burn."""
-        self.isoToBurn = iso
-        self.isoDate = date
-        self.isoCommitter = committer
+        """Adds a job to the local queue.
+
+        Returns False if the queue is full."""
+        self.jobsCondition.acquire()
+        try:
+            if len(self.jobs) >= self.maxQueue:
+                return False
+            self.jobs.append((date, iso, committer))
+            self.jobsCondition.notify()
+            return True
+        finally:
+            self.jobsCondition.release()
+
+    def revoke(self, date, iso, committer):
+        """Gives a job back to the server, if writing has not started.
+
+        The last job in the local queue matching the parameters is
+        removed; if there is none, the job being worked on is stopped if
+        it matches and it is still waiting for a disc.
+
+        Returns True if the job was found."""
+        self.jobsCondition.acquire()
+        try:
+            for i in range(len(self.jobs) - 1, -1, -1):
+                if self.jobs[i] == (date, iso, committer):
+                    del self.jobs[i]
+                    self.logger.info("The server took back %s for %s." %
+                                     (iso, committer))
+                    return True
+            if self.isoToBurn == iso and self.isoDate == date and \
+                   self.isoCommitter == committer and \
+                   not self.cancelled and not self.writing:
+                self.logger.info("The server took back %s for %s: stop "
+                                 "waiting for a disc." % (iso, committer))
+                self.cancelled = True
+                return True
+            return False
+        finally:
+            self.jobsCondition.release()
+
+    def cancel(self, date, iso, committer):
+        """Drops a job, stopping it if it has been started.
+
+        The job being worked on is stopped if it matches the parameters;
+        otherwise the last matching job in the local queue is removed.
+
+        Returns True if the job was found."""
+        self.jobsCondition.acquire()
+        try:
+            if self.isoToBurn == iso and self.isoDate == date and \
+                   self.isoCommitter == committer and not self.cancelled:
+                self.logger.info("The server cancelled %s for %s: stopping." %
+                                 (iso, committer))
+                self.cancelled = True
+                if self.burnProcess is not None:
+                    try:
+                        # The shell and all the processes it started
+                        os.killpg(self.burnProcess.pid, signal.SIGTERM)
+                    except OSError:
+                        pass # It has just ended
+                return True
+            for i in range(len(self.jobs) - 1, -1, -1):
+                if self.jobs[i] == (date, iso, committer):
+                    del self.jobs[i]
+                    self.logger.info("The server cancelled %s for %s." %
+                                     (iso, committer))
+                    return True
+            return False
+        finally:
+            self.jobsCondition.release()
+
+    def __checkCancelled(self):
+        """Raises BurnCancelled if the server cancelled the job being worked
+        on."""
+        if self.cancelled:
+            raise BurnCancelled
+
+    def __burn(self):
+        """Runs the burn command on isoToBurn.
+
+        Returns the exit status of the command. Raises BurnCancelled if the
+        server cancelled the job before the command started."""
+        self.jobsCondition.acquire()
+        try:
+            self.__checkCancelled()
+            self.writing = True
+            # The command runs in a process group of its own, that
+            # cancel() can stop as a whole
+            self.burnProcess = subprocess.Popen(
+                self.burnCmd % os.path.join(self.isoDirectory,
+                                            self.isoToBurn), shell=True,
+                preexec_fn=os.setpgrp)
+        finally:
+            self.jobsCondition.release()
+        self.__reportBurnStarted()
+        try:
+            return self.burnProcess.wait()
+        finally:
+            self.burnProcess = None
+
+    def __nextJob(self):
+        """Waits for a job and starts working on it.
+
+        Sets isoToBurn, isoDate and isoCommitter. Returns False if the
+        client is quitting instead."""
+        self.jobsCondition.acquire()
+        try:
+            if not self.jobs:
+                self.logger.info("Waiting for server request...")
+            while not self.jobs and not self.quitting:
+                self.jobsCondition.wait(1)
+            if self.quitting:
+                return False
+            (self.isoDate, self.isoToBurn,
+             self.isoCommitter) = self.jobs.pop(0)
+            self.cancelled = False
+            self.writing = False
+            return True
+        finally:
+            self.jobsCondition.release()
+
+    def __findUDisksDevice(self, systemBus):
+        """Returns the UDisks object of our burner.
 
-    def __waitForDiscUDisks(self, systemBus):
-        """Waits for the disc to be inserted using UDisks.
-        
         Raises dbus.exceptions.DBusException or common.BurnerException
         in case of error.
         """
@@ -262,11 +677,20 @@ class CustomBurnerClient:
         device = systemBus.get_object("org.freedesktop.UDisks", 
                                       objectPath)
         mediaCompatibility = device.Get("", "DriveMediaCompatibility")
-        if ((not "optical_cd_r" in mediaCompatibility) or 
-            (not "optical_dvd_r" in mediaCompatibility) or
+        if ((not "optical_cd_r" in mediaCompatibility) and
+            (not "optical_dvd_r" in mediaCompatibility) and
             (not "optical_dvd_plus_r" in mediaCompatibility)):
             raise common.BurnerException("Device %s is not a CD/DVD "
                                          "burner" % self.device)
+        return device
+
+    def __waitForDiscUDisks(self, systemBus):
+        """Waits for the disc to be inserted using UDisks.
+        
+        Raises dbus.exceptions.DBusException or common.BurnerException
+        in case of error.
+        """
+        device = self.__findUDisksDevice(systemBus)
         ready = False
         while not ready:
             if not device.Get("", "DeviceIsOpticalDisc"):
@@ -276,6 +700,7 @@ class CustomBurnerClient:
                                   self.device))
                 while not device.Get("", "DeviceIsOpticalDisc"):
                     time.sleep(1)
+                    self.__checkCancelled()
             if device.Get("", "OpticalDiscIsBlank"):
                 self.logger.info("Blank disc detected in drive.")
                 ready = True
@@ -284,54 +709,20 @@ class CustomBurnerClient:
                                     "Please change it.")
                 while device.Get("", "DeviceIsOpticalDisc"):
                     time.sleep(1)
+                    self.__checkCancelled()
         return # Good device inserted
 
+    def __findHalDevice(self, systemBus):
+        """Looks for our burner in HAL: see findHalDevice()."""
+        return findHalDevice(systemBus, self.device)
+
     def __waitForDiscHal(self, systemBus):
         """Waits for the disc to be inserted using HAL.
         
         Raises dbus.exceptions.DBusException or common.BurnerException
         in case of error.
         """
-        proxy = systemBus.get_object("org.freedesktop.Hal", 
-                                     "/org/freedesktop/Hal/Manager")
-        manager = dbus.Interface(proxy, "org.freedesktop.Hal.Manager")
-        # First check: FreeBSD requires a SCSI address x,y,z for CAM
-        objectPaths = manager.FindDeviceStringMatch("block.freebsd.cam_path",
-                                                    self.device)
-        if objectPaths:
-            # We are under FreeBSD
-            objectPath = objectPaths[0]
-            isCAMPath = True
-        else:
-            isCAMPath = False
-            objectPaths = manager.FindDeviceStringMatch("block.device",
-                                                        self.device)
-            if not objectPaths:
-                raise common.BurnerException("Device %s not in HAL database" %
-                                             self.device)
-            # We only like names containing "storage_serial" because they
-            # are persistent
-            for p in objectPaths:
-                if "storage_serial" in p:
-                    objectPath = p
-                    break
-            if not objectPath:
-                raise common.BurnerException("Cannot find a suitable device "
-                                             "for %s" % self.device)
-        device = systemBus.get_object("org.freedesktop.Hal", objectPath)
-        interface = dbus.Interface(device, "org.freedesktop.Hal.Device")
-        if isCAMPath:
-            # We need the actual device file
-            deviceFile = interface.GetProperty("block.device")
-        else:
-            deviceFile = self.device
-        if interface.GetProperty("info.category") != "storage.cdrom":
-            raise common.BurnerException("Device %s is not a CD/DVD drive" %
-                                         deviceFile)
-        if ((not interface.GetProperty("storage.cdrom.cdr")) and
-            (not interface.GetProperty("storage.cdrom.dvdr"))):
-            raise common.BurnerException("Device %s is not a burner" % 
-                                         deviceFile)
+        (manager, interface, deviceFile) = self.__findHalDevice(systemBus)
         ready = False
         p = "storage.removable.media_available"
         while not ready:
@@ -342,6 +733,7 @@ class CustomBurnerClient:
                                   deviceFile))
                 while not interface.GetProperty(p):
                     time.sleep(1)
+                    self.__checkCancelled()
             # We look for device paths containing the word "empty"
             objectPaths = manager.FindDeviceStringMatch("block.device",
                                                         deviceFile)
@@ -354,6 +746,7 @@ class CustomBurnerClient:
                                     "Please change it.")
                 while interface.GetProperty(p):
                     time.sleep(1)
+                    self.__checkCancelled()
         self.logger.info("Blank disc detected in drive.")
         return # Good device inserted
 
@@ -363,6 +756,8 @@ class CustomBurnerClient:
         If the device was specified, and dbus and udisks are reachable,
         automatically returns when the disc has been inserted. Otherwise,
         just prompts the user.
+
+        Raises BurnCancelled if the server cancels the job meanwhile.
         """
         if self.device is not None:
             try:
@@ -381,18 +776,147 @@ class CustomBurnerClient:
         self.logger.info("Burning %s for %s. "
                          "Please insert disc and press ENTER" % \
                          (self.isoToBurn, self.isoCommitter))
+        while not select.select([sys.stdin], [], [], 1)[0]:
+            self.__checkCancelled()
         sys.stdin.readline()
 
+    def probeMedia(self):
+        """Checks what is inside the drive, without waiting.
+
+        Returns one of the common.MEDIA_* constants. MEDIA_UNKNOWN means
+        that neither UDisks nor HAL could tell."""
+        if self.device is None:
+            return common.MEDIA_UNKNOWN
+        try:
+            systemBus = dbus.SystemBus()
+            names = systemBus.list_names()
+            if "org.freedesktop.UDisks" in names:
+                device = self.__findUDisksDevice(systemBus)
+                if not device.Get("", "DeviceIsOpticalDisc"):
+                    return common.MEDIA_EMPTY
+                elif device.Get("", "OpticalDiscIsBlank"):
+                    return common.MEDIA_BLANK
+                return common.MEDIA_NOT_BLANK
+            elif "org.freedesktop.Hal" in names:
+                (manager, interface,
+                 deviceFile) = self.__findHalDevice(systemBus)
+                if not interface.GetProperty("storage.removable."
+                                             "media_available"):
+                    return common.MEDIA_EMPTY
+                # Blank discs have device paths containing "empty"
+                for path in manager.FindDeviceStringMatch("block.device",
+                                                          deviceFile):
+                    if "empty" in path:
+                        return common.MEDIA_BLANK
+                return common.MEDIA_NOT_BLANK
+        except dbus.exceptions.DBusException, e:
+            self.logger.debug("probeMedia: %s" % e)
+        except common.BurnerException, e:
+            self.logger.debug("probeMedia: %s" % e)
+        return common.MEDIA_UNKNOWN
+
+    def __reportBurnStarted(self):
+        """Tells the server that the job being worked on is being written,
+        so that it will not try to take it back."""
+        try:
+            connection = self.__connectToServer()
+            connection.send("%s\n%s\n%s\n%s\n" %
+                            (common.MSG_BURN_STARTED, self.name,
+                             self.isoToBurn, self.isoCommitter))
+            data = connection.readLine()
+            connection.close()
+            if data != common.MSG_ACK:
+                raise common.BurnerException, \
+                      "Strange data from server: \"%s\"" % data
+        except common.BurnerException, e:
+            self.logger.warning("Cannot report the start of the burn: %s" % e)
+        except socket.error, e:
+            self.logger.warning("Cannot report the start of the burn: %s" % e)
+
+    def __reportMediaState(self, state):
+        """Tells the server what is inside the drive.
+
+        Returns True if the server received the information."""
+        try:
+            connection = self.__connectToServer()
+            connection.send("%s\n%s\n%s\n" %
+                            (common.MSG_MEDIA_STATE, self.name, state))
+            data = connection.readLine()
+            connection.close()
+            if data != common.MSG_ACK:
+                raise common.BurnerException, \
+                      "Strange data from server: \"%s\"" % data
+            self.logger.debug("Media state reported: %s" % state)
+            return True
+        except common.BurnerException, e:
+            self.logger.warning("Cannot report media state: %s" % e)
+        except socket.error, e:
+            self.logger.warning("Cannot report media state: %s" % e)
+        return False
+
+    def __monitorMedia(self):
+        """Reports the state of the media to the server when it changes.
+
+        Runs in its own thread. The drive is not checked while burning: its
+        state is reported again after the burn."""
+        reported = None
+        while not self.quitting:
+            if self.isoToBurn:
+                reported = None
+            else:
+                state = self.probeMedia()
+                if state != reported and self.__reportMediaState(state):
+                    reported = state
+            time.sleep(self.mediaPollInterval)
+
+    def __sendHeartbeats(self):
+        """Tells the server that we are alive while we have work to do.
+
+        Runs in its own thread."""
+        while not self.quitting:
+            time.sleep(self.heartbeatInterval)
+            if not self.isoToBurn and not self.jobs:
+                continue
+            try:
+                connection = self.__connectToServer()
+                connection.send("%s\n%s\n" % (common.MSG_HEARTBEAT,
+                                               self.name))
+                data = connection.readLine()
+                connection.close()
+                if data != common.MSG_ACK:
+                    raise common.BurnerException, \
+                          "Strange data from server: \"%s\"" % data
+            except common.BurnerException, e:
+                self.logger.warning("Cannot send heartbeat: %s" % e)
+            except socket.error, e:
+                self.logger.warning("Cannot send heartbeat: %s" % e)
+
     def live(self):
         """Waits for jobs and does them."""
+        heartbeat = threading.Thread(target=self.__sendHeartbeats)
+        heartbeat.setDaemon(True)
+        heartbeat.start()
+        if self.device is not None:
+            monitor = threading.Thread(target=self.__monitorMedia)
+            monitor.setDaemon(True)
+            monitor.start()
+        listener = ListenerThread(self.tcpServer, self)
+        listener.setDaemon(True)
+        listener.start()
         while not self.quitting:
-            self.logger.info("Waiting for server request...")
-            self.tcpServer.handle_request()
-            if self.isoToBurn:
+            if self.__nextJob():
                 # Burn!
-                self.__waitForDisc()
-                a = os.system(self.burnCmd % os.path.join(self.isoDirectory,
-                                                          self.isoToBurn))
+                try:
+                    self.__waitForDisc()
+                    a = self.__burn()
+                except BurnCancelled:
+                    a = None
+                if self.cancelled:
+                    # The server already forgot about this job
+                    self.logger.info("Stopped working on %s for %s." %
+                                     (self.isoToBurn, self.isoCommitter))
+                    self.isoToBurn = False
+                    continue
                 try:
                     connection = self.__connectToServer()
                     if a == 0:
@@ -410,7 +934,7 @@ class CustomBurnerClient:
                                      self.isoCommitter))
                     data = connection.readLine()
                     if data != common.MSG_ACK:
-                        raise BurnerException, \
+                        raise common.BurnerException, \
                               "Strange data from server: \"%s\"" % data
                     connection.close()
                 except common.BurnerException, e:
@@ -452,7 +976,8 @@ def BurnerMain():
                         directory=".",
                         port=1235,
                         speed=4,
-                        serverport=1234)
+                        serverport=1234,
+                        queue=3)
     parser.add_option("-n", "--name", dest="name", help="sets the burner name")
     parser.add_option("-d", "--dir", dest="directory",
                       help="specifies the directory containing the isos")
@@ -469,6 +994,22 @@ def BurnerMain():
                       help="specifies the hostname or IP address of the server")
     parser.add_option("-t", "--serverport", dest="serverport", type="int",
                       help="specifies the server'sTCP port")
+    parser.add_option("-q", "--queue", dest="queue", type="int",
+                      help="maximum number of isos waiting to be burnt "
+                      "(default: 3)")
+    parser.add_option("-M", "--media", dest="media",
+                      help="comma separated classes of media the drive can "
+                      "burn, among %s (default: detected from the device, "
+                      "or all)" % ", ".join([c for (c, capacity)
+                                             in common.MEDIA_CLASSES]))
+    parser.add_option("-L", "--labels", dest="labels",
+                      help="comma separated labels of the burner, like "
+                      "room=lab2,speed=fast; jobs can ask for burners with "
+                      "given labels")
+    parser.add_option("-B", "--storage", dest="storage",
+                      help="name of the shared storage the isos are read "
+                      "from, or \"\" for a local disk (default: detected "
+                      "from the mount point of the directory)")
     parser.add_option("-v", "--verbose", dest="verbosity",
                       action="count", help="increase verbosity")
     (opts, args) = parser.parse_args()
@@ -503,12 +1044,30 @@ def BurnerMain():
                 sys.exit(1)
             if opts.device is not None:
                 opts.name = "%s-%s" % (opts.name, opts.device)
+        if opts.media is not None:
+            capabilities = [c.strip() for c in opts.media.split(",")]
+            known = [c for (c, capacity) in common.MEDIA_CLASSES]
+            for c in capabilities:
+                if c not in known:
+                    sys.stderr.write("Unknown media class: %s\n" % c)
+                    sys.exit(1)
+        elif opts.device is not None:
+            capabilities = detectCapabilities(opts.device)
+        else:
+            capabilities = None
+        try:
+            labels = common.parseLabels(opts.labels or "")
+        except ValueError, e:
+            sys.stderr.write("%s\n" % e)
+            sys.exit(1)
         burner = CustomBurnerClient(opts.name, opts.directory,
-                                    opts.port, opts.server, opts.serverport)
+                                    opts.port, opts.server, opts.serverport,
+                                    capabilities, labels, opts.storage)
         if opts.command:
             burner.forceBurnCommand(opts.command)
         if opts.device is not None: # There is a default value for opts.speed
             burner.setBurnParameters(opts.device, opts.speed)
+        burner.setMaxQueue(opts.queue)
     except socket.error, e:
         # This may occur during server start
         sys.stderr.write("Socket error: %s\n" % str(e))
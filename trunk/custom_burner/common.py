@@ -47,12 +47,26 @@ class NetworkCommunicator:
     def readLine(self):
         """Read a single line from the socket.
 
-        Returns the read line."""
+        Returns the read line. Throws BurnerException if the peer closes
+        the connection first."""
+        retVal = self.readLineOrEnd()
+        if retVal is None:
+            raise BurnerException, "Connection closed by the peer"
+        return retVal
+
+    def readLineOrEnd(self):
+        """Read a single line from the socket, if the peer sends one.
+
+        Returns the read line, or None if the peer closes the connection
+        first."""
         chunkSize = 16
         socks = (self.request, )
         while "\n" not in self.__data:
             select.select(socks, (), socks) # Avoid busy waiting
-            self.__data += self.request.recv(chunkSize)
+            chunk = self.request.recv(chunkSize)
+            if not chunk:
+                return None
+            self.__data += chunk
         index = self.__data.find("\n")
         retVal = self.__data[:index]
         self.__data = self.__data[(index + 1):]
@@ -121,18 +135,99 @@ MSG_CLIENT_GREETING = "Custom Burner Client"
 MSG_CLIENT_REGISTER = "Please register me"
 # Client is going to list its isos
 MSG_CLIENT_HAS_ISOS = "My isos are:"
+# The sections below are optional, and follow the isos in any order.
+# Servers that do not know them close the connection after the isos.
+# Client is going to list the sizes of its isos, one per line: the name of
+# the iso, a tab and the size in bytes
+MSG_CLIENT_ISO_SIZES = "My iso sizes are:"
+# Client is going to list the media classes its drive can burn
+MSG_CLIENT_CAN_BURN = "I can burn:"
+# Client is going to list its labels, as key=value lines
+MSG_CLIENT_LABELS = "My labels are:"
+# Client tells which shared storage its isos are read from: one line, or
+# none if they are on a local disk
+MSG_CLIENT_STORAGE = "My isos are on:"
 # Server asks the burner to burn something
 MSG_REQUEST_BURN = "Please burn"
 # The burner reports success
 MSG_BURN_SUCCESS = "Burn successful"
 # The burner reports an error
 MSG_BURN_ERROR = "Burn unsuccessful"
+# The burner has a disc and is starting to write an ISO
+MSG_BURN_STARTED = "Writing now"
 # Burner doesn't have an ISO
 MSG_NO_SUCH_ISO = "I don't have it"
+# Burner cannot queue any more ISOs
+MSG_QUEUE_FULL = "I have too much to do"
+# Server takes back an ISO that the burner has not started writing yet
+MSG_REVOKE_BURN = "Do not burn"
+# Burner cannot give an ISO back, because it has already started writing it
+MSG_ALREADY_STARTED = "Too late"
+# Server asks the burner to stop an ISO, even if it is being burnt
+MSG_CANCEL_BURN = "Stop burning"
 # Client or server is closing
 MSG_CLOSING = "Bye bye"
 # Generic acknowledge message
 MSG_ACK = "Ok"
+# The burner reports what is in its drive
+MSG_MEDIA_STATE = "My media is"
+# The burner is still alive and working
+MSG_HEARTBEAT = "Still here"
+
+# Possible states of the media in a drive
+MEDIA_EMPTY = "empty"
+MEDIA_BLANK = "blank"
+MEDIA_NOT_BLANK = "not blank"
+MEDIA_UNKNOWN = "unknown"
+
+# Classes of media, and how many bytes they hold, from the smallest
+MEDIA_CLASS_CD = "cd"
+MEDIA_CLASS_DVD = "dvd"
+MEDIA_CLASS_DVD_DL = "dvd-dl"
+MEDIA_CLASSES = ((MEDIA_CLASS_CD, 737280000),
+                 (MEDIA_CLASS_DVD, 4700372992),
+                 (MEDIA_CLASS_DVD_DL, 8543666176))
+# The class of an iso whose size is unknown: any burner may try it
+MEDIA_CLASS_ANY = "any"
+
+def mediaClassFor(size):
+    """Returns the smallest class of media that can hold an iso.
+
+    size: the size of the iso in bytes, or None if unknown.
+
+    Returns MEDIA_CLASS_ANY if size is None, and None if the iso does not
+    fit on any media."""
+    if size is None:
+        return MEDIA_CLASS_ANY
+    for (mediaClass, capacity) in MEDIA_CLASSES:
+        if size <= capacity:
+            return mediaClass
+    return None
+
+def parseLabels(text):
+    """Parses labels (or selectors of labels) written as
+    "key=value,key=value".
+
+    Returns a tuple of (key, value) pairs sorted by key; it is empty if
+    text is. A key given twice keeps its last value.
+
+    Raises ValueError if an item has no "=" or no key."""
+    labels = {}
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        (key, sep, value) = item.partition("=")
+        key = key.strip()
+        if not sep or not key:
+            raise ValueError, "Invalid label: %s" % item
+        labels[key] = value.strip()
+    return tuple(sorted(labels.items()))
+
+def formatLabels(labels):
+    """Returns labels, a sequence of (key, value) pairs, written as
+    "key=value,key=value"."""
+    return ",".join(["%s=%s" % (key, value) for (key, value) in labels])
 
 # Program version
 version = "0.7"
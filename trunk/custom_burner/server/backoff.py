@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import heapq
+
+
+class BackoffQueue:
+    """The failed jobs that wait for their backoff time, ordered by their
+    "notBefore" field.
+
+    Adding a job and taking out the ones that are due take logarithmic
+    time; finding and removing a job take constant time. The jobs are kept
+    in a heap of (notBefore, sequence number, job) triples, and a dict maps
+    the id() of each job to its sequence number: a removed job stays in
+    the heap until it reaches the top. Iterating goes in notBefore order,
+    and sorts the jobs.
+
+    The "notBefore" field of a job must not change while it is in the
+    queue.
+
+    This class is not thread safe: BurnerManager protects it with its
+    own locks.
+    """
+
+    def __init__(self, jobs=()):
+        """Constructor. jobs: the initial contents."""
+        self.__heap = []
+        self.__jobs = {}
+        self.__sequence = 0
+        for job in jobs:
+            self.push(job)
+
+    def push(self, job):
+        """Adds a job, that must have the field "notBefore"."""
+        if job in self:
+            raise ValueError, "Job already in the queue."
+        self.__sequence += 1
+        self.__jobs[id(job)] = (self.__sequence, job)
+        heapq.heappush(self.__heap, (job["notBefore"], self.__sequence, job))
+
+    def popDue(self, now):
+        """Removes the jobs whose backoff time is not after now, and
+        returns them, the earliest first."""
+        retval = []
+        while self.__heap and self.__heap[0][0] <= now:
+            (notBefore, sequence, job) = heapq.heappop(self.__heap)
+            entry = self.__jobs.get(id(job))
+            if entry is None or entry[0] != sequence:
+                continue # Removed, and maybe added again later
+            del self.__jobs[id(job)]
+            retval.append(job)
+        return retval
+
+    def remove(self, job):
+        """Removes a job. Raises ValueError if it is not in the queue."""
+        if job not in self:
+            raise ValueError, "Job not in the queue."
+        del self.__jobs[id(job)]
+        if len(self.__heap) > 2 * len(self.__jobs) + 64:
+            # Too many removed jobs left in the heap
+            self.__heap = [(job["notBefore"], sequence, job)
+                           for (sequence, job) in self.__jobs.itervalues()]
+            heapq.heapify(self.__heap)
+
+    def __contains__(self, job):
+        """Tells whether job is in the queue."""
+        entry = self.__jobs.get(id(job))
+        return entry is not None and entry[1] is job
+
+    def __iter__(self):
+        """Iterates over the jobs, the earliest first."""
+        entries = self.__jobs.values()
+        entries.sort(key=lambda (sequence, job): (job["notBefore"], sequence))
+        return iter([job for (sequence, job) in entries])
+
+    def __len__(self):
+        """Returns the number of jobs."""
+        return len(self.__jobs)
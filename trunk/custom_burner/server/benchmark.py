@@ -0,0 +1,608 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import gc
+import sys
+import time
+import random
+import shutil
+import os.path
+import tempfile
+import threading
+import optparse
+import cPickle
+
+from custom_burner import common
+from custom_burner.server import scheduler
+from custom_burner.server import estimator
+from custom_burner.server import jobqueue
+from custom_burner.server import reliability
+from custom_burner.server import burnstats
+# burner_manager first: burner imports it back through network
+from custom_burner.server import burner_manager
+from custom_burner.server import burner
+from custom_burner.server import store
+from custom_burner.server import records
+
+
+def makeView(jobsNum, burnersNum, isosNum, isosPerBurner, seed=0):
+    """Builds a synthetic SchedulerView, like the one BurnerManager builds
+    for a dispatch pass where all the burners are idle.
+
+    jobsNum: number of pending isos.
+    burnersNum: number of burners.
+    isosNum: number of isos in the catalog.
+    isosPerBurner: how many isos of the catalog each burner has.
+    seed: seed of the random generator, for repeatable runs."""
+    generator = random.Random(seed)
+    catalog = ["iso%05d.iso" % i for i in range(isosNum)]
+    burners = ["burner%04d" % i for i in range(burnersNum)]
+    durations = estimator.DurationEstimator()
+    holders = {}
+    for burnerName in burners:
+        durations.burnerFactors[burnerName] = generator.uniform(0.5, 2.0)
+        for iso in generator.sample(catalog, isosPerBurner):
+            holders.setdefault(iso, []).append(burnerName)
+    now = time.time()
+    jobs = []
+    preferred = []
+    for i in range(jobsNum):
+        if generator.random() < 0.5:
+            deadline = now + generator.uniform(0, 4 * 60 * 60)
+        else:
+            deadline = None
+        iso = generator.choice(catalog)
+        jobs.append({"id": i + 1,
+                     "date": time.strftime("%Y-%m-%d %H:%M"),
+                     "iso": iso,
+                     "committer": "committer%d" % generator.randint(0, 99),
+                     "priority": generator.randint(0, 3),
+                     "deadline": deadline})
+        if holders.has_key(iso) and generator.random() < 0.2:
+            preferred.append(generator.choice(holders[iso]))
+        else:
+            preferred.append(None)
+    return scheduler.SchedulerView(jobs, burners, holders, preferred,
+                                   durations, now)
+
+
+def timePasses(policy, view, passes):
+    """Runs policy.assign(view) passes times.
+
+    Returns (best, average, assignments): the best and average time of a
+    pass in seconds, and the number of assignments of the last pass."""
+    times = []
+    pairs = []
+    for i in range(passes):
+        start = time.time()
+        pairs = policy.assign(view)
+        times.append(time.time() - start)
+    return (min(times), sum(times) / len(times), len(pairs))
+
+
+class ListQueue:
+    """The pending queue as a plain list, the way BurnerManager kept it
+    before jobqueue.JobQueue, for comparison."""
+
+    def __init__(self, jobs=()):
+        """Constructor."""
+        self.jobs = list(jobs)
+
+    def append(self, job):
+        """Adds a job at the end."""
+        self.jobs.append(job)
+
+    def appendleft(self, job):
+        """Adds a job at the head."""
+        self.jobs.insert(0, job)
+
+    def remove(self, job):
+        """Removes a job, looking for an equal dict."""
+        self.jobs.remove(job)
+
+    def get(self, jobId):
+        """Returns the job with the given id, or None."""
+        for job in self.jobs:
+            if job["id"] == jobId:
+                return job
+        return None
+
+
+def timeQueue(queueClass, jobs, operations, seed=0):
+    """Replays the operations of BurnerManager on its pending queue:
+    operations times, a job is found by id and removed (removeIso(), or
+    a dispatch), a job goes back to the head (a failed burn) and a new
+    job is appended (queueIso()).
+
+    queueClass: jobqueue.JobQueue or ListQueue.
+    jobs: the initial jobs, with distinct ids.
+
+    Returns the average time of an operation, in seconds."""
+    generator = random.Random(seed)
+    queue = queueClass(jobs)
+    ids = [job["id"] for job in jobs]
+    nextId = max(ids) + 1
+    start = time.time()
+    for i in range(operations):
+        job = queue.get(ids[generator.randrange(len(ids))])
+        queue.remove(job)
+        queue.appendleft(job)
+        position = generator.randrange(len(ids))
+        job = queue.get(ids[position])
+        queue.remove(job)
+        newJob = dict(job)
+        newJob["id"] = nextId
+        queue.append(newJob)
+        ids[position] = nextId
+        nextId += 1
+    return (time.time() - start) / (operations * 4)
+
+
+class SimulatedBurner(burner.Burner):
+    """A burner that takes latency seconds to answer each request, and
+    accepts every iso it has, without any network connection."""
+
+    __slots__ = ()
+
+    latency = 0.01
+
+    def __head(self):
+        """Updates free, iso and committer after jobs has changed."""
+        self.free = len(self.jobs) == 0
+        if self.free:
+            (self.iso, self.committer) = ("", None)
+        else:
+            (self.iso, self.committer) = self.jobs[0]
+
+    def __drop(self, iso, committer):
+        """Drops the last job about iso and committer. Returns False if
+        there is none."""
+        for i in range(len(self.jobs) - 1, -1, -1):
+            if self.jobs[i] == (iso, committer):
+                del self.jobs[i]
+                self.__head()
+                return True
+        return False
+
+    def assignIso(self, date, iso, committer):
+        """Appends an iso to the queue of the burner."""
+        time.sleep(self.latency)
+        if iso not in self.isos:
+            return False
+        self.jobs.append((iso, committer))
+        self.__head()
+        return True
+
+    def revokeIso(self, date, iso, committer):
+        """Takes back an iso the burner has not started."""
+        time.sleep(self.latency)
+        if self.jobs and self.jobs[0] == (iso, committer):
+            return False
+        return self.__drop(iso, committer)
+
+    def cancelIso(self, date, iso, committer):
+        """Drops an iso."""
+        time.sleep(self.latency)
+        return self.__drop(iso, committer)
+
+    def close(self):
+        """Says goodbye."""
+        time.sleep(self.latency)
+
+
+class GlobalLockManager:
+    """Serializes every call to a BurnerManager under one lock, that is
+    held while the burners answer: the way the manager worked when all
+    its methods took both isosLock and burnersLock.
+
+    Attributes that are not methods are read without the lock."""
+
+    def __init__(self, manager):
+        """Wraps manager."""
+        self.__manager = manager
+        self.__lock = threading.Lock()
+
+    def __getattr__(self, name):
+        """Returns the attribute name of the manager; methods are wrapped
+        so that they run with the lock held."""
+        attribute = getattr(self.__manager, name)
+        if not callable(attribute):
+            return attribute
+        lock = self.__lock
+        def locked(*args):
+            lock.acquire()
+            try:
+                return attribute(*args)
+            finally:
+                lock.release()
+        return locked
+
+
+def timeContention(burnersNum, threadsNum, seconds, latency,
+                   globalLock=False):
+    """Drives a BurnerManager with simulated burners, that take latency
+    seconds to answer, from several threads at the same time, the way
+    the network server does.
+
+    The burners are split among threadsNum threads: for each of its
+    burners in turn, a thread sends a heartbeat and a media report and,
+    if the burner has an iso, reports that the burn started and was
+    completed, and queues the iso again. Another thread dispatches the
+    isos continuously, waiting for the burners to answer, and another
+    one registers burners and takes them away.
+
+    If globalLock is True, the calls go through a GlobalLockManager, as
+    a baseline.
+
+    The reporting threads never wait for a burner to answer, so they
+    keep the interpreter busy: with more of them the registering thread
+    gets a smaller share of it, and registers fewer burners per second
+    even if it never waits for a lock. Replacing the reports with a loop
+    that does not call the manager at all shows the same drop.
+
+    Returns (reports, registrations, burnt): how many reports,
+    registrations and completed burns per second in seconds seconds."""
+    directory = tempfile.mkdtemp()
+    BM = burner_manager.BurnerManager
+    saved = (BM.dbFileName, BM.journalFileName, BM.historyDirectory,
+             burner_manager.Burner)
+    try:
+        BM.dbFileName = os.path.join(directory, "benchmark.db")
+        BM.journalFileName = os.path.join(directory, "benchmark.journal")
+        BM.historyDirectory = os.path.join(directory, "benchmark.history")
+        # The manager creates its burners by the name Burner of its module
+        burner_manager.Burner = SimulatedBurner
+        return __runContention(BM(), burnersNum, threadsNum, seconds,
+                               latency, globalLock)
+    finally:
+        (BM.dbFileName, BM.journalFileName, BM.historyDirectory,
+         burner_manager.Burner) = saved
+        SimulatedBurner.latency = 0
+        shutil.rmtree(directory)
+
+
+def __runContention(manager, burnersNum, threadsNum, seconds, latency,
+                    globalLock):
+    """Does the work of timeContention() with manager, that uses
+    SimulatedBurner and has nothing to do yet, and closes it."""
+    SimulatedBurner.latency = 0
+    isos = ["iso%d.iso" % i for i in range(10)]
+    names = ["burner%04d" % i for i in range(burnersNum)]
+    for name in names:
+        manager.registerBurner(name, "127.0.0.1", 0, isos)
+    for i in range(2 * burnersNum):
+        manager.queueIso(isos[i % len(isos)], "committer%d" % i)
+    manager.refresh()
+    if globalLock:
+        manager = GlobalLockManager(manager)
+    SimulatedBurner.latency = latency
+    deadline = time.time() + seconds
+    counts = []
+
+    def report(mine):
+        """Sends the reports of the burners in mine until the deadline."""
+        done = 0
+        while time.time() < deadline:
+            for name in mine:
+                manager.renewLease(name)
+                manager.reportMediaState(name, common.MEDIA_BLANK)
+                done += 2
+                jobs = list(manager.burners[name].jobs)
+                if jobs:
+                    (iso, committer) = jobs[0]
+                    manager.reportBurnStarted(name, iso)
+                    manager.reportCompletion(name, iso)
+                    manager.queueIso(iso, committer)
+                    done += 2
+        counts.append(done)
+
+    def dispatch():
+        """Dispatches until the deadline."""
+        while time.time() < deadline:
+            manager.refresh()
+
+    def register():
+        """Registers and takes away burners until the deadline."""
+        done = 0
+        while time.time() < deadline:
+            name = "extra%d" % (done % 10)
+            manager.registerBurner(name, "127.0.0.1", 0, isos[:5])
+            manager.reportClosingBurner(name)
+            done += 1
+        counts.append(-done)
+
+    threads = [threading.Thread(target=report, args=(names[i::threadsNum],))
+               for i in range(threadsNum)]
+    threads.append(threading.Thread(target=register))
+    threads.append(threading.Thread(target=dispatch))
+    queued = manager.nextJobId
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Each completed iso was queued again
+    burnt = manager.nextJobId - queued
+    SimulatedBurner.latency = 0
+    manager.close()
+    reports = sum([count for count in counts if count > 0])
+    registrations = -sum([count for count in counts if count < 0])
+    return (reports / float(seconds), registrations / float(seconds),
+            burnt / float(seconds))
+
+
+class UnsharedBurner(SimulatedBurner):
+    """A SimulatedBurner laid out like the burners before records.Job: it
+    has a dict of its own, and keeps the list of isos and the sizes it
+    registered with, without sharing their names."""
+
+    def __init__(self, name, ip, port, isos, isoSizes=None,
+                 capabilities=None, labels=None, storage=""):
+        """Constructor: see Burner."""
+        SimulatedBurner.__init__(self, name, ip, port, isos, isoSizes,
+                                 capabilities, labels, storage)
+        self.isos = isos
+        self.isoSizes = isoSizes
+
+
+def residentMemory():
+    """Returns the resident memory of the process in bytes, as reported by
+    /proc (0 where there is no /proc)."""
+    gc.collect()
+    try:
+        f = file("/proc/self/statm")
+        try:
+            pages = int(f.read().split()[1])
+        finally:
+            f.close()
+    except (IOError, ValueError, IndexError):
+        return 0
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def writeHistory(burnersNum, isosNum, historyNum, job):
+    """Writes the checkpoint of a manager that has burnt historyNum isos
+    this month, and nothing else, in the files of BurnerManager.
+
+    job is called with the fields of each burnt iso as keyword arguments,
+    and returns what is saved: a records.Job, or a dict like older
+    versions saved. The isos, committers and burners of the jobs are the
+    ones measureMemory() uses."""
+    BM = burner_manager.BurnerManager
+    now = time.time()
+    burnt = []
+    for i in range(historyNum):
+        finished = now - (historyNum - i) / 1000.0
+        started = finished - 600
+        burnt.append(job(id=i + 1,
+                         date=time.strftime("%Y-%m-%d %H:%M",
+                                            time.localtime(started)),
+                         iso="iso%05d.iso" % (i % isosNum),
+                         committer="committer%d" % (i % 100),
+                         priority=0,
+                         deadline=None,
+                         selector=(),
+                         burner="burner%04d" % (i % burnersNum),
+                         started=started,
+                         leaseExpiry=finished + 1800,
+                         writing=finished - 300,
+                         finished=finished))
+    state = {"burners": {}, "pendingIsos": [], "backingOffIsos": [],
+             "isosBeingBurnt": [],
+             "durations": estimator.DurationEstimator(), "sets": {},
+             "nextSetId": 1, "parkedIsos": {},
+             "reliability": reliability.ReliabilityTracker(),
+             "lastBurner": {}, "nextJobId": historyNum + 1,
+             "statistics": burnstats.BurnStatistics()}
+    pickleStore = store.PickleStore(BM.dbFileName, BM.journalFileName,
+                                    BM.historyDirectory)
+    pickleStore.write(pickleStore.encode(state, [], burnt, 0, True))
+    pickleStore.close()
+
+
+def measureMemory(burnersNum, isosNum, historyNum, baseline=False):
+    """Measures how much memory BurnerManager takes for its history and
+    its catalog, the way the server does after a restart.
+
+    A manager loads a checkpoint with historyNum isos burnt this month,
+    written by another process, so that the memory of this one starts
+    clean. Then burnersNum burners register, each with all the isosNum
+    isos of the catalog and their sizes. The names are built again for
+    each burner, as if they came from the network.
+
+    If baseline is True, the history is kept as dicts, and the burners
+    are UnsharedBurner's that the manager does not make share their
+    catalogs, as before records.Job. The index of the sizes is the
+    current one in both cases.
+
+    Returns (history, catalog): the bytes the resident memory grew by
+    after loading the history, and after registering the burners."""
+    directory = tempfile.mkdtemp()
+    BM = burner_manager.BurnerManager
+    saved = (BM.dbFileName, BM.journalFileName, BM.historyDirectory,
+             BM.saveInterval, BM._BurnerManager__shareCatalog,
+             burner_manager.Burner, store.toJob)
+    try:
+        BM.dbFileName = os.path.join(directory, "benchmark.db")
+        BM.journalFileName = os.path.join(directory, "benchmark.journal")
+        BM.historyDirectory = os.path.join(directory, "benchmark.history")
+        # Only the history and the catalog are measured, not the writes
+        BM.saveInterval = 3600
+        SimulatedBurner.latency = 0
+        if baseline:
+            job = dict
+            burner_manager.Burner = UnsharedBurner
+            BM._BurnerManager__shareCatalog = lambda self, burner: None
+            store.toJob = lambda entry: entry
+        else:
+            job = records.Job
+            burner_manager.Burner = SimulatedBurner
+        pid = os.fork()
+        if pid == 0:
+            try:
+                writeHistory(burnersNum, isosNum, historyNum, job)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        start = residentMemory()
+        manager = BM()
+        history = residentMemory() - start
+        for i in range(burnersNum):
+            isos = ["iso%05d.iso" % j for j in range(isosNum)]
+            sizes = dict([(iso, 700 * 1024 * 1024 + j)
+                          for (j, iso) in enumerate(isos)])
+            manager.registerBurner("burner%04d" % i,
+                                   "10.0.%d.%d" % (i / 256, i % 256),
+                                   1234, isos, sizes)
+        catalog = residentMemory() - start - history
+        manager.close()
+        return (history, catalog)
+    finally:
+        (BM.dbFileName, BM.journalFileName, BM.historyDirectory,
+         BM.saveInterval, BM._BurnerManager__shareCatalog,
+         burner_manager.Burner, store.toJob) = saved
+        shutil.rmtree(directory)
+
+
+def inChild(function, *args):
+    """Calls function with args in a child process, and returns what it
+    returns: each measure of the memory starts from a clean process."""
+    (reader, writer) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(reader)
+            os.write(writer, cPickle.dumps(function(*args)))
+        finally:
+            os._exit(0)
+    os.close(writer)
+    data = ""
+    chunk = os.read(reader, 4096)
+    while chunk:
+        data += chunk
+        chunk = os.read(reader, 4096)
+    os.close(reader)
+    os.waitpid(pid, 0)
+    return cPickle.loads(data)
+
+
+def BenchmarkMain():
+    """Main"""
+    parser = optparse.OptionParser(usage="%prog [options] [scheduler...]")
+    parser.set_defaults(jobs=10000, burners=1000, isos=2000,
+                        isosPerBurner=50, passes=5, queue=False,
+                        operations=1000, contention=False, threads=8,
+                        seconds=5, latency=10, memory=False, history=1000000)
+    parser.add_option("-j", "--jobs", dest="jobs", type="int",
+                      help="number of pending isos (default: 10000)")
+    parser.add_option("-b", "--burners", dest="burners", type="int",
+                      help="number of burners (default: 1000)")
+    parser.add_option("-i", "--isos", dest="isos", type="int",
+                      help="number of isos in the catalog (default: 2000)")
+    parser.add_option("-k", "--isos-per-burner", dest="isosPerBurner",
+                      type="int",
+                      help="isos of the catalog each burner has (default: 50)")
+    parser.add_option("-n", "--passes", dest="passes", type="int",
+                      help="dispatch passes per scheduler (default: 5)")
+    parser.add_option("-q", "--queue", dest="queue", action="store_true",
+                      help="time the operations on the pending queue "
+                      "instead of the schedulers, e.g. with -j 50000")
+    parser.add_option("-o", "--operations", dest="operations", type="int",
+                      help="rounds of queue operations (default: 1000)")
+    parser.add_option("-c", "--contention", dest="contention",
+                      action="store_true",
+                      help="measure how many reports from the burners "
+                      "BurnerManager handles from several threads at the "
+                      "same time, e.g. with -b 64")
+    parser.add_option("-t", "--threads", dest="threads", type="int",
+                      help="threads sending reports (default: 8)")
+    parser.add_option("-s", "--seconds", dest="seconds", type="int",
+                      help="duration of each contention run (default: 5)")
+    parser.add_option("-l", "--latency", dest="latency", type="int",
+                      help="milliseconds each simulated burner takes to "
+                      "answer (default: 10)")
+    parser.add_option("-m", "--memory", dest="memory", action="store_true",
+                      help="measure the memory BurnerManager takes for the "
+                      "history and the catalog, e.g. with -b 500 -i 10000")
+    parser.add_option("-y", "--history", dest="history", type="int",
+                      help="burnt isos in the history (default: 1000000)")
+    (opts, args) = parser.parse_args()
+    if opts.memory:
+        print "%d burnt isos, %d burners with %d isos each" % \
+              (opts.history, opts.burners, opts.isos)
+        print "%-10s %-10s %14s %14s" % ("", "jobs", "MB", "bytes each")
+        for (title, baseline) in (("dicts", True), ("records", False)):
+            (history, catalog) = inChild(measureMemory, opts.burners,
+                                         opts.isos, opts.history, baseline)
+            print "%-10s %-10s %14.1f %14.0f" % \
+                  ("history", title, history / 1048576.0,
+                   history / float(max(opts.history, 1)))
+            print "%-10s %-10s %14.1f %14.0f" % \
+                  ("catalog", title, catalog / 1048576.0,
+                   catalog / float(max(opts.burners * opts.isos, 1)))
+        return
+    if opts.contention:
+        print "%d burners answering in %d ms, %d seconds per run" % \
+              (opts.burners, opts.latency, opts.seconds)
+        print "%-12s %-10s %12s %16s %12s" % ("locks", "threads",
+                                               "reports/s",
+                                               "registrations/s", "burnt/s")
+        for (title, globalLock) in (("global", True), ("ordered", False)):
+            for threadsNum in sorted(set([1, opts.threads])):
+                (reports, registrations, burnt) = \
+                          timeContention(opts.burners, threadsNum,
+                                         opts.seconds,
+                                         opts.latency / 1000.0, globalLock)
+                print "%-12s %-10d %12.0f %16.0f %12.0f" % \
+                      (title, threadsNum, reports, registrations, burnt)
+        return
+    if opts.queue:
+        jobs = makeView(opts.jobs, 1, 1, 1).jobs
+        print "%d pending jobs, %d rounds" % (opts.jobs, opts.operations)
+        print "%-30s %14s" % ("queue", "per op (us)")
+        for (name, queueClass) in (("list", ListQueue),
+                                   ("JobQueue", jobqueue.JobQueue)):
+            average = timeQueue(queueClass, jobs, opts.operations)
+            print "%-30s %14.2f" % (name, average * 1000000)
+        return
+    if not args:
+        args = ["fifo", "matching", "edf"]
+    try:
+        policies = [(name, scheduler.createScheduler(name)) for name in args]
+    except ValueError, e:
+        sys.stderr.write("%s\n" % e)
+        sys.exit(1)
+    view = makeView(opts.jobs, opts.burners, opts.isos, opts.isosPerBurner)
+    print "%d jobs, %d burners, %d isos (%d per burner), %d passes" % \
+          (opts.jobs, opts.burners, opts.isos, opts.isosPerBurner, opts.passes)
+    print "%-30s %10s %10s %12s" % ("scheduler", "best (ms)", "avg (ms)",
+                                   "assigned")
+    for (name, policy) in policies:
+        (best, average, assigned) = timePasses(policy, view, opts.passes)
+        print "%-30s %10.1f %10.1f %12d" % (name, best * 1000, average * 1000,
+                                           assigned)
+
+
+if __name__ == "__main__":
+    BenchmarkMain()
@@ -25,12 +25,27 @@ Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 import socket
 import logging
+import copy_reg
 from custom_burner import common
 import network
+import locks
+from records import share
 
-class Burner:
+
+def newBurner():
+    """Returns an empty Burner, that its __setstate__() is going to fill:
+    the pickled burners are created by this function."""
+    return Burner.__new__(Burner)
+
+
+class Burner(object):
     """Represents a burner.
 
+    The variables are kept in slots, and the names of the burner and of
+    its isos are shared (see records.share()). Burners with the same
+    catalog may share their isos and isoSizes too: see
+    BurnerManager.registerBurner().
+
     Instance variables:
 
     name: name, uniquely identifying this burner
@@ -43,45 +58,173 @@ class Burner:
     
     iso: name of the iso being burnt
     
-    isos: list of the isos we can burn
+    isos: tuple of the isos we can burn
+
+    isoSizes: dict iso -> size in bytes, for the isos whose size the
+    burner reported
+
+    capabilities: set of the classes of media (common.MEDIA_CLASS_*) the
+    drive can burn
+
+    labels: dict key -> value of the labels the burner registered with,
+    like {"room": "lab2"}; jobs can ask for burners with given labels
+
+    storage: name of the shared storage the burner reads its isos from,
+    or an empty string for a local disk
     
     committer: the name of the committer for the ISO being burnt
+
+    jobs: list of (iso, committer) tuples, the isos assigned to the
+    burner in the order it burns them. The first one is being burnt, the
+    others are waiting in the queue of the burner.
+
+    media: what the burner reported to have in its drive (one of the
+    common.MEDIA_* constants)
+
+    suspect: True if the burner stopped giving signs of life while
+    working; it gets no isos until it does
+
+    lock: a locks.OrderedLock that protects the variables that change
+    (free, iso, committer, jobs, media and suspect) and serializes the
+    connections to the burner. The other variables never change after
+    the constructor.
     
     logger: logger object
+
+    A burner is pickled with the variables that never change after the
+    constructor, plus suspect: what it is doing is saved with the isos
+    being burnt, and given back by setJobs(). Older versions pickled
+    instances of an old-style class, that cPickle creates by calling the
+    class without arguments: store.loads() creates them with newBurner()
+    instead.
     """
 
-    def __init__(self, name, ip, port, isos):
+    # The variables that are pickled
+    savedFields = ("name", "ip", "port", "isos", "isoSizes", "capabilities",
+                   "labels", "storage", "suspect")
+
+    __slots__ = savedFields + ("free", "iso", "committer", "jobs", "media",
+                               "lock", "logger")
+
+    def __init__(self, name, ip, port, isos, isoSizes=None,
+                 capabilities=None, labels=None, storage=""):
         """Constructor.
 
         name: the name of the burner.
         ip: the IP address.
         port: the TCP port the burner will wait for connections on.
         isos: a list of the isos this burner can burn.
+        isoSizes: dict iso -> size in bytes; may be incomplete.
+        capabilities: the classes of media the drive can burn; all of them
+        if None.
+        labels: dict key -> value of the labels of the burner.
+        storage: the shared storage the isos are read from ("" if local).
         """
-        self.name = name
+        self.name = share(name)
         self.ip = ip
         self.port = int(port)
         self.free = True
-        self.isos = isos
+        self.isos = tuple([share(iso) for iso in isos])
+        if isoSizes is None:
+            isoSizes = {}
+        self.isoSizes = dict([(share(iso), size)
+                              for (iso, size) in isoSizes.iteritems()])
+        if capabilities is None:
+            capabilities = [c for (c, capacity) in common.MEDIA_CLASSES]
+        self.capabilities = set(capabilities)
+        if labels is None:
+            labels = {}
+        self.labels = labels
+        self.storage = share(storage)
         self.iso = ""
         self.committer = None
+        self.jobs = []
+        self.suspect = False
+        self.media = common.MEDIA_UNKNOWN
+        self.lock = locks.OrderedLock("burner %s" % self.name,
+                                      (locks.BURNER, self.name))
         self.logger = logging.getLogger("Burner(%s)" % self.name)
 
+    def __reduce__(self):
+        """Returns how to pickle the burner: a Burner is created by
+        newBurner(), since store.loads() gives that name to the class
+        Burner; the subclasses are created like any new-style object."""
+        if type(self) is Burner:
+            return (newBurner, (), self.__getstate__())
+        return (copy_reg.__newobj__, (type(self), ), self.__getstate__())
+
     def __getstate__(self):
         """Return the state of this object, for serialization."""
-        odict = self.__dict__.copy()
-        del odict["logger"]
+        odict = {}
+        for key in self.savedFields:
+            odict[key] = getattr(self, key)
         return odict
 
     def __setstate__(self, idict):
-        self.__dict__.update(idict)
+        """Restores the state returned by __getstate__(), or saved by an
+        older version. The names are shared again."""
+        for key in self.savedFields:
+            if idict.has_key(key):
+                setattr(self, key, idict[key])
+        self.name = share(self.name)
+        self.isos = tuple([share(iso) for iso in self.isos])
+        self.setJobs([])
+        if not idict.has_key("suspect"):
+            self.suspect = False
+        if not idict.has_key("labels"):
+            self.labels = {}
+        if not idict.has_key("storage"):
+            self.storage = ""
+        if not idict.has_key("capabilities"):
+            self.isoSizes = {}
+            self.capabilities = set([c for (c, capacity)
+                                     in common.MEDIA_CLASSES])
+        self.isoSizes = dict([(share(iso), size)
+                              for (iso, size) in self.isoSizes.iteritems()])
+        self.storage = share(self.storage)
+        # Whatever was in the drive, it may have changed in the meantime
+        self.media = common.MEDIA_UNKNOWN
+        self.lock = locks.OrderedLock("burner %s" % self.name,
+                                      (locks.BURNER, self.name))
         self.logger = logging.getLogger("Burner(%s)" % self.name)
 
+    def setJobs(self, jobs):
+        """Replaces jobs, e.g. with the isos being burnt that the manager
+        restored for this burner.
+
+        jobs: list of (iso, committer) tuples."""
+        self.jobs = list(jobs)
+        self.__updateHead()
+
+    def __updateHead(self):
+        """Updates free, iso and committer after jobs has changed."""
+        self.free = len(self.jobs) == 0
+        if self.free:
+            self.iso = ""
+            self.committer = None
+        else:
+            (self.iso, self.committer) = self.jobs[0]
+
+    def jobFinished(self, iso):
+        """Forgets the first job about iso, because the burner has completed
+        it (successfully or not).
+
+        Returns False if the burner was not working on iso."""
+        for i in range(len(self.jobs)):
+            if self.jobs[i][0] == iso:
+                del self.jobs[i]
+                self.__updateHead()
+                return True
+        return False
+
     def assignIso(self, date, iso, committer):
         """Tries to assign an iso to the burner.
 
+        The iso is appended to the queue of the burner, that may be working
+        on something else.
+
         Returns true if the operation was succesful, that is: the burner is
-        burning."""
+        burning or will burn the iso."""
         try:
             try:
                 connection = common.RequestMaker(self.ip, self.port)
@@ -94,12 +237,17 @@ class Burner:
             data = connection.readLine()
             if data == common.MSG_ACK:
                 retval = True # Succesful!
-                self.free = False
-                self.iso = iso
-                self.committer = committer
+                if self.free:
+                    # The burner will report its media again after the burn
+                    self.media = common.MEDIA_UNKNOWN
+                self.jobs.append((iso, committer))
+                self.__updateHead()
             elif data == common.MSG_NO_SUCH_ISO:
                 self.logger.debug("No such ISO: %s" % iso)
                 retval = False
+            elif data == common.MSG_QUEUE_FULL:
+                self.logger.debug("Queue full, cannot take %s" % iso)
+                retval = False
             else:
                 raise common.BurnerException, \
                       ("Strange data from burner: \"%s\"" % data)
@@ -111,6 +259,76 @@ class Burner:
             retval = False
         return retval
 
+    def revokeIso(self, date, iso, committer):
+        """Tries to take back an iso that the burner has not started writing
+        yet: either still in its queue, or waiting for a disc.
+
+        The last job in the queue about that iso and committer is revoked.
+
+        Returns True if the burner gave the iso back."""
+        retval = False
+        try:
+            connection = common.RequestMaker(self.ip, self.port)
+            network.handshake(connection)
+            connection.send("%s\n%s\n%s\n%s\n" %
+                            (common.MSG_REVOKE_BURN, date, iso, committer))
+            data = connection.readLine()
+            connection.close()
+            if data == common.MSG_ACK:
+                for i in range(len(self.jobs) - 1, -1, -1):
+                    if self.jobs[i] == (iso, committer):
+                        del self.jobs[i]
+                        break
+                self.__updateHead()
+                retval = True
+            elif data == common.MSG_ALREADY_STARTED:
+                self.logger.debug("Too late to revoke %s" % iso)
+            else:
+                raise common.BurnerException, \
+                      ("Strange data from burner: \"%s\"" % data)
+        except common.BurnerException, e:
+            self.logger.error("revokeIso: " + str(e))
+        except socket.error, e:
+            self.logger.error("revokeIso: " + str(e))
+        return retval
+
+    def cancelIso(self, date, iso, committer):
+        """Asks the burner to drop an iso, even if it is burning it.
+
+        If the burner is working on the iso, the burn (or the wait for a
+        disc) is stopped; otherwise the last job in the queue about that
+        iso and committer is dropped.
+
+        Returns True if the burner dropped the iso."""
+        retval = False
+        try:
+            connection = common.RequestMaker(self.ip, self.port)
+            network.handshake(connection)
+            connection.send("%s\n%s\n%s\n%s\n" %
+                            (common.MSG_CANCEL_BURN, date, iso, committer))
+            data = connection.readLine()
+            connection.close()
+            if data == common.MSG_ACK:
+                if self.jobs and self.jobs[0] == (iso, committer):
+                    del self.jobs[0]
+                else:
+                    for i in range(len(self.jobs) - 1, -1, -1):
+                        if self.jobs[i] == (iso, committer):
+                            del self.jobs[i]
+                            break
+                self.__updateHead()
+                retval = True
+            elif data == common.MSG_NO_SUCH_ISO:
+                self.logger.debug("Not working on %s, cannot cancel it" % iso)
+            else:
+                raise common.BurnerException, \
+                      ("Strange data from burner: \"%s\"" % data)
+        except common.BurnerException, e:
+            self.logger.error("cancelIso: " + str(e))
+        except socket.error, e:
+            self.logger.error("cancelIso: " + str(e))
+        return retval
+
     def close(self):
         """Closes the connection with the burner."""
         if not self.free:
@@ -27,9 +27,24 @@ import threading
 import logging
 import time
 import socket
-import cPickle
+import heapq
 
+from custom_burner import common
 from burner import *
+import matching
+import jobqueue
+import records
+import backoff
+import scheduler
+import estimator
+import reliability
+import burnstats
+import store
+import history
+import snapshot
+import locks
+import sqlite_store
+import writer
 
 singleton = None
 
@@ -37,7 +52,47 @@ class BurnerManager:
     """This class manages the burners and the burnings. It tracks the global
     state and talks to each burner. It knows all the isos the burners have.
 
-    This class must also save and restore its internal state.
+    This class must also save and restore its internal state, through a
+    store.Store chosen by storeBackend. Each change is recorded as a list
+    of operations. With "pickle", they are appended to a journal, and
+    every checkpointInterval changes the whole state is written to a
+    checkpoint that replaces the journal; at startup, the operations are
+    replayed on the checkpoint. The isos burnt before the current month
+    are moved from the checkpoint to compressed segments in
+    historyDirectory. With "sqlite", the operations change the rows of
+    the jobs and burners they concern, in the tables of a database; the
+    first time, it imports the state saved by "pickle". Either way, the
+    burnt isos are forgotten once they are written, and read back by
+    getBurntIsos() only when asked for. The writing is done in
+    the background by a writer.WriterThread, which gathers the changes of
+    saveInterval seconds into a single write; flush() waits for it.
+
+    Readers do not need the locks: the getters return the contents of a
+    snapshot.Snapshot, an immutable copy of the state. Each change of the
+    state increases version; the first reader that finds the snapshot
+    older than version takes a new one, which is then shared by all the
+    readers until the next change. The copies of the jobs are made when
+    they change: each operation recorded for the store also goes to a
+    snapshot.QueueView, which publishes the queues as tuples that share
+    what did not change. A new snapshot takes them as they are, and only
+    describes the burners again, so that a change of a burner does not
+    copy the queues.
+
+    Writers use locks.OrderedLock's, that must be acquired in this order:
+    dispatchLock, that lets only one dispatch pass run at a time;
+    the lock of each burner (Burner.lock), for what it is doing and for
+    the connection to it; several of them are acquired in the order of
+    their names;
+    catalogLock, for the burners that are registered and the indexes of
+    their isos and labels;
+    queueLock, for the isos and everything else.
+    A report from a burner only takes its lock and queueLock, so the
+    reports from different burners do not wait for each other. A
+    registration holds catalogLock only as long as it takes to update
+    the indexes of the isos of that burner. While a burner answers, a
+    dispatch pass only holds the lock of that burner. A thread holding
+    no lock may look up a burner in burners, and may read the indexes,
+    a single operation at a time.
 
     The name is the primary key to access the database.
 
@@ -45,52 +100,344 @@ class BurnerManager:
     
     burners: dict of all connected burners, indexed by name
     
-    burnersLock: lock for accessing burners
+    dispatchLock: the lock of the dispatch passes of refresh()
+
+    catalogLock: the lock for burners and for the indexes below, up to
+    storageTokens
 
     isos: a set of all ISOs available
 
-    pendingIsos: a list of dicts {"date", "iso", "committer"}
+    isoClasses: dict iso -> the smallest class of media it fits on
+    (see common.mediaClassFor())
+
+    burnersByClass: dict class of media -> set of the names of the burners
+    whose drives can burn the isos of that class: their drives take media
+    of that class or of a larger one
+
+    burnable: the set of the isos that at least one burner can burn: it
+    has the iso, and its drive takes media large enough
+
+    burnersByLabel: dict (key, value) -> set of the names of the burners
+    that have that label
+
+    burnersByStorage: dict storage -> set of the names of the burners that
+    read their isos from that shared storage
+
+    readTokens: how many burners may read from the same shared storage at
+    the same time (0 for no limit). A burner holds a read token from when
+    it is given an iso until it is idle again.
+
+    storageTokens: dict storage -> number of read tokens, for the storages
+    whose limit is not readTokens
+
+    pendingIsos: a jobqueue.JobQueue of records.Job's, that behave like
+    dicts {"id", "date", "iso", "committer", "priority", "deadline",
+    "selector"} but take less memory; the id is a number
+    that no other job has, by which the journal and the queues find the
+    job; the deadline is in seconds since the epoch, or None; the
+    selector is a tuple of (key, value) pairs, the labels that the burner
+    of the iso must have (empty for any burner)
+
+    isosBeingBurnt: a JobQueue of jobs like pendingIsos, in the order
+    they were assigned, plus "burner", "started" (the time the burner
+    started working on the iso), "leaseExpiry" (the time the burner must
+    give signs of life before) and, once the burner has a disc and
+    reports that it is writing it, "writing" (the time it started
+    writing)
 
-    isosBeingBurnt: a list of dicts {"date", "iso", "committer", "burner"}
+    The isos that belong to a set also have the fields "set" (the key
+    of the set in sets) and "member" (their index inside the set).
 
-    isosLock: a lock for accessing ISO data
+    An iso that failed has the fields "retries" (how many times it
+    failed), "avoid" (the names of the burners that failed it, which are
+    not given it again while another burner has it) and, until its
+    backoff time has passed, "notBefore" (when it can be assigned again):
+    until then it is in backingOffIsos instead of pendingIsos.
+    An iso waiting for the burner that burnt it last has the field
+    "affinityUntil": when it stops waiting and goes to any burner, 0 once
+    it has stopped.
 
-    isosBurnt: like isosBeingBurnt, but contains the completed isos
+    The iso given to a quarantined burner as a probe has the field
+    "probe" until its outcome is known.
+
+    An iso being burnt twice, because of speculative execution, has the
+    field "twin" in both entries: the name of the other burner. The copy
+    that loses the race gets the field "superseded".
+
+    queueLock: the lock for the isos, the sets and what is learned from
+    the burns
+
+    version: a number that increases each time the state changes in a way
+    the readers can see (see getSnapshot() and changedSince())
+
+    isosBurnt: like isosBeingBurnt, but contains the completed isos, with
+    the additional field "finished": when the burner reported the
+    completion. If the store keeps the history, only the ones that have
+    not been written yet.
+
+    nextJobId: the id of the next job to be queued
 
     logger: logger object
+
+    dispatchMode: the name of the scheduler
+
+    scheduler: the scheduler.Scheduler that decides how refresh() assigns
+    the pending isos to the burners
+
+    durations: a DurationEstimator that learns how long burns take
+
+    reliability: a ReliabilityTracker that learns how often each burner
+    fails, and quarantines the worst ones
+
+    statistics: a burnstats.BurnStatistics that counts the burnt isos and
+    the failed burns as they happen (see getStatistics())
+
+    sets: dict of the sets of isos that must be burnt together, indexed by
+    number. Each set is a dict {"date", "committer", "isos", "missing"}:
+    isos is the list of the members, missing the set of the indexes of
+    those that have not been burnt yet.
+
+    nextSetId: number of the next set to be queued
+
+    backingOffIsos: a backoff.BackoffQueue of the failed isos that wait
+    for their backoff time. They are kept out of pendingIsos, and
+    therefore out of the dispatch passes, until wakeRetries() puts them
+    back at its head.
+
+    parkedIsos: dict iso -> list of the entries, like pendingIsos, of the
+    isos that no registered burner can burn. They are kept out of pendingIsos,
+    and therefore out of the dispatch passes, until a burner that has the
+    iso registers. A set has the field "parked": the number of its
+    members that are parked.
+
+    speculative: if True, refresh() starts backup copies of the isos that
+    are taking much longer than expected, when no other iso is waiting
+
+    stragglerFactor: how many times longer than expected an iso must be
+    taking, to be considered a straggler
+
+    pushAhead: how many isos each burner may have in its queue besides
+    the one it is burning. With a queue, a burner can start the next burn
+    as soon as the previous disc is ejected.
+
+    lastBurner: dict iso -> name of the burner that started burning it most
+    recently. That burner has the iso in its page cache, and its operator
+    has the right labels at hand, so it is preferred for the same iso.
+
+    affinityWait: how many seconds an iso may wait for the burner in
+    lastBurner to become free, before going to another burner
+
+    preemptive: if True, refresh() takes back from the burners the isos
+    they have not started writing, to give them the pending isos with
+    higher priority that found no idle burner
     """
 
-    # The file we save the data into
+    # The file we save the checkpoints into
     dbFileName = "custom_burner_server.db"
+
+    # The file the changes since the last checkpoint are appended to
+    journalFileName = "custom_burner_server.journal"
+
+    # The directory the "pickle" backend archives old burnt isos into
+    historyDirectory = "custom_burner_server.history"
+
+    # The database of the "sqlite" backend
+    sqliteFileName = "custom_burner_server.sqlite"
+
+    # How the state is saved: "pickle" (checkpoint and journal) or
+    # "sqlite". It must be set before the manager is created.
+    storeBackends = ("pickle", "sqlite")
+    storeBackend = "pickle"
+
+    # How many changes are appended to the journal before a checkpoint.
+    # Each change contains the operations made since the previous one and
+    # the isos burnt meanwhile, so its size does not depend on the
+    # history; the checkpoint contains the isos burnt in the current
+    # month, the older ones are archived in historyDirectory.
+    checkpointInterval = 1000
+
+    # How many seconds the changes are gathered for, before being written
+    # together (0 to write each one immediately)
+    saveInterval = 1.0
+
+    # How many seconds the slack times projected by getPendingIsos() are
+    # reused for, while the queues do not change
+    slackRefresh = 30
+
+    # The operations whose second item is a job (see __log())
+    jobOperations = frozenset(("queued", "failed", "parked", "assigned",
+                               "updated"))
+
+    # The schedulers that can be chosen by name (see the scheduler module):
+    # "fifo": each iso goes to the first idle burner that accepts it, in
+    # queue order;
+    # "matching": a maximum matching between pending isos and idle burners
+    # is computed, weighted with the priorities of the isos;
+    # "edf": earliest deadline first, giving the fastest burners to the isos
+    # that risk being late.
+    # Other schedulers can be loaded by the full name of their class.
+    dispatchModes = ("fifo", "matching", "edf")
+
+    # Leases: an iso being burnt is given back to the queue if its burner
+    # gives no signs of life before the lease expires. The lease lasts
+    # leaseFactor times the expected duration of the burn plus leaseGrace
+    # seconds (the time to insert a disc), and each heartbeat of the burner
+    # extends it to at least leaseRenewal seconds from then.
+    leaseFactor = 2.0
+    leaseGrace = 10 * 60
+    leaseRenewal = 5 * 60
+
+    # Retries: after its n-th failure an iso waits retryDelay * 2^(n-1)
+    # seconds, but no more than maxRetryDelay, before being assigned again
+    retryDelay = 60
+    maxRetryDelay = 60 * 60
+
+    # Preference among burners, according to what is in their drives: a job
+    # can start immediately on a blank disc, while the other ones have to
+    # wait for somebody to insert (or change) it.
+    mediaRanks = {common.MEDIA_BLANK: 0,
+                  common.MEDIA_UNKNOWN: 1,
+                  common.MEDIA_EMPTY: 2,
+                  common.MEDIA_NOT_BLANK: 3}
     
     def __init__(self):
         self.burners = {}
+        # The burners as the store saves them: the same as burners, but
+        # changed with queueLock held, when the operations are recorded
+        self.__registered = {}
         self.isos = set()
-        self.pendingIsos = []
-        self.isosBeingBurnt = []
+        self.isoClasses = {}
+        self.burnersByClass = {}
+        self.burnable = set()
+        self.burnersByLabel = {}
+        self.burnersByStorage = {}
+        # iso -> set of the names of the burners that have it, and iso ->
+        # dict size -> how many burners reported that size: the indexes
+        # above are updated from them one burner at a time
+        self.__holders = {}
+        self.__sizes = {}
+        self.readTokens = 0
+        self.storageTokens = {}
+        self.pendingIsos = jobqueue.JobQueue()
+        self.isosBeingBurnt = jobqueue.JobQueue()
+        # burner name -> the entries of isosBeingBurnt assigned to it, in
+        # the order of its queue
+        self.__jobsOfBurner = {}
         self.isosBurnt = []
-        self.burnersLock = threading.Lock()
-        self.isosLock = threading.Lock()
+        self.nextJobId = 1
+        # The operations since the last change was saved (see __log())
+        self.__operations = []
+        # How many operations have been recorded: refresh() saves the
+        # state only if it dispatched something
+        self.__logged = 0
+        self.version = 1
+        self.__versionLock = threading.Lock()
+        # Older than any version: the first reader takes a real one
+        self.__snapshot = snapshot.Snapshot(0)
+        # The copies of the queues, for the snapshots
+        self.__queues = snapshot.QueueView()
+        # (queues, time, slack times) of the last projection
+        self.__slackCache = None
+        # True when the next save must write a checkpoint
+        self.__checkpointWanted = False
+        self.dispatchLock = locks.OrderedLock("dispatch", (locks.DISPATCH,))
+        self.catalogLock = locks.OrderedLock("catalog", (locks.CATALOG,))
+        self.queueLock = locks.OrderedLock("queue", (locks.QUEUE,))
         self.logger = logging.getLogger("BurnerManager")
+        self.dispatchMode = "fifo"
+        self.scheduler = scheduler.FifoScheduler()
+        self.durations = estimator.DurationEstimator()
+        self.reliability = reliability.ReliabilityTracker()
+        self.statistics = burnstats.BurnStatistics()
+        # True while the operations read by the store are replayed on a
+        # state saved before the statistics were kept: the burns are
+        # counted from the history afterwards
+        self.__countingHistory = False
+        self.sets = {}
+        self.nextSetId = 1
+        self.speculative = False
+        self.stragglerFactor = 2.0
+        self.pushAhead = 0
+        self.backingOffIsos = backoff.BackoffQueue()
+        self.parkedIsos = {}
+        self.lastBurner = {}
+        self.affinityWait = 0
+        self.preemptive = False
+        # Burners and isos left out of the current dispatch pass by
+        # __dispatchSets()
+        self.__reservedBurners = set()
+        self.__withheldIsos = set()
+        # Burners with longer queues than this are left out of the
+        # current dispatch pass
+        self.__queueDepth = 0
+        # storage -> how many of its burners hold a read token, and the
+        # names of the burners counted there (see __countReader())
+        self.__readers = {}
+        self.__reading = set()
+        # Heap of the (affinityUntil, id(isoData), isoData) of the pending
+        # isos waiting for the burner that burnt them last; entries are
+        # left behind when an iso stops waiting before its time
+        self.__affinityHeap = []
+        # The entries of isosBeingBurnt that the current dispatch pass
+        # found nobody wants any more: they are cancelled after it
+        self.__unwanted = []
         # Read saved data
-        try:
-            self.logger.debug("Loading saved data...")
-            f = file(self.dbFileName, "r+")
-            unpickler = cPickle.Unpickler(f)
-            self.burners = unpickler.load()
-            self.pendingIsos = unpickler.load()
-            self.isosBeingBurnt = unpickler.load()
-            self.isosBurnt = unpickler.load()            
-            f.close()
-            self.__rebuildIsoList()
-        except IOError, e:
-            self.logger.warning("Unable to read saved data from file %s (%s). "
-                                "Starting from scratch." % \
-                                (self.dbFileName, str(e)))
-        except EOFError, e:
-            self.logger.error("Unable to read saved data from file %s "
-                              "(EOFError). Starting from scratch." %
-                              self.dbFileName)
+        pickleStore = store.PickleStore(self.dbFileName,
+                                        self.journalFileName,
+                                        self.historyDirectory,
+                                        self.checkpointInterval)
+        if self.storeBackend == "sqlite":
+            # The state saved by the pickle store is imported the first
+            # time
+            self.__store = sqlite_store.SqliteStore(self.sqliteFileName,
+                                                    pickleStore)
+        elif self.storeBackend == "pickle":
+            self.__store = pickleStore
+        else:
+            raise ValueError, "Unknown storage backend: %s" % \
+                  self.storeBackend
+        (state, self.isosBurnt, operations) = self.__store.load()
+        self.__checkpointWanted = self.__store.rewriteWanted
+        # Without any saved state, the operations count everything
+        self.__countingHistory = len(state) > 0 and \
+                                 not state.has_key("statistics")
+        self.__setLiveState(state)
+        for operation in operations:
+            self.__apply(operation)
+        if self.__countingHistory:
+            self.__countHistory()
+            self.__countingHistory = False
+            self.__checkpointWanted = True
+        self.__registered = dict(self.burners)
+        # How many burnt isos, at the beginning of isosBurnt, have been
+        # written by the store
+        self.__savedBurnt = len(self.isosBurnt)
+        # Each burner gets back the isos being burnt assigned to it
+        for burner in self.burners.values():
+            burner.setJobs([(isoData["iso"], isoData["committer"])
+                            for isoData
+                            in self.__jobsOfBurner.get(burner.name, ())])
+        self.__affinityHeap = [(isoData["affinityUntil"], id(isoData),
+                                isoData)
+                               for isoData in self.pendingIsos
+                               if isoData.get("affinityUntil")]
+        heapq.heapify(self.__affinityHeap)
+        # The burners could not send heartbeats while we were down
+        minimumExpiry = time.time() + self.leaseRenewal
+        for isoData in self.isosBeingBurnt:
+            isoData["leaseExpiry"] = max(isoData.get("leaseExpiry", 0),
+                                         minimumExpiry)
+        self.__queues.load(self.pendingIsos, self.backingOffIsos,
+                           self.parkedIsos, self.isosBeingBurnt,
+                           self.isosBurnt, self.sets)
+        self.__rebuildIsoList()
+        for burner in self.burners.values():
+            self.__countReader(burner)
+        self.__writer = writer.WriterThread(self.__writeState)
+        self.__writer.setInterval(self.saveInterval)
+        if self.__checkpointWanted:
+            # Until then, what was loaded is only in the old format
+            self.__saveState()
 
     def instance():
         """This method creates the instance of the manager and returns it.
@@ -104,78 +451,621 @@ class BurnerManager:
 
     instance = staticmethod(instance)
 
+    def setDispatchMode(self, mode):
+        """Chooses how refresh() assigns isos to burners.
+
+        mode: one of dispatchModes, or the full name of a
+        scheduler.Scheduler subclass.
+
+        Raises ValueError if the mode is not known."""
+        self.setScheduler(scheduler.createScheduler(mode), mode)
+
+    def setScheduler(self, newScheduler, name=None):
+        """Makes refresh() assign isos to burners with a scheduler.Scheduler
+        instance.
+
+        name: the name to show for it; defaults to its name attribute."""
+        if name is None:
+            name = newScheduler.name or newScheduler.__class__.__name__
+        self.logger.info("Using dispatch mode \"%s\"" % name)
+        self.queueLock.acquire()
+        try:
+            self.scheduler = newScheduler
+            self.dispatchMode = name
+        finally:
+            self.queueLock.release()
+
+    def setSpeculative(self, enabled, stragglerFactor=2.0):
+        """Enables or disables the speculative execution of stragglers.
+
+        enabled: if True, when no isos are pending, the isos that have
+        been burning for more than stragglerFactor times their expected
+        duration are also given to an idle burner that has them. The
+        first copy to be completed wins."""
+        self.speculative = enabled
+        self.stragglerFactor = stragglerFactor
+        if enabled:
+            self.logger.info("Speculative execution of stragglers enabled "
+                             "(factor %.1f)." % stragglerFactor)
+
+    def setPushAhead(self, depth):
+        """Sets how many isos each burner may have waiting in its queue,
+        besides the one it is burning.
+
+        With a depth greater than 0, the idle burners can also steal the
+        waiting isos from the queues of the busy ones."""
+        self.pushAhead = depth
+        if depth > 0:
+            self.logger.info("Keeping up to %d isos queued on each burner." %
+                             depth)
+
+    def setAffinityWait(self, seconds):
+        """Sets how long an iso may wait for the burner that burnt it last.
+
+        That burner is always preferred when it can take the iso; with
+        seconds greater than 0, the iso is also kept in the queue while
+        that burner is busy, up to the given time."""
+        self.affinityWait = seconds
+        if seconds > 0:
+            self.logger.info("Isos wait up to %d seconds for the burner that "
+                             "burnt them last." % seconds)
+
+    def setReadTokens(self, tokens, storageTokens=None):
+        """Limits how many burners read from each shared storage at the same
+        time, so that the storage can feed all of them without buffer
+        underruns.
+
+        tokens: the limit for each storage (0 for no limit).
+
+        storageTokens: dict storage -> limit, for the storages with a
+        different limit. The burners with the isos on a local disk are
+        never limited."""
+        self.catalogLock.acquire()
+        try:
+            self.readTokens = tokens
+            if storageTokens is None:
+                storageTokens = {}
+            self.storageTokens = dict(storageTokens)
+        finally:
+            self.catalogLock.release()
+        if tokens > 0:
+            self.logger.info("Up to %d burners read from each shared storage "
+                             "at the same time." % tokens)
+        for (storage, limit) in sorted(self.storageTokens.items()):
+            self.logger.info("Up to %d burners read from %s at the same time." %
+                             (limit, storage))
+
+    def limitsReads(self):
+        """Returns True if the burners reading from a shared storage may have
+        to wait for a read token."""
+        return self.readTokens > 0 or \
+               len([t for t in self.storageTokens.values() if t > 0]) > 0
+
+    def setPreemptive(self, enabled):
+        """Enables or disables preemption.
+
+        enabled: if True, a pending iso that finds no idle burner can take
+        the burner of an iso with lower priority, as long as that burner
+        is only waiting for a disc. The iso it replaces goes back into the
+        queue."""
+        self.preemptive = enabled
+        if enabled:
+            self.logger.info("Isos with higher priority can preempt the "
+                             "burners that are waiting for a disc.")
+
+    def setSaveInterval(self, seconds):
+        """Sets how many seconds the changes of the state are gathered for,
+        before being written to disk together. With 0, each change is
+        written immediately by the thread that makes it."""
+        self.saveInterval = seconds
+        self.__writer.setInterval(seconds)
+        if seconds > 0:
+            self.logger.info("Changes are written to disk every %.1f "
+                             "seconds." % seconds)
+
+    def flush(self, checkpoint=False):
+        """Returns when all the changes made so far are on disk.
+
+        checkpoint: if True, a checkpoint is written even if the journal
+        is still short.
+
+        Must be called with no locks held."""
+        if checkpoint:
+            self.__checkpointWanted = True
+            self.__writer.changed()
+        self.__writer.flush()
+
     def __saveState(self):
-        """Saves the current state to dbFileName."""
-        self.isosLock.acquire()
-        self.burnersLock.acquire()
+        """Tells the writer that the state has changed: it is going to be
+        saved in the background.
+
+        Must be called after the change, with no locks held."""
+        self.__changed()
+        self.__writer.changed()
+
+    def __changed(self):
+        """Increases version, because the state has changed: the current
+        snapshot is stale.
+
+        Must be called after the change, with no locks held."""
+        self.__versionLock.acquire()
+        try:
+            self.version += 1
+        finally:
+            self.__versionLock.release()
+
+    def getSnapshot(self):
+        """Returns a snapshot.Snapshot of the current state.
+
+        No lock is taken. If nothing changed since the last snapshot was
+        taken, it is returned as it is. Otherwise, the new one has the
+        queues that __queues published last, shared with the previous
+        snapshot if they did not change, and the burners as they are at
+        this moment."""
+        current = self.__snapshot
+        version = self.version
+        if current.version == version:
+            return current
+        # Read after version, they have all the changes up to it
+        queues = self.__queues.published
+        retval = snapshot.Snapshot(version, queues, sorted(self.isos),
+                                   self.__describeBurners(), current)
+        # Another reader may have taken a newer one meanwhile: at worst,
+        # it is replaced and taken again
+        if version > self.__snapshot.version:
+            self.__snapshot = retval
+        return retval
+
+    def changedSince(self, version):
+        """Tells whether the state has changed since the given version,
+        e.g. the one of a snapshot."""
+        return self.version != version
+
+    def __writeState(self):
+        """Writes the operations since the previous call, or the whole
+        state, to disk through the store.
+
+        They are encoded with queueLock held, and written after releasing
+        it: the burners are read from __registered, so that the writer
+        does not wait for their locks, nor they for the encoding. Called
+        by the writer, one thread at a time."""
+        self.queueLock.acquire()
         self.logger.debug("Saving current state...")
         try:
-            try:
-                dbFile = file(self.dbFileName, "w")
-                pickler = cPickle.Pickler(dbFile)
-                pickler.dump(self.burners)
-                pickler.dump(self.pendingIsos)
-                pickler.dump(self.isosBeingBurnt)
-                pickler.dump(self.isosBurnt)
-                pickler.clear_memo()
-                dbFile.close()
-            except IOError, e:
-                self.logger.error("Error while saving state: " + str(e))
+            checkpoint = self.__checkpointWanted
+            self.__checkpointWanted = False
+            operations = self.__operations
+            self.__operations = []
+            data = self.__store.encode(self.__liveState(), operations,
+                                       self.isosBurnt, self.__savedBurnt,
+                                       checkpoint)
+            burnt = len(self.isosBurnt)
         finally:
-            self.isosLock.release()
-            self.burnersLock.release()
+            self.queueLock.release()
+        try:
+            self.__store.write(data)
+        except (IOError, OSError), e:
+            self.logger.error("Error while saving state: " + str(e))
+            # The store may lack this change, or end with half of it: the
+            # next save writes the whole state instead
+            self.__checkpointWanted = True
+            return
+        self.queueLock.acquire()
+        try:
+            if self.__store.keepsHistory:
+                del self.isosBurnt[:burnt]
+                self.__queues.forgetBurnt(burnt)
+                burnt = 0
+            self.__savedBurnt = burnt
+        finally:
+            self.queueLock.release()
+
+    def __liveState(self):
+        """Returns the state that the store saves: all of it but the burnt
+        isos. The objects are the manager's own, not copies.
+
+        Must be called with queueLock held."""
+        return {"burners": self.__registered,
+                "pendingIsos": self.pendingIsos,
+                "backingOffIsos": self.backingOffIsos,
+                "isosBeingBurnt": self.isosBeingBurnt,
+                "durations": self.durations,
+                "sets": self.sets,
+                "nextSetId": self.nextSetId,
+                "parkedIsos": self.parkedIsos,
+                "reliability": self.reliability,
+                "lastBurner": self.lastBurner,
+                "nextJobId": self.nextJobId,
+                "statistics": self.statistics}
+
+    def __setLiveState(self, state):
+        """Restores a state loaded by the store. The parts that are
+        missing, because older versions did not save them, keep their
+        current values.
+
+        The jobs saved by older versions are turned into records.Job's
+        and given their ids here; then the whole state must be saved
+        again, since the operations refer to the jobs by id."""
+        self.burners = state.get("burners", self.burners)
+        pendingIsos = [records.toJob(isoData) for isoData
+                       in state.get("pendingIsos", self.pendingIsos)]
+        isosBeingBurnt = [records.toJob(isoData) for isoData
+                          in state.get("isosBeingBurnt", self.isosBeingBurnt)]
+        self.durations = state.get("durations", self.durations)
+        self.sets = state.get("sets", self.sets)
+        self.nextSetId = state.get("nextSetId", self.nextSetId)
+        parkedIsos = state.get("parkedIsos", self.parkedIsos)
+        self.parkedIsos = {}
+        for (iso, entries) in parkedIsos.items():
+            self.parkedIsos[records.share(iso)] = [records.toJob(isoData)
+                                                   for isoData in entries]
+        self.reliability = state.get("reliability", self.reliability)
+        self.lastBurner = dict([(records.share(iso), records.share(name))
+                                for (iso, name) in
+                                state.get("lastBurner",
+                                          self.lastBurner).items()])
+        self.nextJobId = state.get("nextJobId", self.nextJobId)
+        self.statistics = state.get("statistics", self.statistics)
+        for isoData in pendingIsos + isosBeingBurnt:
+            if not isoData.has_key("id"):
+                self.__newJobId(isoData)
+                self.__checkpointWanted = True
+        # The isos waiting for their backoff time are saved among the
+        # pending ones
+        self.backingOffIsos = backoff.BackoffQueue(
+            [isoData for isoData in pendingIsos
+             if isoData.has_key("notBefore")])
+        self.pendingIsos = jobqueue.JobQueue(
+            [isoData for isoData in pendingIsos
+             if not isoData.has_key("notBefore")])
+        self.isosBeingBurnt = jobqueue.JobQueue()
+        self.__jobsOfBurner = {}
+        for isoData in isosBeingBurnt:
+            self.__addBeingBurnt(isoData)
+
+    def __log(self, *operation):
+        """Records an operation, that the next save writes through the store.
+
+        The operations are tuples whose first item tells what happened:
+        ("queued", job, previous id): the job was put in the pending queue
+        after the one with the previous id, or at the head if it is None,
+        wherever it was before;
+        ("failed", job): a burn of the job failed; it waits for its backoff
+        time if it has the field "notBefore";
+        ("parked", job): the job waits for a burner that can burn its iso;
+        ("assigned", job): the job was appended to the isos being burnt;
+        ("updated", job): some fields of the job changed, not its place;
+        ("completed", id) and ("removed", id): the job was burnt, or is not
+        going to be;
+        ("registered", burner): the burner registered with its catalog;
+        ("left", name): the burner went away;
+        ("suspect", name, flag): the burner became suspect, or alive again;
+        ("outcome", name, success, probe, time) and ("probe", name, time):
+        what was told to the ReliabilityTracker;
+        ("duration", iso, name, seconds): what was told to the
+        DurationEstimator;
+        ("lastBurner", iso, name): the burner that burnt the iso last;
+        ("set", set id, set): the set was queued or changed, or is over if
+        set is None;
+        ("counted", iso, name, committer, time, failed): what was told to
+        the BurnStatistics.
+
+        The operations also go to __queues, that applies them to the
+        copies for the snapshots. The job of a job operation is copied,
+        since it may change again before it is saved; the copy is shared
+        by both.
+
+        Must be called right after the change, with queueLock held."""
+        if operation[0] in self.jobOperations:
+            operation = (operation[0], snapshot.copyJob(operation[1])) + \
+                        operation[2:]
+        self.__operations.append(operation)
+        self.__logged += 1
+        self.__queues.apply(operation)
+
+    def __apply(self, operation):
+        """Applies an operation read by the store (see __log()) to the
+        state.
+
+        Must be called while loading the state."""
+        kind = operation[0]
+        if kind in self.jobOperations:
+            # Older versions journalled dicts
+            operation = (kind, records.toJob(operation[1])) + operation[2:]
+        if kind == "queued":
+            (isoData, previous) = operation[1:]
+            self.__takeJob(isoData["id"])
+            if previous is not None:
+                previous = self.pendingIsos.get(previous)
+            self.pendingIsos.insertAfter(isoData, previous)
+        elif kind == "failed":
+            isoData = operation[1]
+            if isoData.has_key("notBefore"):
+                self.__takeJob(isoData["id"])
+                self.backingOffIsos.push(isoData)
+            else:
+                self.__replaceJob(isoData)
+        elif kind == "parked":
+            isoData = operation[1]
+            self.__takeJob(isoData["id"])
+            self.parkedIsos.setdefault(isoData["iso"], []).append(isoData)
+        elif kind == "assigned":
+            isoData = operation[1]
+            self.__takeJob(isoData["id"])
+            self.__addBeingBurnt(isoData)
+        elif kind == "updated":
+            self.__replaceJob(operation[1])
+        elif kind in ("completed", "removed"):
+            self.__takeJob(operation[1])
+        elif kind == "registered":
+            burner = operation[1]
+            self.burners[burner.name] = burner
+        elif kind == "left":
+            self.burners.pop(operation[1], None)
+        elif kind == "suspect":
+            burner = self.burners.get(operation[1])
+            if burner is not None:
+                burner.suspect = operation[2]
+        elif kind == "outcome":
+            self.reliability.record(*operation[1:])
+        elif kind == "probe":
+            self.reliability.probeStarted(*operation[1:])
+        elif kind == "duration":
+            self.durations.record(*operation[1:])
+        elif kind == "lastBurner":
+            self.lastBurner[operation[1]] = operation[2]
+        elif kind == "counted":
+            # The history has the burns, not the failures
+            if operation[5] or not self.__countingHistory:
+                self.statistics.record(*operation[1:])
+        elif kind == "set":
+            (setId, setData) = operation[1:]
+            if setData is None:
+                self.sets.pop(setId, None)
+            else:
+                self.sets[setId] = setData
+            self.nextSetId = max(self.nextSetId, setId + 1)
+        else:
+            self.logger.error("Unknown saved operation: %s" % kind)
+            return
+        if kind in self.jobOperations:
+            self.nextJobId = max(self.nextJobId, operation[1]["id"] + 1)
+
+    def __takeJob(self, jobId):
+        """Takes the job with the given id out of the pending queue, the
+        isos being burnt, the backoff queue or the parked isos, wherever it
+        is.
+
+        Must be called while loading the state."""
+        if jobId >= self.nextJobId:
+            return # A new one
+        isoData = self.pendingIsos.get(jobId)
+        if isoData is not None:
+            self.pendingIsos.remove(isoData)
+            return
+        isoData = self.isosBeingBurnt.get(jobId)
+        if isoData is not None:
+            self.__removeBeingBurnt(isoData)
+            return
+        for isoData in self.backingOffIsos:
+            if isoData["id"] == jobId:
+                self.backingOffIsos.remove(isoData)
+                return
+        for (iso, jobs) in self.parkedIsos.items():
+            for isoData in jobs:
+                if isoData["id"] == jobId:
+                    jobs.remove(isoData)
+                    if not jobs:
+                        del self.parkedIsos[iso]
+                    return
+
+    def __replaceJob(self, isoData):
+        """Puts isoData in the place of the job with the same id.
+
+        Must be called while loading the state."""
+        jobId = isoData["id"]
+        if self.pendingIsos.get(jobId) is not None:
+            self.pendingIsos.replace(isoData)
+            return
+        old = self.isosBeingBurnt.get(jobId)
+        if old is not None:
+            self.isosBeingBurnt.replace(isoData)
+            jobs = self.__jobsOfBurner[old["burner"]]
+            jobs[jobs.index(old)] = isoData
+            return
+        jobs = self.parkedIsos.get(isoData["iso"], [])
+        for i in range(len(jobs)):
+            if jobs[i]["id"] == jobId:
+                jobs[i] = isoData
+                return
+        for old in self.backingOffIsos:
+            if old["id"] == jobId:
+                self.backingOffIsos.remove(old)
+                self.backingOffIsos.push(isoData)
+                return
+
+    def __newJobId(self, isoData):
+        """Gives a job its id.
+
+        Must be called with queueLock held, or while loading the state."""
+        isoData["id"] = self.nextJobId
+        self.nextJobId += 1
+
+    def __queue(self, isoData, previous):
+        """Puts an entry into pendingIsos right after previous, another
+        entry, or at the head if previous is None.
+
+        Must be called with queueLock held, and isoData must not be in
+        pendingIsos."""
+        self.pendingIsos.insertAfter(isoData, previous)
+        if previous is not None:
+            previous = previous["id"]
+        self.__log("queued", isoData, previous)
+
+    def __addBeingBurnt(self, isoData):
+        """Adds an entry to isosBeingBurnt, at the end of the queue of its
+        burner.
+
+        Must be called with queueLock held, or while loading the state."""
+        self.isosBeingBurnt.append(isoData)
+        self.__jobsOfBurner.setdefault(isoData["burner"], []).append(isoData)
+
+    def __addBurnt(self, isoData):
+        """Adds an entry to isosBurnt, and its copy to __queues, and counts
+        it in the statistics.
+
+        Must be called with queueLock held."""
+        self.isosBurnt.append(isoData)
+        self.__queues.addBurnt(snapshot.copyJob(isoData))
+        self.__count(isoData["iso"], isoData["burner"],
+                     isoData["committer"], isoData["finished"], False)
+
+    def __count(self, iso, burnerName, committer, when, failed):
+        """Counts a burn in the statistics (see BurnStatistics.record()).
+
+        Must be called with queueLock held."""
+        self.statistics.record(iso, burnerName, committer, when, failed)
+        self.__log("counted", iso, burnerName, committer, when, failed)
+
+    def __countHistory(self):
+        """Counts the burnt isos saved before the statistics were kept. The
+        whole history is read, but only once: after that, the statistics
+        are saved with the state.
+
+        The failures of that time are not known.
+
+        Must be called while loading the state."""
+        burnt = list(self.isosBurnt)
+        if self.__store.keepsHistory:
+            burnt = self.__store.history() + burnt
+        for isoData in burnt:
+            self.statistics.recordBurn(isoData)
+        if burnt:
+            self.logger.info("Counted the %d isos burnt before the "
+                             "statistics were kept." % len(burnt))
+
+    def __removeBeingBurnt(self, isoData):
+        """Removes an entry from isosBeingBurnt.
+
+        Must be called with queueLock held, or while loading the state."""
+        self.isosBeingBurnt.remove(isoData)
+        jobs = self.__jobsOfBurner[isoData["burner"]]
+        jobs.remove(isoData) # The queue of a burner is short
+        if not jobs:
+            del self.__jobsOfBurner[isoData["burner"]]
+
+    def __setChanged(self, setId):
+        """Records that the set setId has changed, or is over.
+
+        Must be called with queueLock held."""
+        self.__log("set", setId, self.sets.get(setId))
 
     def getIsos(self):
         """Returns a sorted list containing all the isos all the burners 
         have."""
-        retval = []
-        self.isosLock.acquire()
-        try:
-            retval = list(self.isos)
-            retval.sort()
-        finally:
-            self.isosLock.release()
+        return list(self.getSnapshot().isos)
+
+    def getPendingIsos(self, withSlack=False):
+        """Returns the list of isos waiting to be burnt, from the current
+        snapshot: the entries are shared, and must not be modified.
+
+        The list is in the same form as the local attribute pendingIsos.
+        The isos waiting for their backoff time come first, and the
+        parked isos come last, with the additional field "parked".
+
+        withSlack: if True, the entries are copies that also have a field
+        "slack": the number of seconds between its projected completion
+        and its deadline (negative if it is projected to be late), or
+        None if it has no deadline. The projection is based on the
+        learned burn durations and on the order of the current dispatch
+        mode."""
+        current = self.getSnapshot()
+        retval = list(current.pendingIsos)
+        if withSlack:
+            slacks = self.__slacksFor(current)
+            retval = [dict(isoData, slack=slack) for (isoData, slack)
+                      in zip(retval, slacks)]
         return retval
 
-    def getPendingIsos(self):
-        """Returns a copy of the list of isos waiting to be burnt.
+    def __slacksFor(self, current):
+        """Returns the projected slack times of the entries of
+        current.pendingIsos (None for the ones waiting for their backoff
+        time and the parked ones).
 
-        The list is in the same form as the local attribute isos."""
-        retval = []
-        self.isosLock.acquire()
+        The projection depends on the time, therefore it is not part of
+        the snapshot: it is repeated if the queues have changed, or if it
+        is older than slackRefresh seconds. The changes of the burners
+        alone, e.g. of their media, do not make it older."""
+        now = time.time()
+        cache = self.__slackCache
+        if cache is not None and cache[0] is current.queues and \
+           now - cache[1] < self.slackRefresh:
+            return cache[2]
+        self.catalogLock.acquire()
+        self.queueLock.acquire()
         try:
-            for iso in self.pendingIsos:
-                retval.append(dict(iso))
+            slacks = self.__projectSlack(current.pendingIsos, now)
         finally:
-            self.isosLock.release()
+            self.queueLock.release()
+            self.catalogLock.release()
+        self.__slackCache = (current.queues, now, slacks)
+        return slacks
+
+    def getBurntIsos(self, committer=None, iso=None, burner=None,
+                     since=None, limit=None):
+        """Returns the list of isos already burnt, oldest first. The
+        entries must not be modified.
+
+        The list is in the same form as the local attribute isosBurnt.
+        Only the isos with the given committer, iso and burner, completed
+        not before since (seconds since the epoch), are returned; limit
+        keeps only the most recent ones."""
+        retval = [isoData for isoData in self.getSnapshot().burnt
+                  if history.matches(isoData, committer, iso, burner, since)]
+        if self.__store.keepsHistory and \
+           (limit is None or len(retval) < limit):
+            # The ones that are in the database already. The ones of the
+            # snapshot may have been written meanwhile: then they are also
+            # the last ones of written.
+            written = self.__store.history(committer, iso, burner, since,
+                                           limit)
+            overlap = min(len(written), len(retval))
+            while overlap > 0 and written[-overlap:] != retval[:overlap]:
+                overlap -= 1
+            retval = written[:len(written) - overlap] + retval
+        if limit is not None:
+            retval = retval[-limit:]
         return retval
 
-    def getBurntIsos(self):
-        """Returns a copy of the list of isos already burnt.
+    def getStatistics(self):
+        """Returns a copy of the burnstats.BurnStatistics of the manager.
 
-        The list is in the same form as the local attribute isosBurnt."""
-        retval = []
-        self.isosLock.acquire()
+        It takes a time proportional to the number of isos, burners,
+        committers, hours and days counted, not to the length of the
+        history."""
+        self.queueLock.acquire()
         try:
-            for iso in self.isosBurnt:
-                retval.append(dict(iso))
+            return self.statistics.copy()
         finally:
-            self.isosLock.release()
-        return retval
-
+            self.queueLock.release()
 
     def getIsosBeingBurnt(self):
-        """Returns a copy of the list of isos being burnt.
+        """Returns the list of isos being burnt, from the current snapshot:
+        the entries are shared, and must not be modified.
 
         The list is in the same form as the local attribute isosBeingBurnt."""
-        retval = []
-        self.isosLock.acquire()
-        try:
-            for iso in self.isosBeingBurnt:
-                retval.append(dict(iso))
-        finally:
-            self.isosLock.release()
-        return retval
+        return list(self.getSnapshot().isosBeingBurnt)
+
+    def getSets(self):
+        """Returns a list of the sets of isos that are not complete yet.
+
+        The list contains dict's with the following fields:
+        \"set\"       : number of the set;
+        \"date\"      : when it was queued;
+        \"committer\" : for whom;
+        \"isos\"      : list of the members;
+        \"burnt\"     : number of members already burnt."""
+        return list(self.getSnapshot().sets)
 
     def getBurners(self):
         """Returns a list of the registered burners.
@@ -185,105 +1075,696 @@ class BurnerManager:
         \"ip\"        : IP address
         \"port\"      : TCP port
         \"iso\"       : iso the burner is currently burning (or None)
-        \"committer\" : the committer of the iso (or None)"""
+        \"committer\" : the committer of the iso (or None)
+        \"media\"     : what the burner has in its drive
+        \"queued\"    : number of isos waiting in the queue of the burner
+        \"suspect\"   : True if the burner stopped giving signs of life
+        \"capabilities\" : sorted list of the classes of media it can burn
+        \"labels\"    : sorted list of the (key, value) pairs of its labels
+        \"storage\"   : the shared storage it reads its isos from ("" if
+        local)
+        \"failureRate\" : estimated probability that a burn fails
+        \"quarantined\" : True if the burner fails too often, and only
+        receives probe isos"""
+        return list(self.getSnapshot().burners)
+
+    def __describeBurners(self):
+        """Returns the list for getBurners().
+
+        Needs no lock: burners.values(), like sorted(isos), copies the
+        dict before any other thread can change it."""
         retval = []
-        self.burnersLock.acquire()
-        try:
-            for burner in self.burners.values():
-                entry = {"name":burner.name, "ip":burner.ip, "port":burner.port}
-                if burner.free:
-                    entry["iso"] = entry["committer"] = None
-                else:
-                    entry["iso"] = burner.iso
-                    entry["committer"] = burner.committer                    
-                retval.append(entry)
-        finally:
-            self.burnersLock.release()
+        for burner in self.burners.values():
+            entry = {"name":burner.name, "ip":burner.ip, "port":burner.port,
+                     "media":burner.media,
+                     "queued":max(0, len(burner.jobs) - 1),
+                     "suspect":burner.suspect,
+                     "capabilities":sorted(burner.capabilities),
+                     "labels":sorted(burner.labels.items()),
+                     "storage":burner.storage,
+                     "failureRate":
+                     self.reliability.failureRate(burner.name),
+                     "quarantined":
+                     self.reliability.isQuarantined(burner.name)}
+            if burner.free:
+                entry["iso"] = entry["committer"] = None
+            else:
+                entry["iso"] = burner.iso
+                entry["committer"] = burner.committer                    
+            retval.append(entry)
         return retval
 
-    def registerBurner(self, burnerName, burnerIP, burnerPort, isos):
-        """Register a burner and its isos."""
-        self.burnersLock.acquire()
+    def registerBurner(self, burnerName, burnerIP, burnerPort, isos,
+                       isoSizes=None, capabilities=None, labels=None,
+                       storage=""):
+        """Register a burner and its isos.
+
+        isoSizes: dict iso -> size in bytes, for the isos whose size is
+        known.
+
+        capabilities: the classes of media the drive can burn (all of them
+        if None).
+
+        labels: dict key -> value of the labels of the burner.
+
+        storage: the shared storage the burner reads its isos from ("" if
+        they are on a local disk)."""
+        newBurner = Burner(burnerName, burnerIP, burnerPort, isos, isoSizes,
+                           capabilities, labels, storage)
+        while True:
+            oldBurner = self.__lockBurner(burnerName)
+            self.catalogLock.acquire()
+            if self.burners.get(burnerName) is oldBurner:
+                break
+            # Another thread registered it meanwhile
+            self.catalogLock.release()
+            if oldBurner is not None:
+                oldBurner.lock.release()
         try:
-            # If another burner with the same name was registered, we
-            # warn the user and overwrite it
-            if self.burners.has_key(burnerName):
+            self.burners[burnerName] = newBurner
+            lost = []
+            if oldBurner is not None:
+                # If another burner with the same name was registered, we
+                # warn the user and overwrite it
                 self.logger.warning("Burner %s is already registered" %
                                     burnerName)
-                if not self.burners[burnerName].free:
-                    missingISO = self.burners[burnerName].iso
+                lost = self.__removeFromCatalog(oldBurner)
+            self.__addToCatalog(newBurner)
+            self.queueLock.acquire()
+            try:
+                self.__registered[burnerName] = newBurner
+                self.__log("registered", newBurner)
+                if oldBurner is not None:
+                    self.__forgetReader(oldBurner)
+                if oldBurner is not None and not oldBurner.free:
+                    missingJobs = oldBurner.jobs[:]
                     self.logger.warning("Burner %s was working on %s. "
                                         "Assuming it was NOT burnt." %
-                                        (burnerName, missingISO, ))
-                    self.burnersLock.release() # We need to release the lock
-                    try:
-                        self.reportBurningError(burnerName, missingISO)
-                    finally:
-                        # Better to re-acquire it otherwise the other finally
-                        # clause could give error
-                        self.burnersLock.acquire()
-            self.burners[burnerName] = Burner(burnerName, burnerIP,
-                                              burnerPort, isos)
+                                        (burnerName, ", ".join(
+                        [job[0] for job in missingJobs])))
+                    self.__requeueJobs(oldBurner, missingJobs)
+                self.__unpark(isos)
+                # It may have lost some isos
+                self.__parkOrphans([iso for iso in lost
+                                    if iso not in self.burnable])
+            finally:
+                self.queueLock.release()
         finally:
-            self.burnersLock.release()
-        self.__rebuildIsoList()        
+            self.catalogLock.release()
+            if oldBurner is not None:
+                oldBurner.lock.release()
         self.__saveState()
 
     def close(self):
         """Close the connection with all the burners.
 
         Informs the burners that the server is exiting."""
-        self.burnersLock.acquire()
+        burners = self.__lockAll()
         try:
+            self.burners.clear()
+            self.__registered.clear()
+            for burner in burners:
+                # They register again when the server is back
+                self.__log("left", burner.name)
+        finally:
+            self.queueLock.release()
+            self.catalogLock.release()
+        for burner in burners:
             try:
-                while True:
-                    (temp, burner) = self.burners.popitem()
-                    burner.close()
-            except KeyError:
-                pass # We popped out all the burners
+                burner.close()
+            finally:
+                burner.lock.release()
+        self.flush(checkpoint=True)
+        self.__writer.stop()
+        self.__store.close()
+
+    def __lockBurner(self, burnerName):
+        """Returns the registered burner with the given name, after
+        acquiring its lock, or None if there is no such burner.
+
+        Must be called with no locks held, or with dispatchLock only."""
+        while True:
+            burner = self.burners.get(burnerName)
+            if burner is None:
+                return None
+            burner.lock.acquire()
+            if self.burners.get(burnerName) is burner:
+                return burner
+            # It registered again while we were waiting
+            burner.lock.release()
+
+    def __lockAll(self):
+        """Acquires all the locks but dispatchLock, in order, so that
+        nothing changes.
+
+        Returns the burners whose locks were acquired, sorted by name;
+        they are released one by one, after queueLock and catalogLock.
+
+        Must be called with no locks held."""
+        while True:
+            burners = self.__sortedBurners()
+            for burner in burners:
+                burner.lock.acquire()
+            self.catalogLock.acquire()
+            if map(id, self.__sortedBurners()) == map(id, burners):
+                break
+            # A burner registered or left meanwhile
+            self.catalogLock.release()
+            for burner in burners:
+                burner.lock.release()
+        self.queueLock.acquire()
+        return burners
+
+    def __sortedBurners(self):
+        """Returns the list of the registered burners, sorted by name."""
+        return [burner for (name, burner) in sorted(self.burners.items())]
+
+    def reportMediaState(self, burnerName, state):
+        """Records what a burner has in its drive.
+
+        state: one of the common.MEDIA_* constants.
+
+        Idle clients repeat their state now and then: only a change is
+        recorded, and makes the snapshot stale. What is in the drive is
+        not saved: the state is saved only when a suspect burner comes
+        back to life."""
+        burner = self.__lockBurner(burnerName)
+        if burner is None:
+            self.logger.error("Burner %s was not known!" % burnerName)
+            return
+        changed = False
+        try:
+            revived = self.__burnerAlive(burner)
+            if burner.media != state:
+                burner.media = state
+                changed = True
         finally:
-            self.burnersLock.release()
-        self.__saveState()
+            burner.lock.release()
+        if revived:
+            self.__saveState()
+        elif changed:
+            self.__changed()
+
+    def renewLease(self, burnerName):
+        """Records a heartbeat of a burner: extends the lease of the iso it
+        is burning.
+
+        Heartbeats are frequent: the state is saved, and the snapshot
+        made stale, only when a suspect burner comes back to life. The
+        renewed leases are not shown by the snapshots, and the saved ones
+        are extended anyway when they are loaded."""
+        burner = self.__lockBurner(burnerName)
+        if burner is None:
+            self.logger.error("Heartbeat from unknown burner %s" %
+                              burnerName)
+            return
+        try:
+            revived = self.__burnerAlive(burner)
+            expiry = time.time() + self.leaseRenewal
+            self.queueLock.acquire()
+            try:
+                jobs = self.__jobsOfBurner.get(burnerName)
+                if jobs:
+                    # Only the first one is being burnt
+                    jobs[0]["leaseExpiry"] = max(jobs[0].get("leaseExpiry",
+                                                             0), expiry)
+            finally:
+                self.queueLock.release()
+        finally:
+            burner.lock.release()
+        if revived:
+            self.__saveState()
+
+    def reapExpiredLeases(self):
+        """Puts back into the queue the isos of the burners whose leases have
+        expired, and marks those burners as suspect.
+
+        The isos whose burners are not registered any more go back into
+        the queue too.
+
+        Returns the number of isos put back into the queue."""
+        now = time.time()
+        retval = 0
+        # The last entry put back into the queue: the next ones go after it
+        last = None
+        self.catalogLock.acquire()
+        self.queueLock.acquire()
+        try:
+            expired = []
+            for (name, jobs) in self.__jobsOfBurner.items():
+                if self.burners.has_key(name):
+                    if jobs[0].get("leaseExpiry", now) < now:
+                        expired.append(name)
+                    continue
+                for isoData in list(jobs):
+                    self.logger.warning("ISO %s for %s was assigned to "
+                                        "unknown burner %s: putting it back "
+                                        "into the queue." %
+                                        (isoData["iso"], isoData["committer"],
+                                         name))
+                    self.__removeBeingBurnt(isoData)
+                    self.__queue(isoData, last)
+                    last = isoData
+                    retval += 1
+        finally:
+            self.queueLock.release()
+            self.catalogLock.release()
+        for name in sorted(expired):
+            burner = self.__lockBurner(name)
+            if burner is None:
+                continue # It left meanwhile
+            try:
+                self.queueLock.acquire()
+                try:
+                    jobs = self.__jobsOfBurner.get(name)
+                    if not jobs or jobs[0].get("leaseExpiry", now) >= now:
+                        continue # It reported meanwhile
+                    self.logger.warning("Burner %s gave no signs of life "
+                                        "while burning %s for %s: it is now "
+                                        "suspect, and its isos go back into "
+                                        "the queue." %
+                                        (name, burner.iso, burner.committer))
+                    burner.suspect = True
+                    self.__log("suspect", name, True)
+                    self.__recordOutcome(name, False, jobs[0])
+                    if last is not None and last not in self.pendingIsos:
+                        last = None # Removed meanwhile
+                    for (iso, committer) in burner.jobs[:]:
+                        isoData = self.__burnFailed(burner, iso, last)
+                        if isoData is not None:
+                            if not self.__recordFailure(isoData, name):
+                                last = isoData # Not backing off
+                            retval += 1
+                finally:
+                    self.queueLock.release()
+            finally:
+                burner.lock.release()
+        if retval > 0:
+            self.__saveState()
+        return retval
+
+    def __recordOutcome(self, burnerName, success, isoData):
+        """Updates the statistics of a burner with the outcome of a burn.
+
+        isoData: the iso that was burnt. It is not a probe any more.
+
+        Must be called with queueLock held."""
+        probe = isoData.pop("probe", False)
+        now = time.time()
+        change = self.reliability.record(burnerName, success, probe, now)
+        self.__log("outcome", burnerName, success, probe, now)
+        if change == "quarantined":
+            self.logger.warning("Burner %s fails %d%% of its burns: it is "
+                                "quarantined." % (burnerName, 100 *
+                                self.reliability.failureRate(burnerName)))
+        elif change == "requalified":
+            self.logger.info("Burner %s burnt its probe iso: it is out of "
+                             "quarantine." % burnerName)
+
+    def __burnerAlive(self, burner):
+        """Records that a burner has given signs of life.
 
-    def queueIso(self, iso, committer):
+        Returns True if the burner was suspect.
+
+        Must be called with the lock of burner held, and without
+        queueLock."""
+        if not burner.suspect:
+            return False
+        self.logger.info("Burner %s is alive again." % burner.name)
+        self.queueLock.acquire()
+        try:
+            burner.suspect = False
+            self.__log("suspect", burner.name, False)
+        finally:
+            self.queueLock.release()
+        return True
+
+    def __startLease(self, isoData):
+        """Records that a burner is starting to work on an iso now, and
+        gives it a lease based on the expected duration of the burn.
+
+        Must be called with queueLock held."""
+        now = time.time()
+        isoData["started"] = now
+        if isoData.has_key("writing"):
+            del isoData["writing"] # From a previous attempt
+        self.lastBurner[isoData["iso"]] = isoData["burner"]
+        self.__log("lastBurner", isoData["iso"], isoData["burner"])
+        isoData["leaseExpiry"] = now + self.leaseGrace + self.leaseFactor * \
+                                 self.durations.expected(isoData["iso"],
+                                                         isoData["burner"])
+
+    def queueIso(self, iso, committer, priority=0, deadline=None,
+                 selector=()):
         """Adds an ISO to the queue.
 
+        priority: isos with higher priority are preferred by the
+        "matching" dispatch mode, and can preempt the other ones if
+        preemption is enabled.
+
+        deadline: when the iso must be ready, in seconds since the epoch,
+        or None. Used by the "edf" dispatch mode.
+
+        selector: (key, value) pairs, like the ones returned by
+        common.parseLabels(): only the burners that have all these labels
+        can burn the iso. While no such burner is registered, the iso
+        waits in the queue.
+
         Please note that the iso must be a valid filename, otherwise it will
         remain in the queue forever, because all clients will reject it."""
-        self.isosLock.acquire()
+        self.queueLock.acquire()
         try:
             self.logger.debug("Adding %s for %s to the queue." %
                               (iso, committer))
-            self.pendingIsos.append({"date": time.strftime("%Y-%m-%d %H:%M"),
-                                     "iso": iso,
-                                     "committer": committer})
+            self.__checkSelector(selector)
+            self.__enqueue(records.Job(date=time.strftime("%Y-%m-%d %H:%M"),
+                                       iso=iso,
+                                       committer=committer,
+                                       priority=priority,
+                                       deadline=deadline,
+                                       selector=tuple(selector)))
+        finally:
+            self.queueLock.release()
+        self.__saveState()
+
+    def queueSet(self, isos, committer, priority=0, deadline=None,
+                 selector=()):
+        """Adds a set of ISOs to the queue, as a single job.
+
+        isos: list of the isos of the set (the same iso may appear more
+        than once).
+
+        The other parameters are the same as queueIso(). The members of
+        the set are started together, each on its own burner, and the set
+        is complete when all of them have been burnt.
+
+        Returns the number of the set."""
+        self.queueLock.acquire()
+        try:
+            setId = self.nextSetId
+            self.nextSetId += 1
+            date = time.strftime("%Y-%m-%d %H:%M")
+            self.logger.debug("Adding set %d (%s) for %s to the queue." %
+                              (setId, ", ".join(isos), committer))
+            self.__checkSelector(selector)
+            self.sets[setId] = {"date": date, "committer": committer,
+                                "isos": list(isos),
+                                "missing": set(range(len(isos))),
+                                "parked": 0}
+            for i in range(len(isos)):
+                self.__enqueue(records.Job(date=date,
+                                           iso=isos[i],
+                                           committer=committer,
+                                           priority=priority,
+                                           deadline=deadline,
+                                           selector=tuple(selector),
+                                           set=setId,
+                                           member=i))
+            self.__setChanged(setId)
         finally:
-            self.isosLock.release()
+            self.queueLock.release()
+        self.__saveState()
+        return setId
+
+    def __checkSelector(self, selector):
+        """Warns if no registered burner has the labels of selector.
+
+        Must be called with queueLock held. The catalog is read without
+        catalogLock: a burner that is registering meanwhile may not be
+        seen yet."""
+        pool = self.__pool(selector)
+        if pool is not None and not pool:
+            self.logger.warning("No burner has the labels %s: the iso waits "
+                                "until one registers." %
+                                common.formatLabels(selector))
+
+    def __enqueue(self, isoData):
+        """Gives a new entry its id and appends it to the pending queue, or
+        parks it if no burner has its iso.
+
+        Must be called with queueLock held. If a burner that has the iso
+        is registering meanwhile, catalogLock is not needed: the
+        registration unparks the entry, or it has updated burnable
+        already."""
+        self.__newJobId(isoData)
+        if isoData["iso"] in self.burnable:
+            self.__queue(isoData, self.pendingIsos.last())
+        else:
+            self.__park(isoData)
+
+    def __park(self, isoData):
+        """Moves an entry to parkedIsos.
+
+        Must be called with queueLock held, and isoData must not be in
+        pendingIsos."""
+        self.logger.info("No burner can burn %s: the iso for %s waits until "
+                         "one registers." %
+                         (isoData["iso"], isoData["committer"]))
+        self.parkedIsos.setdefault(isoData["iso"], []).append(isoData)
+        self.__log("parked", isoData)
+        setData = self.sets.get(isoData.get("set"))
+        if setData is not None:
+            setData["parked"] = setData.get("parked", 0) + 1
+            self.__setChanged(isoData["set"])
+
+    def __unpark(self, isos):
+        """Moves the parked entries of the given isos back into the pending
+        queue.
+
+        Must be called with catalogLock and queueLock held."""
+        if len(isos) > len(self.parkedIsos):
+            isos = set(isos)
+            isos = [iso for iso in self.parkedIsos.keys() if iso in isos]
+        for iso in isos:
+            if iso not in self.burnable:
+                continue # Too large for the drive that has it
+            jobs = self.parkedIsos.pop(iso, None)
+            if jobs is None:
+                continue
+            self.logger.info("%s is available again: %d isos back into the "
+                             "queue." % (iso, len(jobs)))
+            for isoData in jobs:
+                setData = self.sets.get(isoData.get("set"))
+                if setData is not None:
+                    setData["parked"] -= 1
+                    self.__setChanged(isoData["set"])
+                self.__queue(isoData, self.pendingIsos.last())
+
+    def __parkOrphans(self, isos):
+        """Parks the pending entries of the given isos, that no burner can
+        burn any more. The ones waiting for their backoff time stop
+        waiting: they have to wait for a burner anyway.
+
+        Must be called with catalogLock and queueLock held."""
+        if not isos:
+            return
+        isos = set(isos)
+        for isoData in list(self.backingOffIsos):
+            if isoData["iso"] in isos:
+                self.backingOffIsos.remove(isoData)
+                del isoData["notBefore"]
+                self.__park(isoData)
+        for isoData in list(self.pendingIsos):
+            if isoData["iso"] in isos:
+                self.pendingIsos.remove(isoData)
+                self.__park(isoData)
+
+    def __recordFailure(self, isoData, burnerName):
+        """Records that burnerName failed a pending iso: the iso is kept
+        away from that burner and waits for its backoff time in
+        backingOffIsos.
+
+        If every burner that has the iso failed it, they are all tried
+        again.
+
+        Returns True if the iso left pendingIsos to wait.
+
+        Must be called with queueLock held. The catalog is read without
+        catalogLock."""
+        retries = isoData.get("retries", 0) + 1
+        isoData["retries"] = retries
+        delay = min(self.retryDelay * 2 ** (retries - 1), self.maxRetryDelay)
+        if delay > 0:
+            isoData["notBefore"] = time.time() + delay
+            self.pendingIsos.remove(isoData)
+            self.backingOffIsos.push(isoData)
+        avoid = isoData.setdefault("avoid", [])
+        if burnerName not in avoid:
+            avoid.append(burnerName)
+        holders = [burner.name for burner in self.burners.values()
+                   if self.__canBurn(isoData["iso"], burner) and
+                   self.__hasLabels(isoData, burner)]
+        if not [name for name in holders if name not in avoid]:
+            del avoid[:]
+        self.__log("failed", isoData)
+        self.logger.info("ISO %s for %s failed %d times: retrying in %d "
+                         "seconds." % (isoData["iso"], isoData["committer"],
+                                       retries, delay))
+        return delay > 0
+
+    def wakeRetries(self):
+        """Makes the failed isos whose backoff time has passed eligible
+        again, and so the isos that stopped waiting for the burner that
+        burnt them last.
+
+        Returns their number: if it is not zero, refresh() should be
+        called, which saves the state."""
+        now = time.time()
+        retval = 0
+        self.queueLock.acquire()
+        try:
+            # Back at the head of the queue, where they failed
+            last = None
+            for isoData in self.backingOffIsos.popDue(now):
+                del isoData["notBefore"]
+                self.__queue(isoData, last)
+                last = isoData
+                retval += 1
+            while self.__affinityHeap and self.__affinityHeap[0][0] < now:
+                (until, key, isoData) = heapq.heappop(self.__affinityHeap)
+                if isoData.get("affinityUntil") == until:
+                    # 0 means done waiting
+                    isoData["affinityUntil"] = 0
+                    self.__log("updated", isoData)
+                    retval += 1
+        finally:
+            self.queueLock.release()
+        return retval
+
+    def __memberGone(self, isoData, burnt):
+        """Updates the set that isoData belongs to, because the member is
+        not going to be burnt any more.
+
+        burnt: True if the member has been burnt, False if it has been
+        removed from the queue.
+
+        Must be called with queueLock held."""
+        setId = isoData.get("set")
+        if setId is None or not self.sets.has_key(setId):
+            return
+        setData = self.sets[setId]
+        setData["missing"].discard(isoData["member"])
+        if setData["missing"]:
+            self.__setChanged(setId)
+            return
+        del self.sets[setId]
+        self.__setChanged(setId)
+        if burnt:
+            self.logger.info("Set %d for %s is complete." %
+                             (setId, setData["committer"]))
+        else:
+            self.logger.info("Set %d for %s is not waiting for anything "
+                             "else." % (setId, setData["committer"]))
+
+    def reportBurnStarted(self, burnerName, iso):
+        """Records that a burner has a disc and started writing an iso: from
+        now on, it cannot be preempted."""
+        burner = self.__lockBurner(burnerName)
+        if burner is None:
+            self.logger.error("Burner %s was not known!" % burnerName)
+            return
+        try:
+            self.__burnerAlive(burner)
+            self.queueLock.acquire()
+            try:
+                isoData = self.__findBeingBurnt(burnerName, iso)
+                if isoData is None:
+                    self.logger.warning("Burner %s started writing %s, that "
+                                        "it was not supposed to burn." %
+                                        (burnerName, iso))
+                else:
+                    isoData["writing"] = time.time()
+                    self.__log("updated", isoData)
+            finally:
+                self.queueLock.release()
+        finally:
+            burner.lock.release()
         self.__saveState()
 
     def reportCompletion(self, burnerName, iso):
         """Reports a successful burn."""
-        self.isosLock.acquire()
-        self.burnersLock.acquire()
+        burner = self.__lockBurner(burnerName)
+        if burner is None:
+            self.logger.error("Burner %s was not known!" % burnerName)
+            return
+        twin = None
         try:
-            burner = self.burners[burnerName]
-            for i in range(len(self.isosBeingBurnt)):
-                if self.isosBeingBurnt[i]["burner"] == burnerName:
-                    # Found
-                    self.isosBurnt.append(self.isosBeingBurnt[i])
-                    del(self.isosBeingBurnt[i])
-                    burner.free = True
-                    break;
-            if not burner.free: # Sanity check
-                self.logger.error("Something VERY strange happened: "
-                                  "the burner %s doesn't seem to "
-                                  "have been working on %s!" %
-                                  (burnerName, iso))
+            self.__burnerAlive(burner)
+            self.queueLock.acquire()
+            try:
+                isoData = self.__findBeingBurnt(burnerName, iso)
+                if isoData is None:
+                    self.__lateCompletion(burnerName, iso)
+                else:
+                    self.__recordOutcome(burnerName, True, isoData)
+                    if isoData.has_key("started"):
+                        duration = time.time() - isoData["started"]
+                        self.durations.record(isoData["iso"], burnerName,
+                                              duration)
+                        self.__log("duration", isoData["iso"], burnerName,
+                                   duration)
+                    if isoData.has_key("superseded"):
+                        self.logger.info("%s burnt %s, but another burner "
+                                         "had already completed it." %
+                                         (burnerName, isoData["iso"]))
+                    else:
+                        twin = self.__twinOf(isoData)
+                        if twin is not None:
+                            # First success wins
+                            self.logger.info("%s won the race on %s: the "
+                                             "copy on %s is not needed." %
+                                             (burnerName, isoData["iso"],
+                                              twin["burner"]))
+                            twin["superseded"] = True
+                            self.__log("updated", twin)
+                            del isoData["twin"]
+                        isoData["finished"] = time.time()
+                        self.__addBurnt(isoData)
+                        self.__memberGone(isoData, True)
+                    self.__removeBeingBurnt(isoData)
+                    if isoData.has_key("superseded"):
+                        self.__log("removed", isoData["id"])
+                    else:
+                        self.__log("completed", isoData["id"])
+                    burner.jobFinished(isoData["iso"])
+                    self.__countReader(burner)
+                    self.__nextJobStarted(burnerName)
+            finally:
+                self.queueLock.release()
         finally:
-            self.isosLock.release()
-            self.burnersLock.release()
+            burner.lock.release()
+        if twin is not None:
+            # Free the other burner, if it can still be stopped
+            self.__cancelEntry(twin)
         self.__saveState()
 
+    def __lateCompletion(self, burnerName, iso):
+        """Handles the completion of an iso that had been taken back from
+        the burner, because its lease had expired.
+
+        If the iso is still in the queue, it is not burnt again.
+
+        Must be called with the lock of the burner and queueLock held."""
+        for queue in (self.backingOffIsos, self.pendingIsos):
+            for isoData in queue:
+                if isoData.get("burner") != burnerName or \
+                       isoData["iso"] != iso:
+                    continue
+                self.logger.info("%s completed %s for %s after all." %
+                                 (burnerName, iso, isoData["committer"]))
+                self.__recordOutcome(burnerName, True, isoData)
+                queue.remove(isoData)
+                self.__log("completed", isoData["id"])
+                isoData["finished"] = time.time()
+                self.__addBurnt(isoData)
+                self.__memberGone(isoData, True)
+                return
+        # Sanity check
+        self.logger.error("Something VERY strange happened: "
+                          "the burner %s doesn't seem to "
+                          "have been working on %s!" %
+                          (burnerName, iso))
+
     def reportBurningError(self, burnerName, iso):
         """Reports an unsuccessful burn.
 
@@ -292,122 +1773,1099 @@ class BurnerManager:
         iso: filename of the ISO that burnerName was supposed to burn
 
         Takes the ISO that is marked as being burnt by burnerName, and
-        puts it back into the top of the pending queue.
+        puts it back into the top of the pending queue. It is not assigned
+        again until its backoff time has passed, and preferably not to the
+        same burner.
         """
-        self.isosLock.acquire()
-        self.burnersLock.acquire()
+        # It might happen that the burner is not in the queue any
+        # more, because we have just sent it a goodbye message
+        # from another thread. This shouldn't happen, but may
+        # happen. So it must be handled.
+        burner = self.__lockBurner(burnerName)
+        if burner is None:
+            self.logger.error("Burner named %s is not in the database." %
+                              burnerName)
+            return
         try:
-            # It might happen that the burner is not in the queue any
-            # more, because we have just sent it a goodbye message
-            # from another thread. This shouldn't happen, but may
-            # happen. So it must be handled.
+            self.__burnerAlive(burner)
+            self.queueLock.acquire()
             try:
-                burner = self.burners[burnerName]
-                for i in range(len(self.isosBeingBurnt)):
-                    if self.isosBeingBurnt[i]["burner"] == burnerName:
-                        # Found: we put it into the head of the waiting queue.
-                        # This will have the additional "burner" field, that
-                        # we will easily ignore.
-                        self.pendingIsos.insert(0, self.isosBeingBurnt[i])
-                        del(self.isosBeingBurnt[i])
-                        burner.free = True
-                        break;
-                if not burner.free: # Sanity check
-                    self.logger.error("Something VERY strange happened: "
-                                      "the burner %s doesn't seem to have "
-                                      "been working on %s!" %
-                                      (burnerName, iso) )
-            except KeyError:
-                self.logger.error("Burner named %s is not in the database." %
-                                  burnerName)
+                isoData = self.__findBeingBurnt(burnerName, iso)
+                if isoData is not None:
+                    self.__recordOutcome(burnerName, False, isoData)
+                    self.__count(iso, burnerName, isoData["committer"],
+                                 time.time(), True)
+                isoData = self.__burnFailed(burner, iso, None)
+                if isoData is not None:
+                    self.__recordFailure(isoData, burnerName)
+            finally:
+                self.queueLock.release()
         finally:
-            self.isosLock.release()
-            self.burnersLock.release()
+            burner.lock.release()
         self.__saveState()
 
+    def __burnFailed(self, burner, iso, after):
+        """Takes the ISO that is marked as being burnt by burner, and
+        puts it back into the pending queue.
+
+        after: the pending entry to put it after, or None for the head of
+        the queue.
+
+        Returns the entry, if the iso went back into the queue, otherwise
+        None.
+
+        Must be called with the lock of burner and queueLock held."""
+        isoData = self.__findBeingBurnt(burner.name, iso)
+        if isoData is None: # Sanity check
+            self.logger.error("Something VERY strange happened: "
+                              "the burner %s doesn't seem to have "
+                              "been working on %s!" %
+                              (burner.name, iso) )
+            return None
+        twin = self.__twinOf(isoData)
+        self.__removeBeingBurnt(isoData)
+        retval = None
+        if isoData.has_key("superseded"):
+            self.__log("removed", isoData["id"]) # Nobody needs it any more
+        elif twin is not None:
+            # The other copy is still going on
+            self.logger.info("%s is still burning %s." %
+                             (twin["burner"], isoData["iso"]))
+            del twin["twin"]
+            self.__log("updated", twin)
+            self.__log("removed", isoData["id"])
+        else:
+            # Found: we put it back into the waiting queue. This will
+            # have the additional "burner" field, that we will easily
+            # ignore.
+            self.__queue(isoData, after)
+            retval = isoData
+        burner.jobFinished(isoData["iso"])
+        self.__countReader(burner)
+        self.__nextJobStarted(burner.name)
+        return retval
+
+    def __findBeingBurnt(self, burnerName, iso):
+        """Returns the entry of isosBeingBurnt of the first iso assigned to
+        burnerName with the given name, or of the first iso assigned to it
+        if there is no such name. Returns None if there are none.
+
+        Must be called with queueLock held."""
+        jobs = self.__jobsOfBurner.get(burnerName)
+        if not jobs:
+            return None
+        for isoData in jobs:
+            if isoData["iso"] == iso:
+                return isoData
+        return jobs[0]
+
+    def __nextJobStarted(self, burnerName):
+        """Records that the burner has moved on to the next iso in its
+        queue, if any: its burn starts now.
+
+        Must be called with queueLock held."""
+        jobs = self.__jobsOfBurner.get(burnerName)
+        if jobs:
+            self.__startLease(jobs[0])
+            self.__log("updated", jobs[0])
+
+    def __requeueJobs(self, burner, jobs):
+        """Puts the isos assigned to a burner that disappeared back into the
+        pending queue, in the same order.
+
+        jobs: the (iso, committer) tuples that were assigned to the burner.
+
+        Must be called with the lock of burner and queueLock held."""
+        last = None
+        for (iso, committer) in jobs:
+            isoData = self.__burnFailed(burner, iso, last)
+            if isoData is not None:
+                last = isoData
+
+    def cancelIso(self, isoData):
+        """Stops an iso that has been assigned to a burner, even if the
+        burner has already started burning it or waiting for a disc.
+
+        isoData: an entry of the list returned by getIsosBeingBurnt().
+
+        The iso is not put back into the queue. Returns True if the burner
+        dropped it."""
+        self.queueLock.acquire()
+        try:
+            entry = self.isosBeingBurnt.get(isoData["id"])
+        finally:
+            self.queueLock.release()
+        retval = False
+        if entry is not None and entry["burner"] == isoData["burner"]:
+            retval = self.__cancelEntry(entry)
+        else:
+            self.logger.error("Cannot cancel %s for %s: it is not being "
+                              "burnt." % (isoData["iso"], isoData["committer"]))
+        if retval:
+            self.__saveState()
+        return retval
+
+    def __cancelEntry(self, isoData):
+        """Asks the burner of an entry of isosBeingBurnt to drop it, and
+        forgets it if the burner does.
+
+        Returns True if the entry was cancelled.
+
+        Must be called with no locks held: queueLock is not held while
+        the burner answers."""
+        burner = self.__lockBurner(isoData["burner"])
+        if burner is None:
+            return False
+        try:
+            self.queueLock.acquire()
+            try:
+                if self.isosBeingBurnt.get(isoData["id"]) is not isoData:
+                    return False # Completed or requeued meanwhile
+            finally:
+                self.queueLock.release()
+            job = (isoData["iso"], isoData["committer"])
+            wasStarted = bool(burner.jobs) and burner.jobs[0] == job
+            if not burner.cancelIso(isoData["date"], isoData["iso"],
+                                    isoData["committer"]):
+                return False
+            self.logger.info("%s for %s cancelled on %s." %
+                             (isoData["iso"], isoData["committer"],
+                              burner.name))
+            self.queueLock.acquire()
+            try:
+                self.__countReader(burner)
+                self.__removeBeingBurnt(isoData)
+                self.__log("removed", isoData["id"])
+                twin = self.__twinOf(isoData)
+                if twin is not None:
+                    del twin["twin"] # The other copy goes on alone
+                    self.__log("updated", twin)
+                elif not isoData.has_key("superseded"):
+                    self.__memberGone(isoData, False)
+                if wasStarted:
+                    self.__nextJobStarted(burner.name)
+            finally:
+                self.queueLock.release()
+        finally:
+            burner.lock.release()
+        return True
+
+    def __twinOf(self, isoData):
+        """Returns the other copy of an iso being burnt twice, or None.
+
+        Must be called with queueLock held."""
+        twinName = isoData.get("twin")
+        if twinName is None:
+            return None
+        for other in self.__jobsOfBurner.get(twinName, ()):
+            if other.get("twin") == isoData["burner"] and \
+                   other["iso"] == isoData["iso"]:
+                return other
+        return None
+
     def reportClosingBurner(self, burnerName):
         """Takes a burner out of the list, because it's closing itself.
 
-        Calls self.reportBurningError() if the burner was working."""
-        self.burnersLock.acquire()
+        Puts all the isos the burner was working on back into the queue."""
+        burner = self.__lockBurner(burnerName)
+        if burner is None:
+            # Weird, but may happen during debugging
+            self.logger.error("Burner %s was not known!" % burnerName)
+            return
         try:
+            self.catalogLock.acquire()
+            self.queueLock.acquire()
             try:
-                if not self.burners[burnerName].free:
-                    b = self.burners[burnerName]
+                if not burner.free:
                     self.logger.warning("Burner %s was working on %s for %s. "
                                         "Assuming the ISO was NOT burnt." %
-                                        (burnerName, b.iso, b.committer))
-                    self.burnersLock.release() # We must release it temporarily
-                    try:
-                        self.reportBurningError(burnerName, b.iso)
-                    finally:
-                        self.burnersLock.acquire()
+                                        (burnerName, burner.iso,
+                                         burner.committer))
+                    self.__requeueJobs(burner, burner.jobs[:])
                 self.logger.debug("Forgetting burner %s" % burnerName)
+                self.__forgetReader(burner)
                 del(self.burners[burnerName])
-            except KeyError:
-                # Weird, but may happen during debugging
-                self.logger.error("Burner %s was not known!" % burnerName)
+                del(self.__registered[burnerName])
+                self.__log("left", burnerName)
+                self.__parkOrphans(self.__removeFromCatalog(burner))
+            finally:
+                self.queueLock.release()
+                self.catalogLock.release()
         finally:
-            self.burnersLock.release()
-        self.__rebuildIsoList()
+            burner.lock.release()
         self.__saveState()
 
-
     def __rebuildIsoList(self):
-        """Rebuilds isos merging all the isos that the burners have."""
-        self.burnersLock.acquire()
-        self.isosLock.acquire()
-        try:
-            self.isos = set()
-            for burner in self.burners.values():
-                self.isos.update(burner.isos)
-                # for iso in burner.isos:
-                #    self.isos.add(iso)
-        finally:
-            self.burnersLock.release()
-            self.isosLock.release()
+        """Rebuilds isos and the other indexes from scratch, adding the
+        burners one at a time.
+
+        Must be called with catalogLock held, or while loading the
+        state."""
+        self.isos = set()
+        self.isoClasses = {}
+        self.burnersByClass = {}
+        self.burnable = set()
+        self.burnersByLabel = {}
+        self.burnersByStorage = {}
+        self.__holders = {}
+        self.__sizes = {}
+        for burner in self.burners.values():
+            self.__addToCatalog(burner)
+
+    def __addToCatalog(self, burner):
+        """Adds a burner to isos and to the indexes of the isos and of the
+        burners by class of media, by label and by storage.
+
+        Only the entries of the isos of burner change, so the cost does
+        not depend on the number of burners.
+
+        Must be called with catalogLock held."""
+        self.__shareCatalog(burner)
+        if burner.storage:
+            self.burnersByStorage.setdefault(burner.storage,
+                                             set()).add(burner.name)
+        for label in burner.labels.items():
+            self.burnersByLabel.setdefault(label, set()).add(burner.name)
+        for mediaClass in self.__classesTaken(burner):
+            self.burnersByClass.setdefault(mediaClass,
+                                           set()).add(burner.name)
+        for iso in burner.isos:
+            self.__holders.setdefault(iso, set()).add(burner.name)
+            self.isos.add(iso)
+        for (iso, size) in burner.isoSizes.iteritems():
+            sizes = self.__sizes.setdefault(iso, {})
+            sizes[size] = sizes.get(size, 0) + 1
+        for iso in set(burner.isos) | set(burner.isoSizes.keys()):
+            self.__updateIso(iso)
+
+    def __shareCatalog(self, burner):
+        """Makes burner use the isos and isoSizes of a registered burner
+        that has the same ones, if there is any: the burners that read
+        from the same storage usually do, and their catalog is kept in
+        memory only once.
+
+        Must be called with catalogLock held, before adding burner to the
+        indexes."""
+        if not burner.isos:
+            return
+        tried = set()
+        for name in self.__holders.get(burner.isos[0], ()):
+            other = self.burners[name]
+            if id(other.isos) in tried:
+                continue # Shared by a burner already compared
+            tried.add(id(other.isos))
+            if other.isos == burner.isos and \
+                   other.isoSizes == burner.isoSizes:
+                burner.isos = other.isos
+                burner.isoSizes = other.isoSizes
+                return
+
+    def __removeFromCatalog(self, burner):
+        """Removes a burner from the indexes; the opposite of
+        __addToCatalog().
+
+        Returns the list of the isos that could be burnt before, and
+        cannot be any more.
+
+        Must be called with catalogLock held."""
+        self.__discard(self.burnersByStorage, burner.storage, burner.name)
+        for label in burner.labels.items():
+            self.__discard(self.burnersByLabel, label, burner.name)
+        for mediaClass in self.__classesTaken(burner):
+            self.__discard(self.burnersByClass, mediaClass, burner.name)
+        for iso in burner.isos:
+            self.__discard(self.__holders, iso, burner.name)
+            if not self.__holders.has_key(iso):
+                self.isos.discard(iso)
+        for (iso, size) in burner.isoSizes.iteritems():
+            sizes = self.__sizes[iso]
+            sizes[size] -= 1
+            if not sizes[size]:
+                del sizes[size]
+                if not sizes:
+                    del self.__sizes[iso]
+        retval = []
+        for iso in set(burner.isos) | set(burner.isoSizes.keys()):
+            wasBurnable = iso in self.burnable
+            self.__updateIso(iso)
+            if wasBurnable and iso not in self.burnable:
+                retval.append(iso)
+        return retval
+
+    def __discard(self, index, key, name):
+        """Removes name from the set index[key], and the set from index if it
+        becomes empty."""
+        names = index.get(key)
+        if names is None:
+            return
+        names.discard(name)
+        if not names:
+            del index[key]
+
+    def __updateIso(self, iso):
+        """Updates isoClasses and burnable for an iso, from the sizes
+        reported by the burners that have it.
+
+        Must be called with catalogLock held."""
+        sizes = self.__sizes.get(iso)
+        if sizes:
+            size = max(sizes)
+            mediaClass = common.mediaClassFor(size)
+            if mediaClass is None and \
+                   self.isoClasses.get(iso, common.MEDIA_CLASS_ANY) is not None:
+                self.logger.warning("%s is too large for any media "
+                                    "(%d bytes)." % (iso, size))
+            self.isoClasses[iso] = mediaClass
+        else:
+            self.isoClasses.pop(iso, None)
+        for name in self.__holders.get(iso, ()):
+            if self.__fits(iso, self.burners[name]):
+                self.burnable.add(iso)
+                return
+        self.burnable.discard(iso)
 
     def removeIso(self, isoData):
-        """ Removes an element from the pending ISOs"""
-        self.isosLock.acquire()
+        """ Removes an element from the pending ISOs
+
+        isoData: an entry of the list returned by getPendingIsos(); the
+        job is found by its id."""
+        self.queueLock.acquire()
         try:
             self.logger.info("Removing iso %s for %s" % 
                              (isoData["iso"], isoData["committer"]))
-            self.pendingIsos.remove(isoData)
+            entry = None
+            if isoData.get("parked"):
+                jobs = self.parkedIsos.get(isoData["iso"], [])
+                for job in jobs:
+                    if job["id"] == isoData["id"]:
+                        entry = job
+            elif isoData.has_key("notBefore"):
+                for job in self.backingOffIsos:
+                    if job["id"] == isoData["id"]:
+                        entry = job
+            else:
+                entry = self.pendingIsos.get(isoData["id"])
+            if entry is None:
+                self.logger.warning("%s for %s is not pending any more." %
+                                    (isoData["iso"], isoData["committer"]))
+                return
+            if isoData.get("parked"):
+                jobs.remove(entry)
+                if not jobs:
+                    del self.parkedIsos[entry["iso"]]
+                setData = self.sets.get(entry.get("set"))
+                if setData is not None:
+                    setData["parked"] -= 1
+            elif entry.has_key("notBefore"):
+                self.backingOffIsos.remove(entry)
+            else:
+                self.pendingIsos.remove(entry)
+            self.__log("removed", entry["id"])
+            self.__memberGone(entry, False)
         finally:
-            self.isosLock.release()
+            self.queueLock.release()
         self.__saveState()
 
     def refresh(self):
         """Checks if new isos are waiting and tries to assign them to idle
-        burners."""
-        self.isosLock.acquire()
-        self.burnersLock.acquire()
+        burners.
+
+        The state is saved only if something was dispatched.
+
+        Only one pass runs at a time. catalogLock and queueLock are
+        released while each burner answers (see __askBurner()), so the
+        isos and the burners the pass had chosen may be gone by then."""
+        self.dispatchLock.acquire()
+        self.catalogLock.acquire()
+        self.queueLock.acquire()
         try:
+            logged = self.__logged
             if len(self.pendingIsos) > 0:
                 # We have pending isos!
-                for isoData in self.pendingIsos[:]:
-                    isoAssigned = False
-                    burnerIterator = self.burners.itervalues()
-                    try:
-                        while not isoAssigned:
-                            burner = burnerIterator.next()
-                            if burner.free:
-                                if burner.assignIso(isoData["date"],
-                                                    isoData["iso"],
-                                                    isoData["committer"]):
-                                    self.logger.info("ISO %s assigned to %s." %
-                                                     (isoData["iso"],
-                                                      burner.name))
-                                    self.pendingIsos.remove(isoData)
-                                    isoData["burner"] = burner.name
-                                    self.isosBeingBurnt.append(isoData)
-                                    isoAssigned = True
-                    except StopIteration:
-                        # We finished iterating over burners
-                        self.logger.warning("Could not assign %s to anybody." %
-                                            isoData["iso"])
+                self.__dispatchSets()
+                # The idle burners first, then one more iso for each burner,
+                # until their queues are pushAhead isos long
+                for depth in range(self.pushAhead + 1):
+                    self.__queueDepth = depth
+                    self.__dispatch()
+            if self.preemptive and len(self.pendingIsos) > 0:
+                self.__preempt()
+            if self.pushAhead > 0:
+                self.__stealJobs()
+            if self.speculative and len(self.pendingIsos) == 0:
+                self.__startBackups()
+            changed = self.__logged != logged
+            unwanted = self.__unwanted
+            self.__unwanted = []
         finally:
-            self.burnersLock.release()
-            self.isosLock.release()        
-        self.__saveState()
+            self.__reservedBurners.clear()
+            self.__withheldIsos.clear()
+            self.__queueDepth = 0
+            self.queueLock.release()
+            self.catalogLock.release()
+            self.dispatchLock.release()
+        for isoData in unwanted:
+            self.__cancelEntry(isoData)
+        if changed:
+            self.__saveState()
+
+    def __askBurner(self, burner, request, isoData):
+        """Calls the method request of burner ("assignIso" or "revokeIso")
+        about the iso of isoData, and returns what it returns, or False if
+        the burner left or registered again meanwhile.
+
+        catalogLock and queueLock are released while the burner answers,
+        and the lock of burner is held; they are acquired again before
+        releasing it, so that the reports of burner find the entries
+        updated.
+
+        Must be called with dispatchLock, catalogLock and queueLock held."""
+        self.queueLock.release()
+        self.catalogLock.release()
+        locked = False
+        try:
+            burner.lock.acquire()
+            locked = True
+            retval = getattr(burner, request)(isoData["date"], isoData["iso"],
+                                              isoData["committer"])
+        finally:
+            self.catalogLock.acquire()
+            self.queueLock.acquire()
+            if locked:
+                if self.burners.get(burner.name) is burner:
+                    self.__countReader(burner)
+                burner.lock.release()
+        return retval and self.burners.get(burner.name) is burner
+
+    def __startBurning(self, isoData, burner):
+        """Assigns a pending iso to a burner and moves it among the isos
+        being burnt.
+
+        If the iso left the queue while the burner was answering, because
+        it was removed or completed late, the burner gets a copy marked
+        "superseded", that is cancelled after the dispatch pass.
+
+        Must be called with dispatchLock, catalogLock and queueLock held.
+
+        Returns True if the burner accepted the iso."""
+        if not self.__askBurner(burner, "assignIso", isoData):
+            return False
+        self.logger.info("ISO %s assigned to %s." %
+                         (isoData["iso"], burner.name))
+        if isoData in self.pendingIsos:
+            self.pendingIsos.remove(isoData)
+        else:
+            self.logger.info("%s for %s left the queue meanwhile: it is "
+                             "going to be cancelled on %s." %
+                             (isoData["iso"], isoData["committer"],
+                              burner.name))
+            isoData = isoData.copy()
+            self.__newJobId(isoData)
+            isoData["superseded"] = True
+            self.__unwanted.append(isoData)
+        if self.reliability.isQuarantined(burner.name):
+            self.logger.info("%s is a probe for quarantined burner %s." %
+                             (isoData["iso"], burner.name))
+            now = time.time()
+            self.reliability.probeStarted(burner.name, now)
+            self.__log("probe", burner.name, now)
+            isoData["probe"] = True
+        elif isoData.has_key("probe"):
+            del isoData["probe"] # Its burner left before the outcome
+        if isoData.has_key("affinityUntil"):
+            del isoData["affinityUntil"]
+        isoData["burner"] = burner.name
+        self.__startLease(isoData)
+        self.__addBeingBurnt(isoData)
+        self.__log("assigned", isoData)
+        return True
+
+    def __dispatch(self):
+        """Runs a dispatch pass: the scheduler decides which pending isos go
+        to the burners that have room for one more iso.
+
+        Must be called with dispatchLock, catalogLock and queueLock held."""
+        burners = [b for b in self.burners.values() if self.__hasRoom(b)]
+        if not burners:
+            return
+        now = time.time()
+        # The scheduler sees the key of the preference of each burner
+        tiers = {}
+        for burner in burners:
+            tiers[burner.name] = self.__tier(burner, now)
+        burners.sort(key=lambda b: tiers[b.name])
+        jobs = [isoData for isoData in self.__eligibleIsos(now)
+                if not self.__waitsForAffinity(isoData, now)]
+        # Each iso is mapped to the burners that can take it
+        holders = {}
+        for burner in burners:
+            for iso in burner.isos:
+                if self.__fits(iso, burner):
+                    holders.setdefault(iso, []).append(burner.name)
+        preferred = []
+        pools = {}
+        for isoData in jobs:
+            burner = self.__affineBurner(isoData)
+            if burner is not None and self.__hasRoom(burner):
+                preferred.append(burner.name)
+            else:
+                preferred.append(None)
+            selector = isoData.get("selector", ())
+            if not pools.has_key(selector):
+                pools[selector] = self.__pool(selector)
+        view = scheduler.SchedulerView(jobs,
+                                       [burner.name for burner in burners],
+                                       holders, preferred, self.durations, now,
+                                       pools, tiers)
+        pairs = self.scheduler.assign(view)
+        for i in view.atRisk():
+            if not jobs[i].get("atRisk"):
+                self.logger.warning("ISO %s for %s is projected to miss its "
+                                    "deadline." %
+                                    (jobs[i]["iso"], jobs[i]["committer"]))
+                jobs[i]["atRisk"] = True
+                self.__log("updated", jobs[i])
+        used = set()
+        outOfTokens = False
+        for (i, burnerName) in pairs:
+            if burnerName in used or burnerName not in view.candidates(i):
+                self.logger.error("The scheduler gave %s to %s, that cannot "
+                                  "take it." % (jobs[i]["iso"], burnerName))
+                continue
+            burner = self.burners.get(burnerName)
+            if burner is None or jobs[i] not in self.pendingIsos:
+                continue # Gone while another burner was answering
+            if not self.__mayRead(burner):
+                # Taken by an earlier pair of this pass
+                outOfTokens = True
+                continue
+            used.add(burnerName)
+            if not self.__startBurning(jobs[i], burner):
+                self.logger.warning("Burner %s refused %s: it will be "
+                                    "assigned again later." %
+                                    (burnerName, jobs[i]["iso"]))
+        self.logger.debug("Dispatch pass: %d isos assigned, %d still "
+                          "pending." % (len(used), len(self.pendingIsos)))
+        if outOfTokens:
+            # The burners that lost their token are out of the next pass
+            self.__dispatch()
+
+    def __eligibleIsos(self, now):
+        """Returns the pending isos that can be dispatched, in queue order.
+
+        The members of the sets that are waiting for enough burners are
+        left out. The failed isos waiting for their backoff time are not
+        in pendingIsos.
+
+        Must be called with queueLock held."""
+        return [isoData for isoData in self.pendingIsos
+                if id(isoData) not in self.__withheldIsos]
+
+    def __dispatchOrder(self):
+        """Returns the pending isos that can be dispatched, in the order the
+        scheduler considers them.
+
+        Must be called with queueLock held."""
+        return self.scheduler.order(self.__eligibleIsos(time.time()))
+
+    def __waitsForAffinity(self, isoData, now):
+        """Returns True if isoData is waiting for the burner that burnt its
+        iso last to have room for it.
+
+        Must be called with catalogLock and queueLock held."""
+        if self.affinityWait <= 0:
+            return False
+        burner = self.__affineBurner(isoData)
+        if burner is None or self.__hasRoom(burner):
+            return False
+        until = isoData.get("affinityUntil")
+        if until is None:
+            until = now + self.affinityWait
+            isoData["affinityUntil"] = until
+            self.__log("updated", isoData)
+            heapq.heappush(self.__affinityHeap, (until, id(isoData), isoData))
+        return now < until
+
+    def __affineBurner(self, isoData):
+        """Returns the burner that burnt the iso of isoData last, if it could
+        take it, otherwise None.
+
+        Must be called with catalogLock held."""
+        burner = self.burners.get(self.lastBurner.get(isoData["iso"]))
+        if burner is None or burner.suspect or \
+               not self.__canBurn(isoData["iso"], burner) or \
+               self.reliability.isQuarantined(burner.name) or \
+               not self.__allowed(isoData, burner):
+            return None
+        return burner
+
+    def __classesTaken(self, burner):
+        """Returns the classes of media whose isos burner can burn: the one
+        of the largest media its drive takes, and the smaller ones, whose
+        isos fit on those media too."""
+        retval = []
+        classes = []
+        for (mediaClass, capacity) in common.MEDIA_CLASSES:
+            classes.append(mediaClass)
+            if mediaClass in burner.capabilities:
+                retval = list(classes)
+        return retval
+
+    def __fits(self, iso, burner):
+        """Returns True if the drive of burner takes media large enough for
+        iso (whether it has the iso or not): media of the class of the iso,
+        or of a larger class.
+
+        Must be called with catalogLock held."""
+        mediaClass = self.isoClasses.get(iso, common.MEDIA_CLASS_ANY)
+        return mediaClass == common.MEDIA_CLASS_ANY or \
+               burner.name in self.burnersByClass.get(mediaClass, ())
+
+    def __canBurn(self, iso, burner):
+        """Returns True if burner has iso and can burn it.
+
+        Must be called with catalogLock held."""
+        return burner.name in self.__holders.get(iso, ()) and \
+               self.__fits(iso, burner)
+
+    def __allowed(self, isoData, burner):
+        """Returns True if burner has the labels isoData asks for, and has
+        not failed it before."""
+        return burner.name not in isoData.get("avoid", ()) and \
+               self.__hasLabels(isoData, burner)
+
+    def __hasLabels(self, isoData, burner):
+        """Returns True if burner has all the labels in the selector of
+        isoData."""
+        for (key, value) in isoData.get("selector", ()):
+            if burner.labels.get(key) != value:
+                return False
+        return True
+
+    def __pool(self, selector):
+        """Returns the set of the names of the burners that have all the
+        labels in selector, or None if selector is empty: any burner.
+
+        The sets of the labels are intersected starting from the smallest
+        one, so the cost depends on the rarest label and not on the number
+        of burners.
+
+        Must be called with catalogLock held."""
+        if not selector:
+            return None
+        pools = [self.burnersByLabel.get(label, set()) for label in selector]
+        pools.sort(key=len)
+        return pools[0].intersection(*pools[1:])
+
+    def __rankedBurners(self, burners):
+        """Sorts burners by preference: the ones with the shortest queues
+        come first; among them, the most reliable ones (in steps of 10% of
+        failure rate); then the ones with a blank disc ready come first
+        and the ones with a disc that cannot be burnt come last.
+
+        Returns a new list. The sort is stable.
+
+        Must be called with catalogLock held."""
+        now = time.time()
+        return sorted(burners, key=lambda b: self.__tier(b, now))
+
+    def __tier(self, burner, now):
+        """Returns the key that __rankedBurners() sorts burner by.
+
+        Must be called with catalogLock held."""
+        return (len(burner.jobs),
+                int(10 * self.reliability.failureRate(burner.name, now)),
+                self.mediaRanks.get(burner.media, 1))
+
+    def __isIdle(self, burner):
+        """Returns True if burner is idle and can receive an iso in this
+        dispatch pass.
+
+        Must be called with catalogLock and queueLock held."""
+        return burner.free and not burner.suspect and \
+               not self.reliability.isQuarantined(burner.name) and \
+               burner.name not in self.__reservedBurners and \
+               self.__mayRead(burner)
+
+    def __hasRoom(self, burner):
+        """Returns True if burner can receive an iso in this dispatch pass,
+        either to burn it immediately or to queue it. A quarantined burner
+        can only receive a probe iso, when it is idle and the probe is due.
+
+        Must be called with catalogLock and queueLock held."""
+        if self.reliability.isQuarantined(burner.name):
+            # Only one probe iso at a time
+            if not burner.free or not self.reliability.probeDue(burner.name):
+                return False
+        return len(burner.jobs) <= self.__queueDepth and \
+               not burner.suspect and \
+               burner.name not in self.__reservedBurners and \
+               self.__mayRead(burner)
+
+    def __tokensLeft(self, storage):
+        """Returns how many more burners may start reading from storage, or
+        None if there is no limit.
+
+        Must be called with catalogLock and queueLock held."""
+        if not storage:
+            return None
+        limit = self.storageTokens.get(storage, self.readTokens)
+        if limit <= 0:
+            return None
+        return limit - self.__readers.get(storage, 0)
+
+    def __countReader(self, burner):
+        """Updates the number of burners that hold a read token of the
+        storage of burner, after burner.free may have changed.
+
+        Must be called with the lock of burner and queueLock held, or
+        while loading the state."""
+        if not burner.storage:
+            return
+        reading = not burner.free
+        if reading == (burner.name in self.__reading):
+            return
+        if reading:
+            self.__reading.add(burner.name)
+            self.__readers[burner.storage] = \
+                self.__readers.get(burner.storage, 0) + 1
+        else:
+            self.__forgetReader(burner)
+
+    def __forgetReader(self, burner):
+        """Stops counting burner among the readers of its storage, because
+        it is idle or it is leaving.
+
+        Must be called with queueLock held."""
+        if burner.name not in self.__reading:
+            return
+        self.__reading.discard(burner.name)
+        self.__readers[burner.storage] -= 1
+        if not self.__readers[burner.storage]:
+            del self.__readers[burner.storage]
+
+    def __mayRead(self, burner):
+        """Returns True if burner can be given an iso as far as the read
+        tokens are concerned: it already holds one, because it is busy, or
+        a token of its storage is available.
+
+        Must be called with catalogLock and queueLock held."""
+        if not burner.free:
+            return True
+        left = self.__tokensLeft(burner.storage)
+        return left is None or left > 0
+
+    def __dispatchSets(self):
+        """Starts the sets of isos whose members can all be started now,
+        each one on a different burner.
+
+        The sets are considered before the single isos, in dispatch order.
+        A set that cannot start yet keeps its members out of the rest of
+        the dispatch pass, so that they do not trickle out one at a time.
+        The first such set also reserves the idle burners it would use, so
+        that single isos cannot starve it. The members of a set that could
+        not start even if all the burners were idle, because too few
+        burners have its isos, are dispatched as single isos.
+
+        Must be called with dispatchLock, catalogLock and queueLock held."""
+        if not self.sets:
+            # A set is forgotten when none of its members is pending
+            return
+        groups = {}
+        order = []
+        for isoData in self.__dispatchOrder():
+            setId = isoData.get("set")
+            if setId is None:
+                continue
+            if not groups.has_key(setId):
+                groups[setId] = []
+                order.append(setId)
+            groups[setId].append(isoData)
+        if not order:
+            return
+        reserved = False
+        allHolders = {}
+        ranked = self.__rankedBurners(self.burners.values())
+        for burner in ranked:
+            for iso in burner.isos:
+                if self.__fits(iso, burner):
+                    allHolders.setdefault(iso, []).append(burner.name)
+        for setId in order:
+            members = groups[setId]
+            if self.sets.has_key(setId) and self.sets[setId].get("parked"):
+                # Some members wait for a burner that has them
+                for isoData in members:
+                    self.__withheldIsos.add(id(isoData))
+                continue
+            isos = [isoData["iso"] for isoData in members]
+            pool = self.__pool(members[0].get("selector", ()))
+            holders = lambda iso: [name for name in allHolders.get(iso, ())
+                                   if pool is None or name in pool]
+            if len(matching.maximumMatching(isos, holders)) < len(members):
+                # Not enough burners in the whole farm: no gang possible
+                continue
+            ready = self.__readyTogether(ranked)
+            idleHolders = lambda iso: [name for name in holders(iso) if
+                                       name in ready]
+            pairs = matching.maximumMatching(isos, idleHolders)
+            if len(pairs) == len(members):
+                self.logger.info("Starting %d isos of set %d together." %
+                                 (len(members), setId))
+                for (i, burnerName) in pairs:
+                    burner = self.burners.get(burnerName)
+                    if burner is None or members[i] not in self.pendingIsos:
+                        continue # Gone while another burner was answering
+                    if not self.__startBurning(members[i], burner):
+                        self.logger.warning("Burner %s refused %s: set %d "
+                                            "was not started together." %
+                                            (burnerName, isos[i], setId))
+                continue
+            for isoData in members:
+                self.__withheldIsos.add(id(isoData))
+            if not reserved:
+                for (i, burnerName) in pairs:
+                    self.__reservedBurners.add(burnerName)
+                reserved = True
+
+    def __readyTogether(self, burners):
+        """Returns the set of the names of the idle burners, among burners,
+        that can all start an iso at the same time: for each shared
+        storage, only as many as its read tokens left, in the given order.
+
+        Must be called with catalogLock and queueLock held."""
+        retval = set()
+        left = {}
+        for burner in burners:
+            if not self.__isIdle(burner):
+                continue
+            storage = burner.storage
+            if not left.has_key(storage):
+                left[storage] = self.__tokensLeft(storage)
+            if left[storage] is not None:
+                if left[storage] <= 0:
+                    continue
+                left[storage] -= 1
+            retval.add(burner.name)
+        return retval
+
+    def __projectSlack(self, jobs, now):
+        """Projects when each iso is going to be burnt, and how much earlier
+        than its deadline.
+
+        jobs: the pending isos, or copies of them; the ones that are not
+        in pendingIsos get no slack.
+        now: the current time.
+
+        Each iso, in dispatch order, is given to the burner that would
+        complete it first, according to the learned durations and to what
+        the burners are doing now.
+
+        Returns a list of slack times in seconds, aligned with jobs. The
+        slack is None for the isos without a deadline or that no burner
+        has.
+
+        Must be called with catalogLock and queueLock held."""
+        available = {}
+        for burner in self.burners.values():
+            available[burner.name] = now
+        # When the isos assigned to each burner are going to be completed
+        ends = {}
+        for isoData in self.isosBeingBurnt:
+            name = isoData["burner"]
+            if available.has_key(name):
+                if ends.has_key(name):
+                    start = ends[name] # Waiting in the queue of the burner
+                else:
+                    start = isoData.get("started", now)
+                ends[name] = start + \
+                             self.durations.expected(isoData["iso"], name)
+                available[name] = max(now, ends[name])
+        holders = {}
+        for burner in self.burners.values():
+            for iso in burner.isos:
+                if self.__fits(iso, burner):
+                    holders.setdefault(iso, []).append(burner.name)
+        slacks = {}
+        for isoData in self.__dispatchOrder():
+            iso = isoData["iso"]
+            pool = self.__pool(isoData.get("selector", ()))
+            best = None
+            for name in holders.get(iso, ()):
+                if pool is not None and name not in pool:
+                    continue
+                end = available[name] + self.durations.expected(iso, name)
+                if best is None or end < best[0]:
+                    best = (end, name)
+            if best is None:
+                continue
+            available[best[1]] = best[0]
+            if isoData.get("deadline") is not None:
+                slacks[isoData["id"]] = isoData["deadline"] - best[0]
+        return [slacks.get(isoData["id"]) for isoData in jobs]
+
+    def __startBackups(self):
+        """Gives a second copy of each straggler to an idle burner.
+
+        A straggler is an iso that has been burning for more than
+        stragglerFactor times its expected duration. The backup goes to the
+        fastest idle burner that has the iso, preferring the ones with a
+        blank disc ready; the first of the two copies
+        to be completed wins and the other is ignored.
+
+        Must be called with dispatchLock, catalogLock and queueLock held."""
+        now = time.time()
+        # The first iso of each queue is being burnt, the others are waiting
+        for isoData in [jobs[0] for jobs in self.__jobsOfBurner.values()]:
+            if isoData.has_key("twin") or not isoData.has_key("started") or \
+                   isoData not in self.isosBeingBurnt:
+                continue
+            iso = isoData["iso"]
+            expected = self.durations.expected(iso, isoData["burner"])
+            if now - isoData["started"] <= self.stragglerFactor * expected:
+                continue
+            candidates = [b for b in self.burners.values()
+                          if self.__isIdle(b) and self.__canBurn(iso, b) and
+                          self.__allowed(isoData, b)]
+            candidates.sort(key=lambda b: self.durations.speed(b.name),
+                            reverse=True)
+            candidates = self.__rankedBurners(candidates)
+            for burner in candidates:
+                if self.__askBurner(burner, "assignIso", isoData):
+                    self.logger.info("%s is late on %s: backup copy "
+                                     "assigned to %s." %
+                                     (isoData["burner"], iso, burner.name))
+                    backup = isoData.copy()
+                    self.__newJobId(backup)
+                    backup["burner"] = burner.name
+                    self.__startLease(backup)
+                    if isoData in self.isosBeingBurnt and \
+                           not isoData.has_key("superseded"):
+                        backup["twin"] = isoData["burner"]
+                        isoData["twin"] = burner.name
+                        self.__log("updated", isoData)
+                    else:
+                        # Completed while the backup burner was answering
+                        backup["superseded"] = True
+                        self.__unwanted.append(backup)
+                    self.__addBeingBurnt(backup)
+                    self.__log("assigned", backup)
+                    break
+
+    def __stealJobs(self):
+        """Moves the isos waiting in the queues of the busy burners to the
+        idle burners that have them.
+
+        The isos being burnt cannot be moved, and the burners can refuse
+        to give back the ones they have just started. The last isos of the
+        longest queues are taken first.
+
+        Must be called with dispatchLock, catalogLock and queueLock held."""
+        idleBurners = self.__rankedBurners([b for b in self.burners.values()
+                                            if self.__isIdle(b)])
+        for thief in idleBurners:
+            if not self.__mayRead(thief):
+                continue # Another thief took the last token
+            victims = [b for b in self.burners.values() if len(b.jobs) > 1]
+            victims.sort(key=lambda b: len(b.jobs), reverse=True)
+            stolen = False
+            for victim in victims:
+                for j in range(len(victim.jobs) - 1, 0, -1):
+                    (iso, committer) = victim.jobs[j]
+                    if not self.__canBurn(iso, thief):
+                        continue
+                    isoData = self.__findQueued(victim.name, iso, committer)
+                    if isoData is None:
+                        continue
+                    if not self.__allowed(isoData, thief):
+                        continue
+                    if not self.__askBurner(victim, "revokeIso", isoData):
+                        continue
+                    stolen = True
+                    if isoData not in self.isosBeingBurnt:
+                        break # The victim reported about it meanwhile
+                    self.__removeBeingBurnt(isoData)
+                    # It waits at the head of the queue while the thief
+                    # answers
+                    self.__queue(isoData, None)
+                    if self.__startBurning(isoData, thief):
+                        self.logger.info("ISO %s moved from %s to %s." %
+                                         (iso, victim.name, thief.name))
+                    else:
+                        self.logger.warning("%s refused %s: putting it back "
+                                            "into the queue." %
+                                            (thief.name, iso))
+                    break
+                if stolen:
+                    break
+
+    def __preempt(self):
+        """Gives the burners that are waiting for a disc to the pending isos
+        with higher priority.
+
+        Only the burners with no other isos in their queues are considered,
+        so that the new iso is the next one they burn. Each pending iso
+        takes the burner of the iso with the lowest priority among the ones
+        it can replace; the replaced iso goes back to the head of the
+        queue. The members of sets and the isos being burnt twice are
+        never preempted.
+
+        Must be called with dispatchLock, catalogLock and queueLock held."""
+        victims = {}
+        for jobs in self.__jobsOfBurner.values():
+            isoData = jobs[0]
+            burner = self.burners.get(isoData["burner"])
+            if burner is None or len(burner.jobs) != 1 or \
+                   isoData.has_key("writing") or isoData.has_key("twin") or \
+                   isoData.has_key("set") or burner.suspect or \
+                   self.reliability.isQuarantined(burner.name):
+                continue
+            victims[burner.name] = isoData
+        if not victims:
+            return
+        urgent = [isoData for isoData in self.__dispatchOrder()
+                  if not isoData.has_key("set")]
+        urgent.sort(key=lambda isoData: isoData.get("priority", 0),
+                    reverse=True)
+        for isoData in urgent:
+            if isoData not in self.pendingIsos:
+                continue # Removed while a burner was answering
+            for name in victims.keys():
+                if not self.burners.has_key(name):
+                    del victims[name] # It left while a burner was answering
+            priority = isoData.get("priority", 0)
+            candidates = [v for v in victims.values()
+                          if v.get("priority", 0) < priority and
+                          self.__canBurn(isoData["iso"],
+                                         self.burners[v["burner"]]) and
+                          self.__allowed(isoData, self.burners[v["burner"]])]
+            if not candidates:
+                continue
+            victim = min(candidates, key=lambda v: v.get("priority", 0))
+            burner = self.burners[victim["burner"]]
+            del victims[burner.name]
+            if not self.__askBurner(burner, "revokeIso", victim):
+                continue # It has just started writing
+            if victim not in self.isosBeingBurnt:
+                continue # The burner reported about it meanwhile
+            self.__removeBeingBurnt(victim)
+            self.__queue(victim, None)
+            if isoData not in self.pendingIsos:
+                continue # Removed while the burner answered
+            self.logger.info("ISO %s for %s preempts %s for %s on %s." %
+                             (isoData["iso"], isoData["committer"],
+                              victim["iso"], victim["committer"],
+                              burner.name))
+            if not self.__startBurning(isoData, burner):
+                self.logger.warning("Burner %s refused %s: it will be "
+                                    "assigned again later." %
+                                    (burner.name, isoData["iso"]))
+
+    def __findQueued(self, burnerName, iso, committer):
+        """Returns the entry of isosBeingBurnt of the last iso with the
+        given name and committer assigned to burnerName, or None.
+
+        Must be called with queueLock held."""
+        for isoData in reversed(self.__jobsOfBurner.get(burnerName, [])):
+            if isoData["iso"] == iso and isoData["committer"] == committer:
+                return isoData
+        return None
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import time
+
+
+# (start, end, hour, day) of the last hour that _buckets() was asked about
+_lastHour = (0, 0, None, None)
+
+
+def _buckets(when):
+    """Returns the keys of the hour and of the day that contain when (in
+    seconds since the epoch).
+
+    The burns come in order of time, so the keys of the last hour are
+    usually the right ones, and they are not formatted again."""
+    global _lastHour
+    (start, end, hour, day) = _lastHour
+    if not start <= when < end:
+        localTime = time.localtime(when)
+        start = int(when) - localTime.tm_min * 60 - localTime.tm_sec
+        hour = time.strftime("%Y-%m-%d %H:00", localTime)
+        day = time.strftime("%Y-%m-%d", localTime)
+        _lastHour = (start, start + 60 * 60, hour, day)
+    return (hour, day)
+
+
+class BurnStatistics:
+    """Counts the isos burnt and the failed burns, per iso, per burner,
+    per committer, per hour and per day.
+
+    The counts are updated as the burns complete or fail, so reading them
+    does not depend on how long the history is. Each count is a list
+    [burnt, failed]. Only the keptHours most recent hours and the
+    keptDays most recent days that had any burn are kept; the other
+    counts are kept forever.
+
+    This class is not thread safe: BurnerManager protects it with its
+    own locks. It is pickled together with the state of the manager.
+
+    Instance variables:
+
+    isos: dict iso -> counts
+
+    burners: dict burner name -> counts
+
+    committers: dict committer -> counts
+
+    hours: dict "YYYY-MM-DD HH:00" (local time) -> counts
+
+    days: dict "YYYY-MM-DD" (local time) -> counts
+    """
+
+    keptHours = 7 * 24
+    keptDays = 366
+
+    def __init__(self):
+        """Constructor."""
+        self.isos = {}
+        self.burners = {}
+        self.committers = {}
+        self.hours = {}
+        self.days = {}
+
+    def recordBurn(self, isoData):
+        """Counts a burnt iso, an entry like the ones of
+        BurnerManager.isosBurnt."""
+        self.record(isoData["iso"], isoData.get("burner"),
+                    isoData["committer"], isoData.get("finished"), False)
+
+    def record(self, iso, burnerName, committer, when, failed):
+        """Counts a burn of iso by burnerName for committer.
+
+        when: the time of the outcome, in seconds since the epoch, or None
+        if it is not known: the hours and days are not counted then.
+        failed: True if the burn failed, False if the iso was burnt."""
+        index = int(bool(failed))
+        self.__add(self.isos, iso, index)
+        if burnerName is not None:
+            self.__add(self.burners, burnerName, index)
+        self.__add(self.committers, committer, index)
+        if when is not None:
+            (hour, day) = _buckets(when)
+            self.__add(self.hours, hour, index, self.keptHours)
+            self.__add(self.days, day, index, self.keptDays)
+
+    def __add(self, counts, key, index, kept=None):
+        """Adds one to counts[key][index].
+
+        If kept is not None and a new key makes counts longer than that,
+        the smallest keys are removed: this only happens once per key."""
+        if not counts.has_key(key):
+            counts[key] = [0, 0]
+            if kept is not None and len(counts) > kept:
+                keys = counts.keys()
+                keys.sort()
+                for old in keys[:len(counts) - kept]:
+                    del counts[old]
+                if not counts.has_key(key):
+                    return # Older than all the ones kept
+        counts[key][index] += 1
+
+    def copy(self):
+        """Returns a copy that shares nothing with this one."""
+        retval = BurnStatistics()
+        for name in ("isos", "burners", "committers", "hours", "days"):
+            setattr(retval, name,
+                    dict([(key, list(value)) for (key, value)
+                          in getattr(self, name).iteritems()]))
+        return retval
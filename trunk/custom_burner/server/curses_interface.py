@@ -33,6 +33,7 @@ import curses.textpad
 from custom_burner import common
 import accumulator
 import burner_manager
+from deadline import *
 
 def errorMessage(message):
     """Displays an error message."""
@@ -335,16 +336,21 @@ class IsoWindow(CursesTable):
 
     def __init__(self, height, width, y, x):
         CursesTable.__init__(self, height, width, y, x,
-                             ("date", "iso", "committer"), title="ISO Queue",
-                             autoScroll=False)
+                             ("date", "iso", "committer", "deadline",
+                              "slack"),
+                             title="ISO Queue", autoScroll=False)
         self.burnerManager = burner_manager.BurnerManager.instance()
         self.reloadData()
 
     def reloadData(self):
         """Refresh the iso list and redisplays it."""
         self.clear()
-        for iso in self.burnerManager.getPendingIsos():
-            self.addRow(iso)
+        for iso in self.burnerManager.getPendingIsos(withSlack=True):
+            # Only the displayed columns: the entries may have other fields
+            self.addRow({"date": iso["date"], "iso": iso["iso"],
+                         "committer": iso["committer"],
+                         "deadline": formatDeadline(iso.get("deadline")),
+                         "slack": formatSlack(iso["slack"])})
 
 
 class IsoSelectorWindow(CursesTable):
@@ -448,7 +454,32 @@ class CursesInterface:
             curses.panel.update_panels()
             curses.doupdate()
             if committer != None:
-                self.burnerManager.queueIso(chosenIso, committer)
+                priority = askString("Priority (empty for 0)", 10)
+                curses.panel.update_panels()
+                curses.doupdate()
+                try:
+                    priority = int(priority or 0)
+                except ValueError:
+                    errorMessage("Invalid priority: %s" % priority)
+                    return
+                deadline = askString("Deadline (%s)" % DEADLINE_HELP, 16)
+                curses.panel.update_panels()
+                curses.doupdate()
+                try:
+                    deadline = parseDeadline(deadline or "")
+                except ValueError:
+                    errorMessage("Invalid deadline: %s" % deadline)
+                    return
+                selector = askString("Burner labels (key=value,...)", 30)
+                curses.panel.update_panels()
+                curses.doupdate()
+                try:
+                    selector = common.parseLabels(selector or "")
+                except ValueError, e:
+                    errorMessage(str(e))
+                    return
+                self.burnerManager.queueIso(chosenIso, committer, priority,
+                                            deadline, selector)
                 self.__isoWindow.reloadData()
                 curses.panel.update_panels()
                 curses.doupdate()
@@ -460,7 +491,8 @@ class CursesInterface:
         self.__stdscr = stdscr
         (screenH, screenW) = self.__stdscr.getmaxyx()
         self.__stdscr.addstr(0, 0, "Custom Burner " + common.version)
-        self.__stdscr.addstr(screenH - 1, 0, "a: add ISO  q: Quit")
+        self.__stdscr.addstr(screenH - 1, 0,
+                             "a: add ISO  r: refresh queue  q: Quit")
         self.__stdscr.noutrefresh()
         isoWindowHeight = ((screenH - 2) * 2)/ 3
         self.__isoWindow = IsoWindow(isoWindowHeight, screenW, 1, 0)
@@ -480,5 +512,9 @@ class CursesInterface:
                 self.__switchFocus()
             elif c == ord('a'):
                 self.__askForIso()
+            elif c == ord('r'):
+                # Dispatch, and update the projected slack times
+                self.burnerManager.refresh()
+                self.__isoWindow.reloadData()
             elif c == ord('q'):
                 quitting = True
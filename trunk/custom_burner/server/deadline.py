@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import time
+
+# The formats the user can enter deadlines in
+DEADLINE_HELP = "HH:MM or YYYY-MM-DD HH:MM"
+
+
+def parseDeadline(text, now=None):
+    """Converts a deadline entered by the user into seconds since the epoch.
+
+    text: "HH:MM" (today, or tomorrow if that time has already passed) or
+    "YYYY-MM-DD HH:MM".
+    now: the current time, defaults to time.time().
+
+    Returns None if text is empty. Raises ValueError if it is not valid."""
+    text = text.strip()
+    if not text:
+        return None
+    if now is None:
+        now = time.time()
+    try:
+        return time.mktime(time.strptime(text, "%Y-%m-%d %H:%M"))
+    except ValueError:
+        pass
+    hourMinute = time.strptime(text, "%H:%M") # Raises ValueError
+    today = list(time.localtime(now))
+    today[3:6] = [hourMinute.tm_hour, hourMinute.tm_min, 0]
+    today[8] = -1 # Let mktime() guess daylight saving time
+    retval = time.mktime(tuple(today))
+    if retval < now:
+        retval += 24 * 60 * 60 # Tomorrow
+    return retval
+
+
+def formatDeadline(deadline):
+    """Returns a deadline as a human readable string ("" if None)."""
+    if deadline is None:
+        return ""
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(deadline))
+
+
+def formatSlack(slack):
+    """Returns a slack time, in seconds, as a string like "+1h05m" or "-12m".
+
+    Returns "" if slack is None."""
+    if slack is None:
+        return ""
+    if slack < 0:
+        sign = "-"
+    else:
+        sign = "+"
+    minutes = int(abs(slack)) / 60
+    if minutes >= 60:
+        return "%s%dh%02dm" % (sign, minutes / 60, minutes % 60)
+    return "%s%dm" % (sign, minutes)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+
+class DurationEstimator:
+    """Learns how long burning takes.
+
+    Each ISO has its own expected duration, and each burner has a factor
+    that tells how much slower (> 1) or faster (< 1) than the average it
+    is. Both are exponential moving averages of the completed burns.
+
+    This class is not thread safe: BurnerManager protects it with its
+    own locks. It is pickled together with the state of the manager.
+
+    Instance variables:
+
+    isoDurations: dict iso -> expected duration in seconds
+
+    burnerFactors: dict burner name -> speed factor
+    """
+
+    # Duration assumed for the isos that were never burnt, in seconds
+    defaultDuration = 15 * 60
+
+    # Weight of the last measure in the moving averages
+    alpha = 0.3
+
+    def __init__(self):
+        """Constructor."""
+        self.isoDurations = {}
+        self.burnerFactors = {}
+
+    def expected(self, iso, burnerName=None):
+        """Returns the expected duration of burning iso, in seconds.
+
+        If burnerName is given, the speed of that burner is taken into
+        account, otherwise an average burner is assumed."""
+        duration = self.isoDurations.get(iso, self.defaultDuration)
+        if burnerName is not None:
+            duration *= self.burnerFactors.get(burnerName, 1.0)
+        return duration
+
+    def speed(self, burnerName):
+        """Returns the relative speed of a burner: higher is faster."""
+        return 1.0 / self.burnerFactors.get(burnerName, 1.0)
+
+    def record(self, iso, burnerName, duration):
+        """Learns from a completed burn.
+
+        iso: the iso that was burnt.
+        burnerName: the burner that burnt it.
+        duration: how long it took, in seconds."""
+        if duration <= 0:
+            return
+        if iso in self.isoDurations:
+            # How this burner performed compared to the expectation
+            ratio = duration / self.isoDurations[iso]
+            oldFactor = self.burnerFactors.get(burnerName, 1.0)
+            self.burnerFactors[burnerName] = self.__average(oldFactor, ratio)
+            # The iso duration is learned normalized to an average burner
+            normalized = duration / self.burnerFactors[burnerName]
+            self.isoDurations[iso] = self.__average(self.isoDurations[iso],
+                                                    normalized)
+        else:
+            # First time we see this iso: we can only trust the burner
+            factor = self.burnerFactors.get(burnerName, 1.0)
+            self.isoDurations[iso] = duration / factor
+
+    def __average(self, old, new):
+        """Updates a moving average with a new value."""
+        return (1 - self.alpha) * old + self.alpha * new
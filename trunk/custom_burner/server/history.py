@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import os
+import time
+import gzip
+import logging
+import cPickle
+
+
+class HistorySegments:
+    """The burnt isos that are not kept in memory any more, stored in a
+    directory as compressed segments: one file per period (a month, by
+    default) of completion times.
+
+    A segment is never modified after it has been written. Each one is
+    named after its period and the generation of the archive that wrote
+    it, e.g. "2008-05.3.gz": the checkpoint that lists an archiving
+    records its generation, and the segments of later generations, left
+    by a crash before the checkpoint was written, are deleted by
+    discardAfter().
+
+    This class is not thread safe: the store protects it with its own
+    lock.
+
+    Instance variables:
+
+    directory: where the segments are
+
+    periodFormat: the strftime() format of the periods
+
+    logger: logger object
+    """
+
+    def __init__(self, directory, periodFormat="%Y-%m"):
+        """Constructor."""
+        self.directory = directory
+        self.periodFormat = periodFormat
+        self.logger = logging.getLogger("HistorySegments")
+        # List of (period, generation, file name), oldest first
+        self.__segments = []
+        if os.path.isdir(directory):
+            for fileName in os.listdir(directory):
+                parts = fileName.split(".")
+                if len(parts) != 3 or parts[2] != "gz":
+                    continue # Temporary files are cleaned by discardAfter()
+                try:
+                    self.__segments.append((parts[0], int(parts[1]),
+                                            fileName))
+                except ValueError:
+                    continue
+            self.__segments.sort()
+
+    def periodOf(self, isoData):
+        """Returns the period a burnt iso belongs to.
+
+        The isos burnt by older versions, which did not record the
+        completion time, are filed under the date they were queued."""
+        if isoData.has_key("finished"):
+            when = isoData["finished"]
+        else:
+            try:
+                when = time.mktime(time.strptime(isoData["date"],
+                                                 "%Y-%m-%d %H:%M"))
+            except (KeyError, ValueError):
+                when = 0
+        return time.strftime(self.periodFormat, time.localtime(when))
+
+    def split(self, isos, now=None):
+        """Divides burnt isos between the ones of the current period and
+        the ones to archive.
+
+        Returns a tuple (dict period -> list of isos to archive, list of
+        isos of the current period)."""
+        if now is None:
+            now = time.time()
+        current = time.strftime(self.periodFormat, time.localtime(now))
+        archived = {}
+        recent = []
+        for isoData in isos:
+            period = self.periodOf(isoData)
+            if period < current:
+                archived.setdefault(period, []).append(isoData)
+            else:
+                recent.append(isoData)
+        return (archived, recent)
+
+    def write(self, archived, generation):
+        """Writes new segments: archived is a dict period -> list of
+        isos, as returned by split().
+
+        Each file is written under a temporary name, synced to disk and
+        renamed. Raises IOError or OSError."""
+        if not archived:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        written = []
+        for (period, isos) in sorted(archived.items()):
+            fileName = "%s.%d.gz" % (period, generation)
+            path = os.path.join(self.directory, fileName)
+            f = file(path + ".tmp", "wb")
+            try:
+                segment = gzip.GzipFile(fileName, "wb", 9, f)
+                cPickle.dump(isos, segment, cPickle.HIGHEST_PROTOCOL)
+                segment.close()
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            os.rename(path + ".tmp", path)
+            written.append((period, generation, fileName))
+        self.logger.info("Archived the burnt isos of %s." %
+                         ", ".join([period for (period, generation, fileName)
+                                    in written]))
+        self.__segments.extend(written)
+        self.__segments.sort()
+
+    def discardAfter(self, generation):
+        """Deletes the segments of the archivings after generation, that
+        no checkpoint refers to, and the temporary files."""
+        if not os.path.isdir(self.directory):
+            return
+        for fileName in os.listdir(self.directory):
+            if fileName.endswith(".tmp"):
+                os.remove(os.path.join(self.directory, fileName))
+        for segment in self.__segments[:]:
+            if segment[1] > generation:
+                self.logger.warning("Removing %s: it was written by a "
+                                    "checkpoint that did not complete." %
+                                    segment[2])
+                os.remove(os.path.join(self.directory, segment[2]))
+                self.__segments.remove(segment)
+
+    def segments(self, since=None):
+        """Returns the file names of the segments, oldest first.
+
+        since: if given, only the segments of the periods that end after
+        that time."""
+        if since is None:
+            first = ""
+        else:
+            first = time.strftime(self.periodFormat, time.localtime(since))
+        return [fileName for (period, generation, fileName)
+                in self.__segments if period >= first]
+
+    def read(self, fileName):
+        """Returns the burnt isos of a segment. Raises IOError."""
+        segment = gzip.open(os.path.join(self.directory, fileName), "rb")
+        try:
+            try:
+                return cPickle.load(segment)
+            except (EOFError, cPickle.UnpicklingError, ValueError), e:
+                raise IOError, "%s is damaged: %s" % (fileName, e)
+        finally:
+            segment.close()
+
+
+def matches(isoData, committer=None, iso=None, burner=None, since=None):
+    """Tells whether a burnt iso has the given committer, iso and burner,
+    and was completed not before since. None matches anything."""
+    return (committer is None or isoData["committer"] == committer) and \
+           (iso is None or isoData["iso"] == iso) and \
+           (burner is None or isoData.get("burner") == burner) and \
+           (since is None or isoData.get("finished", 0) >= since)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+
+class JobQueue:
+    """An ordered collection of jobs, the dicts BurnerManager keeps for
+    each iso to burn, indexed by their "id" field.
+
+    Appending, inserting at the head or after another job, removing a job
+    and finding one by id all take constant time: the jobs are kept in a
+    doubly linked list, and a dict maps each id to its link. Iterating,
+    len() and truth testing work as with a list.
+
+    Each job can be in the queue only once, and its id must not change
+    while it is there. Removing jobs while iterating over the queue is
+    not allowed: iterate over list(queue) instead.
+
+    This class is not thread safe: BurnerManager protects it with its
+    own locks. It is pickled as the list of its jobs.
+    """
+
+    def __init__(self, jobs=()):
+        """Constructor. jobs: the initial contents, in order."""
+        # The links are lists [previous, next, job]; the root is both the
+        # head and the tail of the circular list
+        self.__root = []
+        self.__root[:] = [self.__root, self.__root, None]
+        self.__links = {}
+        for job in jobs:
+            self.append(job)
+
+    def append(self, job):
+        """Adds a job at the end of the queue."""
+        self.__link(job, self.__root[0])
+
+    def appendleft(self, job):
+        """Adds a job at the head of the queue."""
+        self.__link(job, self.__root)
+
+    def insertAfter(self, job, previous):
+        """Adds a job right after another one, or at the head if previous
+        is None.
+
+        Raises ValueError if previous is not in the queue."""
+        if previous is None:
+            self.appendleft(job)
+        else:
+            self.__link(job, self.__linkOf(previous))
+
+    def __link(self, job, previous):
+        """Inserts job after the link previous."""
+        if self.__links.has_key(job["id"]):
+            raise ValueError, "Job %d is already in the queue." % job["id"]
+        following = previous[1]
+        link = [previous, following, job]
+        previous[1] = link
+        following[0] = link
+        self.__links[job["id"]] = link
+
+    def __linkOf(self, job):
+        """Returns the link of job. Raises ValueError if it is not in the
+        queue."""
+        link = self.__links.get(job.get("id"))
+        if link is None or link[2] is not job:
+            raise ValueError, "Job not in the queue."
+        return link
+
+    def remove(self, job):
+        """Removes a job. Raises ValueError if it is not in the queue."""
+        (previous, following, job) = self.__linkOf(job)
+        previous[1] = following
+        following[0] = previous
+        del self.__links[job["id"]]
+
+    def replace(self, job):
+        """Puts job in the place of the job with the same id.
+
+        Raises ValueError if there is no such job in the queue."""
+        link = self.__links.get(job["id"])
+        if link is None:
+            raise ValueError, "Job %d not in the queue." % job["id"]
+        link[2] = job
+
+    def get(self, jobId):
+        """Returns the job with the given id, or None."""
+        link = self.__links.get(jobId)
+        if link is None:
+            return None
+        return link[2]
+
+    def first(self):
+        """Returns the job at the head of the queue, or None."""
+        return self.__root[1][2]
+
+    def last(self):
+        """Returns the job at the end of the queue, or None."""
+        return self.__root[0][2]
+
+    def __contains__(self, job):
+        """Tells whether job is in the queue."""
+        link = self.__links.get(job.get("id"))
+        return link is not None and link[2] is job
+
+    def __iter__(self):
+        """Iterates over the jobs, from the head."""
+        link = self.__root[1]
+        while link is not self.__root:
+            yield link[2]
+            link = link[1]
+
+    def __len__(self):
+        """Returns the number of jobs."""
+        return len(self.__links)
+
+    def __getstate__(self):
+        """Pickles the queue as the list of its jobs."""
+        return list(self)
+
+    def __setstate__(self, jobs):
+        """Restores a pickled queue."""
+        self.__init__(jobs)
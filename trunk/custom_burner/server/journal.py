@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import os
+import logging
+import cPickle
+
+
+class Journal:
+    """An append-only file of records: the changes of the state of the
+    server since its last checkpoint.
+
+    The records are strings, usually pickled objects. Each one is pickled
+    together with a sequence number, which keeps growing across
+    checkpoints, written with a single write() and synced to disk. A crash
+    can therefore only lose or truncate the last record: replay() stops
+    at the first record that cannot be read, and cuts it off so that the
+    next records are appended after the good ones.
+
+    This class is not thread safe: BurnerManager protects it with its
+    own locks.
+
+    Instance variables:
+
+    fileName: the file the records are appended to
+
+    sequence: the sequence number of the last record written or read
+
+    records: how many records the file contains
+
+    logger: logger object
+    """
+
+    def __init__(self, fileName):
+        """Constructor. The file is only opened by replay() or append()."""
+        self.fileName = fileName
+        self.sequence = 0
+        self.records = 0
+        self.logger = logging.getLogger("Journal")
+        self.__file = None
+
+    def replay(self, after=0):
+        """Reads the file and returns the records whose sequence number is
+        greater than after, oldest first.
+
+        after: the sequence number of the last record contained in the
+        checkpoint the state was loaded from."""
+        retval = []
+        self.sequence = after
+        self.records = 0
+        try:
+            f = file(self.fileName, "rb")
+        except IOError:
+            return retval # Nothing was written since the checkpoint
+        good = 0
+        try:
+            unpickler = cPickle.Unpickler(f)
+            while True:
+                try:
+                    (sequence, record) = unpickler.load()
+                except EOFError:
+                    break
+                except (cPickle.UnpicklingError, ValueError, KeyError,
+                        IndexError), e:
+                    self.logger.warning("%s is damaged after %d records "
+                                        "(%s): the rest is lost." %
+                                        (self.fileName, self.records, e))
+                    break
+                good = f.tell()
+                self.records += 1
+                if sequence > after:
+                    retval.append(record)
+                    self.sequence = sequence
+            size = os.fstat(f.fileno()).st_size
+        finally:
+            f.close()
+        if size > good:
+            # Cut off the truncated record
+            f = file(self.fileName, "r+b")
+            try:
+                f.truncate(good)
+            finally:
+                f.close()
+        return retval
+
+    def append(self, record):
+        """Appends a record (a string) to the file and syncs it to disk.
+
+        Returns its sequence number. Raises IOError or OSError."""
+        data = cPickle.dumps((self.sequence + 1, record),
+                             cPickle.HIGHEST_PROTOCOL)
+        if self.__file is None:
+            self.__file = file(self.fileName, "ab")
+        self.__file.write(data)
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.sequence += 1
+        self.records += 1
+        return self.sequence
+
+    def truncate(self):
+        """Empties the file, after a checkpoint has saved all its records.
+
+        The sequence numbers go on from the last record. Raises IOError."""
+        self.close()
+        self.__file = file(self.fileName, "wb")
+        self.records = 0
+
+    def close(self):
+        """Closes the file. The next append() opens it again."""
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
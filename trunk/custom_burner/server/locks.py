@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import threading
+
+# The ranks of the locks of BurnerManager, in the order they must be
+# acquired: the dispatch lock first, then the locks of the burners, sorted
+# by name, then the catalog lock and the queue lock last.
+DISPATCH = 0
+BURNER = 1
+CATALOG = 2
+QUEUE = 3
+
+# The locks held by each thread
+_state = threading.local()
+
+
+def _heldLocks():
+    """Returns the list of the OrderedLocks the calling thread holds."""
+    try:
+        return _state.held
+    except AttributeError:
+        _state.held = []
+        return _state.held
+
+
+class OrderedLock:
+    """A lock that must be acquired in a fixed order.
+
+    Each lock has a rank, a tuple: a thread can only acquire a lock whose
+    rank is greater than the ranks of all the locks it already holds.
+    Acquiring one out of order raises AssertionError, instead of risking a
+    deadlock with another thread that acquires the same locks in the
+    right order. The locks can be released in any order.
+
+    The lock is not reentrant.
+
+    Instance variables:
+
+    name: the name of the lock, for the error messages
+
+    rank: the tuple that gives the order, e.g. (BURNER, name of the burner)
+    """
+
+    def __init__(self, name, rank):
+        """Constructor."""
+        self.name = name
+        self.rank = rank
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        """Acquires the lock, waiting for it if needed.
+
+        Raises AssertionError if the calling thread already holds a lock
+        of the same or of a higher rank."""
+        held = _heldLocks()
+        for lock in held:
+            if lock.rank >= self.rank:
+                raise AssertionError, "Acquiring %s while holding %s." % \
+                      (self.name, lock.name)
+        self.__lock.acquire()
+        held.append(self)
+
+    def release(self):
+        """Releases the lock, that the calling thread must hold."""
+        _heldLocks().remove(self)
+        self.__lock.release()
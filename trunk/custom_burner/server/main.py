@@ -35,6 +35,7 @@ from custom_burner import common
 from curses_interface import *
 from user_interface import *
 from network import *
+from reaper import *
 from burner import *
 from burner_manager import *
 
@@ -55,15 +56,44 @@ class CustomBurnerServer:
     # Maximum number of clients allowed to connect
     MAX_CLIENTS = 10
     
-    def __init__(self, port, useCurses):
+    def __init__(self, port, useCurses, dispatchMode="fifo",
+                 speculative=False, pushAhead=0, affinityWait=0,
+                 preemptive=False, readTokens=0, storageTokens=None,
+                 saveInterval=1.0, storeBackend="pickle"):
         """Initializes the server.
 
         isoDirectory: path to the directory containing the ISO images.
         port: TCP port to use for listening for connections.
         useCurses: set to True to enable the curses interface.
+        dispatchMode: how the pending isos are assigned to the burners
+        (see BurnerManager.setDispatchMode()).
+        speculative: set to True to start backup copies of the isos that
+        take much longer than expected.
+        pushAhead: how many isos each burner may keep in its queue, besides
+        the one it is burning.
+        affinityWait: how many seconds an iso may wait for the burner that
+        burnt it last, while it is busy.
+        preemptive: set to True to let the isos with higher priority take
+        the burners that are still waiting for a disc for other isos.
+        readTokens, storageTokens: how many burners may read from the same
+        shared storage at the same time (see
+        BurnerManager.setReadTokens()).
+        saveInterval: how many seconds the changes of the state are
+        gathered for, before being written to disk together.
+        storeBackend: how the state is saved, one of
+        BurnerManager.storeBackends.
         """
         self.port = port
         self.quitting = False
+        # Must be chosen before the manager is created
+        BurnerManager.storeBackend = storeBackend
+        BurnerManager.instance().setDispatchMode(dispatchMode)
+        BurnerManager.instance().setSpeculative(speculative)
+        BurnerManager.instance().setPushAhead(pushAhead)
+        BurnerManager.instance().setAffinityWait(affinityWait)
+        BurnerManager.instance().setPreemptive(preemptive)
+        BurnerManager.instance().setReadTokens(readTokens, storageTokens)
+        BurnerManager.instance().setSaveInterval(saveInterval)
         if useCurses:
             self.ui = CursesInterface(BurnerManager.instance())
         else:
@@ -74,17 +104,20 @@ class CustomBurnerServer:
                          ("", self.port))
         self.tcpServer = TCPServer(("", self.port), RequestHandler)
         self.listener = NetworkServerThread(self.tcpServer, self)
+        self.reaper = ReaperThread(BurnerManager.instance(), self)
 
     def live(self):
         """Accept network connections and user interaction."""
         try:
             self.listener.start()
+            self.reaper.start()
             self.ui.live()
         except KeyboardInterrupt:
             self.logger.info("CTRL+C received. Closing...")
             pass
         self.quitting = True
         self.listener.join()
+        self.reaper.join()
         BurnerManager.instance().close()
 
 
@@ -97,7 +130,14 @@ def ServerMain():
     parser.set_defaults(directory=".",
                         port=1234,
                         logfile="custom_burner_server.log",
-                        useCurses=False)
+                        useCurses=False,
+                        dispatchMode="fifo",
+                        speculative=False,
+                        preemptive=False,
+                        saveInterval=1.0,
+                        storeBackend="pickle",
+                        pushAhead=0,
+                        affinityWait=0)
     parser.add_option("-p", "--port", dest="port", type="int",
                       help="specifies the TCP port for listening")
     parser.add_option("-v", "--verbose", dest="verbosity",
@@ -106,12 +146,61 @@ def ServerMain():
                       help="where to log messages (\"-\" for stdout)")
     parser.add_option("-c", "--curses", dest="useCurses", action="store_true",
                       help="use curses interface")
+    parser.add_option("-m", "--dispatch", dest="dispatchMode",
+                      help="how isos are assigned to the burners: %s, or the "
+                      "full name of a Scheduler class, like "
+                      "mymodule.MyScheduler (default: fifo)" %
+                      ", ".join(BurnerManager.dispatchModes))
+    parser.add_option("-x", "--speculative", dest="speculative",
+                      action="store_true",
+                      help="when the queue is empty, burn a second copy of "
+                      "the isos that are taking too long")
+    parser.add_option("-P", "--preempt", dest="preemptive",
+                      action="store_true",
+                      help="let isos with higher priority take the burners "
+                      "that have not started writing yet")
+    parser.add_option("-T", "--read-tokens", dest="readTokens",
+                      help="how many burners may read from the same shared "
+                      "storage at the same time: a number for every "
+                      "storage, and/or storage=number items, comma "
+                      "separated (default: no limit)")
+    parser.add_option("-a", "--push-ahead", dest="pushAhead", type="int",
+                      help="number of isos queued on each burner besides the "
+                      "one it is burning (default: 0)")
+    parser.add_option("-A", "--affinity-wait", dest="affinityWait", type="int",
+                      help="seconds an iso may wait for the busy burner that "
+                      "burnt it last, instead of going to another one "
+                      "(default: 0)")
+    parser.add_option("-W", "--save-interval", dest="saveInterval",
+                      type="float",
+                      help="seconds the changes of the state are gathered "
+                      "for, before being written to disk together; 0 writes "
+                      "each change immediately (default: 1)")
+    parser.add_option("-S", "--store", dest="storeBackend",
+                      choices=BurnerManager.storeBackends,
+                      help="how the state is saved: %s (default: pickle)" %
+                      ", ".join(BurnerManager.storeBackends))
     (opts, args) = parser.parse_args()
 
     if len(args) > 0:
         # We don't want cmdline arguments
         parser.print_help()
         sys.exit(-1)
+    readTokens = 0
+    storageTokens = {}
+    try:
+        for item in (opts.readTokens or "").split(","):
+            item = item.strip()
+            if not item:
+                continue
+            if "=" in item:
+                (storage, tokens) = item.rsplit("=", 1)
+                storageTokens[storage.strip()] = int(tokens)
+            else:
+                readTokens = int(item)
+    except ValueError:
+        sys.stderr.write("Invalid read tokens: %s\n" % opts.readTokens)
+        sys.exit(-1)
 
     # Setup logger
     if opts.verbosity == None or opts.verbosity == 0:
@@ -130,10 +219,18 @@ def ServerMain():
 
 
     try:
-        srv = CustomBurnerServer(opts.port, opts.useCurses)
+        srv = CustomBurnerServer(opts.port, opts.useCurses,
+                                 opts.dispatchMode, opts.speculative,
+                                 opts.pushAhead, opts.affinityWait,
+                                 opts.preemptive, readTokens, storageTokens,
+                                 opts.saveInterval, opts.storeBackend)
     except socket.error, e:
         # This may occur during server start
         sys.stderr.write("Socket error: %s\n" % str(e))
         sys.exit(-1)
+    except ValueError, e:
+        # Unknown scheduler, or no sqlite3 module
+        sys.stderr.write("%s\n" % str(e))
+        sys.exit(-1)
 
     srv.live()
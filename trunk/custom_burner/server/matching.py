@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+
+def maximumMatching(jobs, candidates, burnersNum=None):
+    """Computes a maximum matching between jobs and burners.
+
+    jobs: list of job keys, sorted by decreasing priority.
+
+    candidates: function that receives a job key and returns the list of
+    the burners that can take it, in order of preference. Jobs with the
+    same key must have the same candidates.
+
+    burnersNum: number of distinct burners, if known. It is only used to
+    stop early when all of them have been matched.
+
+    Returns a list of (job index, burner) pairs.
+
+    The jobs are inserted into the matching one at a time, in priority
+    order, looking for an augmenting path each time (Kuhn's
+    algorithm). A job that has been matched is never dropped by later
+    jobs, only moved to another burner. This is the greedy algorithm on
+    the transversal matroid of the graph, therefore the result is not
+    only a matching of maximum size, but also the one that maximizes
+    the sum of the priorities of the matched jobs, whatever their
+    numeric weights are.
+    """
+    # burner -> index of the job it is matched with
+    jobOfBurner = {}
+    # index of the job -> burner
+    burnerOfJob = {}
+    # Keys of jobs that found no augmenting path. If a vertex has no
+    # augmenting path, it will not have one after later augmentations
+    # either, so all the jobs sharing its key can be skipped.
+    hopeless = set()
+    for i in range(len(jobs)):
+        if burnersNum is not None and len(jobOfBurner) >= burnersNum:
+            break # Every burner is busy
+        key = jobs[i]
+        if key in hopeless:
+            continue
+        path = _augmentingPath(i, jobs, candidates, jobOfBurner)
+        if path is None:
+            hopeless.add(key)
+            continue
+        # Walk the path backwards, flipping matched and unmatched edges
+        (job, burner, parentJob) = path
+        while True:
+            previousBurner = burnerOfJob.get(job)
+            jobOfBurner[burner] = job
+            burnerOfJob[job] = burner
+            if previousBurner is None:
+                break # We got back to the new job
+            burner = previousBurner
+            job = parentJob[burner]
+    retval = burnerOfJob.items()
+    retval.sort()
+    return retval
+
+
+def _augmentingPath(start, jobs, candidates, jobOfBurner):
+    """Looks for an augmenting path starting from job number start.
+
+    The search is a breadth-first visit, so that the first candidates
+    of each job are tried before the others and shorter paths are
+    preferred.
+
+    Returns None if no path was found, otherwise a tuple (job, burner,
+    parentJob), where burner is the free burner at the end of the path,
+    job is the job that reached it and parentJob is a dict that maps
+    each burner visited to the job it was reached from."""
+    parentJob = {}
+    frontier = [start]
+    while frontier:
+        nextFrontier = []
+        for job in frontier:
+            for burner in candidates(jobs[job]):
+                if burner in parentJob:
+                    continue
+                parentJob[burner] = job
+                if burner not in jobOfBurner:
+                    return (job, burner, parentJob)
+                nextFrontier.append(jobOfBurner[burner])
+        frontier = nextFrontier
+    return None
@@ -98,12 +98,77 @@ class RequestHandler(common.RequestHandler):
         for i in range(isosNum):
             isos.append(self.readLine())
         self.request.send(common.MSG_ACK + "\n")
+        # The other sections are optional, in any order: older clients
+        # close the connection after their isos
+        isoSizes = {}
+        capabilities = None
+        labels = {}
+        storage = ""
+        data = self.readLineOrEnd()
+        while data is not None:
+            if data == common.MSG_CLIENT_ISO_SIZES:
+                sizesNum = int(self.readLine())
+                try:
+                    for i in range(sizesNum):
+                        (iso, size) = self.readLine().split("\t")
+                        isoSizes[iso] = int(size)
+                except ValueError, e:
+                    raise common.BurnerException("Burner registration for "
+                                                 "%s failed: bad iso size "
+                                                 "(%s)" % (peerName, e))
+            elif data == common.MSG_CLIENT_CAN_BURN:
+                capabilitiesNum = int(self.readLine())
+                capabilities = []
+                for i in range(capabilitiesNum):
+                    capabilities.append(self.readLine())
+            elif data == common.MSG_CLIENT_LABELS:
+                labelsNum = int(self.readLine())
+                try:
+                    for i in range(labelsNum):
+                        labels.update(common.parseLabels(self.readLine()))
+                except ValueError, e:
+                    raise common.BurnerException("Burner registration for "
+                                                 "%s failed: %s" %
+                                                 (peerName, e))
+            elif data == common.MSG_CLIENT_STORAGE:
+                for i in range(int(self.readLine())):
+                    storage = self.readLine()
+            else:
+                raise common.BurnerException("Burner registration for %s "
+                                             "failed: strange data received: "
+                                             "\"%s\"" % (peerName, data))
+            self.request.send(common.MSG_ACK + "\n")
+            data = self.readLineOrEnd()
         peerIP = self.request.getpeername()[0]
-        self.logger.info("Registering burner %s, IP: %s, port: %s" %
-                         (peerName, peerIP, peerPort))
+        if capabilities is None:
+            media = "unknown"
+        else:
+            media = ", ".join(capabilities)
+        self.logger.info("Registering burner %s, IP: %s, port: %s, media: %s" %
+                         (peerName, peerIP, peerPort, media))
+        if labels:
+            self.logger.info("Burner %s has labels %s" %
+                             (peerName,
+                              common.formatLabels(sorted(labels.items()))))
+        if storage:
+            self.logger.info("Burner %s reads its isos from %s" %
+                             (peerName, storage))
         self.logger.debug("It has the following isos: %s" % str(isos))
-        self.burnerManager.registerBurner(peerName, peerIP, peerPort, isos)
-
+        self.burnerManager.registerBurner(peerName, peerIP, peerPort, isos,
+                                          isoSizes, capabilities, labels,
+                                          storage)
+
+
+    def __refillQueues(self):
+        """Dispatches again after a burner has completed an iso, if the
+        burners keep queues of isos, if isos may be waiting for that
+        burner or if isos may be waiting for a read token: the queue that
+        has just become shorter is filled again while the burner works on
+        its next iso."""
+        if self.burnerManager.pushAhead > 0 or \
+               self.burnerManager.affinityWait > 0 or \
+               self.burnerManager.limitsReads():
+            self.burnerManager.refresh()
 
     def handle(self):
         """Handle the connection: greet the peer."""
@@ -122,6 +187,15 @@ class RequestHandler(common.RequestHandler):
                 self.logger.info("Peer %s reports completion of job %s for %s" %
                                  (burnerName, isoName, committer))
                 self.burnerManager.reportCompletion(burnerName, isoName)
+                self.__refillQueues()
+            elif data == common.MSG_BURN_STARTED:
+                burnerName = self.readLine()
+                isoName = self.readLine()
+                committer = self.readLine()
+                self.request.send(common.MSG_ACK + "\n")
+                self.logger.debug("Peer %s started writing %s for %s" %
+                                  (burnerName, isoName, committer))
+                self.burnerManager.reportBurnStarted(burnerName, isoName)
             elif data == common.MSG_BURN_ERROR:
                 burnerName = self.readLine()
                 isoName = self.readLine()
@@ -130,6 +204,18 @@ class RequestHandler(common.RequestHandler):
                 self.logger.info(("Peer %s reports error while burning %s " \
                                   "for %s") % (burnerName, isoName, committer))
                 self.burnerManager.reportBurningError(burnerName, isoName)
+                self.__refillQueues()
+            elif data == common.MSG_MEDIA_STATE:
+                burnerName = self.readLine()
+                state = self.readLine()
+                self.request.send(common.MSG_ACK + "\n")
+                self.logger.debug("Peer %s reports media state: %s" %
+                                  (burnerName, state))
+                self.burnerManager.reportMediaState(burnerName, state)
+            elif data == common.MSG_HEARTBEAT:
+                burnerName = self.readLine()
+                self.request.send(common.MSG_ACK + "\n")
+                self.burnerManager.renewLease(burnerName)
             elif data == common.MSG_CLOSING:
                 burnerName = self.readLine()
                 self.logger.info("Burner %s is leaving." % burnerName)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import time
+import threading
+
+
+class ReaperThread(threading.Thread):
+    """Thread that periodically takes back the isos of the burners that
+    stopped giving signs of life, and dispatches the failed isos whose
+    backoff time has passed, until quitting becomes True."""
+
+    # Seconds between two checks
+    interval = 30
+
+    def __init__(self, burnerManager, customBurnerServer):
+        """Constructor."""
+        threading.Thread.__init__(self)
+        self.burnerManager = burnerManager
+        self.customBurnerServer = customBurnerServer
+
+    def run(self):
+        """Main loop."""
+        lastCheck = time.time()
+        while not self.customBurnerServer.quitting:
+            time.sleep(1)
+            if time.time() - lastCheck < self.interval:
+                continue
+            lastCheck = time.time()
+            reaped = self.burnerManager.reapExpiredLeases()
+            if self.burnerManager.wakeRetries() > 0 or reaped > 0:
+                self.burnerManager.refresh()
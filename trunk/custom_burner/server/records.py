@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+
+def share(name):
+    """Returns the shared copy of a name: the name of an iso, of a
+    committer or of a burner, that many jobs and burners contain.
+
+    Plain strings are interned, so all the records that contain the same
+    name point to the same string, and it goes away with the last of
+    them. Other values, like None, are returned as they are."""
+    if type(name) is str:
+        return intern(name)
+    return name
+
+
+class Job(object):
+    """A job of BurnerManager: an iso to burn for a committer, pending,
+    being burnt or burnt already.
+
+    A job behaves like the dict that BurnerManager used to keep for each
+    iso (see its description of pendingIsos): the fields are read and
+    changed with job["iso"], get(), has_key() and so on, and a field that
+    has not been set is missing, like a key that is not in a dict. Only
+    the fields in FIELDS can be set, though: they are kept in slots
+    instead of a dict of their own, and the names in them are shared
+    (see share()), so that a job takes a fraction of the memory of the
+    dict.
+
+    A job is pickled as the values of the fields that are set, after a
+    bit mask that tells which fields they are: new fields must be added
+    at the end of FIELDS, or the jobs saved before would be read wrong.
+    """
+
+    FIELDS = ("id", "date", "iso", "committer", "priority", "deadline",
+              "selector", "set", "member", "burner", "started",
+              "leaseExpiry", "writing", "finished", "retries", "avoid",
+              "notBefore", "affinityUntil", "twin", "superseded", "atRisk",
+              "parked", "probe")
+
+    __slots__ = FIELDS
+
+    # The fields that contain names. Jobs queued in the same minute also
+    # share their date.
+    sharedFields = frozenset(("date", "iso", "committer", "burner", "twin"))
+
+    __hash__ = None # Like a dict
+
+    def __init__(self, fields=(), **kwargs):
+        """Constructor.
+
+        fields: a dict, or another job, to copy the fields from. The
+        keyword arguments are set after them.
+
+        Raises KeyError if a field is not in FIELDS."""
+        if fields:
+            for (key, value) in fields.items():
+                self[key] = value
+        for (key, value) in kwargs.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        """Returns a field. Raises KeyError if it is not set."""
+        if key in _FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError, key
+
+    def __setitem__(self, key, value):
+        """Sets a field. Raises KeyError if it is not in FIELDS."""
+        if key not in _FIELDS:
+            raise KeyError, "%s is not a field of a job" % key
+        if key in self.sharedFields:
+            value = share(value)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        """Removes a field. Raises KeyError if it is not set."""
+        if key in _FIELDS:
+            try:
+                delattr(self, key)
+                return
+            except AttributeError:
+                pass
+        raise KeyError, key
+
+    def __contains__(self, key):
+        """Tells whether a field is set."""
+        return key in _FIELDS and hasattr(self, key)
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        """Returns a field, or default if it is not set."""
+        if key in _FIELDS:
+            return getattr(self, key, default)
+        return default
+
+    def pop(self, key, *default):
+        """Removes a field and returns its value, or default if it is not
+        set. Raises KeyError if it is not set and there is no default."""
+        if key in self:
+            retval = self[key]
+            del self[key]
+            return retval
+        if default:
+            return default[0]
+        raise KeyError, key
+
+    def setdefault(self, key, default=None):
+        """Returns a field, setting it to default first if it is not set."""
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def keys(self):
+        """Returns the names of the fields that are set, in the order of
+        FIELDS."""
+        return [key for key in self.FIELDS if hasattr(self, key)]
+
+    def items(self):
+        """Returns the (name, value) pairs of the fields that are set."""
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def __iter__(self):
+        """Iterates over the names of the fields that are set."""
+        return iter(self.keys())
+
+    def __len__(self):
+        """Returns the number of fields that are set."""
+        return len(self.keys())
+
+    def copy(self):
+        """Returns a shallow copy, like dict.copy()."""
+        return Job(self)
+
+    def __eq__(self, other):
+        """Compares the fields with the ones of another job or dict."""
+        if not isinstance(other, (Job, dict)):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        """The opposite of __eq__()."""
+        retval = self.__eq__(other)
+        if retval is NotImplemented:
+            return retval
+        return not retval
+
+    def __repr__(self):
+        """Returns the fields as a dict would show them."""
+        return "Job(%r)" % dict(self.items())
+
+    def __getstate__(self):
+        """Returns the tuple that is pickled: a bit mask of the fields that
+        are set, followed by their values."""
+        mask = 0
+        values = []
+        bit = 1
+        for key in self.FIELDS:
+            if hasattr(self, key):
+                mask |= bit
+                values.append(getattr(self, key))
+            bit <<= 1
+        return (mask, ) + tuple(values)
+
+    def __setstate__(self, state):
+        """Restores a job from the tuple returned by __getstate__()."""
+        mask = state[0]
+        i = 1
+        for key in self.FIELDS:
+            if mask & 1:
+                self[key] = state[i]
+                i += 1
+            mask >>= 1
+
+
+# The fields of a job, for the checks of Job
+_FIELDS = frozenset(Job.FIELDS)
+
+
+def toJob(entry):
+    """Returns a saved entry as a Job: the jobs saved by older versions are
+    dicts. Their fields that this version does not know are dropped."""
+    if isinstance(entry, Job):
+        return entry
+    return Job(dict([(key, value) for (key, value) in entry.items()
+                     if key in _FIELDS]))
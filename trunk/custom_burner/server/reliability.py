@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+
+import time
+
+
+class ReliabilityTracker:
+    """Keeps the success and failure statistics of the burners, and
+    decides which ones must be quarantined.
+
+    The counts decay exponentially with time, so that a drive that has
+    been repaired or cleaned is not blamed forever for its old failures.
+    A burner whose failure rate goes above quarantineThreshold stops
+    receiving isos; after probeInterval seconds it receives one iso as a
+    probe, and it is requalified if the probe succeeds. The isos it was
+    given before the quarantine do not requalify it.
+
+    This class is not thread safe: BurnerManager protects it with its
+    own locks. It is pickled together with the state of the manager.
+
+    Instance variables:
+
+    counts: dict burner name -> [successes, failures, time of the last
+    update]; the counts are decayed up to that time
+
+    quarantined: dict burner name -> time it was quarantined or its last
+    probe was started
+    """
+
+    # Seconds after which the old outcomes weigh half
+    halfLife = 7 * 24 * 60 * 60
+
+    # Failure rate assumed for a new burner, and how many burns that
+    # assumption is worth
+    priorRate = 0.05
+    priorBurns = 2.0
+
+    # Failure rate above which a burner is quarantined, and the minimum
+    # (decayed) number of burns needed to judge it
+    quarantineThreshold = 0.3
+    minimumBurns = 5.0
+
+    # Seconds between two probes of a quarantined burner
+    probeInterval = 60 * 60
+
+    def __init__(self):
+        """Constructor."""
+        self.counts = {}
+        self.quarantined = {}
+
+    def failureRate(self, burnerName, now=None):
+        """Returns the estimated probability that burnerName fails a
+        burn."""
+        (successes, failures) = self.__decayed(burnerName, now)
+        return (failures + self.priorRate * self.priorBurns) / \
+               (successes + failures + self.priorBurns)
+
+    def isQuarantined(self, burnerName):
+        """Returns True if burnerName must not receive isos, except for
+        probes."""
+        return burnerName in self.quarantined
+
+    def probeDue(self, burnerName, now=None):
+        """Returns True if burnerName is quarantined and it is time to give
+        it a probe iso."""
+        if now is None:
+            now = time.time()
+        since = self.quarantined.get(burnerName)
+        return since is not None and now - since >= self.probeInterval
+
+    def probeStarted(self, burnerName, now=None):
+        """Records that a probe iso has been given to burnerName: the next
+        one is due after probeInterval seconds."""
+        if now is None:
+            now = time.time()
+        self.quarantined[burnerName] = now
+
+    def record(self, burnerName, success, probe=False, now=None):
+        """Learns the outcome of a burn.
+
+        success: True if the iso was burnt, False if the burn failed.
+        probe: True if the iso was the probe of a quarantined burner.
+
+        Returns "quarantined" if the burner has just been quarantined,
+        "requalified" if it has just left the quarantine, None
+        otherwise."""
+        if now is None:
+            now = time.time()
+        (successes, failures) = self.__decayed(burnerName, now)
+        if success:
+            successes += 1
+        else:
+            failures += 1
+        self.counts[burnerName] = [successes, failures, now]
+        if self.isQuarantined(burnerName):
+            if not success:
+                # The next probe is due after probeInterval seconds
+                self.probeStarted(burnerName, now)
+                return None
+            if not probe:
+                return None
+            # The probe succeeded: the old failures are forgiven
+            del self.quarantined[burnerName]
+            self.counts[burnerName] = [successes, 0.0, now]
+            return "requalified"
+        if successes + failures >= self.minimumBurns and \
+               self.failureRate(burnerName, now) > self.quarantineThreshold:
+            self.quarantined[burnerName] = now
+            return "quarantined"
+        return None
+
+    def __decayed(self, burnerName, now):
+        """Returns the (successes, failures) of burnerName, decayed up to
+        now."""
+        if not self.counts.has_key(burnerName):
+            return (0.0, 0.0)
+        (successes, failures, updated) = self.counts[burnerName]
+        if now is None:
+            now = time.time()
+        weight = 0.5 ** (max(0, now - updated) / float(self.halfLife))
+        return (successes * weight, failures * weight)
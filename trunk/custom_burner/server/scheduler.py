@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+
+import matching
+
+
+class SchedulerView:
+    """What a scheduler can see during a dispatch pass.
+
+    The view is read-only: schedulers must not modify the jobs, and they
+    do not see the burners or the manager directly.
+
+    Instance variables:
+
+    jobs: list of the pending isos that can be assigned in this pass, in
+    queue order. Each one is an entry of BurnerManager.pendingIsos, a
+    records.Job that is read like a dict.
+
+    burners: list of the names of the burners that can receive one iso in
+    this pass, from the most preferred to the least preferred one
+
+    now: the time of the pass, in seconds since the epoch
+    """
+
+    def __init__(self, jobs, burners, holders, preferred, durations, now,
+                 pools=None, tiers=None):
+        """Constructor: called by BurnerManager.
+
+        holders: dict iso -> list of the names of the burners in burners
+        that can burn it, in the same order.
+        preferred: list aligned with jobs: the name of the burner that
+        burnt each iso last, if it can take it in this pass, or None.
+        durations: the DurationEstimator of the manager.
+        pools: dict selector -> set of the names of the burners that have
+        the labels of the selector, or None for the empty selector.
+        tiers: dict name of a burner -> the key that burners is sorted by
+        (see tier())."""
+        self.jobs = jobs
+        self.burners = burners
+        self.now = now
+        self.__holders = holders
+        self.__preferred = preferred
+        self.__durations = durations
+        if pools is None:
+            pools = {}
+        self.__pools = pools
+        if tiers is None:
+            tiers = {}
+        self.__tiers = tiers
+        self.__rank = {}
+        for i in range(len(burners)):
+            self.__rank[burners[i]] = i
+        self.__atRisk = []
+
+    def candidates(self, index):
+        """Returns the names of the burners that can take job number index,
+        most preferred first.
+
+        The burners that already failed the job and the ones without the
+        labels it asks for are left out, and the burner that burnt its iso
+        last comes first."""
+        retval = self.candidatesFor(self.jobs[index]["iso"],
+                                    self.jobs[index].get("avoid", ()),
+                                    self.jobs[index].get("selector", ()))
+        preferred = self.__preferred[index]
+        if preferred is not None and preferred in retval:
+            retval.remove(preferred)
+            retval.insert(0, preferred)
+        return retval
+
+    def preferred(self, index):
+        """Returns the name of the burner that burnt the iso of job number
+        index last, if it can take it in this pass, otherwise None."""
+        return self.__preferred[index]
+
+    def candidatesFor(self, iso, avoid=(), selector=()):
+        """Returns the names of the burners that can burn iso, most
+        preferred first, except the ones in avoid and the ones without the
+        labels in selector."""
+        pool = self.__pools.get(selector)
+        return [name for name in self.__holders.get(iso, ())
+                if name not in avoid and (pool is None or name in pool)]
+
+    def rank(self, burnerName):
+        """Returns the position of a burner in burners."""
+        return self.__rank[burnerName]
+
+    def tier(self, burnerName):
+        """Returns the preference of a burner, as a sortable key: burners
+        with the same key are equally preferred by the manager, whatever
+        their rank."""
+        return self.__tiers.get(burnerName, ())
+
+    def expected(self, iso, burnerName):
+        """Returns how many seconds burnerName is expected to take to burn
+        iso."""
+        return self.__durations.expected(iso, burnerName)
+
+    def speed(self, burnerName):
+        """Returns the relative speed of a burner: higher is faster."""
+        return self.__durations.speed(burnerName)
+
+    def markAtRisk(self, index):
+        """Tells the manager that job number index is projected to miss its
+        deadline."""
+        self.__atRisk.append(index)
+
+    def atRisk(self):
+        """Returns the indexes of the jobs marked with markAtRisk()."""
+        return self.__atRisk
+
+
+class Scheduler:
+    """Base class of the scheduling policies.
+
+    A scheduler decides which pending isos go to which burners. The
+    manager calls assign() once for each dispatch pass; with push-ahead
+    queues there is one pass for each level of the queues.
+    """
+
+    # The name used on the command line
+    name = None
+
+    def order(self, jobs):
+        """Returns the pending isos in the order the scheduler considers
+        them, as a new list. The manager uses this order for the sets of
+        isos and to project the slack times.
+
+        jobs: entries of BurnerManager.pendingIsos, in queue order."""
+        return list(jobs)
+
+    def assign(self, view):
+        """Decides the assignments of a dispatch pass.
+
+        view: a SchedulerView.
+
+        Returns a list of (job index, burner name) pairs. Each burner may
+        appear at most once, and only with a job among its candidates."""
+        raise NotImplementedError
+
+
+class FifoScheduler(Scheduler):
+    """Gives each pending iso, in queue order, to the first burner that
+    can take it."""
+
+    name = "fifo"
+
+    def assign(self, view):
+        """Assigns the isos greedily, in queue order."""
+        retval = []
+        used = set()
+        for i in range(len(view.jobs)):
+            if len(used) == len(view.burners):
+                break # Every burner got something
+            for burnerName in view.candidates(i):
+                if burnerName not in used:
+                    used.add(burnerName)
+                    retval.append((i, burnerName))
+                    break
+        return retval
+
+
+class MatchingScheduler(Scheduler):
+    """Computes a maximum matching between the pending isos and the
+    burners.
+
+    A greedy assignment can give the only burner that has a rare iso to a
+    job that other burners could have taken. The matching keeps as many
+    burners busy as possible and, among the assignments of maximum size,
+    prefers the isos with the highest priority (and the oldest ones among
+    those with the same priority).
+    """
+
+    name = "matching"
+
+    def order(self, jobs):
+        """Highest priority first; the sort is stable."""
+        return sorted(jobs, key=lambda isoData: -isoData.get("priority", 0))
+
+    def assign(self, view):
+        """Assigns the isos with matching.maximumMatching()."""
+        indexes = range(len(view.jobs))
+        indexes.sort(key=lambda i: -view.jobs[i].get("priority", 0))
+        # Jobs are keyed by iso, by the burners they must avoid and by the
+        # labels they ask for
+        keys = [(view.jobs[i]["iso"], tuple(view.jobs[i].get("avoid", ())),
+                 view.jobs[i].get("selector", ())) for i in indexes]
+        # The preferred burner depends on the key only
+        preferred = {}
+        for j in range(len(indexes)):
+            preferred.setdefault(keys[j], view.preferred(indexes[j]))
+        def candidates(key):
+            retval = view.candidatesFor(*key)
+            burnerName = preferred[key]
+            if burnerName in retval:
+                # Tried first by the breadth-first search
+                retval.remove(burnerName)
+                retval.insert(0, burnerName)
+            return retval
+        pairs = matching.maximumMatching(keys, candidates, len(view.burners))
+        return [(indexes[j], burnerName) for (j, burnerName) in pairs]
+
+
+class EdfScheduler(Scheduler):
+    """Earliest deadline first, giving the fastest burners to the isos that
+    risk being late.
+
+    An iso that can still be completed in time goes to the slowest burner
+    that makes it, so that the fast ones are kept for the isos at risk. An
+    iso that is projected to miss its deadline on every burner goes to the
+    fastest one. Isos without a deadline come last and take the slowest
+    burners. The slowest burner is chosen within the most preferred tier
+    (see SchedulerView.tier()), unless the iso is at risk; the order of
+    the view only breaks ties.
+    """
+
+    name = "edf"
+
+    def order(self, jobs):
+        """Earliest deadline first."""
+        return sorted(jobs, key=self.__key)
+
+    def __key(self, isoData):
+        """Sort key for the earliest deadline first order.
+
+        Isos without a deadline come last; ties are broken by priority."""
+        deadline = isoData.get("deadline")
+        return (deadline is None, deadline, -isoData.get("priority", 0))
+
+    def assign(self, view):
+        """Assigns the isos in earliest deadline first order."""
+        retval = []
+        used = set()
+        indexes = range(len(view.jobs))
+        indexes.sort(key=lambda i: self.__key(view.jobs[i]))
+        for i in indexes:
+            if len(used) == len(view.burners):
+                break
+            iso = view.jobs[i]["iso"]
+            candidates = [name for name in view.candidates(i)
+                          if name not in used]
+            if not candidates:
+                continue
+            preferred = view.preferred(i)
+            expected = lambda name: view.expected(iso, name)
+            deadline = view.jobs[i].get("deadline")
+            inTime = [name for name in candidates if deadline is None or
+                      view.now + expected(name) <= deadline]
+            if inTime:
+                # Slowest first among the burners of the best tier, then
+                # in the order of the view
+                candidates = sorted(inTime, key=lambda name: (
+                    view.tier(name), -expected(name), view.rank(name)))
+                if preferred in candidates:
+                    candidates.remove(preferred)
+                    candidates.insert(0, preferred)
+            else:
+                view.markAtRisk(i)
+                # Fastest first; the order of the view only breaks ties
+                candidates.sort(key=view.rank)
+                candidates.sort(key=expected)
+            used.add(candidates[0])
+            retval.append((i, candidates[0]))
+        return retval
+
+
+# The schedulers that can be chosen by name
+SCHEDULERS = {FifoScheduler.name: FifoScheduler,
+              MatchingScheduler.name: MatchingScheduler,
+              EdfScheduler.name: EdfScheduler}
+
+
+def createScheduler(name):
+    """Creates a scheduler.
+
+    name: one of the keys of SCHEDULERS, or the full name of a Scheduler
+    subclass in another module, like "mypackage.mymodule.MyScheduler".
+
+    Raises ValueError if the scheduler cannot be found."""
+    if SCHEDULERS.has_key(name):
+        return SCHEDULERS[name]()
+    if "." not in name:
+        raise ValueError, "Unknown scheduler: %s" % name
+    (moduleName, className) = name.rsplit(".", 1)
+    try:
+        module = __import__(moduleName, globals(), locals(), [className])
+        return getattr(module, className)()
+    except (ImportError, AttributeError), e:
+        raise ValueError, "Cannot load scheduler %s: %s" % (name, e)
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+
+import itertools
+
+
+class Snapshot:
+    """A copy of the state of BurnerManager, taken at a given version.
+
+    A snapshot is never modified after it has been taken, so any thread
+    can read it without locks. The dicts it contains are shared by all
+    its readers, and with the following snapshots: they must not modify
+    them either.
+
+    Instance variables:
+
+    version: the version of the manager the snapshot was taken at
+
+    queues: what QueueView published when the snapshot was taken, or
+    None; the following snapshots take the queues from this one until
+    QueueView publishes something else
+
+    isos: sorted tuple of the isos that the burners have
+
+    pendingIsos: tuple of the entries of the pending queue, in order,
+    preceded by the ones waiting for their backoff time and followed by
+    the parked ones (with the field "parked")
+
+    isosBeingBurnt: tuple of the entries of the isos being burnt
+
+    burnt: tuple of the burnt isos that the manager had in memory
+
+    sets: tuple of the sets that are not complete yet, as returned by
+    BurnerManager.getSets()
+
+    burners: tuple of the registered burners, as returned by
+    BurnerManager.getBurners()
+    """
+
+    def __init__(self, version, queues=None, isos=(), burners=(),
+                 previous=None):
+        """Constructor.
+
+        queues: QueueView.published at the time of the snapshot.
+
+        previous: the snapshot taken before this one: if it has the same
+        queues, its tuples are shared instead of being built again."""
+        self.version = version
+        self.queues = queues
+        self.isos = tuple(isos)
+        self.burners = tuple(burners)
+        if previous is not None and previous.queues is queues:
+            self.pendingIsos = previous.pendingIsos
+            self.isosBeingBurnt = previous.isosBeingBurnt
+            self.burnt = previous.burnt
+            self.sets = previous.sets
+        elif queues is None:
+            self.pendingIsos = self.isosBeingBurnt = self.burnt = \
+                               self.sets = ()
+        else:
+            (backingOff, chunks, parked, self.isosBeingBurnt, self.burnt,
+             self.sets) = queues
+            self.pendingIsos = tuple(itertools.chain(backingOff,
+                                                     itertools.chain(*chunks),
+                                                     parked))
+
+
+class QueueView:
+    """The queues of BurnerManager, as frozen copies of their jobs, for
+    the snapshots.
+
+    The manager gives it the operations it records (see
+    BurnerManager.__log()), each with its own copy of the job, right
+    after the change: the view puts the copies where the operations say,
+    and publishes the result as a tuple that never changes (see
+    published), which the readers take without locks. The copies are
+    never modified, so they are shared by all the snapshots, and with
+    the operations.
+
+    The pending queue is kept in chunks of at most 2 * chunkSize jobs:
+    each chunk is a list [ids, jobs], where jobs is a tuple that is
+    replaced when one of them changes, and ids is the list of their
+    ids. A change takes a time proportional to chunkSize and to the
+    number of chunks, not to the length of the queue, and publishes the
+    chunks that did not change as they are.
+
+    The changes that are not recorded as operations, i.e. the renewals
+    of the leases, do not reach the view: the copies have the
+    leaseExpiry of the last operation on their jobs.
+
+    This class is not thread safe: the manager changes it with queueLock
+    held.
+
+    Instance variables:
+
+    published: the tuple (backing off, chunks, parked, being burnt,
+    burnt, sets) of tuples: the jobs waiting for their backoff time,
+    earliest first; the tuple of the jobs of each chunk of the pending
+    queue; the parked jobs, with the field "parked"; the jobs being
+    burnt; the burnt ones the manager has in memory; the sets that are
+    not complete yet, as returned by BurnerManager.getSets()
+    """
+
+    chunkSize = 256
+
+    def __init__(self):
+        """Constructor. The view is empty until load() is called."""
+        self.load((), (), {}, (), (), {})
+
+    def load(self, pending, backingOff, parked, beingBurnt, burnt, sets):
+        """Replaces the contents of the view with copies of the given
+        queues.
+
+        pending, backingOff, beingBurnt, burnt: the jobs in each queue,
+        in order; parked: dict iso -> list of parked jobs; sets: dict set
+        id -> set, as kept by BurnerManager."""
+        self.__chunks = []
+        # job id -> the chunk of the pending queue it is in
+        self.__chunkOf = {}
+        previous = None
+        for job in pending:
+            self.__insertAfter(copyJob(job), previous)
+            previous = job["id"]
+        # job id -> job
+        self.__backingOff = {}
+        for job in backingOff:
+            self.__backingOff[job["id"]] = copyJob(job)
+        # iso -> tuple of parked jobs
+        self.__parked = {}
+        # job id -> iso, for the parked jobs
+        self.__parkedIso = {}
+        for jobs in parked.values():
+            for job in jobs:
+                self.__park(copyJob(job))
+        self.__beingBurnt = tuple([copyJob(job) for job in beingBurnt])
+        self.__burnt = tuple([copyJob(job) for job in burnt])
+        # set id -> description
+        self.__sets = {}
+        for (setId, setData) in sets.items():
+            self.__sets[setId] = self.__describeSet(setId, setData)
+        self.__publishBackingOff()
+        self.__publishParked()
+        self.__publishSets()
+        self.__publish()
+
+    def apply(self, operation):
+        """Applies an operation (see BurnerManager.__log()) to the view,
+        and publishes the result.
+
+        The job of a job operation becomes part of the view: it must be a
+        copy, that nobody is going to change."""
+        kind = operation[0]
+        if kind == "queued":
+            (job, previous) = operation[1:]
+            self.__take(job["id"])
+            self.__insertAfter(job, previous)
+        elif kind == "failed":
+            job = operation[1]
+            if job.has_key("notBefore"):
+                self.__take(job["id"])
+                self.__backingOff[job["id"]] = job
+                self.__publishBackingOff()
+            else:
+                self.__replace(job)
+        elif kind == "parked":
+            job = operation[1]
+            self.__take(job["id"])
+            self.__park(job)
+            self.__publishParked()
+        elif kind == "assigned":
+            job = operation[1]
+            self.__take(job["id"])
+            self.__beingBurnt += (job,)
+        elif kind == "updated":
+            self.__replace(operation[1])
+        elif kind in ("completed", "removed"):
+            self.__take(operation[1])
+        elif kind == "set":
+            (setId, setData) = operation[1:]
+            if setData is None:
+                self.__sets.pop(setId, None)
+            else:
+                self.__sets[setId] = self.__describeSet(setId, setData)
+            self.__publishSets()
+        else:
+            return
+        self.__publish()
+
+    def addBurnt(self, job):
+        """Adds a copy of a job to the burnt ones, and publishes the
+        result."""
+        self.__burnt += (job,)
+        self.__publish()
+
+    def forgetBurnt(self, count):
+        """Forgets the first count burnt jobs, because they have been
+        written, and publishes the result."""
+        self.__burnt = self.__burnt[count:]
+        self.__publish()
+
+    def __publish(self):
+        """Publishes the current contents of the view."""
+        self.published = (self.__publishedBackingOff,
+                          tuple([chunk[1] for chunk in self.__chunks]),
+                          self.__publishedParked, self.__beingBurnt,
+                          self.__burnt, self.__publishedSets)
+
+    def __publishBackingOff(self):
+        """Sorts the jobs waiting for their backoff time, for
+        __publish()."""
+        self.__publishedBackingOff = tuple(sorted(
+            self.__backingOff.values(),
+            key=lambda job: (job["notBefore"], job["id"])))
+
+    def __publishParked(self):
+        """Gathers the parked jobs, for __publish()."""
+        self.__publishedParked = tuple(itertools.chain(
+            *self.__parked.values()))
+
+    def __publishSets(self):
+        """Sorts the sets, for __publish()."""
+        self.__publishedSets = tuple([self.__sets[setId] for setId
+                                      in sorted(self.__sets.keys())])
+
+    def __describeSet(self, setId, setData):
+        """Returns the entry of a set for BurnerManager.getSets()."""
+        return {"set": setId, "date": setData["date"],
+                "committer": setData["committer"],
+                "isos": list(setData["isos"]),
+                "burnt": len(setData["isos"]) - len(setData["missing"])}
+
+    def __park(self, job):
+        """Adds a job to the parked ones, as a copy with the field
+        "parked"."""
+        job = job.copy()
+        job["parked"] = True
+        self.__parked[job["iso"]] = self.__parked.get(job["iso"], ()) + \
+                                    (job,)
+        self.__parkedIso[job["id"]] = job["iso"]
+
+    def __take(self, jobId):
+        """Takes the job with the given id out of the view, wherever it
+        is. Nothing happens if it is not there."""
+        if self.__chunkOf.has_key(jobId):
+            self.__removePending(jobId)
+        elif self.__backingOff.has_key(jobId):
+            del self.__backingOff[jobId]
+            self.__publishBackingOff()
+        elif self.__parkedIso.has_key(jobId):
+            iso = self.__parkedIso.pop(jobId)
+            jobs = tuple([job for job in self.__parked[iso]
+                          if job["id"] != jobId])
+            if jobs:
+                self.__parked[iso] = jobs
+            else:
+                del self.__parked[iso]
+            self.__publishParked()
+        else:
+            # The queue of each burner is short
+            self.__beingBurnt = tuple([job for job in self.__beingBurnt
+                                       if job["id"] != jobId])
+
+    def __replace(self, job):
+        """Puts job in the place of the one with the same id, wherever it
+        is. Nothing happens if it is not there."""
+        jobId = job["id"]
+        chunk = self.__chunkOf.get(jobId)
+        if chunk is not None:
+            position = chunk[0].index(jobId)
+            chunk[1] = chunk[1][:position] + (job,) + \
+                       chunk[1][position + 1:]
+        elif self.__backingOff.has_key(jobId):
+            self.__backingOff[jobId] = job
+            self.__publishBackingOff()
+        elif self.__parkedIso.has_key(jobId):
+            self.__take(jobId)
+            self.__park(job)
+            self.__publishParked()
+        else:
+            jobs = list(self.__beingBurnt)
+            for i in range(len(jobs)):
+                if jobs[i]["id"] == jobId:
+                    jobs[i] = job
+            self.__beingBurnt = tuple(jobs)
+
+    def __insertAfter(self, job, previous):
+        """Adds a job to the pending queue right after the job with id
+        previous, or at the head if previous is None or not in the
+        queue."""
+        chunk = self.__chunkOf.get(previous)
+        if chunk is not None:
+            position = chunk[0].index(previous) + 1
+        else:
+            if not self.__chunks:
+                self.__chunks.append([[], ()])
+            chunk = self.__chunks[0]
+            position = 0
+        chunk[0].insert(position, job["id"])
+        chunk[1] = chunk[1][:position] + (job,) + chunk[1][position:]
+        self.__chunkOf[job["id"]] = chunk
+        if len(chunk[0]) > 2 * self.chunkSize:
+            self.__split(chunk)
+
+    def __removePending(self, jobId):
+        """Removes the job with the given id from the pending queue.
+
+        A chunk that becomes empty is dropped, one that becomes shorter
+        than chunkSize / 4 is merged with a neighbour."""
+        chunk = self.__chunkOf.pop(jobId)
+        position = chunk[0].index(jobId)
+        del chunk[0][position]
+        chunk[1] = chunk[1][:position] + chunk[1][position + 1:]
+        if not chunk[0]:
+            del self.__chunks[self.__indexOf(chunk)]
+            return
+        if len(chunk[0]) >= self.chunkSize / 4 or len(self.__chunks) == 1:
+            return
+        index = self.__indexOf(chunk)
+        if index == 0:
+            index = 1
+        (first, second) = self.__chunks[index - 1:index + 1]
+        for jobId in second[0]:
+            self.__chunkOf[jobId] = first
+        first[0].extend(second[0])
+        first[1] += second[1]
+        del self.__chunks[index]
+        if len(first[0]) > 2 * self.chunkSize:
+            self.__split(first)
+
+    def __split(self, chunk):
+        """Splits a chunk of the pending queue in two halves."""
+        half = len(chunk[0]) / 2
+        second = [chunk[0][half:], chunk[1][half:]]
+        del chunk[0][half:]
+        chunk[1] = chunk[1][:half]
+        for jobId in second[0]:
+            self.__chunkOf[jobId] = second
+        self.__chunks.insert(self.__indexOf(chunk) + 1, second)
+
+    def __indexOf(self, chunk):
+        """Returns the position of a chunk in the pending queue."""
+        for index in range(len(self.__chunks)):
+            if self.__chunks[index] is chunk:
+                return index
+        raise ValueError, "Chunk not in the queue."
+
+
+def copyJob(job):
+    """Returns a copy of a job that shares nothing mutable with it."""
+    retval = job.copy()
+    if retval.has_key("avoid"):
+        retval["avoid"] = list(retval["avoid"])
+    return retval
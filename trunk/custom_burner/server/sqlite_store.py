@@ -0,0 +1,515 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import threading
+import logging
+import cPickle
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None # Python was built without it
+
+from store import Store
+from history import matches
+
+
+# The tables: the columns that can be queried, plus the whole object
+# pickled in "data"
+SCHEMA = (
+    # The data of a burner is its class and the dict of its saved
+    # variables but isos and isoSizes, that are in the catalog
+    "CREATE TABLE IF NOT EXISTS burners (name TEXT PRIMARY KEY, ip TEXT, "
+    "port INTEGER, storage TEXT, data BLOB)",
+    # The isos each burner has, in order, and the sizes it knows: an iso
+    # with listed 0 only has its size there
+    "CREATE TABLE IF NOT EXISTS catalog (burner TEXT, iso TEXT, "
+    "size INTEGER, listed INTEGER DEFAULT 1, PRIMARY KEY (burner, iso))",
+    "CREATE INDEX IF NOT EXISTS catalog_iso ON catalog (iso)",
+    # The jobs that are not burnt yet, by id. place is one of the places
+    # below. The pending queue is a list linked by previous, the id of
+    # the job before (NULL for the head and for the other places); the
+    # other places are in the order of position.
+    "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, "
+    "place INTEGER, previous INTEGER, position INTEGER, burner TEXT, "
+    "date TEXT, iso TEXT, committer TEXT, priority INTEGER, deadline REAL, "
+    "started REAL, data BLOB)",
+    "CREATE INDEX IF NOT EXISTS jobs_previous ON jobs (place, previous)",
+    "CREATE INDEX IF NOT EXISTS jobs_committer ON jobs (committer)",
+    "CREATE INDEX IF NOT EXISTS jobs_iso ON jobs (iso)",
+    "CREATE INDEX IF NOT EXISTS jobs_burner ON jobs (burner)",
+    "CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY, "
+    "date TEXT, iso TEXT, committer TEXT, burner TEXT, started REAL, "
+    "finished REAL, data BLOB)",
+    "CREATE INDEX IF NOT EXISTS history_committer ON history "
+    "(committer, finished)",
+    "CREATE INDEX IF NOT EXISTS history_iso ON history (iso, finished)",
+    "CREATE INDEX IF NOT EXISTS history_burner ON history (burner, finished)",
+    "CREATE INDEX IF NOT EXISTS history_finished ON history (finished)",
+    # The other parts of the state, each one pickled
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, data BLOB)")
+
+# The places of the jobs: the pending queue, the backoff queue, the isos
+# being burnt and the parked isos
+PENDING = 0
+BACKING_OFF = 1
+BEING_BURNT = 2
+PARKED = 3
+
+# The parts of the state saved in the meta table
+META_KEYS = ("durations", "sets", "nextSetId", "reliability", "lastBurner",
+             "nextJobId", "statistics")
+
+# The parts of the meta table that each operation changes
+META_CHANGED = {"queued": ("nextJobId", ), "failed": ("nextJobId", ),
+                "parked": ("nextJobId", ), "assigned": ("nextJobId", ),
+                "updated": ("nextJobId", ),
+                "outcome": ("reliability", ), "probe": ("reliability", ),
+                "duration": ("durations", ), "lastBurner": ("lastBurner", ),
+                "set": ("sets", "nextSetId"), "counted": ("statistics", )}
+
+
+class SqliteStore(Store):
+    """Saves the state into an SQLite database.
+
+    Each write() is a single transaction. The operations are replayed on
+    the tables: only the rows of the jobs and of the burners they concern
+    are changed, and only the parts of the meta table they change are
+    written again. The catalog of a burner is only written when it
+    registers. The new burnt isos are appended to the history. The
+    database is in WAL mode, so a transaction only appends to the log,
+    and the writer.WriterThread of the manager batches many changes into
+    each one.
+
+    The history stays on disk: the manager forgets the burnt isos once
+    they are written, and history() answers with the indexes. Restarting
+    only loads the other tables, whatever the length of the history.
+
+    The whole state is written again instead, when what was loaded did
+    not come from these tables: the first time, the state saved by a
+    store.PickleStore is imported. The same happens after a write()
+    fails, since the tables no longer follow the operations.
+
+    Instance variables:
+
+    fileName: the database file
+
+    logger: logger object
+    """
+
+    keepsHistory = True
+
+    def __init__(self, fileName, importFrom=None):
+        """Constructor. Opens the database, creating the tables if needed.
+
+        importFrom: a store.PickleStore, whose state is imported if the
+        database is empty.
+
+        Raises ValueError if the sqlite3 module is not available."""
+        if sqlite3 is None:
+            raise ValueError, "Python has no sqlite3 module."
+        self.fileName = fileName
+        self.logger = logging.getLogger("SqliteStore")
+        self.__importFrom = importFrom
+        # write() and history() run on different threads
+        self.__lock = threading.Lock()
+        # The position of the next job added to a place but PENDING
+        self.__position = 0
+        # True if the next write() must replace all the tables
+        self.rewriteWanted = False
+        # The burnt isos imported, that the next write() adds to the
+        # history
+        self.__imported = []
+        self.__connection = sqlite3.connect(fileName,
+                                            check_same_thread=False)
+        self.__connection.text_factory = str
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode, this still survives crashes of the server
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self.__connection.execute(statement)
+        self.__connection.commit()
+
+    def load(self):
+        """Reads all the tables but the history, or imports the state of
+        the pickle store if they are empty."""
+        state = {}
+        self.__lock.acquire()
+        try:
+            self.logger.debug("Loading saved data...")
+            cursor = self.__connection.cursor()
+            burners = self.__loadBurners(cursor)
+            (pendingIsos, parkedIsos, isosBeingBurnt) = \
+                          self.__loadJobs(cursor)
+            cursor.execute("SELECT key, data FROM meta")
+            for (key, data) in cursor:
+                state[key] = cPickle.loads(str(data))
+            cursor.execute("SELECT count(*) FROM history")
+            (burnt, ) = cursor.fetchone()
+        finally:
+            self.__lock.release()
+        if state or burners or pendingIsos or isosBeingBurnt:
+            state["burners"] = burners
+            state["pendingIsos"] = pendingIsos
+            state["parkedIsos"] = parkedIsos
+            state["isosBeingBurnt"] = isosBeingBurnt
+            return (state, [], [])
+        if burnt == 0 and self.__importFrom is not None and \
+               self.__importFrom.hasData():
+            return self.__import()
+        self.logger.warning("No saved data in %s. Starting from "
+                            "scratch." % self.fileName)
+        return (state, [], [])
+
+    def __loadBurners(self, cursor):
+        """Reads the burners, with their catalogs.
+
+        Returns a dict name -> Burner."""
+        isos = {}
+        isoSizes = {}
+        cursor.execute("SELECT burner, iso, size, listed FROM catalog "
+                       "ORDER BY rowid")
+        for (name, iso, size, listed) in cursor:
+            if listed:
+                isos.setdefault(name, []).append(iso)
+            if size is not None:
+                isoSizes.setdefault(name, {})[iso] = size
+        retval = {}
+        cursor.execute("SELECT name, data FROM burners")
+        for (name, data) in cursor:
+            (burnerClass, data) = cPickle.loads(str(data))
+            data["isos"] = isos.get(name, [])
+            data["isoSizes"] = isoSizes.get(name, {})
+            # Like the unpickling of a burner
+            burner = burnerClass.__new__(burnerClass)
+            burner.__setstate__(data)
+            retval[name] = burner
+        return retval
+
+    def __loadJobs(self, cursor):
+        """Reads the jobs table.
+
+        Returns a tuple (pending isos, parked isos, isos being burnt) like
+        the parts of the state with the same names."""
+        pendingIsos = []
+        parkedIsos = {}
+        isosBeingBurnt = []
+        # previous id -> id of the job after it, in the pending queue
+        following = {}
+        pending = {}
+        cursor.execute("SELECT id, place, previous, data FROM jobs "
+                       "ORDER BY position")
+        for (jobId, place, previous, data) in cursor:
+            isoData = cPickle.loads(str(data))
+            if place == PENDING:
+                following[previous] = jobId
+                pending[jobId] = isoData
+            elif place == BACKING_OFF:
+                pendingIsos.append(isoData)
+            elif place == BEING_BURNT:
+                isosBeingBurnt.append(isoData)
+            else:
+                parkedIsos.setdefault(isoData["iso"], []).append(isoData)
+        cursor.execute("SELECT max(position) FROM jobs")
+        (position, ) = cursor.fetchone()
+        if position is not None:
+            self.__position = position + 1
+        jobId = following.get(None)
+        while jobId is not None and pending.has_key(jobId):
+            pendingIsos.append(pending.pop(jobId))
+            jobId = following.get(jobId)
+        if pending:
+            self.logger.error("%d pending isos are not linked to the "
+                              "queue: they are put at its end." %
+                              len(pending))
+            pendingIsos.extend([pending[jobId]
+                                for jobId in sorted(pending.keys())])
+            self.rewriteWanted = True
+        return (pendingIsos, parkedIsos, isosBeingBurnt)
+
+    def __import(self):
+        """Loads the state saved by the pickle store, with all its history:
+        the next write() puts them into the tables.
+
+        Returns what load() returns."""
+        fileName = self.__importFrom.fileName
+        self.logger.info("Importing the state saved in %s." % fileName)
+        (state, burnt, operations) = self.__importFrom.load()
+        self.__imported = burnt + self.__importFrom.history()
+        self.__importFrom.close()
+        self.logger.info("Imported %d operations and %d burnt isos." %
+                         (len(operations), len(self.__imported)))
+        self.rewriteWanted = True
+        return (state, [], operations)
+
+    def encode(self, state, operations, burnt, saved, checkpoint=False):
+        """Returns the statements that replay the operations on the tables,
+        or that replace all of them if rewriteWanted.
+
+        Returns a tuple (list of (statement, parameters), history rows,
+        checkpoint)."""
+        if self.rewriteWanted:
+            statements = self.__rewrite(state)
+        else:
+            statements = []
+            changed = set()
+            for operation in operations:
+                self.__replay(operation, state, statements)
+                changed.update(META_CHANGED.get(operation[0], ()))
+            for key in META_KEYS:
+                if key in changed:
+                    statements.append(("INSERT OR REPLACE INTO meta "
+                                       "VALUES (?, ?)",
+                                       (key, self.__pickle(state[key]))))
+        historyRows = []
+        for isoData in self.__imported + burnt[saved:]:
+            historyRows.append((isoData.get("date"), isoData["iso"],
+                                isoData.get("committer"),
+                                isoData.get("burner"),
+                                isoData.get("started"),
+                                isoData.get("finished"),
+                                self.__pickle(isoData)))
+        return (statements, historyRows, checkpoint)
+
+    def __replay(self, operation, state, statements):
+        """Appends to statements the ones that apply an operation to the
+        tables."""
+        kind = operation[0]
+        if kind == "queued":
+            (isoData, previous) = operation[1:]
+            self.__unlink(isoData["id"], statements)
+            # The job that followed previous now follows isoData
+            statements.append(("UPDATE jobs SET previous = ? WHERE "
+                               "place = ? AND previous IS ? AND id != ?",
+                               (isoData["id"], PENDING, previous,
+                                isoData["id"])))
+            self.__putJob(isoData, PENDING, previous, statements)
+        elif kind == "failed":
+            isoData = operation[1]
+            if isoData.has_key("notBefore"):
+                self.__unlink(isoData["id"], statements)
+                self.__putJob(isoData, BACKING_OFF, None, statements)
+            else:
+                self.__updateJob(isoData, statements)
+        elif kind == "parked":
+            self.__unlink(operation[1]["id"], statements)
+            self.__putJob(operation[1], PARKED, None, statements)
+        elif kind == "assigned":
+            self.__unlink(operation[1]["id"], statements)
+            self.__putJob(operation[1], BEING_BURNT, None, statements)
+        elif kind == "updated":
+            self.__updateJob(operation[1], statements)
+        elif kind in ("completed", "removed"):
+            self.__unlink(operation[1], statements)
+            statements.append(("DELETE FROM jobs WHERE id = ?",
+                               (operation[1], )))
+        elif kind == "registered":
+            self.__putBurner(operation[1], statements)
+        elif kind == "left":
+            statements.append(("DELETE FROM burners WHERE name = ?",
+                               (operation[1], )))
+            statements.append(("DELETE FROM catalog WHERE burner = ?",
+                               (operation[1], )))
+        elif kind == "suspect":
+            burner = state["burners"].get(operation[1])
+            if burner is not None:
+                statements.append(("UPDATE burners SET data = ? WHERE "
+                                   "name = ?",
+                                   (self.__burnerData(burner, operation[2]),
+                                    operation[1])))
+
+    def __unlink(self, jobId, statements):
+        """Appends the statement that takes a job out of the linked list of
+        the pending queue, if it is there: the job after it follows the
+        one before it."""
+        statements.append(("UPDATE jobs SET previous = (SELECT previous "
+                           "FROM jobs WHERE id = ?) WHERE place = ? AND "
+                           "previous = ?", (jobId, PENDING, jobId)))
+
+    def __putJob(self, isoData, place, previous, statements):
+        """Appends the statement that writes the row of a job in a place,
+        after previous if it is PENDING, or at the end of the others."""
+        position = None
+        if place != PENDING:
+            position = self.__position
+            self.__position += 1
+        statements.append(("INSERT OR REPLACE INTO jobs VALUES "
+                           "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           (isoData["id"], place, previous, position,
+                            isoData.get("burner"), isoData.get("date"),
+                            isoData["iso"], isoData.get("committer"),
+                            isoData.get("priority"),
+                            isoData.get("deadline"),
+                            isoData.get("started"),
+                            self.__pickle(isoData))))
+
+    def __updateJob(self, isoData, statements):
+        """Appends the statement that changes the fields of a job, but not
+        its place."""
+        statements.append(("UPDATE jobs SET burner = ?, date = ?, iso = ?, "
+                           "committer = ?, priority = ?, deadline = ?, "
+                           "started = ?, data = ? WHERE id = ?",
+                           (isoData.get("burner"), isoData.get("date"),
+                            isoData["iso"], isoData.get("committer"),
+                            isoData.get("priority"),
+                            isoData.get("deadline"),
+                            isoData.get("started"), self.__pickle(isoData),
+                            isoData["id"])))
+
+    def __putBurner(self, burner, statements):
+        """Appends the statements that write a burner and its catalog."""
+        statements.append(("INSERT OR REPLACE INTO burners VALUES "
+                           "(?, ?, ?, ?, ?)",
+                           (burner.name, burner.ip, burner.port,
+                            burner.storage,
+                            self.__burnerData(burner, burner.suspect))))
+        statements.append(("DELETE FROM catalog WHERE burner = ?",
+                           (burner.name, )))
+        for iso in burner.isos:
+            statements.append(("INSERT OR IGNORE INTO catalog VALUES "
+                               "(?, ?, ?, 1)", (burner.name, iso,
+                                                burner.isoSizes.get(iso))))
+        listed = set(burner.isos)
+        for (iso, size) in burner.isoSizes.iteritems():
+            if iso not in listed:
+                statements.append(("INSERT INTO catalog VALUES "
+                                   "(?, ?, ?, 0)", (burner.name, iso, size)))
+
+    def __burnerData(self, burner, suspect):
+        """Returns the data column of a burner: its class and its saved
+        variables but the catalog, with suspect."""
+        data = burner.__getstate__()
+        del data["isos"]
+        del data["isoSizes"]
+        data["suspect"] = suspect
+        return self.__pickle((burner.__class__, data))
+
+    def __rewrite(self, state):
+        """Returns the statements that replace all the tables but the
+        history with state."""
+        statements = []
+        for table in ("burners", "catalog", "jobs"):
+            statements.append(("DELETE FROM %s" % table, ()))
+        for burner in state["burners"].itervalues():
+            self.__putBurner(burner, statements)
+        previous = None
+        for isoData in state["pendingIsos"]:
+            self.__putJob(isoData, PENDING, previous, statements)
+            previous = isoData["id"]
+        for isoData in state["backingOffIsos"]:
+            self.__putJob(isoData, BACKING_OFF, None, statements)
+        for isoData in state["isosBeingBurnt"]:
+            self.__putJob(isoData, BEING_BURNT, None, statements)
+        for entries in state["parkedIsos"].itervalues():
+            for isoData in entries:
+                self.__putJob(isoData, PARKED, None, statements)
+        for key in META_KEYS:
+            statements.append(("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                               (key, self.__pickle(state[key]))))
+        self.rewriteWanted = False
+        return statements
+
+    def __pickle(self, obj):
+        """Returns an object pickled into a BLOB."""
+        return sqlite3.Binary(cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL))
+
+    def write(self, data):
+        """Writes everything in a single transaction. If checkpoint is
+        True, the log is then copied back into the database.
+
+        Raises sqlite3.Error as IOError."""
+        (statements, historyRows, checkpoint) = data
+        self.__lock.acquire()
+        try:
+            try:
+                connection = self.__connection
+                for (statement, parameters) in statements:
+                    connection.execute(statement, parameters)
+                connection.executemany("INSERT INTO history (date, iso, "
+                                       "committer, burner, started, "
+                                       "finished, data) VALUES "
+                                       "(?, ?, ?, ?, ?, ?, ?)", historyRows)
+                connection.commit()
+                self.__imported = []
+                if checkpoint:
+                    connection.execute("PRAGMA wal_checkpoint")
+            except sqlite3.Error, e:
+                connection.rollback()
+                # The tables do not follow the operations any more
+                self.rewriteWanted = True
+                raise IOError, str(e)
+        finally:
+            self.__lock.release()
+
+    def history(self, committer=None, iso=None, burner=None, since=None,
+                limit=None):
+        """Looks for the burnt isos in the history table, or among the
+        imported ones until they are written."""
+        self.__lock.acquire()
+        try:
+            imported = self.__imported
+        finally:
+            self.__lock.release()
+        if imported:
+            # Nothing was written yet: the table is empty
+            retval = [isoData for isoData in imported
+                      if matches(isoData, committer, iso, burner, since)]
+            if limit is not None:
+                retval = retval[max(len(retval) - limit, 0):]
+            return retval
+        conditions = []
+        parameters = []
+        for (column, value) in (("committer", committer), ("iso", iso),
+                                ("burner", burner)):
+            if value is not None:
+                conditions.append("%s = ?" % column)
+                parameters.append(value)
+        if since is not None:
+            conditions.append("finished >= ?")
+            parameters.append(since)
+        query = "SELECT data FROM history"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        # The same order as the indexes, so that they also sort the rows
+        query += " ORDER BY finished DESC, id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        self.__lock.acquire()
+        try:
+            rows = self.__connection.execute(query, parameters).fetchall()
+        finally:
+            self.__lock.release()
+        retval = [cPickle.loads(str(data)) for (data, ) in rows]
+        retval.reverse()
+        return retval
+
+    def close(self):
+        """Closes the database."""
+        self.__lock.acquire()
+        try:
+            self.__connection.close()
+        finally:
+            self.__lock.release()
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import os
+import sys
+import threading
+import logging
+import cPickle
+import cStringIO
+
+import journal
+import history
+from records import toJob
+
+
+def _findGlobal(module, name):
+    """Returns the class or function that a pickle refers to by name,
+    like cPickle does.
+
+    The burners saved by older versions refer to the class Burner, that
+    cPickle would call without arguments: burner.newBurner() creates
+    them instead."""
+    __import__(module)
+    module = sys.modules[module]
+    if name == "Burner" and hasattr(module, "newBurner"):
+        name = "newBurner"
+    return getattr(module, name)
+
+
+def unpickler(f):
+    """Returns a cPickle.Unpickler that reads from f, that can also read
+    what older versions saved."""
+    retval = cPickle.Unpickler(f)
+    retval.find_global = _findGlobal
+    return retval
+
+
+def loads(data):
+    """Like cPickle.loads(), but reads the data with unpickler()."""
+    return unpickler(cStringIO.StringIO(data)).load()
+
+
+class Store:
+    """Base class of the ways BurnerManager saves its state.
+
+    The state is a dict with the keys "burners", "pendingIsos",
+    "isosBeingBurnt", "durations", "sets", "nextSetId", "parkedIsos",
+    "reliability", "lastBurner", "nextJobId" and "statistics", holding the
+    attributes of the manager with the same names. load() returns the
+    queues as lists, the isos waiting for their backoff time among the
+    pending ones; encode() is given the manager's own objects, and the
+    backoff queue as "backingOffIsos". The burnt isos are saved
+    separately, since only the new ones change.
+
+    Between two saves, the manager records what it changes as a list of
+    operations (see BurnerManager.__log()), that the stores save instead
+    of the whole state.
+
+    Saving takes two steps: encode() turns the operations, or the whole
+    state, into data while the manager holds its locks, write() puts the
+    data on disk after they have been released. Both are called by one
+    thread at a time.
+    """
+
+    # True if the next save must contain the whole state, e.g. because
+    # what load() read was written by another store or an older version
+    rewriteWanted = False
+
+    # True if the store can answer history() itself: the manager can then
+    # forget the burnt isos once they are written
+    keepsHistory = False
+
+    def load(self):
+        """Reads the saved state.
+
+        Returns a tuple (state, burnt, operations): state contains only
+        the keys that were found (older versions saved less), burnt is the
+        list of the burnt isos that the manager has to keep in memory,
+        operations is the list of the operations written after state,
+        that the manager has to replay on it."""
+        raise NotImplementedError
+
+    def encode(self, state, operations, burnt, saved, checkpoint=False):
+        """Prepares the operations, or the whole state, for write().
+
+        operations: the operations since the previous call.
+        burnt: the isos burnt that the manager has in memory.
+        saved: how many of them, at the beginning of the list, have
+        already been written.
+        checkpoint: if True, the store compacts what it has written so
+        far, if it needs to; if the previous write() failed, the manager
+        asks for a checkpoint, and the store must not depend on the
+        operations it was given then.
+
+        Must be called with queueLock held, because the objects in state
+        and the burners in operations are still shared with the
+        manager."""
+        raise NotImplementedError
+
+    def write(self, data):
+        """Writes the data returned by encode(). Raises IOError or
+        OSError (or the errors of the database) if it fails."""
+        raise NotImplementedError
+
+    def history(self, committer=None, iso=None, burner=None, since=None,
+                limit=None):
+        """Returns the burnt isos that have been written, oldest first.
+
+        Only the ones that history.matches() the arguments are returned;
+        limit keeps only the last ones.
+
+        Only available if keepsHistory is True."""
+        raise NotImplementedError
+
+    def close(self):
+        """Releases the files of the store."""
+        pass
+
+
+class PickleStore(Store):
+    """Saves the state with pickle: the operations of each change are
+    appended to a journal.Journal, and every checkpointInterval changes
+    the whole state is written to a checkpoint file that replaces the
+    journal. At startup, the checkpoint is loaded, and the manager
+    replays the operations of the journal on it.
+
+    The checkpoint contains the burners, the pending isos, the isos being
+    burnt, the burnt isos and a dict with the rest of the state. The files
+    saved by older versions end before the dict.
+
+    Only the isos burnt in the current period are in the checkpoint, and
+    in memory. Each checkpoint moves the older ones to the
+    history.HistorySegments, which history() reads when asked: startup
+    does not depend on how long the history is.
+
+    Instance variables:
+
+    fileName: the file the checkpoints are written into
+
+    checkpointInterval: how many changes are appended to the journal
+    before a checkpoint
+
+    logger: logger object
+    """
+
+    keepsHistory = True
+
+    # The parts of the state in the dict at the end of the checkpoint.
+    # The checkpoints written before the statistics were kept do not have
+    # "statistics".
+    checkpointKeys = ("durations", "sets", "nextSetId", "parkedIsos",
+                      "reliability", "lastBurner", "nextJobId",
+                      "statistics")
+
+    def __init__(self, fileName, journalFileName, historyDirectory,
+                 checkpointInterval=1000):
+        """Constructor."""
+        self.fileName = fileName
+        self.checkpointInterval = checkpointInterval
+        self.logger = logging.getLogger("PickleStore")
+        self.__journal = journal.Journal(journalFileName)
+        self.__segments = history.HistorySegments(historyDirectory)
+        # The burnt isos that are not in the segments, oldest first
+        self.__recent = []
+        # The generation of the last checkpoint (see HistorySegments)
+        self.__generation = 0
+        # history() runs on a different thread than write()
+        self.__lock = threading.Lock()
+
+    def hasData(self):
+        """Tells whether there is a checkpoint or a journal to load."""
+        return os.path.exists(self.fileName) or \
+               os.path.exists(self.__journal.fileName)
+
+    def load(self):
+        """Loads the last checkpoint, and reads the operations of the
+        journal written after it.
+
+        A file saved by an older version only has the burners and the
+        queues: its jobs have no ids yet, so the whole state is written
+        again as soon as the manager has given them one."""
+        state = {}
+        burnt = []
+        sequence = 0
+        generation = 0
+        try:
+            self.logger.debug("Loading saved data...")
+            f = file(self.fileName, "rb")
+            try:
+                checkpointFile = unpickler(f)
+                burners = checkpointFile.load()
+                pendingIsos = checkpointFile.load()
+                isosBeingBurnt = checkpointFile.load()
+                burnt = checkpointFile.load()
+                try:
+                    rest = checkpointFile.load()
+                except EOFError:
+                    self.logger.info("Saved data comes from an older "
+                                     "version.")
+                    rest = None
+            finally:
+                f.close()
+            state["burners"] = burners
+            state["pendingIsos"] = pendingIsos
+            state["isosBeingBurnt"] = isosBeingBurnt
+            if rest is None:
+                self.rewriteWanted = True
+            else:
+                for key in self.checkpointKeys:
+                    if rest.has_key(key):
+                        state[key] = rest[key]
+                sequence = rest["sequence"]
+                generation = rest["generation"]
+        except IOError, e:
+            self.logger.warning("Unable to read saved data from file %s (%s). "
+                                "Starting from scratch." % \
+                                (self.fileName, str(e)))
+        except EOFError, e:
+            self.logger.error("Unable to read saved data from file %s "
+                              "(EOFError). Starting from scratch." %
+                              self.fileName)
+            burnt = []
+        try:
+            self.__segments.discardAfter(generation)
+        except OSError, e:
+            self.logger.error("Unable to clean %s: %s" %
+                              (self.__segments.directory, e))
+        self.__generation = generation
+        operations = []
+        changes = self.__journal.replay(sequence)
+        for change in changes:
+            (changedOperations, newBurnt) = loads(change)
+            operations.extend(changedOperations)
+            burnt.extend(newBurnt)
+        if changes:
+            self.logger.info("Read %d changes from %s." %
+                             (len(changes), self.__journal.fileName))
+        # Converted one at a time, so that the dicts of older versions
+        # are freed while the records are built
+        for i in range(len(burnt)):
+            burnt[i] = toJob(burnt[i])
+        self.__recent = burnt
+        return (state, [], operations)
+
+    def encode(self, state, operations, burnt, saved, checkpoint=False):
+        """Pickles a change of the journal, with the operations and the new
+        burnt isos or, if checkpoint is True, the journal is long enough
+        or some burnt isos are due to be archived, the parts of a whole
+        checkpoint.
+
+        The burnt isos of a checkpoint are left to write(), that splits
+        them between the segments and the checkpoint: they are never
+        changed, and only write() changes the list of the ones kept in
+        memory, so only a reference to it is taken here.
+
+        Returns a tuple (checkpoint, pickled data, new burnt isos, burnt
+        isos kept in memory, generation)."""
+        newBurnt = burnt[saved:]
+        checkpoint = checkpoint or \
+                     self.__journal.records >= self.checkpointInterval or \
+                     self.__archiveDue()
+        if not checkpoint:
+            return (False, cPickle.dumps((operations, newBurnt),
+                                         cPickle.HIGHEST_PROTOCOL),
+                    newBurnt, None, None)
+        # Each checkpoint has its own generation: the segments it archives
+        # are discarded at startup if it was not written
+        generation = self.__generation + 1
+        liveState = cStringIO.StringIO()
+        pickler = cPickle.Pickler(liveState, cPickle.HIGHEST_PROTOCOL)
+        pickler.dump(state["burners"])
+        pickler.dump(list(state["backingOffIsos"]) +
+                     list(state["pendingIsos"]))
+        pickler.dump(list(state["isosBeingBurnt"]))
+        rest = {}
+        for key in self.checkpointKeys:
+            rest[key] = state[key]
+        # The sequence number of the last change of the journal that the
+        # checkpoint contains: if the server stops before the journal is
+        # emptied, those changes are not replayed twice.
+        rest["sequence"] = self.__journal.sequence
+        rest["generation"] = generation
+        return (True, (liveState.getvalue(),
+                       cPickle.dumps(rest, cPickle.HIGHEST_PROTOCOL)),
+                newBurnt, self.__recent, generation)
+
+    def __archiveDue(self):
+        """Tells whether the oldest burnt iso in memory belongs to a period
+        that is over."""
+        if not self.__recent:
+            return False
+        (archived, recent) = self.__segments.split(self.__recent[:1])
+        return len(archived) > 0
+
+    def write(self, data):
+        """Appends a change to the journal, or archives the burnt isos of
+        the past periods and writes a checkpoint."""
+        (checkpoint, data, newBurnt, recent, generation) = data
+        if not checkpoint:
+            self.__journal.append(data)
+            self.__lock.acquire()
+            try:
+                self.__recent.extend(newBurnt)
+            finally:
+                self.__lock.release()
+            return
+        (liveState, rest) = data
+        (archived, recent) = self.__segments.split(recent + newBurnt)
+        self.__lock.acquire()
+        try:
+            # If the checkpoint fails, the next one writes the same
+            # segments again, under the same names
+            self.__segments.write(archived, generation)
+        finally:
+            self.__lock.release()
+        self.__writeCheckpoint(liveState, recent, rest)
+        self.__lock.acquire()
+        try:
+            self.__recent = recent
+            self.__generation = generation
+        finally:
+            self.__lock.release()
+
+    def __writeCheckpoint(self, liveState, burnt, rest):
+        """Replaces fileName with a checkpoint, then empties the journal.
+
+        liveState and rest are the pickled parts of the checkpoint that
+        come before and after the burnt isos.
+
+        The checkpoint is written to a temporary file, synced to disk and
+        renamed over fileName, and the directory is synced as well: after
+        a crash, fileName contains either the old checkpoint or the new
+        one, never half of it, and the journal is only emptied once the
+        new one is there to stay.
+
+        Raises IOError or OSError."""
+        self.logger.debug("Writing a checkpoint...")
+        tempFileName = self.fileName + ".tmp"
+        dbFile = file(tempFileName, "wb")
+        try:
+            dbFile.write(liveState)
+            cPickle.dump(burnt, dbFile, cPickle.HIGHEST_PROTOCOL)
+            dbFile.write(rest)
+            dbFile.flush()
+            os.fsync(dbFile.fileno())
+        finally:
+            dbFile.close()
+        os.rename(tempFileName, self.fileName)
+        directory = os.open(os.path.dirname(os.path.abspath(self.fileName)),
+                            os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        self.__journal.truncate()
+
+    def history(self, committer=None, iso=None, burner=None, since=None,
+                limit=None):
+        """Looks for the burnt isos in memory, then in the segments, from
+        the most recent ones backwards."""
+        self.__lock.acquire()
+        try:
+            recent = list(self.__recent)
+            segments = self.__segments.segments(since)
+        finally:
+            self.__lock.release()
+        retval = []
+        batch = recent
+        while True:
+            found = [isoData for isoData in batch
+                     if history.matches(isoData, committer, iso, burner,
+                                        since)]
+            found.reverse()
+            retval.extend(found)
+            if not segments or (limit is not None and len(retval) >= limit):
+                break
+            # Segments are never modified: no need to hold the lock
+            fileName = segments.pop()
+            try:
+                batch = self.__segments.read(fileName)
+            except IOError, e:
+                self.logger.error("Unable to read %s: %s" % (fileName, e))
+                batch = []
+        if limit is not None:
+            del retval[limit:]
+        retval.reverse()
+        return retval
+
+    def close(self):
+        """Closes the journal."""
+        self.__journal.close()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import os
+import shutil
+import tempfile
+import logging
+import unittest
+
+from custom_burner import common
+from custom_burner.server import burner_manager
+from custom_burner.server.burner import Burner
+
+
+class FakeBurner(Burner):
+    """A burner that does not need the network: it accepts the isos it
+    has, and the tests tell the manager when it is done.
+
+    queueSize: how many isos the burner accepts besides the one it is
+    burning, like the -q option of the clients
+
+    refuseCancel: set to True to make cancelIso() fail, like a burner
+    that cannot be reached
+
+    writing: set to True when the burner is writing the first iso of its
+    queue, that revokeIso() cannot take back any more"""
+
+    queueSize = 3
+    refuseCancel = False
+    writing = False
+
+    def assignIso(self, date, iso, committer):
+        """Accepts the iso if the burner has it and its queue is not
+        full."""
+        if iso not in self.isos or len(self.jobs) > self.queueSize:
+            return False
+        if self.free:
+            self.media = common.MEDIA_UNKNOWN
+        self.jobs.append((iso, committer))
+        self.free = False
+        (self.iso, self.committer) = self.jobs[0]
+        return True
+
+    def revokeIso(self, date, iso, committer):
+        """Gives back the last job about iso and committer, unless it is
+        being written."""
+        if self.writing:
+            first = 1
+        else:
+            first = 0
+        for i in range(len(self.jobs) - 1, first - 1, -1):
+            if self.jobs[i] == (iso, committer):
+                del self.jobs[i]
+                self.__updateHead()
+                return True
+        return False
+
+    def cancelIso(self, date, iso, committer):
+        """Drops the job about iso and committer, even if it is being
+        burnt, unless refuseCancel is set."""
+        if self.refuseCancel or (iso, committer) not in self.jobs:
+            return False
+        if self.jobs[0] == (iso, committer):
+            del self.jobs[0]
+        else:
+            for i in range(len(self.jobs) - 1, 0, -1):
+                if self.jobs[i] == (iso, committer):
+                    del self.jobs[i]
+                    break
+        self.__updateHead()
+        return True
+
+    def __updateHead(self):
+        """Updates free, iso and committer after jobs has changed."""
+        self.free = len(self.jobs) == 0
+        if self.free:
+            (self.iso, self.committer) = ("", None)
+        else:
+            (self.iso, self.committer) = self.jobs[0]
+
+    def close(self):
+        """Nothing to close."""
+        pass
+
+
+class ManagerTestCase(unittest.TestCase):
+    """Base class of the tests of BurnerManager.
+
+    Each test runs in a temporary directory, where the manager saves its
+    state, with FakeBurner's instead of burners. The changes are saved
+    immediately, without a writer thread, by the store named
+    storeBackend."""
+
+    storeBackend = "pickle"
+
+    def setUp(self):
+        """Creates the temporary directory and a manager."""
+        for name in ("BurnerManager", "PickleStore", "SqliteStore",
+                     "HistorySegments"):
+            logging.getLogger(name).setLevel(logging.CRITICAL)
+        self.directory = tempfile.mkdtemp()
+        self.previousDirectory = os.getcwd()
+        os.chdir(self.directory)
+        self.burnerClass = burner_manager.Burner
+        burner_manager.Burner = FakeBurner
+        self.saveInterval = burner_manager.BurnerManager.saveInterval
+        burner_manager.BurnerManager.saveInterval = 0
+        self.storeBackendBefore = burner_manager.BurnerManager.storeBackend
+        burner_manager.BurnerManager.storeBackend = self.storeBackend
+        self.manager = burner_manager.BurnerManager()
+
+    def tearDown(self):
+        """Restores the burners and removes the temporary directory."""
+        burner_manager.Burner = self.burnerClass
+        burner_manager.BurnerManager.saveInterval = self.saveInterval
+        burner_manager.BurnerManager.storeBackend = self.storeBackendBefore
+        os.chdir(self.previousDirectory)
+        shutil.rmtree(self.directory)
+
+    def reload(self):
+        """Replaces the manager with a new one, that loads the saved
+        state."""
+        self.manager = burner_manager.BurnerManager()
+
+    def state(self):
+        """Returns what the manager must restore: the ids of the jobs in
+        each queue, in order, the sets, the queues of the burners and the
+        statistics."""
+        manager = self.manager
+        parked = {}
+        for (iso, jobs) in manager.parkedIsos.items():
+            parked[iso] = [isoData["id"] for isoData in jobs]
+        return {"pending": [(isoData["id"], isoData.get("retries"))
+                            for isoData in manager.pendingIsos],
+                "backingOff": [isoData["id"]
+                               for isoData in manager.backingOffIsos],
+                "beingBurnt": [(isoData["id"], isoData["burner"],
+                                isoData.get("twin"))
+                               for isoData in manager.isosBeingBurnt],
+                "burnt": [(isoData["iso"], isoData["committer"])
+                          for isoData in manager.getBurntIsos()],
+                "parked": parked,
+                "sets": manager.sets,
+                "nextJobId": manager.nextJobId,
+                "burners": dict([(burner.name, burner.jobs) for burner
+                                 in manager.burners.values()]),
+                "lastBurner": manager.lastBurner,
+                "statistics": (manager.statistics.isos,
+                               manager.statistics.burners,
+                               manager.statistics.committers,
+                               manager.statistics.hours)}
+
+    def assertRestored(self):
+        """Reloads the manager, and checks that its state is the same."""
+        expected = self.state()
+        self.reload()
+        self.assertEqual(self.state(), expected)
+
+    def assigned(self):
+        """Returns the dict burner name -> iso it is burning, for the busy
+        burners."""
+        return dict([(burner.name, burner.iso)
+                     for burner in self.manager.burners.values()
+                     if not burner.free])
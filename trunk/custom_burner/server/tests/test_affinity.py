@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import time
+import unittest
+
+from custom_burner import common
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class AffinityTest(ManagerTestCase):
+    """Tests the preference for the burner that burnt an iso last."""
+
+    def setUp(self):
+        """Registers b1 and b2, which have the same isos, and makes b2 burn
+        "a" once. b1 has a blank disc, so it would be preferred
+        otherwise."""
+        ManagerTestCase.setUp(self)
+        for name in ("b1", "b2"):
+            self.manager.registerBurner(name, "127.0.0.1", 1, ["a", "b"])
+        self.manager.burners["b1"].isos = ["b"]
+        self.manager.queueIso("a", "c0")
+        self.manager.refresh()
+        self.manager.reportCompletion("b2", "a")
+        self.manager.burners["b1"].isos = ["a", "b"]
+        self.manager.reportMediaState("b1", common.MEDIA_BLANK)
+
+    def checkPreference(self, mode):
+        """Checks that mode gives "a" to b2 again."""
+        self.manager.setDispatchMode(mode)
+        self.assertEqual(self.manager.lastBurner, {"a": "b2"})
+        self.manager.queueIso("a", "c1")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b2": "a"})
+
+    def testFifo(self):
+        """FIFO dispatch prefers the last burner."""
+        self.checkPreference("fifo")
+
+    def testMatching(self):
+        """Matching dispatch prefers the last burner."""
+        self.checkPreference("matching")
+
+    def testEdf(self):
+        """EDF dispatch prefers the last burner."""
+        self.checkPreference("edf")
+
+    def testSaved(self):
+        """The last burners are saved."""
+        self.reload()
+        self.checkPreference("fifo")
+
+    def testUnreliable(self):
+        """A burner that failed the iso, or that is quarantined, is not
+        preferred."""
+        for i in range(6):
+            self.manager.reliability.record("b2", False)
+        self.manager.queueIso("a", "c1")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a"})
+
+    def testNoWait(self):
+        """Without a wait, an iso whose last burner is busy goes to
+        another one."""
+        self.manager.burners["b1"].isos = ["a"]
+        self.manager.queueIso("b", "c1")
+        self.manager.refresh()
+        self.manager.queueIso("a", "c2")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a", "b2": "b"})
+
+    def testWait(self):
+        """With a wait, the iso waits for its last burner until the wait
+        ends, and that is counted once."""
+        self.manager.setAffinityWait(0.05)
+        self.manager.burners["b1"].isos = ["a"]
+        self.manager.queueIso("b", "c1")
+        self.manager.refresh()
+        self.manager.queueIso("a", "c2")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b2": "b"})
+        self.assertEqual(self.manager.wakeRetries(), 0)
+        time.sleep(0.1)
+        self.assertEqual(self.manager.wakeRetries(), 1)
+        self.assertEqual(self.manager.wakeRetries(), 0)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a", "b2": "b"})
+
+    def testFollow(self):
+        """An iso waiting for its last burner follows it when it is
+        free."""
+        self.manager.setAffinityWait(60)
+        self.manager.burners["b1"].isos = ["a"]
+        self.manager.queueIso("b", "c1")
+        self.manager.refresh()
+        self.manager.queueIso("a", "c2")
+        self.manager.refresh()
+        self.manager.reportCompletion("b2", "b")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b2": "a"})
+        self.assertFalse(self.manager.isosBeingBurnt.first().has_key(
+            "affinityUntil"))
+
+
+if __name__ == "__main__":
+    unittest.main()
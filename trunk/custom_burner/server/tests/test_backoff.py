@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import time
+import unittest
+
+from custom_burner.server.backoff import BackoffQueue
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class BackoffQueueTest(unittest.TestCase):
+    """Tests the heap of the jobs waiting for their backoff time."""
+
+    def testOrder(self):
+        """Jobs come out in notBefore order, only when they are due."""
+        jobs = [{"iso": "a", "notBefore": 30}, {"iso": "b", "notBefore": 10},
+                {"iso": "c", "notBefore": 20}, {"iso": "d", "notBefore": 10}]
+        queue = BackoffQueue(jobs)
+        self.assertEqual([job["iso"] for job in queue], ["b", "d", "c", "a"])
+        self.assertEqual(queue.popDue(5), [])
+        self.assertEqual([job["iso"] for job in queue.popDue(20)],
+                         ["b", "d", "c"])
+        self.assertEqual(len(queue), 1)
+        self.assertTrue(jobs[0] in queue)
+        self.assertFalse(jobs[1] in queue)
+        self.assertFalse(dict(jobs[0]) in queue) # Equal is not enough
+
+    def testRemove(self):
+        """Removed jobs do not come out, even when added again later."""
+        job = {"iso": "a", "notBefore": 10}
+        queue = BackoffQueue([job])
+        self.assertRaises(ValueError, queue.push, job)
+        queue.remove(job)
+        self.assertRaises(ValueError, queue.remove, job)
+        self.assertEqual(queue.popDue(100), [])
+        queue.push(job)
+        queue.remove(job)
+        job["notBefore"] = 50
+        queue.push(job)
+        self.assertEqual(queue.popDue(20), [])
+        self.assertEqual(queue.popDue(50), [job])
+
+    def testCompaction(self):
+        """Many removals do not leave the heap growing."""
+        queue = BackoffQueue()
+        kept = {"iso": "kept", "notBefore": 1000}
+        queue.push(kept)
+        for i in range(500):
+            job = {"iso": "x", "notBefore": i}
+            queue.push(job)
+            queue.remove(job)
+        self.assertTrue(len(queue._BackoffQueue__heap) < 200)
+        self.assertEqual(queue.popDue(1000), [kept])
+
+
+class RetryTest(ManagerTestCase):
+    """Tests how the failed isos are retried."""
+
+    def setUp(self):
+        """Starts "a" on b1; b2 has it too, but is busy."""
+        ManagerTestCase.setUp(self)
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a"])
+        self.manager.registerBurner("b2", "127.0.0.1", 1, ["a"])
+        self.manager.queueIso("a", "c1")
+        self.manager.queueIso("a", "c2")
+        self.manager.refresh()
+
+    def pending(self):
+        """Returns the (iso, committer) pairs of getPendingIsos()."""
+        return [(isoData["iso"], isoData["committer"])
+                for isoData in self.manager.getPendingIsos()]
+
+    def otherBurner(self, isoData):
+        """Returns the name of the burner that did not fail isoData."""
+        return [name for name in ("b1", "b2")
+                if name not in isoData["avoid"]][0]
+
+    def failC1(self):
+        """Makes the burner of "a" for c1 fail it, and returns its entry."""
+        for isoData in self.manager.isosBeingBurnt:
+            if isoData["committer"] == "c1":
+                self.manager.reportBurningError(isoData["burner"], "a")
+                return isoData
+
+    def testBackoff(self):
+        """A failed iso leaves the queue until its backoff time has passed,
+        and then goes back to its head."""
+        self.manager.retryDelay = 0.05
+        isoData = self.failC1()
+        self.assertEqual(list(self.manager.pendingIsos), [])
+        self.assertEqual(list(self.manager.backingOffIsos), [isoData])
+        self.assertEqual(isoData["retries"], 1)
+        self.manager.queueIso("a", "c3")
+        self.assertEqual(self.pending(), [("a", "c1"), ("a", "c3")])
+        self.assertEqual(self.manager.wakeRetries(), 0)
+        time.sleep(0.1)
+        self.assertEqual(self.manager.wakeRetries(), 1)
+        self.assertFalse(isoData.has_key("notBefore"))
+        self.assertEqual([(isoData["iso"], isoData["committer"])
+                          for isoData in self.manager.pendingIsos],
+                         [("a", "c1"), ("a", "c3")])
+
+    def testDelays(self):
+        """The delay doubles at each failure, up to maxRetryDelay."""
+        self.manager.retryDelay = 60
+        self.manager.maxRetryDelay = 100
+        isoData = self.failC1()
+        self.assertTrue(abs(isoData["notBefore"] - time.time() - 60) < 5)
+        self.manager.reportCompletion(self.otherBurner(isoData), "a")
+        self.manager.backingOffIsos.remove(isoData)
+        del isoData["notBefore"]
+        self.manager.pendingIsos.appendleft(isoData)
+        self.manager.refresh()
+        self.failC1()
+        self.assertEqual(isoData["retries"], 2)
+        self.assertTrue(abs(isoData["notBefore"] - time.time() - 100) < 5)
+
+    def testAvoid(self):
+        """The burner that failed an iso is avoided while another one has
+        it; when all of them failed it, they are all tried again."""
+        self.manager.retryDelay = 0
+        isoData = self.failC1()
+        self.assertEqual(isoData["avoid"], [isoData["burner"]])
+        self.manager.refresh()
+        self.assertEqual(self.pending(), [("a", "c1")])
+        other = self.otherBurner(isoData)
+        self.manager.reportCompletion(other, "a")
+        self.manager.refresh()
+        self.assertEqual(isoData["burner"], other)
+        self.failC1()
+        self.assertEqual(isoData["avoid"], [])
+
+    def testSaved(self):
+        """The isos waiting for their backoff time are saved, and removed
+        like the other ones."""
+        isoData = self.failC1()
+        self.reload()
+        self.assertEqual([entry["committer"]
+                          for entry in self.manager.backingOffIsos], ["c1"])
+        self.assertEqual(list(self.manager.pendingIsos), [])
+        self.manager.removeIso(self.manager.getPendingIsos(True)[0])
+        self.assertEqual(self.pending(), [])
+
+
+class ParkingTest(ManagerTestCase):
+    """Tests the isos that no burner has."""
+
+    def testPark(self):
+        """The isos that no burner has wait out of the queue until one
+        registers."""
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a"])
+        self.manager.queueIso("x", "c1")
+        self.assertEqual(list(self.manager.pendingIsos), [])
+        self.assertEqual([(isoData["iso"], isoData.get("parked"))
+                          for isoData in self.manager.getPendingIsos()],
+                         [("x", True)])
+        self.manager.registerBurner("b2", "127.0.0.1", 1, ["x"])
+        self.assertEqual(self.manager.parkedIsos, {})
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b2": "x"})
+
+    def testOrphans(self):
+        """The isos of a burner that leaves are parked, even if they were
+        waiting for their backoff time."""
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a"])
+        self.manager.queueIso("a", "c1")
+        self.manager.queueIso("a", "c2")
+        self.manager.refresh()
+        self.manager.reportBurningError("b1", "a")
+        self.manager.reportClosingBurner("b1")
+        self.assertEqual(len(self.manager.backingOffIsos), 0)
+        self.assertEqual([isoData["committer"]
+                          for isoData in self.manager.parkedIsos["a"]],
+                         ["c1", "c2"])
+        self.assertFalse(self.manager.parkedIsos["a"][1].has_key("notBefore"))
+
+    def testParkedSet(self):
+        """A set with parked members is held back as a whole, and its
+        parked members can be removed."""
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a"])
+        self.manager.queueSet(["a", "x"], "c1")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {})
+        parked = [isoData for isoData in self.manager.getPendingIsos()
+                  if isoData.get("parked")]
+        self.manager.removeIso(parked[0])
+        self.assertEqual(self.manager.parkedIsos, {})
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+import time
+
+from custom_burner.server import store
+from custom_burner.server.burnstats import BurnStatistics
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+def hour(when):
+    """Returns the key of the hour that contains when."""
+    return time.strftime("%Y-%m-%d %H:00", time.localtime(when))
+
+
+def day(when):
+    """Returns the key of the day that contains when."""
+    return time.strftime("%Y-%m-%d", time.localtime(when))
+
+
+class BurnStatisticsTest(unittest.TestCase):
+    """Tests the counts and the time buckets."""
+
+    def setUp(self):
+        """Creates the statistics, and a time at the start of an hour."""
+        self.statistics = BurnStatistics()
+        now = time.time()
+        self.start = now - now % 3600
+
+    def testCounts(self):
+        """Burns and failures are counted per iso, burner and committer;
+        a burn of unknown time is not in any bucket."""
+        statistics = self.statistics
+        statistics.recordBurn({"iso": "a", "burner": "b1",
+                               "committer": "c1", "finished": self.start})
+        statistics.record("a", "b2", "c2", self.start + 10, True)
+        statistics.record("b", "b1", "c1", None, False)
+        statistics.recordBurn({"iso": "b", "committer": "c2"})
+        self.assertEqual(statistics.isos, {"a": [1, 1], "b": [2, 0]})
+        self.assertEqual(statistics.burners, {"b1": [2, 0], "b2": [0, 1]})
+        self.assertEqual(statistics.committers,
+                         {"c1": [2, 0], "c2": [1, 1]})
+        self.assertEqual(statistics.hours, {hour(self.start): [1, 1]})
+        self.assertEqual(statistics.days, {day(self.start): [1, 1]})
+
+    def testBuckets(self):
+        """Each burn goes in the bucket of its own hour, also when the
+        times go back, and only the last keptHours hours are kept."""
+        statistics = self.statistics
+        statistics.keptHours = 3
+        for offset in (0, 3599, 3600, 2 * 3600, 10, 3 * 3600 + 1):
+            statistics.record("a", "b1", "c1", self.start + offset, False)
+        self.assertEqual(statistics.hours,
+                         {hour(self.start + 3600): [1, 0],
+                          hour(self.start + 2 * 3600): [1, 0],
+                          hour(self.start + 3 * 3600): [1, 0]})
+        # Older than all the ones kept
+        statistics.record("a", "b1", "c1", self.start, True)
+        self.assertEqual(len(statistics.hours), 3)
+        self.assertFalse(statistics.hours.has_key(hour(self.start)))
+        # The totals are kept forever
+        self.assertEqual(statistics.isos, {"a": [6, 1]})
+
+    def testCopy(self):
+        """A copy does not change with the original."""
+        statistics = self.statistics
+        statistics.record("a", "b1", "c1", self.start, False)
+        copy = statistics.copy()
+        statistics.record("a", "b1", "c1", self.start, True)
+        self.assertEqual(copy.isos, {"a": [1, 0]})
+        self.assertEqual(copy.hours, {hour(self.start): [1, 0]})
+
+
+class ManagerStatisticsTest(ManagerTestCase):
+    """Tests the statistics kept by the manager."""
+
+    def setUp(self):
+        """Registers b1, that has "a" and "b"."""
+        ManagerTestCase.setUp(self)
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b"])
+        self.manager.retryDelay = 0
+
+    def burn(self, iso, committer):
+        """Queues an iso, and lets b1 burn it."""
+        self.manager.queueIso(iso, committer)
+        self.manager.refresh()
+        self.manager.reportCompletion("b1", iso)
+
+    def fail(self, iso, committer):
+        """Queues an iso, lets b1 fail it and takes it out of the
+        queue."""
+        self.manager.queueIso(iso, committer)
+        self.manager.refresh()
+        self.manager.reportBurningError("b1", iso)
+        self.manager.wakeRetries()
+        self.manager.removeIso(self.manager.getPendingIsos()[0])
+
+    def counts(self):
+        """Returns the counts per iso, burner and committer, and the
+        counts of all the days together."""
+        statistics = self.manager.getStatistics()
+        days = [0, 0]
+        for (burnt, failed) in statistics.days.values():
+            days[0] += burnt
+            days[1] += failed
+        return (statistics.isos, statistics.burners, statistics.committers,
+                days)
+
+    def testCounts(self):
+        """Completions and errors are counted, and restored."""
+        self.burn("a", "c1")
+        self.fail("b", "c2")
+        self.burn("b", "c1")
+        expected = ({"a": [1, 0], "b": [1, 1]}, {"b1": [2, 1]},
+                    {"c1": [2, 0], "c2": [0, 1]}, [2, 1])
+        self.assertEqual(self.counts(), expected)
+        # From the journal, then from a checkpoint
+        self.reload()
+        self.assertEqual(self.counts(), expected)
+        self.manager.flush(checkpoint=True)
+        self.reload()
+        self.assertEqual(self.counts(), expected)
+
+    def testCountHistory(self):
+        """A checkpoint without statistics makes the manager count the
+        history once; the failures are only known since then."""
+        self.burn("a", "c1")
+        self.fail("b", "c1")
+        checkpointKeys = store.PickleStore.checkpointKeys
+        store.PickleStore.checkpointKeys = tuple(
+            [key for key in checkpointKeys if key != "statistics"])
+        try:
+            self.manager.flush(checkpoint=True)
+        finally:
+            store.PickleStore.checkpointKeys = checkpointKeys
+        # In the journal, after the checkpoint
+        self.burn("a", "c2")
+        self.fail("a", "c2")
+        self.reload()
+        expected = ({"a": [2, 1]}, {"b1": [2, 1]},
+                    {"c1": [1, 0], "c2": [1, 1]}, [2, 1])
+        self.assertEqual(self.counts(), expected)
+        # The checkpoint asked for at startup has them all
+        self.reload()
+        self.assertEqual(self.counts(), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
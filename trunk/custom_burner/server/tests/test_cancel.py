@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+
+from custom_burner.server.estimator import DurationEstimator
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class CancelTest(ManagerTestCase):
+    """Tests the cancellation of the isos given to the burners."""
+
+    def setUp(self):
+        """Registers b1, with room for one more iso, and gives it "a" and
+        "b"."""
+        ManagerTestCase.setUp(self)
+        self.manager.setPushAhead(1)
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b"])
+        self.manager.queueIso("a", "c1")
+        self.manager.queueIso("b", "c2")
+        self.manager.refresh()
+
+    def entry(self, iso):
+        """Returns the entry of getIsosBeingBurnt() about iso."""
+        for isoData in self.manager.getIsosBeingBurnt():
+            if isoData["iso"] == iso:
+                return isoData
+        self.fail("%s is not being burnt" % iso)
+
+    def testCancelBurning(self):
+        """Cancelling the iso being burnt starts the next one, and does not
+        put it back into the queue."""
+        self.assertTrue(self.manager.cancelIso(self.entry("a")))
+        self.assertEqual(self.manager.burners["b1"].jobs, [("b", "c2")])
+        self.assertEqual(self.assigned(), {"b1": "b"})
+        self.assertEqual(self.manager.getPendingIsos(), [])
+        self.assertEqual(self.manager.getBurntIsos(), [])
+        self.assertTrue(self.entry("b").has_key("started"))
+        self.reload()
+        self.assertEqual([isoData["iso"] for isoData in
+                          self.manager.getIsosBeingBurnt()], ["b"])
+
+    def testCancelQueued(self):
+        """Cancelling an iso in the queue of the burner leaves the burn
+        alone."""
+        self.assertTrue(self.manager.cancelIso(self.entry("b")))
+        self.assertEqual(self.manager.burners["b1"].jobs, [("a", "c1")])
+        self.manager.reportCompletion("b1", "a")
+        self.assertEqual([isoData["iso"] for isoData in
+                          self.manager.getBurntIsos()], ["a"])
+
+    def testRefused(self):
+        """An iso that the burner does not drop stays where it is."""
+        self.manager.burners["b1"].refuseCancel = True
+        self.assertFalse(self.manager.cancelIso(self.entry("a")))
+        self.assertEqual(len(self.manager.getIsosBeingBurnt()), 2)
+
+    def testUnknown(self):
+        """Entries that are not being burnt any more cannot be
+        cancelled."""
+        isoData = self.entry("a")
+        self.manager.reportCompletion("b1", "a")
+        self.assertFalse(self.manager.cancelIso(isoData))
+
+    def testSetMember(self):
+        """A cancelled member does not keep its set waiting."""
+        for name in ("b2", "b3"):
+            self.manager.registerBurner(name, "127.0.0.1", 1, ["a"])
+        self.manager.queueSet(["a", "a"], "c3")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a", "b2": "a", "b3": "a"})
+        self.manager.reportCompletion("b2", "a")
+        self.assertEqual(self.manager.getSets()[0]["burnt"], 1)
+        members = [isoData for isoData in self.manager.getIsosBeingBurnt()
+                   if isoData["burner"] == "b3"]
+        self.assertTrue(self.manager.cancelIso(members[0]))
+        self.assertEqual(self.manager.getSets(), [])
+
+
+class CancelTwinTest(ManagerTestCase):
+    """Tests the cancellation of the copies of a straggler."""
+
+    def setUp(self):
+        """Starts "a" on b1 and a backup copy on b2."""
+        ManagerTestCase.setUp(self)
+        self.manager.setSpeculative(True)
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a"])
+        self.manager.queueIso("a", "c1")
+        self.manager.refresh()
+        self.manager.registerBurner("b2", "127.0.0.1", 1, ["a"])
+        self.manager.isosBeingBurnt.first()["started"] -= \
+            3 * DurationEstimator.defaultDuration
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a", "b2": "a"})
+
+    def testWinnerCancelsLoser(self):
+        """When a copy is burnt, the other one is cancelled and its burner
+        is free again."""
+        self.manager.reportCompletion("b2", "a")
+        self.assertEqual(self.assigned(), {})
+        self.assertEqual(self.manager.getIsosBeingBurnt(), [])
+        self.assertEqual(len(self.manager.getBurntIsos()), 1)
+
+    def testLoserNotStopped(self):
+        """A copy that cannot be stopped is ignored when it completes."""
+        self.manager.burners["b1"].refuseCancel = True
+        self.manager.reportCompletion("b2", "a")
+        self.assertEqual(self.assigned(), {"b1": "a"})
+        self.manager.reportCompletion("b1", "a")
+        self.assertEqual(len(self.manager.getBurntIsos()), 1)
+
+    def testCancelOneCopy(self):
+        """Cancelling a copy lets the other one go on alone."""
+        copies = self.manager.getIsosBeingBurnt()
+        self.assertTrue(self.manager.cancelIso(copies[0]))
+        remaining = self.manager.getIsosBeingBurnt()
+        self.assertEqual(len(remaining), 1)
+        self.assertFalse(remaining[0].has_key("twin"))
+        self.manager.reportBurningError(remaining[0]["burner"], "a")
+        self.assertEqual([isoData["iso"] for isoData in
+                          self.manager.getPendingIsos()], ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
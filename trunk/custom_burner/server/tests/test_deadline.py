@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+import time
+
+from custom_burner.server import deadline
+from custom_burner.server.estimator import DurationEstimator
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class DeadlineTest(unittest.TestCase):
+    """Tests the parsing and formatting of deadlines."""
+
+    def testParse(self):
+        """Full dates are taken as they are; times of the day are today,
+        or tomorrow if they have passed."""
+        now = time.mktime((2008, 5, 10, 12, 0, 0, 0, 0, -1))
+        self.assertEqual(deadline.parseDeadline("", now), None)
+        self.assertEqual(deadline.parseDeadline("2008-05-11 08:30", now),
+                         time.mktime((2008, 5, 11, 8, 30, 0, 0, 0, -1)))
+        self.assertEqual(deadline.parseDeadline(" 13:15 ", now),
+                         time.mktime((2008, 5, 10, 13, 15, 0, 0, 0, -1)))
+        self.assertEqual(deadline.parseDeadline("11:00", now),
+                         time.mktime((2008, 5, 11, 11, 0, 0, 0, 0, -1)))
+        self.assertRaises(ValueError, deadline.parseDeadline, "noon", now)
+
+    def testFormat(self):
+        """Slack times are shown in hours and minutes, with their sign."""
+        self.assertEqual(deadline.formatSlack(None), "")
+        self.assertEqual(deadline.formatSlack(65 * 60), "+1h05m")
+        self.assertEqual(deadline.formatSlack(-12 * 60 - 30), "-12m")
+        self.assertEqual(deadline.formatDeadline(None), "")
+
+
+class DurationEstimatorTest(unittest.TestCase):
+    """Tests how the burn durations are learned."""
+
+    def testFirstBurn(self):
+        """The first burn of an iso gives its duration."""
+        durations = DurationEstimator()
+        self.assertEqual(durations.expected("a"),
+                         DurationEstimator.defaultDuration)
+        durations.record("a", "b1", 600)
+        self.assertEqual(durations.expected("a"), 600)
+        self.assertEqual(durations.expected("a", "b1"), 600)
+        durations.record("a", "b1", 0) # Ignored
+        self.assertEqual(durations.expected("a"), 600)
+
+    def testBurnerFactor(self):
+        """A burner slower than expected gets a factor above 1."""
+        durations = DurationEstimator()
+        durations.record("a", "b1", 600)
+        durations.record("a", "b2", 1200)
+        self.assertTrue(durations.expected("a", "b2") >
+                        durations.expected("a", "b1"))
+        self.assertTrue(durations.speed("b2") < 1.0)
+        self.assertEqual(durations.speed("unknown"), 1.0)
+
+
+class EdfDispatchTest(ManagerTestCase):
+    """Tests the "edf" dispatch mode of BurnerManager."""
+
+    def setUp(self):
+        """Registers a fast burner and a slow one, that take 300 and 1200
+        seconds to burn the iso "a"."""
+        ManagerTestCase.setUp(self)
+        self.manager.setDispatchMode("edf")
+        self.manager.durations.isoDurations["a"] = 600.0
+        self.manager.durations.burnerFactors.update({"fast": 0.5,
+                                                     "slow": 2.0})
+        self.manager.registerBurner("fast", "127.0.0.1", 1, ["a", "b"])
+        self.manager.registerBurner("slow", "127.0.0.1", 1, ["a", "b"])
+
+    def testSlowestInTime(self):
+        """An iso that both burners can complete in time goes to the
+        slowest one."""
+        self.manager.queueIso("a", "c1", 0, time.time() + 1500)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"slow": "a"})
+
+    def testFastestInTime(self):
+        """An iso that only the fast burner completes in time goes to
+        it."""
+        self.manager.queueIso("a", "c1", 0, time.time() + 700)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"fast": "a"})
+
+    def testAtRisk(self):
+        """An iso that misses its deadline anyway goes to the fastest
+        burner, and is marked at risk."""
+        self.manager.queueIso("a", "c1", 0, time.time() + 100)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"fast": "a"})
+        isoData = self.manager.isosBeingBurnt.first()
+        self.assertTrue(isoData.get("atRisk"))
+
+    def testOrder(self):
+        """The earliest deadline goes first, the isos without a deadline
+        last."""
+        self.manager.registerBurner("slow", "127.0.0.1", 1, [])
+        self.manager.queueIso("b", "c1")
+        self.manager.queueIso("a", "c2", 0, time.time() + 5000)
+        self.manager.queueIso("b", "c3", 0, time.time() + 3000)
+        self.manager.refresh()
+        self.assertEqual(self.manager.isosBeingBurnt.first()["committer"],
+                         "c3")
+        self.assertEqual([isoData["committer"] for isoData
+                          in self.manager.getPendingIsos()], ["c1", "c2"])
+
+    def testSlack(self):
+        """The slack is projected on the burner that completes the iso
+        first."""
+        now = time.time()
+        self.manager.queueIso("a", "c1", 0, now + 1000)
+        self.manager.queueIso("b", "c2")
+        slacks = [isoData["slack"] for isoData
+                  in self.manager.getPendingIsos(True)]
+        self.assertEqual(slacks[1], None)
+        self.assertTrue(abs(slacks[0] - 700) < 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
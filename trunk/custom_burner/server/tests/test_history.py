@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+import os
+import time
+import shutil
+import cPickle
+import tempfile
+
+from custom_burner.server import history
+from custom_burner.server import burner_manager
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+def finishedIn(year, month, iso, committer="c1"):
+    """Returns a burnt iso completed in the middle of a month."""
+    when = time.mktime((year, month, 15, 12, 0, 0, 0, 0, -1))
+    return {"date": time.strftime("%Y-%m-%d %H:%M", time.localtime(when)),
+            "iso": iso, "committer": committer, "burner": "b1",
+            "finished": when}
+
+
+class HistorySegmentsTest(unittest.TestCase):
+    """Splitting, writing and reading the segments."""
+
+    def setUp(self):
+        """Creates a temporary directory for the segments."""
+        self.directory = tempfile.mkdtemp()
+        self.segmentDirectory = os.path.join(self.directory, "history")
+        self.segments = history.HistorySegments(self.segmentDirectory)
+
+    def tearDown(self):
+        """Removes the temporary directory."""
+        shutil.rmtree(self.directory)
+
+    def testSplit(self):
+        """Only the isos of the past periods are archived, by period; the
+        ones without a completion time are filed under their date."""
+        now = time.mktime((2008, 6, 10, 12, 0, 0, 0, 0, -1))
+        old = {"date": "2008-04-30 23:00", "iso": "c", "committer": "c1"}
+        isos = [finishedIn(2008, 5, "a"), old, finishedIn(2008, 5, "b"),
+                finishedIn(2008, 6, "d")]
+        (archived, recent) = self.segments.split(isos, now)
+        self.assertEqual(sorted(archived.keys()), ["2008-04", "2008-05"])
+        self.assertEqual([isoData["iso"] for isoData in archived["2008-05"]],
+                         ["a", "b"])
+        self.assertEqual(archived["2008-04"], [old])
+        self.assertEqual([isoData["iso"] for isoData in recent], ["d"])
+
+    def testWriteRead(self):
+        """Segments are written once per period, and found again by a new
+        instance."""
+        self.segments.write({}, 1)
+        self.assertFalse(os.path.exists(self.segmentDirectory))
+        may = [finishedIn(2008, 5, "a"), finishedIn(2008, 5, "b")]
+        april = [finishedIn(2008, 4, "c")]
+        self.segments.write({"2008-05": may, "2008-04": april}, 1)
+        self.assertEqual(self.segments.segments(),
+                         ["2008-04.1.gz", "2008-05.1.gz"])
+        self.assertEqual(self.segments.read("2008-05.1.gz"), may)
+        segments = history.HistorySegments(self.segmentDirectory)
+        self.assertEqual(segments.segments(),
+                         ["2008-04.1.gz", "2008-05.1.gz"])
+        since = time.mktime((2008, 5, 1, 0, 0, 0, 0, 0, -1))
+        self.assertEqual(segments.segments(since), ["2008-05.1.gz"])
+
+    def testDamaged(self):
+        """A damaged segment raises IOError."""
+        self.segments.write({"2008-05": [finishedIn(2008, 5, "a")]}, 1)
+        f = file(os.path.join(self.segmentDirectory, "2008-05.1.gz"), "wb")
+        f.write("garbage")
+        f.close()
+        self.assertRaises(IOError, self.segments.read, "2008-05.1.gz")
+
+    def testDiscardAfter(self):
+        """The segments of later generations and the temporary files are
+        removed."""
+        self.segments.write({"2008-04": [finishedIn(2008, 4, "a")]}, 1)
+        self.segments.write({"2008-05": [finishedIn(2008, 5, "b")]}, 2)
+        tmp = os.path.join(self.segmentDirectory, "2008-06.3.gz.tmp")
+        file(tmp, "wb").close()
+        segments = history.HistorySegments(self.segmentDirectory)
+        segments.discardAfter(1)
+        self.assertEqual(segments.segments(), ["2008-04.1.gz"])
+        self.assertEqual(sorted(os.listdir(self.segmentDirectory)),
+                         ["2008-04.1.gz"])
+
+    def testMatches(self):
+        """None matches anything; since excludes older completions."""
+        isoData = finishedIn(2008, 5, "a", "c2")
+        self.assertTrue(history.matches(isoData))
+        self.assertTrue(history.matches(isoData, "c2", "a", "b1"))
+        self.assertFalse(history.matches(isoData, iso="b"))
+        self.assertFalse(history.matches(isoData, burner="b2"))
+        self.assertFalse(history.matches(isoData,
+                                         since=isoData["finished"] + 1))
+
+
+class ArchiveTest(ManagerTestCase):
+    """The pickle store moves the isos burnt in the past months from the
+    checkpoint to the segments."""
+
+    def setUp(self):
+        """Replaces the saved state with a file of an older version, with
+        isos burnt in May 2008 and in the current month."""
+        ManagerTestCase.setUp(self)
+        self.manager.close()
+        os.remove(self.manager.journalFileName)
+        self.now = finishedIn(2008, 1, "x")
+        self.now["finished"] = time.time()
+        self.burnt = [finishedIn(2008, 4, "a"), finishedIn(2008, 5, "b", "c2"),
+                      finishedIn(2008, 5, "c"), self.now]
+        f = file(self.manager.dbFileName, "wb")
+        pickler = cPickle.Pickler(f)
+        for data in ({}, [], [], self.burnt):
+            pickler.dump(data)
+        f.close()
+        self.reload()
+
+    def checkpoint(self):
+        """Returns the burnt isos in the checkpoint."""
+        f = file(self.manager.dbFileName, "rb")
+        try:
+            unpickler = cPickle.Unpickler(f)
+            for i in range(3):
+                unpickler.load()
+            return unpickler.load()
+        finally:
+            f.close()
+
+    def testArchived(self):
+        """Only the isos of the current month are left in the checkpoint;
+        getBurntIsos() still returns all of them."""
+        self.assertEqual(sorted(os.listdir(self.manager.historyDirectory)),
+                         ["2008-04.1.gz", "2008-05.1.gz"])
+        self.assertEqual(self.checkpoint(), [self.now])
+        self.assertEqual(self.manager.getBurntIsos(), self.burnt)
+        self.manager.close()
+        self.reload()
+        self.assertEqual(self.manager.getBurntIsos(), self.burnt)
+
+    def testQueries(self):
+        """Queries read the segments from the newest, and filter them."""
+        self.assertEqual(self.manager.getBurntIsos(limit=2),
+                         self.burnt[2:])
+        self.assertEqual(self.manager.getBurntIsos(committer="c2"),
+                         [self.burnt[1]])
+        since = time.mktime((2008, 5, 1, 0, 0, 0, 0, 0, -1))
+        self.assertEqual(self.manager.getBurntIsos(since=since),
+                         self.burnt[1:])
+
+    def testNewBurntKept(self):
+        """The isos burnt after the archiving are appended to the ones
+        of the current month, and found after a checkpoint."""
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["d"])
+        self.manager.queueIso("d", "c1")
+        self.manager.refresh()
+        self.manager.reportCompletion("b1", "d")
+        self.assertEqual([isoData["iso"] for isoData
+                          in self.manager.getBurntIsos()],
+                         ["a", "b", "c", "x", "d"])
+        self.manager.close()
+        self.assertEqual([isoData["iso"] for isoData in self.checkpoint()],
+                         ["x", "d"])
+        self.reload()
+        self.assertEqual([isoData["iso"] for isoData
+                          in self.manager.getBurntIsos()],
+                         ["a", "b", "c", "x", "d"])
+
+    def testIncompleteCheckpoint(self):
+        """The segments written for a checkpoint that was not written are
+        removed at startup."""
+        self.manager.close()
+        directory = self.manager.historyDirectory
+        shutil.copy(os.path.join(directory, "2008-05.1.gz"),
+                    os.path.join(directory, "2008-05.9.gz"))
+        self.reload()
+        self.assertEqual(sorted(os.listdir(directory)),
+                         ["2008-04.1.gz", "2008-05.1.gz"])
+        self.assertEqual(self.manager.getBurntIsos(), self.burnt)
+
+    def testImportArchived(self):
+        """The SQLite store imports the archived isos too."""
+        self.manager.close()
+        burner_manager.BurnerManager.storeBackend = "sqlite"
+        self.reload()
+        self.assertEqual(self.manager.getBurntIsos(), self.burnt)
+
+
+if __name__ == "__main__":
+    unittest.main()
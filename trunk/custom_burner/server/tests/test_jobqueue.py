@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+import cPickle
+
+from custom_burner.server.jobqueue import JobQueue
+
+
+def ids(queue):
+    """Returns the ids of the jobs of a queue, in order."""
+    return [job["id"] for job in queue]
+
+
+class JobQueueTest(unittest.TestCase):
+    """Tests the linking and unlinking of jobqueue.JobQueue."""
+
+    def setUp(self):
+        """Builds a queue with the jobs 1, 2 and 3."""
+        self.jobs = [{"id": i, "iso": "iso%d" % i} for i in range(1, 6)]
+        self.queue = JobQueue(self.jobs[:3])
+
+    def testOrder(self):
+        """The constructor appends the jobs in order."""
+        self.assertEqual(ids(self.queue), [1, 2, 3])
+        self.assertEqual(len(self.queue), 3)
+        self.assertTrue(self.queue.first() is self.jobs[0])
+        self.assertTrue(self.queue.last() is self.jobs[2])
+
+    def testEmpty(self):
+        """An empty queue is false, and has neither first nor last."""
+        queue = JobQueue()
+        self.assertFalse(queue)
+        self.assertEqual(list(queue), [])
+        self.assertTrue(queue.first() is None)
+        self.assertTrue(queue.last() is None)
+
+    def testAppendLeft(self):
+        """appendleft() and insertAfter(job, None) link at the head."""
+        self.queue.appendleft(self.jobs[3])
+        self.queue.insertAfter(self.jobs[4], None)
+        self.assertEqual(ids(self.queue), [5, 4, 1, 2, 3])
+
+    def testInsertAfter(self):
+        """insertAfter() links right after the given job."""
+        self.queue.insertAfter(self.jobs[3], self.jobs[0])
+        self.assertEqual(ids(self.queue), [1, 4, 2, 3])
+        self.queue.insertAfter(self.jobs[4], self.jobs[2])
+        self.assertEqual(ids(self.queue), [1, 4, 2, 3, 5])
+        self.assertTrue(self.queue.last() is self.jobs[4])
+
+    def testInsertAfterMissing(self):
+        """insertAfter() refuses a previous job that is not queued, or an
+        equal copy of one that is."""
+        self.assertRaises(ValueError, self.queue.insertAfter,
+                          self.jobs[3], self.jobs[4])
+        self.assertRaises(ValueError, self.queue.insertAfter,
+                          self.jobs[3], self.jobs[0].copy())
+        self.assertEqual(ids(self.queue), [1, 2, 3])
+
+    def testDuplicate(self):
+        """A job id can be queued only once."""
+        self.assertRaises(ValueError, self.queue.append, {"id": 2})
+        self.assertEqual(ids(self.queue), [1, 2, 3])
+
+    def testRemove(self):
+        """remove() unlinks from the middle, the head and the tail."""
+        self.queue.remove(self.jobs[1])
+        self.assertEqual(ids(self.queue), [1, 3])
+        self.queue.remove(self.jobs[0])
+        self.assertEqual(ids(self.queue), [3])
+        self.queue.remove(self.jobs[2])
+        self.assertEqual(ids(self.queue), [])
+        self.assertFalse(self.queue)
+        self.assertTrue(self.queue.get(1) is None)
+
+    def testRemoveMissing(self):
+        """remove() refuses a job that is not queued."""
+        self.assertRaises(ValueError, self.queue.remove, self.jobs[3])
+        self.queue.remove(self.jobs[1])
+        self.assertRaises(ValueError, self.queue.remove, self.jobs[1])
+
+    def testRelink(self):
+        """A removed job can be queued again, anywhere."""
+        self.queue.remove(self.jobs[0])
+        self.queue.insertAfter(self.jobs[0], self.jobs[2])
+        self.assertEqual(ids(self.queue), [2, 3, 1])
+        self.queue.remove(self.jobs[2])
+        self.queue.insertAfter(self.jobs[2], self.jobs[1])
+        self.assertEqual(ids(self.queue), [2, 3, 1])
+
+    def testReplace(self):
+        """replace() keeps the place of the job with the same id."""
+        newJob = {"id": 2, "iso": "other"}
+        self.queue.replace(newJob)
+        self.assertEqual(ids(self.queue), [1, 2, 3])
+        self.assertTrue(self.queue.get(2) is newJob)
+        self.assertTrue(newJob in self.queue)
+        self.assertFalse(self.jobs[1] in self.queue)
+        self.assertRaises(ValueError, self.queue.replace, self.jobs[3])
+
+    def testPickle(self):
+        """A queue is pickled as the list of its jobs."""
+        self.queue.insertAfter(self.jobs[3], None)
+        copy = cPickle.loads(cPickle.dumps(self.queue,
+                                           cPickle.HIGHEST_PROTOCOL))
+        self.assertEqual(ids(copy), [4, 1, 2, 3])
+        self.assertEqual(list(copy), list(self.queue))
+        copy.remove(copy.get(2))
+        self.assertEqual(ids(copy), [4, 1, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+import os
+import shutil
+import tempfile
+import logging
+import new
+import cPickle
+
+from custom_burner.server import burner_manager
+from custom_burner.server.journal import Journal
+from custom_burner.server.tests.fakes import FakeBurner, ManagerTestCase
+
+
+class JournalTest(unittest.TestCase):
+    """Tests the recovery of journal.Journal from a truncated file."""
+
+    def setUp(self):
+        """Creates a temporary directory for the journal."""
+        logging.getLogger("Journal").setLevel(logging.ERROR)
+        self.directory = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.directory, "journal")
+
+    def tearDown(self):
+        """Removes the temporary directory."""
+        shutil.rmtree(self.directory)
+
+    def write(self, records):
+        """Writes the records to a new journal, and returns the size of
+        the file after each of them."""
+        if os.path.exists(self.fileName):
+            os.remove(self.fileName)
+        journal = Journal(self.fileName)
+        sizes = []
+        for record in records:
+            journal.append(record)
+            sizes.append(os.path.getsize(self.fileName))
+        journal.close()
+        return sizes
+
+    def testReplay(self):
+        """The records come back in order, with their sequence numbers."""
+        self.write(["a", "b", "c"])
+        journal = Journal(self.fileName)
+        self.assertEqual(journal.replay(), ["a", "b", "c"])
+        self.assertEqual(journal.sequence, 3)
+        self.assertEqual(journal.records, 3)
+
+    def testMissingFile(self):
+        """Without a file, nothing was written since the checkpoint."""
+        journal = Journal(self.fileName)
+        self.assertEqual(journal.replay(5), [])
+        self.assertEqual(journal.sequence, 5)
+        self.assertFalse(os.path.exists(self.fileName))
+
+    def testReplayAfter(self):
+        """The records contained in the checkpoint are skipped."""
+        self.write(["a", "b", "c"])
+        journal = Journal(self.fileName)
+        self.assertEqual(journal.replay(2), ["c"])
+        self.assertEqual(journal.sequence, 3)
+        self.assertEqual(journal.records, 3)
+
+    def testTruncatedTail(self):
+        """Each truncation of the last record loses only that record, and
+        is cut off the file."""
+        sizes = self.write(["a", "b", "c" * 100])
+        for size in range(sizes[1], sizes[2]):
+            self.write(["a", "b", "c" * 100])
+            f = file(self.fileName, "r+b")
+            try:
+                f.truncate(size)
+            finally:
+                f.close()
+            journal = Journal(self.fileName)
+            self.assertEqual(journal.replay(), ["a", "b"])
+            self.assertEqual(journal.sequence, 2)
+            self.assertEqual(os.path.getsize(self.fileName), sizes[1])
+
+    def testGarbageTail(self):
+        """Garbage after the last good record is cut off."""
+        sizes = self.write(["a", "b"])
+        f = file(self.fileName, "ab")
+        try:
+            f.write("\x00garbage")
+        finally:
+            f.close()
+        journal = Journal(self.fileName)
+        self.assertEqual(journal.replay(), ["a", "b"])
+        self.assertEqual(os.path.getsize(self.fileName), sizes[1])
+
+    def testAppendAfterRecovery(self):
+        """The records appended after a recovery follow the good ones."""
+        sizes = self.write(["a", "b"])
+        f = file(self.fileName, "r+b")
+        try:
+            f.truncate(sizes[1] - 1)
+        finally:
+            f.close()
+        journal = Journal(self.fileName)
+        self.assertEqual(journal.replay(), ["a"])
+        self.assertEqual(journal.append("c"), 2)
+        journal.close()
+        journal = Journal(self.fileName)
+        self.assertEqual(journal.replay(), ["a", "c"])
+
+    def testSequenceAcrossTruncate(self):
+        """The sequence numbers go on after the journal is emptied."""
+        journal = Journal(self.fileName)
+        journal.replay()
+        journal.append("a")
+        journal.append("b")
+        journal.truncate()
+        self.assertEqual(journal.append("c"), 3)
+        journal.close()
+        journal = Journal(self.fileName)
+        self.assertEqual(journal.replay(2), ["c"])
+        self.assertEqual(journal.records, 1)
+
+
+class Burner:
+    """A burner pickled like older versions did: an instance of an
+    old-style class named Burner, with all its variables. It is read back
+    through newBurner() below, like the ones of the burner module."""
+
+
+def newBurner():
+    """Returns an empty FakeBurner, that the saved variables of a Burner
+    above are going to fill."""
+    return FakeBurner.__new__(FakeBurner)
+
+
+class RecoveryTest(ManagerTestCase):
+    """Tests how the manager saves its state in the journal and in the
+    checkpoints, and loads it again."""
+
+    def setUp(self):
+        """Registers b1, that has "a" and "b", and b2, that has "a"."""
+        ManagerTestCase.setUp(self)
+        logging.getLogger("Journal").setLevel(logging.CRITICAL)
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b"])
+        self.manager.registerBurner("b2", "127.0.0.1", 1, ["a"])
+
+    def state(self):
+        """Returns what the manager must restore: the ids of the jobs in
+        each queue, in order, the sets and the queues of the burners."""
+        manager = self.manager
+        parked = {}
+        for (iso, jobs) in manager.parkedIsos.items():
+            parked[iso] = [isoData["id"] for isoData in jobs]
+        return {"pending": [(isoData["id"], isoData.get("retries"))
+                            for isoData in manager.pendingIsos],
+                "backingOff": [isoData["id"]
+                               for isoData in manager.backingOffIsos],
+                "beingBurnt": [(isoData["id"], isoData["burner"],
+                                isoData.get("twin"))
+                               for isoData in manager.isosBeingBurnt],
+                "burnt": [(isoData["iso"], isoData["committer"])
+                          for isoData in manager.getBurntIsos()],
+                "parked": parked,
+                "sets": manager.sets,
+                "nextJobId": manager.nextJobId,
+                "burners": dict([(burner.name, burner.jobs) for burner
+                                 in manager.burners.values()]),
+                "lastBurner": manager.lastBurner}
+
+    def assertRestored(self):
+        """Reloads the manager, and checks that its state is the same."""
+        expected = self.state()
+        self.reload()
+        self.assertEqual(self.state(), expected)
+
+    def testReplay(self):
+        """The operations of the journal rebuild the queues in the same
+        order, wherever the jobs moved."""
+        self.manager.retryDelay = 0
+        self.manager.pushAhead = 1
+        for iso in ("a", "b", "a", "x", "b"):
+            self.manager.queueIso(iso, "c1")
+        self.manager.queueSet(["a", "x"], "c2")
+        self.manager.refresh()
+        # The set waits for a burner that has "x"
+        self.assertEqual(len(self.manager.isosBeingBurnt), 3)
+        # Back at the head of the queue, then burnt by the other burner
+        self.manager.reportBurningError("b2", "a")
+        self.manager.reportCompletion("b1", "a")
+        self.assertRestored()
+        self.assertEqual(self.manager.pendingIsos.first()["retries"], 1)
+        self.manager.refresh()
+        self.manager.reportClosingBurner("b1")
+        self.assertEqual(len(self.manager.burners), 1)
+        self.assertRestored()
+        # All of it came from the journal
+        self.assertFalse(os.path.exists(self.manager.dbFileName))
+
+    def testBackupCopies(self):
+        """A backup copy is a job of its own, and the copy that loses the
+        race is forgotten."""
+        self.manager.setSpeculative(True)
+        self.manager.queueIso("a", "c1")
+        self.manager.refresh()
+        self.manager.isosBeingBurnt.first()["started"] -= 24 * 60 * 60
+        self.manager.refresh()
+        self.assertEqual(len(self.manager.isosBeingBurnt), 2)
+        self.assertRestored()
+        self.manager.reportCompletion("b2", "a")
+        self.assertEqual(list(self.manager.isosBeingBurnt), [])
+        self.assertRestored()
+
+    def testBackoffAndParking(self):
+        """The isos waiting for their backoff time or for a burner are
+        restored where they were."""
+        self.manager.queueIso("a", "c1")
+        self.manager.queueIso("x", "c1")
+        self.manager.refresh()
+        self.manager.reportBurningError("b1", "a")
+        self.assertEqual(len(self.manager.backingOffIsos), 1)
+        self.assertRestored()
+        self.manager.registerBurner("b3", "127.0.0.1", 1, ["x"])
+        self.assertRestored()
+        self.assertEqual(self.manager.parkedIsos, {})
+
+    def testCheckpoint(self):
+        """Every checkpointInterval changes, the whole state replaces the
+        journal."""
+        # The store is given the interval when the manager is created
+        checkpointInterval = burner_manager.BurnerManager.checkpointInterval
+        burner_manager.BurnerManager.checkpointInterval = 3
+        try:
+            self.reload()
+        finally:
+            burner_manager.BurnerManager.checkpointInterval = \
+                checkpointInterval
+        self.manager.queueIso("a", "c1")
+        # The journal has the 2 registrations and the iso
+        self.manager.queueIso("b", "c1")
+        self.assertEqual(os.path.getsize(self.manager.journalFileName), 0)
+        self.manager.queueIso("a", "c1")
+        self.manager.refresh()
+        self.manager.reportCompletion("b1", "a")
+        self.assertRestored()
+        self.manager.close()
+        self.reload()
+        self.assertEqual(self.manager.burners, {})
+        self.assertEqual([isoData["iso"] for isoData
+                          in self.manager.getBurntIsos()], ["a"])
+
+    def testNotReplayedTwice(self):
+        """The changes contained in a checkpoint are not replayed again if
+        the server stopped before emptying the journal."""
+        self.manager.queueIso("a", "c1")
+        self.manager.refresh()
+        self.manager.reportCompletion("b1", "a")
+        f = file(self.manager.journalFileName, "rb")
+        journal = f.read()
+        f.close()
+        counts = self.manager.reliability.counts["b1"][:2]
+        self.manager.close()
+        f = file(self.manager.journalFileName, "wb")
+        f.write(journal)
+        f.close()
+        self.reload()
+        self.assertEqual(self.manager.reliability.counts["b1"][:2], counts)
+        self.assertEqual(len(self.manager.getBurntIsos()), 1)
+
+    def testOlderVersion(self):
+        """The db file of older versions, with the burners, the pending
+        isos, the isos being burnt and the burnt isos only, is loaded, and
+        replaced with a checkpoint."""
+        self.manager.close()
+        os.remove(self.manager.journalFileName)
+        burner = new.instance(Burner, {"name": "b1", "ip": "127.0.0.1",
+                                       "port": 1, "free": False,
+                                       "iso": "a", "committer": "c1",
+                                       "isos": ["a", "b"]})
+        f = file(self.manager.dbFileName, "w")
+        pickler = cPickle.Pickler(f)
+        pickler.dump({"b1": burner})
+        pickler.dump([{"date": "2008-01-01 10:00", "iso": "b",
+                       "committer": "c2"}])
+        pickler.dump([{"date": "2008-01-01 09:00", "iso": "a",
+                       "committer": "c1", "burner": "b1"}])
+        pickler.dump([{"date": "2008-01-01 08:00", "iso": "a",
+                       "committer": "c3", "burner": "b1"}])
+        f.close()
+        self.reload()
+        burner = self.manager.burners["b1"]
+        self.assertEqual(burner.jobs, [("a", "c1")])
+        self.assertFalse(burner.free)
+        self.assertFalse(burner.suspect)
+        self.assertEqual([isoData["id"] for isoData
+                          in list(self.manager.pendingIsos) +
+                          list(self.manager.isosBeingBurnt)], [1, 2])
+        self.assertEqual(len(self.manager.getBurntIsos()), 1)
+        self.assertRestored()
+        self.manager.reportCompletion("b1", "a")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "b"})
+        self.assertRestored()
+
+
+if __name__ == "__main__":
+    unittest.main()
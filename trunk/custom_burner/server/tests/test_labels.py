@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+
+from custom_burner import common
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class ParseLabelsTest(unittest.TestCase):
+    """Tests the text form of the labels."""
+
+    def testParse(self):
+        """Labels are sorted by key, and the last value of a key wins."""
+        self.assertEqual(common.parseLabels(""), ())
+        self.assertEqual(common.parseLabels(" speed=fast , room=lab2,"),
+                         (("room", "lab2"), ("speed", "fast")))
+        self.assertEqual(common.parseLabels("room=a,room=b"),
+                         (("room", "b"),))
+        self.assertEqual(common.parseLabels("empty="), (("empty", ""),))
+        self.assertRaises(ValueError, common.parseLabels, "room")
+        self.assertRaises(ValueError, common.parseLabels, "=lab2")
+
+    def testFormat(self):
+        """formatLabels() is the inverse of parseLabels()."""
+        labels = (("room", "lab2"), ("speed", "fast"))
+        self.assertEqual(common.formatLabels(labels), "room=lab2,speed=fast")
+        self.assertEqual(common.parseLabels(common.formatLabels(labels)),
+                         labels)
+
+
+class SelectorTest(ManagerTestCase):
+    """Tests that isos only go to the burners with the labels they ask
+    for."""
+
+    def setUp(self):
+        """Registers three burners with the same isos and different
+        labels."""
+        ManagerTestCase.setUp(self)
+        self.manager.registerBurner("plain", "127.0.0.1", 1, ["a", "b"])
+        self.manager.registerBurner("lab1", "127.0.0.1", 1, ["a", "b"],
+                                    labels={"room": "lab1"})
+        self.manager.registerBurner("lab2fast", "127.0.0.1", 1, ["a", "b"],
+                                    labels={"room": "lab2",
+                                            "speed": "fast"})
+
+    def testIndex(self):
+        """burnersByLabel maps each label to its burners."""
+        self.assertEqual(self.manager.burnersByLabel,
+                         {("room", "lab1"): set(["lab1"]),
+                          ("room", "lab2"): set(["lab2fast"]),
+                          ("speed", "fast"): set(["lab2fast"])})
+        self.manager.reportClosingBurner("lab1")
+        self.assertFalse(self.manager.burnersByLabel.has_key(
+            ("room", "lab1")))
+
+    def testSelector(self):
+        """Every label of the selector must match."""
+        self.manager.queueIso("a", "c1", selector=(("room", "lab2"),
+                                                   ("speed", "fast")))
+        self.manager.queueIso("b", "c2", selector=(("room", "lab1"),))
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"lab2fast": "a", "lab1": "b"})
+
+    def testSelectorInEveryMode(self):
+        """The selector holds whatever the dispatch mode."""
+        for mode in ("fifo", "matching", "edf"):
+            self.manager.setDispatchMode(mode)
+            self.manager.queueIso("a", mode, selector=(("room", "lab1"),))
+            self.manager.refresh()
+            self.assertEqual(self.assigned(), {"lab1": "a"})
+            self.manager.reportCompletion("lab1", "a")
+
+    def testNoMatch(self):
+        """An iso whose selector matches no burner waits in the queue
+        until one registers."""
+        selector = (("room", "lab1"), ("speed", "fast"))
+        self.manager.queueIso("a", "c1", selector=selector)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {})
+        self.assertEqual(len(self.manager.getPendingIsos()), 1)
+        self.manager.registerBurner("lab1fast", "127.0.0.1", 1, ["a"],
+                                    labels=dict(selector))
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"lab1fast": "a"})
+
+    def testSet(self):
+        """The members of a set only go to the burners with the labels,
+        and wait until enough of them are idle."""
+        self.manager.registerBurner("lab1b", "127.0.0.1", 1, ["a"],
+                                    labels={"room": "lab1"})
+        self.manager.queueIso("a", "c0", selector=(("room", "lab1"),))
+        self.manager.refresh()
+        self.assertEqual(len(self.assigned()), 1)
+        self.manager.queueSet(["a", "a"], "c1", selector=(("room", "lab1"),))
+        self.manager.refresh()
+        self.assertEqual(len(self.assigned()), 1)
+        busy = self.assigned().keys()[0]
+        self.manager.reportCompletion(busy, "a")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"lab1": "a", "lab1b": "a"})
+
+    def testRetryKeepsSelector(self):
+        """A failed iso is retried on another burner with the labels, or on
+        the same one if it is the only one; never on the others."""
+        self.manager.retryDelay = 0
+        self.manager.queueIso("a", "c1", selector=(("room", "lab1"),))
+        self.manager.refresh()
+        self.manager.reportBurningError("lab1", "a")
+        self.manager.wakeRetries()
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"lab1": "a"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import os
+import time
+import unittest
+
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class LeaseTest(ManagerTestCase):
+    """Tests the leases of the isos being burnt, and how the expired ones
+    are reaped."""
+
+    def setUp(self):
+        """Starts "a" on b1; b2 is idle and has it too. The isos taken back
+        are retried immediately."""
+        ManagerTestCase.setUp(self)
+        self.manager.retryDelay = 0
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b"])
+        self.manager.queueIso("a", "c1")
+        self.manager.refresh()
+        self.manager.registerBurner("b2", "127.0.0.1", 1, ["a"])
+        self.isoData = self.manager.isosBeingBurnt.first()
+
+    def expire(self):
+        """Makes the lease of "a" expire."""
+        self.isoData["leaseExpiry"] = time.time() - 1
+
+    def testLease(self):
+        """The lease covers the expected burn plus the grace period, and
+        heartbeats extend it."""
+        manager = self.manager
+        expected = manager.durations.expected("a", "b1")
+        self.assertTrue(abs(self.isoData["leaseExpiry"] - time.time() -
+                            manager.leaseGrace -
+                            manager.leaseFactor * expected) < 5)
+        self.expire()
+        manager.renewLease("b1")
+        self.assertTrue(self.isoData["leaseExpiry"] >
+                        time.time() + manager.leaseRenewal - 5)
+        self.assertEqual(manager.reapExpiredLeases(), 0)
+
+    def testReap(self):
+        """An expired lease puts the iso back at the head of the queue, and
+        the burner gets no more work until it is alive again."""
+        self.manager.queueIso("b", "c2")
+        self.expire()
+        self.assertEqual(self.manager.reapExpiredLeases(), 1)
+        self.assertEqual([isoData["iso"]
+                          for isoData in self.manager.pendingIsos],
+                         ["a", "b"])
+        self.assertTrue(self.manager.burners["b1"].suspect)
+        self.assertEqual(self.assigned(), {})
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b2": "a"})
+        self.manager.reportCompletion("b2", "a")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {})
+        self.manager.renewLease("b1")
+        self.assertFalse(self.manager.burners["b1"].suspect)
+
+    def testReapQueue(self):
+        """All the isos queued on a reaped burner go back to the head of
+        the queue, in their order."""
+        self.manager.setPushAhead(1)
+        self.manager.queueIso("b", "c1")
+        self.manager.refresh()
+        self.assertEqual(self.manager.burners["b1"].jobs,
+                         [("a", "c1"), ("b", "c1")])
+        self.manager.queueIso("a", "c2")
+        self.expire()
+        self.assertEqual(self.manager.reapExpiredLeases(), 2)
+        self.assertEqual([(isoData["iso"], isoData["committer"])
+                          for isoData in self.manager.pendingIsos],
+                         [("a", "c1"), ("b", "c1"), ("a", "c2")])
+        self.assertEqual(list(self.manager.isosBeingBurnt), [])
+
+    def testLateCompletion(self):
+        """A completion after the reaping is honoured if the iso has not
+        been given to somebody else."""
+        self.expire()
+        self.manager.reapExpiredLeases()
+        self.manager.reportCompletion("b1", "a")
+        self.assertEqual(list(self.manager.pendingIsos), [])
+        self.assertEqual([isoData["iso"]
+                          for isoData in self.manager.getBurntIsos()], ["a"])
+        self.assertFalse(self.manager.burners["b1"].suspect)
+
+    def testUnknownBurner(self):
+        """The isos of a burner that is not registered any more are reaped
+        even if their lease is still valid."""
+        del self.manager.burners["b1"]
+        self.assertEqual(self.manager.reapExpiredLeases(), 1)
+        self.assertEqual(list(self.manager.isosBeingBurnt), [])
+
+    def testSaving(self):
+        """Heartbeats save the state only when they revive a burner, and
+        the leases are extended when the state is loaded."""
+        journalFileName = self.manager.journalFileName
+        os.utime(journalFileName, (0, 0))
+        self.manager.renewLease("b1")
+        self.assertEqual(os.stat(journalFileName).st_mtime, 0)
+        self.expire()
+        self.manager.reapExpiredLeases()
+        self.manager.renewLease("b1")
+        self.assertNotEqual(os.stat(journalFileName).st_mtime, 0)
+        self.reload()
+        self.assertFalse(self.manager.burners["b1"].suspect)
+        self.manager.refresh()
+        isoData = self.manager.isosBeingBurnt.first()
+        isoData["leaseExpiry"] = time.time() - 1
+        self.manager.queueIso("b", "c2") # Saves the state
+        self.reload()
+        self.assertEqual(self.manager.reapExpiredLeases(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
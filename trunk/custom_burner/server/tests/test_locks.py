@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import threading
+import unittest
+
+from custom_burner import common
+from custom_burner.server import locks
+from custom_burner.server import burner_manager
+from custom_burner.server.tests.fakes import FakeBurner, ManagerTestCase
+
+
+class OrderedLockTest(unittest.TestCase):
+    """Tests the order in which OrderedLocks can be acquired."""
+
+    def setUp(self):
+        """Creates the locks of a manager with two burners."""
+        self.dispatch = locks.OrderedLock("dispatch", (locks.DISPATCH,))
+        self.a = locks.OrderedLock("burner a", (locks.BURNER, "a"))
+        self.b = locks.OrderedLock("burner b", (locks.BURNER, "b"))
+        self.catalog = locks.OrderedLock("catalog", (locks.CATALOG,))
+        self.queue = locks.OrderedLock("queue", (locks.QUEUE,))
+
+    def testOrder(self):
+        """Locks acquired in order can be released in any order."""
+        for lock in (self.dispatch, self.a, self.b, self.catalog,
+                     self.queue):
+            lock.acquire()
+        for lock in (self.catalog, self.a, self.queue, self.dispatch,
+                     self.b):
+            lock.release()
+        self.assertEqual(locks._heldLocks(), [])
+
+    def testWrongOrder(self):
+        """A lock of a lower or equal rank cannot be acquired."""
+        self.queue.acquire()
+        try:
+            self.assertRaises(AssertionError, self.catalog.acquire)
+            self.assertRaises(AssertionError, self.a.acquire)
+            self.assertRaises(AssertionError, self.queue.acquire)
+        finally:
+            self.queue.release()
+        self.b.acquire()
+        try:
+            self.assertRaises(AssertionError, self.a.acquire)
+            self.queue.acquire()
+            self.queue.release()
+        finally:
+            self.b.release()
+        self.a.acquire()
+        self.a.release()
+
+    def testThreads(self):
+        """Each thread has its own order."""
+        self.queue.acquire()
+        try:
+            done = []
+            def other():
+                self.a.acquire()
+                self.a.release()
+                done.append(True)
+            thread = threading.Thread(target=other)
+            thread.start()
+            thread.join(5)
+            self.assertEqual(done, [True])
+        finally:
+            self.queue.release()
+
+
+class SlowBurner(FakeBurner):
+    """A FakeBurner that does not answer assignIso() until answer is
+    set."""
+
+    answer = threading.Event()
+    asked = threading.Event()
+
+    def assignIso(self, date, iso, committer):
+        """Waits for answer, then behaves like FakeBurner."""
+        SlowBurner.asked.set()
+        SlowBurner.answer.wait(5)
+        return FakeBurner.assignIso(self, date, iso, committer)
+
+
+class ManagerLocksTest(ManagerTestCase):
+    """Tests what the manager does while a burner answers."""
+
+    def setUp(self):
+        """Registers a slow burner and a normal one, and starts a
+        dispatch pass that waits for the slow burner to answer."""
+        ManagerTestCase.setUp(self)
+        SlowBurner.answer.clear()
+        SlowBurner.asked.clear()
+        burner_manager.Burner = SlowBurner
+        self.manager.registerBurner("slow", "127.0.0.1", 0, ["a"])
+        burner_manager.Burner = FakeBurner
+        self.manager.registerBurner("fast", "127.0.0.1", 0, ["b"])
+        self.manager.queueIso("a", "c1")
+        self.dispatch = threading.Thread(target=self.manager.refresh)
+        self.dispatch.start()
+        self.assertTrue(SlowBurner.asked.wait(5))
+
+    def tearDown(self):
+        """Lets the slow burner answer."""
+        SlowBurner.answer.set()
+        self.dispatch.join(5)
+        ManagerTestCase.tearDown(self)
+
+    def inThread(self, function, *args):
+        """Calls function in another thread. Returns True if it
+        returned within a few seconds."""
+        thread = threading.Thread(target=function, args=args)
+        thread.setDaemon(True)
+        thread.start()
+        thread.join(5)
+        return not thread.isAlive()
+
+    def testReports(self):
+        """The other burners can report and be registered while a burner
+        answers."""
+        manager = self.manager
+        self.assertTrue(self.inThread(manager.renewLease, "fast"))
+        self.assertTrue(self.inThread(manager.reportMediaState, "fast",
+                                      common.MEDIA_BLANK))
+        self.assertTrue(self.inThread(manager.registerBurner, "new",
+                                      "127.0.0.1", 0, ["a"]))
+        self.assertTrue(self.inThread(manager.queueIso, "b", "c2"))
+        self.assertTrue("new" in manager.burners)
+
+    def testRemove(self):
+        """An iso removed from the queue while a burner answers is taken
+        back from the burner after the pass."""
+        manager = self.manager
+        (isoData, ) = manager.getPendingIsos()
+        self.assertTrue(self.inThread(manager.removeIso, isoData))
+        SlowBurner.answer.set()
+        self.dispatch.join(5)
+        self.assertFalse(self.dispatch.isAlive())
+        self.assertEqual(manager.burners["slow"].jobs, [])
+        self.assertEqual(len(manager.pendingIsos), 0)
+        self.assertEqual(len(manager.isosBeingBurnt), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+
+from custom_burner.server.matching import maximumMatching
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class MaximumMatchingTest(unittest.TestCase):
+    """Tests the maximum matching between jobs and burners."""
+
+    def match(self, jobs, holders, burnersNum=None):
+        """Returns the dict job index -> burner of the matching."""
+        return dict(maximumMatching(jobs, lambda job: holders.get(job, []),
+                                    burnersNum))
+
+    def testRareIso(self):
+        """The only burner that has a rare iso is left to it: the common
+        iso moves to another burner."""
+        holders = {"common": ["b1", "b2"], "rare": ["b1"]}
+        self.assertEqual(self.match(["common", "rare"], holders),
+                         {0: "b2", 1: "b1"})
+
+    def testAugmentingChain(self):
+        """A new job can move several matched jobs along a path."""
+        holders = {"a": ["b1", "b2"], "b": ["b2", "b3"], "c": ["b1"]}
+        self.assertEqual(self.match(["a", "b", "c"], holders),
+                         {0: "b2", 1: "b3", 2: "b1"})
+
+    def testPriorityOrder(self):
+        """When not all the jobs fit, the first ones are kept."""
+        holders = {"a": ["b1"], "b": ["b1"]}
+        self.assertEqual(self.match(["b", "a", "b"], holders), {0: "b1"})
+
+    def testMatchedJobsStay(self):
+        """A matched job is never dropped for a later one, even if that
+        would match more jobs of lower priority."""
+        holders = {"a": ["b1"], "b": ["b1", "b2"], "c": ["b2"]}
+        self.assertEqual(self.match(["a", "b", "c"], holders),
+                         {0: "b1", 1: "b2"})
+
+    def testNoCandidates(self):
+        """Jobs that nobody can take are left out."""
+        self.assertEqual(self.match(["a", "x", "x"], {"a": ["b1"]}),
+                         {0: "b1"})
+        self.assertEqual(self.match([], {}), {})
+
+    def testPreference(self):
+        """The first candidate of a job is preferred."""
+        holders = {"a": ["b2", "b1"]}
+        self.assertEqual(self.match(["a"], holders), {0: "b2"})
+
+    def testBurnersNum(self):
+        """The search stops when every burner is busy."""
+        asked = []
+        def candidates(job):
+            asked.append(job)
+            return ["b1"]
+        self.assertEqual(maximumMatching(["a", "b", "c"], candidates, 1),
+                         [(0, "b1")])
+        self.assertEqual(asked, ["a"])
+
+
+class MatchingDispatchTest(ManagerTestCase):
+    """Tests the "matching" dispatch mode of BurnerManager."""
+
+    def testRareIso(self):
+        """The matching keeps both burners busy, where the first free
+        burner could take the common iso."""
+        self.manager.setDispatchMode("matching")
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["common", "rare"])
+        self.manager.registerBurner("b2", "127.0.0.1", 1, ["common"])
+        self.manager.queueIso("common", "c1")
+        self.manager.queueIso("rare", "c2")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "rare", "b2": "common"})
+        self.assertEqual(self.manager.getPendingIsos(), [])
+
+    def testPriority(self):
+        """With one burner, the iso with the highest priority goes
+        first, then the oldest one."""
+        self.manager.setDispatchMode("matching")
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b", "c"])
+        self.manager.queueIso("a", "c1")
+        self.manager.queueIso("b", "c2", 5)
+        self.manager.queueIso("c", "c3", 5)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "b"})
+        self.assertEqual([isoData["iso"] for isoData
+                          in self.manager.getPendingIsos()], ["a", "c"])
+
+    def testUnknownMode(self):
+        """Unknown modes are refused."""
+        self.assertRaises(ValueError, self.manager.setDispatchMode, "random")
+        self.assertEqual(self.manager.dispatchMode, "fifo")
+
+
+if __name__ == "__main__":
+    unittest.main()
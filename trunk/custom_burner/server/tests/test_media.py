@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+import time
+
+from custom_burner import common
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class MediaTest(ManagerTestCase):
+    """Tests the preference for the burners with a blank disc ready."""
+
+    def setUp(self):
+        """Registers b1 and b2, which have the same isos."""
+        ManagerTestCase.setUp(self)
+        for name in ("b1", "b2"):
+            self.manager.registerBurner(name, "127.0.0.1", 1, ["a", "b"])
+
+    def media(self):
+        """Returns the dict burner name -> reported media state."""
+        return dict([(entry["name"], entry["media"])
+                     for entry in self.manager.getBurners()])
+
+    def testReport(self):
+        """Reports are recorded, and reset when the disc is going to
+        change."""
+        self.assertEqual(self.media(), {"b1": common.MEDIA_UNKNOWN,
+                                        "b2": common.MEDIA_UNKNOWN})
+        self.manager.reportMediaState("b1", common.MEDIA_BLANK)
+        self.manager.reportMediaState("b2", common.MEDIA_EMPTY)
+        self.manager.reportMediaState("nobody", common.MEDIA_BLANK)
+        self.assertEqual(self.media(), {"b1": common.MEDIA_BLANK,
+                                        "b2": common.MEDIA_EMPTY})
+        self.manager.queueIso("a", "c1")
+        self.manager.refresh()
+        self.assertEqual(self.media()["b1"], common.MEDIA_UNKNOWN)
+        self.manager.reportMediaState("b2", common.MEDIA_BLANK)
+        self.reload()
+        self.assertEqual(self.media(), {"b1": common.MEDIA_UNKNOWN,
+                                        "b2": common.MEDIA_UNKNOWN})
+
+    def checkPreference(self, mode):
+        """Checks that mode tries the burner with a blank disc first, and
+        the one with a burnt disc last."""
+        self.manager.setDispatchMode(mode)
+        self.manager.reportMediaState("b1", common.MEDIA_NOT_BLANK)
+        self.manager.reportMediaState("b2", common.MEDIA_BLANK)
+        self.manager.queueIso("a", "c1")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b2": "a"})
+        self.manager.queueIso("b", "c1")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "b", "b2": "a"})
+
+    def testFifo(self):
+        """FIFO dispatch prefers blank discs."""
+        self.checkPreference("fifo")
+
+    def testMatching(self):
+        """Matching dispatch prefers blank discs."""
+        self.checkPreference("matching")
+
+    def testEdf(self):
+        """EDF dispatch prefers blank discs among the burners in time..."""
+        self.checkPreference("edf")
+
+    def testEdfAtRisk(self):
+        """...but gives an iso at risk to the fastest burner anyway."""
+        self.manager.setDispatchMode("edf")
+        self.manager.durations.record("a", "b1", 600)
+        self.manager.durations.record("a", "b2", 1200)
+        self.manager.reportMediaState("b2", common.MEDIA_BLANK)
+        self.manager.queueIso("a", "c1", deadline=time.time() + 100)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+
+from custom_burner import common
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+CD_ISO = 700 * 1024 * 1024
+DVD_ISO = 4 * 1024 * 1024 * 1024
+TOO_LARGE_ISO = 9 * 1024 * 1024 * 1024
+
+
+class MediaClassTest(unittest.TestCase):
+    """Tests common.mediaClassFor()."""
+
+    def testClasses(self):
+        """Each iso gets the smallest media it fits on."""
+        self.assertEqual(common.mediaClassFor(CD_ISO),
+                         common.MEDIA_CLASS_CD)
+        self.assertEqual(common.mediaClassFor(737280000),
+                         common.MEDIA_CLASS_CD)
+        self.assertEqual(common.mediaClassFor(737280001),
+                         common.MEDIA_CLASS_DVD)
+        self.assertEqual(common.mediaClassFor(DVD_ISO),
+                         common.MEDIA_CLASS_DVD)
+        self.assertEqual(common.mediaClassFor(TOO_LARGE_ISO), None)
+        self.assertEqual(common.mediaClassFor(None),
+                         common.MEDIA_CLASS_ANY)
+
+
+class CapabilitiesTest(ManagerTestCase):
+    """Tests that isos only go to the drives that take their media."""
+
+    def testRegistration(self):
+        """registerBurner() stores the sizes and the capabilities; a burner
+        that does not send them can burn anything."""
+        self.manager.registerBurner("cd", "127.0.0.1", 1, ["a"],
+                                    {"a": CD_ISO}, [common.MEDIA_CLASS_CD])
+        self.manager.registerBurner("old", "127.0.0.1", 1, ["a"])
+        self.assertEqual(self.manager.burners["cd"].isoSizes, {"a": CD_ISO})
+        self.assertEqual(self.manager.burners["cd"].capabilities,
+                         set([common.MEDIA_CLASS_CD]))
+        self.assertEqual(self.manager.burners["old"].isoSizes, {})
+        self.assertEqual(self.manager.burners["old"].capabilities,
+                         set([c for (c, capacity) in common.MEDIA_CLASSES]))
+        self.assertEqual(self.manager.isoClasses,
+                         {"a": common.MEDIA_CLASS_CD})
+
+    def testLargerDriveTakesSmallerIsos(self):
+        """A DVD drive burns CD isos too."""
+        self.manager.registerBurner("dvd", "127.0.0.1", 1, ["a"],
+                                    {"a": CD_ISO}, [common.MEDIA_CLASS_DVD])
+        self.assertEqual(self.manager.burnersByClass,
+                         {common.MEDIA_CLASS_CD: set(["dvd"]),
+                          common.MEDIA_CLASS_DVD: set(["dvd"])})
+        self.manager.queueIso("a", "c1")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"dvd": "a"})
+
+    def testCdDriveSkipsDvdIsos(self):
+        """A CD drive does not get a DVD iso, even if it is the only idle
+        burner that has it."""
+        self.manager.registerBurner("cd", "127.0.0.1", 1, ["a"],
+                                    {"a": DVD_ISO}, [common.MEDIA_CLASS_CD])
+        self.manager.registerBurner("dvd", "127.0.0.1", 1, ["a"],
+                                    {"a": DVD_ISO}, [common.MEDIA_CLASS_DVD])
+        self.manager.reportMediaState("cd", common.MEDIA_BLANK)
+        self.manager.queueIso("a", "c1")
+        self.manager.queueIso("a", "c2")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"dvd": "a"})
+        self.assertEqual(self.manager.burners["cd"].jobs, [])
+
+    def testParkedUntilDriveRegisters(self):
+        """An iso that only a smaller drive has is parked, and goes back
+        into the queue when a drive that takes it registers."""
+        self.manager.registerBurner("cd", "127.0.0.1", 1, ["a"],
+                                    {"a": DVD_ISO}, [common.MEDIA_CLASS_CD])
+        self.manager.queueIso("a", "c1")
+        self.assertEqual(self.manager.parkedIsos.keys(), ["a"])
+        self.manager.registerBurner("dvd", "127.0.0.1", 1, ["a"],
+                                    {"a": DVD_ISO}, [common.MEDIA_CLASS_DVD])
+        self.assertEqual(self.manager.parkedIsos, {})
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"dvd": "a"})
+
+    def testTooLarge(self):
+        """An iso too large for any media stays parked."""
+        self.manager.registerBurner("dl", "127.0.0.1", 1, ["a"],
+                                    {"a": TOO_LARGE_ISO})
+        self.assertEqual(self.manager.isoClasses, {"a": None})
+        self.manager.queueIso("a", "c1")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {})
+        self.assertEqual(self.manager.parkedIsos.keys(), ["a"])
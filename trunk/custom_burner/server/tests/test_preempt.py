@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+
+from custom_burner.server.estimator import DurationEstimator
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class PreemptTest(ManagerTestCase):
+    """Tests the preemption of the burners waiting for a disc."""
+
+    def setUp(self):
+        """Gives "a", with no priority, to b1, which is waiting for a
+        disc."""
+        ManagerTestCase.setUp(self)
+        self.manager.setPreemptive(True)
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b"])
+        self.manager.queueIso("a", "c1")
+        self.manager.refresh()
+
+    def pending(self):
+        """Returns the isos in the queue."""
+        return [isoData["iso"] for isoData in self.manager.getPendingIsos()]
+
+    def testPreempt(self):
+        """An iso with higher priority takes the burner, and the other one
+        goes back to the head of the queue."""
+        self.manager.queueIso("a", "c3")
+        self.manager.queueIso("b", "c2", priority=5)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "b"})
+        self.assertEqual(self.pending(), ["a", "a"])
+        self.assertEqual(self.manager.getPendingIsos()[0]["committer"], "c1")
+        self.manager.reportCompletion("b1", "b")
+        self.manager.refresh()
+        self.assertEqual(self.manager.burners["b1"].committer, "c1")
+
+    def testDisabled(self):
+        """Nothing is preempted unless preemption is enabled."""
+        self.manager.setPreemptive(False)
+        self.manager.queueIso("b", "c2", priority=5)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a"})
+
+    def testSamePriority(self):
+        """Isos with the same priority do not preempt each other."""
+        self.manager.queueIso("b", "c2")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a"})
+        self.assertEqual(self.pending(), ["b"])
+
+    def testWriting(self):
+        """A burner that reported that it is writing keeps its iso."""
+        self.manager.reportBurnStarted("b1", "a")
+        self.assertTrue(self.manager.getIsosBeingBurnt()[0]
+                        .has_key("writing"))
+        self.manager.queueIso("b", "c2", priority=5)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a"})
+
+    def testJustStartedWriting(self):
+        """A burner that started writing before the server heard about it
+        refuses to give the iso back, and keeps it."""
+        self.manager.burners["b1"].writing = True
+        self.manager.queueIso("b", "c2", priority=5)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a"})
+        self.assertEqual(self.pending(), ["b"])
+        self.assertEqual(len(self.manager.getIsosBeingBurnt()), 1)
+
+    def testQueuedBurner(self):
+        """A burner with more isos in its queue is not preempted."""
+        self.manager.setPushAhead(1)
+        self.manager.queueIso("a", "c3")
+        self.manager.refresh()
+        self.manager.queueIso("b", "c2", priority=5)
+        self.manager.refresh()
+        self.assertEqual(self.manager.burners["b1"].jobs,
+                         [("a", "c1"), ("a", "c3")])
+
+    def testCannotBurn(self):
+        """A burner that does not have the urgent iso is not preempted."""
+        self.manager.registerBurner("b2", "127.0.0.1", 1, ["c"])
+        self.manager.queueIso("c", "c0")
+        self.manager.refresh()
+        self.manager.reportBurnStarted("b2", "c")
+        self.manager.queueIso("c", "c2", priority=5)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a", "b2": "c"})
+        self.assertEqual(self.pending(), ["c"])
+
+    def testSetMember(self):
+        """Set members are neither preempted nor preempting."""
+        self.manager.reportCompletion("b1", "a")
+        self.manager.queueSet(["a"], "c1")
+        self.manager.refresh()
+        self.manager.queueIso("b", "c2", priority=5)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a"})
+        self.manager.reportCompletion("b1", "a")
+        self.manager.queueIso("a", "c3")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "b"})
+        self.manager.queueSet(["a"], "c4", priority=9)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "b"})
+
+    def testTwin(self):
+        """The copies of a straggler are not preempted."""
+        self.manager.setSpeculative(True)
+        self.manager.registerBurner("b2", "127.0.0.1", 1, ["a", "b"])
+        self.manager.isosBeingBurnt.first()["started"] -= \
+            3 * DurationEstimator.defaultDuration
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a", "b2": "a"})
+        self.manager.queueIso("b", "c2", priority=5)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a", "b2": "a"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class PushAheadTest(ManagerTestCase):
+    """Tests the isos queued on the burners, and how idle burners steal
+    them."""
+
+    def setUp(self):
+        """Keeps one iso queued on each burner."""
+        ManagerTestCase.setUp(self)
+        self.manager.setPushAhead(1)
+
+    def jobs(self):
+        """Returns the dict burner name -> isos assigned to it."""
+        return dict([(burner.name, [job[0] for job in burner.jobs])
+                     for burner in self.manager.burners.values()])
+
+    def pending(self):
+        """Returns the names of the pending isos."""
+        return [isoData["iso"] for isoData in self.manager.pendingIsos]
+
+    def testFillLevels(self):
+        """The idle burners are served first, then each queue gets one more
+        iso, up to pushAhead."""
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b"])
+        self.manager.registerBurner("b2", "127.0.0.1", 1, ["a", "b"])
+        for iso in ("a", "b", "a", "b", "a"):
+            self.manager.queueIso(iso, "c1")
+        self.manager.refresh()
+        self.assertEqual(sorted(self.jobs().values()),
+                         [["a", "a"], ["b", "b"]])
+        self.assertEqual(self.pending(), ["a"])
+
+    def testNextJob(self):
+        """After a completion, the burner goes on with its queue."""
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b"])
+        self.manager.queueIso("a", "c1")
+        self.manager.queueIso("b", "c1")
+        self.manager.refresh()
+        self.manager.reportCompletion("b1", "a")
+        self.assertEqual(self.assigned(), {"b1": "b"})
+        self.assertEqual([isoData["iso"]
+                          for isoData in self.manager.isosBeingBurnt], ["b"])
+
+    def testQueueFull(self):
+        """A burner that answers "queue full" gets nothing more."""
+        self.manager.setPushAhead(3)
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a"])
+        self.manager.burners["b1"].queueSize = 1
+        for i in range(3):
+            self.manager.queueIso("a", "c1")
+        self.manager.refresh()
+        self.assertEqual(self.jobs(), {"b1": ["a", "a"]})
+        self.assertEqual(self.pending(), ["a"])
+
+    def testSteal(self):
+        """An idle burner takes the last waiting iso of the longest queue
+        it can burn."""
+        self.manager.setPushAhead(2)
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b", "c"])
+        for iso in ("a", "b", "c"):
+            self.manager.queueIso(iso, "c1")
+        self.manager.refresh()
+        self.assertEqual(self.jobs(), {"b1": ["a", "b", "c"]})
+        self.manager.registerBurner("b2", "127.0.0.1", 1, ["a", "b"])
+        self.manager.refresh()
+        self.assertEqual(self.jobs(), {"b1": ["a", "c"], "b2": ["b"]})
+        self.assertEqual(dict([(isoData["iso"], isoData["burner"])
+                               for isoData in self.manager.isosBeingBurnt]),
+                         {"a": "b1", "b": "b2", "c": "b1"})
+
+    def testReregister(self):
+        """A burner that registers again gives back all its jobs, in
+        order."""
+        self.manager.setPushAhead(2)
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b", "c"])
+        for iso in ("a", "b", "c"):
+            self.manager.queueIso(iso, "c1")
+        self.manager.refresh()
+        self.manager.queueIso("a", "c2")
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b", "c"])
+        self.assertEqual([(isoData["iso"], isoData["committer"])
+                          for isoData in self.manager.pendingIsos],
+                         [("a", "c1"), ("b", "c1"), ("c", "c1"),
+                          ("a", "c2")])
+        self.assertEqual(list(self.manager.isosBeingBurnt), [])
+
+
+    def testRemoveGone(self):
+        """removeIso() finds the job by its id, and does nothing if it is
+        not pending any more."""
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b"])
+        self.manager.queueIso("a", "c1")
+        self.manager.queueIso("a", "c2")
+        self.manager.queueIso("b", "c3")
+        (first, second, third) = self.manager.getPendingIsos(withSlack=True)
+        self.manager.refresh()
+        self.assertEqual(self.pending(), ["b"])
+        self.manager.removeIso(first)
+        self.assertEqual(self.jobs(), {"b1": ["a", "a"]})
+        self.manager.removeIso(third)
+        self.assertEqual(self.pending(), [])
+
+if __name__ == "__main__":
+    unittest.main()
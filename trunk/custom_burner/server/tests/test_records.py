@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+import cPickle
+
+from custom_burner import common
+from custom_burner.server.records import Job, toJob
+from custom_burner.server.tests.fakes import FakeBurner, ManagerTestCase
+
+
+class JobTest(unittest.TestCase):
+    """Tests that a records.Job reads like the dict it replaces."""
+
+    def testMapping(self):
+        """The fields that are set are read like the keys of a dict."""
+        job = Job(id=1, iso="a.iso", committer="me")
+        self.assertEqual(job["iso"], "a.iso")
+        self.assertEqual(job.get("burner"), None)
+        self.assertEqual(job.get("burner", "b1"), "b1")
+        self.assertTrue(job.has_key("id"))
+        self.assertFalse("burner" in job)
+        self.assertEqual(job, {"id": 1, "iso": "a.iso", "committer": "me"})
+        self.assertEqual(dict(job, slack=5)["slack"], 5)
+        self.assertRaises(KeyError, job.__setitem__, "unknown", True)
+
+    def testChanges(self):
+        """Fields can be removed, and copies do not share them."""
+        job = Job(id=1, probe=True)
+        copy = job.copy()
+        self.assertEqual(job.pop("probe"), True)
+        self.assertEqual(job.pop("probe", False), False)
+        self.assertRaises(KeyError, job.pop, "probe")
+        self.assertRaises(KeyError, job.__delitem__, "probe")
+        self.assertTrue(copy["probe"])
+        job.setdefault("avoid", []).append("b1")
+        self.assertEqual(job["avoid"], ["b1"])
+        self.assertEqual(len(job), 2)
+
+
+class JobPickleTest(unittest.TestCase):
+    """Tests the bit mask records.Job is pickled with."""
+
+    def testState(self):
+        """The state is the mask of the fields that are set, followed by
+        their values in the order of FIELDS."""
+        job = Job(iso="a.iso", id=7, notBefore=12.5)
+        mask = 1 << Job.FIELDS.index("id") | \
+               1 << Job.FIELDS.index("iso") | \
+               1 << Job.FIELDS.index("notBefore")
+        self.assertEqual(job.__getstate__(), (mask, 7, "a.iso", 12.5))
+        self.assertEqual(Job().__getstate__(), (0, ))
+
+    def testRoundTrip(self):
+        """Every protocol gives back the same fields, and no others."""
+        job = Job(id=3, date="2008-01-01 10:00", iso="a.iso",
+                  committer="me", priority=2, deadline=None,
+                  selector=(), avoid=["b1", "b2"], parked=True)
+        for protocol in range(cPickle.HIGHEST_PROTOCOL + 1):
+            copy = cPickle.loads(cPickle.dumps(job, protocol))
+            self.assertTrue(isinstance(copy, Job))
+            self.assertEqual(copy, job)
+            self.assertEqual(copy.keys(), job.keys())
+            self.assertFalse(copy.has_key("burner"))
+            self.assertRaises(KeyError, copy.__getitem__, "burner")
+
+    def testFalseValues(self):
+        """Fields set to None, 0 or empty values are kept as set."""
+        job = Job(id=0, deadline=None, retries=0, avoid=[])
+        copy = cPickle.loads(cPickle.dumps(job, cPickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copy.items(), [("id", 0), ("deadline", None),
+                                        ("retries", 0), ("avoid", [])])
+
+    def testSharedNames(self):
+        """The names of a job read back are shared with the other jobs."""
+        name = "".join(["committer", "X"])
+        job = cPickle.loads(cPickle.dumps(Job(id=1, committer=name),
+                                          cPickle.HIGHEST_PROTOCOL))
+        self.assertTrue(job["committer"] is intern("committerX"))
+
+    def testOlderFields(self):
+        """A state written before the last fields existed is read back:
+        the mask does not have their bits."""
+        job = Job()
+        job.__setstate__((1 | 1 << 2, 4, "a.iso"))
+        self.assertEqual(job, {"id": 4, "iso": "a.iso"})
+
+    def testToJob(self):
+        """The dicts of older versions become jobs, without the fields
+        this version does not know."""
+        job = toJob({"id": 1, "iso": "a.iso", "unknown": True})
+        self.assertTrue(isinstance(job, Job))
+        self.assertEqual(job, {"id": 1, "iso": "a.iso"})
+        self.assertTrue(toJob(job) is job)
+
+
+class SharedCatalogTest(ManagerTestCase):
+    """Tests the catalogs that the burners share."""
+
+    def setUp(self):
+        """Registers b1 and b2 with the same catalog."""
+        ManagerTestCase.setUp(self)
+        for name in ("b1", "b2"):
+            self.manager.registerBurner(name, "127.0.0.1", 1, ["a", "b"],
+                                        {"a": 10})
+
+    def testShared(self):
+        """Burners with the same catalog keep it once, and with another
+        catalog they do not."""
+        burners = self.manager.burners
+        self.assertTrue(burners["b1"].isos is burners["b2"].isos)
+        self.assertTrue(burners["b1"].isoSizes is burners["b2"].isoSizes)
+        self.manager.registerBurner("b3", "127.0.0.1", 1, ["a", "b"],
+                                    {"a": 11})
+        self.assertFalse(burners["b3"].isos is burners["b1"].isos)
+
+    def testSizes(self):
+        """The class of an iso comes from the largest size reported by
+        the burners that are left."""
+        self.manager.registerBurner("b3", "127.0.0.1", 1, ["a"],
+                                    {"a": 800000000})
+        self.assertEqual(self.manager.isoClasses["a"],
+                         common.MEDIA_CLASS_DVD)
+        self.manager.reportClosingBurner("b3")
+        self.assertEqual(self.manager.isoClasses["a"], common.MEDIA_CLASS_CD)
+        self.manager.reportClosingBurner("b1")
+        self.assertEqual(self.manager.isoClasses["a"], common.MEDIA_CLASS_CD)
+        self.manager.reportClosingBurner("b2")
+        self.assertFalse(self.manager.isoClasses.has_key("a"))
+
+    def testReload(self):
+        """The burners come back with their class and shared names."""
+        self.reload()
+        (b1, b2) = (self.manager.burners["b1"], self.manager.burners["b2"])
+        self.assertTrue(isinstance(b1, FakeBurner))
+        self.assertEqual(b1.isos, ("a", "b"))
+        self.assertTrue(b1.isos is b2.isos)
+        self.assertTrue(b1.isos[0] is intern("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
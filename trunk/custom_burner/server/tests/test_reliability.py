@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+
+from custom_burner.server.reliability import ReliabilityTracker
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class ReliabilityTrackerTest(unittest.TestCase):
+    """Tests the failure statistics and the quarantine decisions."""
+
+    def setUp(self):
+        """Creates a tracker."""
+        self.tracker = ReliabilityTracker()
+
+    def testRates(self):
+        """New burners get the prior rate, and the old outcomes decay."""
+        tracker = self.tracker
+        self.assertAlmostEqual(tracker.failureRate("b1", 0),
+                               tracker.priorRate)
+        tracker.record("b1", False, now=0)
+        tracker.record("b1", True, now=0)
+        rate = tracker.failureRate("b1", 0)
+        self.assertAlmostEqual(rate, (1 + tracker.priorRate * 2) / 4)
+        later = tracker.failureRate("b1", 10 * tracker.halfLife)
+        self.assertTrue(abs(later - tracker.priorRate) <
+                        abs(rate - tracker.priorRate) / 100)
+
+    def testQuarantine(self):
+        """Enough failures quarantine a burner; only a successful probe
+        requalifies it."""
+        tracker = self.tracker
+        for i in range(3):
+            self.assertEqual(tracker.record("b1", True, now=0), None)
+        self.assertEqual(tracker.record("b1", False, now=0), None)
+        self.assertFalse(tracker.isQuarantined("b1"))
+        self.assertEqual(tracker.record("b1", False, now=0), None)
+        self.assertEqual(tracker.record("b1", False, now=0), "quarantined")
+        self.assertTrue(tracker.isQuarantined("b1"))
+        self.assertFalse(tracker.probeDue("b1", tracker.probeInterval - 1))
+        self.assertTrue(tracker.probeDue("b1", tracker.probeInterval))
+        # An iso given before the quarantine
+        self.assertEqual(tracker.record("b1", True, now=10), None)
+        self.assertTrue(tracker.isQuarantined("b1"))
+        tracker.probeStarted("b1", 100)
+        self.assertFalse(tracker.probeDue("b1", 100 +
+                                          tracker.probeInterval - 1))
+        # A failed probe postpones the next one
+        self.assertEqual(tracker.record("b1", False, True, now=200), None)
+        self.assertFalse(tracker.probeDue("b1", 200 +
+                                          tracker.probeInterval - 1))
+        self.assertEqual(tracker.record("b1", True, True, now=300),
+                         "requalified")
+        self.assertFalse(tracker.isQuarantined("b1"))
+        self.assertTrue(tracker.failureRate("b1", 300) < tracker.priorRate)
+
+
+class QuarantineTest(ManagerTestCase):
+    """Tests how the manager treats unreliable burners."""
+
+    def setUp(self):
+        """Registers b1 and b2, which have the same isos, and makes b1
+        fail enough to be quarantined."""
+        ManagerTestCase.setUp(self)
+        self.manager.retryDelay = 0
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a"])
+        self.manager.registerBurner("b2", "127.0.0.1", 1, ["a"])
+        self.tracker = self.manager.reliability
+
+    def quarantineB1(self):
+        """Records enough failures of b1 to quarantine it."""
+        for i in range(6):
+            self.tracker.record("b1", False)
+        self.assertTrue(self.tracker.isQuarantined("b1"))
+
+    def makeProbeDue(self):
+        """Makes b1 due for a probe."""
+        self.tracker.quarantined["b1"] -= self.tracker.probeInterval
+
+    def testRanking(self):
+        """The burner that fails more is tried last."""
+        for i in range(2):
+            self.tracker.record("b1", False)
+        self.manager.queueIso("a", "c1")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b2": "a"})
+
+    def testQuarantined(self):
+        """A quarantined burner gets a single probe iso when it is due."""
+        self.quarantineB1()
+        for committer in ("c1", "c2", "c3"):
+            self.manager.queueIso("a", committer)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b2": "a"})
+        self.makeProbeDue()
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a", "b2": "a"})
+        self.manager.setPushAhead(2)
+        self.manager.refresh()
+        self.assertEqual(len(self.manager.burners["b1"].jobs), 1)
+        self.assertEqual([isoData.get("probe")
+                          for isoData in self.manager.isosBeingBurnt
+                          if isoData["burner"] == "b1"], [True])
+        self.manager.reportCompletion("b1", "a")
+        self.assertFalse(self.tracker.isQuarantined("b1"))
+        self.assertEqual([isoData.get("probe")
+                          for isoData in self.manager.getBurntIsos()], [None])
+
+    def testFailedProbe(self):
+        """A failed probe keeps the burner in quarantine."""
+        self.quarantineB1()
+        self.makeProbeDue()
+        self.manager.queueIso("a", "c1")
+        self.manager.queueIso("a", "c2")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a", "b2": "a"})
+        self.manager.reportBurningError("b1", "a")
+        self.assertTrue(self.tracker.isQuarantined("b1"))
+        self.assertFalse(self.tracker.probeDue("b1"))
+        self.assertFalse(self.manager.pendingIsos.first().has_key("probe"))
+
+    def testOldIso(self):
+        """An iso given before the quarantine does not requalify the burner
+        when it is burnt."""
+        self.manager.queueIso("a", "c1")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a"})
+        self.quarantineB1()
+        self.manager.reportCompletion("b1", "a")
+        self.assertTrue(self.tracker.isQuarantined("b1"))
+
+    def testSaved(self):
+        """The statistics are saved with the state: the outcomes are
+        replayed from the journal, and written with the checkpoints."""
+        self.manager.reportClosingBurner("b2")
+        self.manager.queueIso("a", "c1")
+        while not self.tracker.isQuarantined("b1"):
+            self.manager.refresh()
+            self.manager.reportBurningError("b1", "a")
+        self.reload()
+        self.assertTrue(self.manager.reliability.isQuarantined("b1"))
+        self.manager.close() # Writes a checkpoint
+        self.reload()
+        self.assertTrue(self.manager.reliability.isQuarantined("b1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+
+from custom_burner.server import scheduler
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class FixedDurations:
+    """Durations that do not depend on the iso: each burner takes the
+    number of seconds given to the constructor."""
+
+    def __init__(self, seconds):
+        """seconds: dict burner name -> seconds to burn any iso."""
+        self.seconds = seconds
+
+    def expected(self, iso, burnerName=None):
+        """Returns the duration of burnerName."""
+        return self.seconds[burnerName]
+
+    def speed(self, burnerName):
+        """Faster burners take less time."""
+        return 1.0 / self.seconds[burnerName]
+
+
+class BadScheduler(scheduler.Scheduler):
+    """Gives every iso to the first burner, whether it can take them or
+    not."""
+
+    name = "bad"
+
+    def assign(self, view):
+        """Returns a pair for each job, all with the same burner."""
+        return [(i, view.burners[0]) for i in range(len(view.jobs))]
+
+
+class SchedulerTest(unittest.TestCase):
+    """Tests the schedulers on views built by hand."""
+
+    def view(self, jobs, burners, seconds, tiers=None, preferred=None):
+        """Returns a view where every burner has every iso."""
+        holders = {}
+        for job in jobs:
+            holders[job["iso"]] = list(burners)
+        if preferred is None:
+            preferred = [None] * len(jobs)
+        return scheduler.SchedulerView(jobs, burners, holders, preferred,
+                                       FixedDurations(seconds), 1000.0,
+                                       tiers=tiers)
+
+    def testCreate(self):
+        """Schedulers are found by short name or by the full name of their
+        class."""
+        self.assertTrue(isinstance(scheduler.createScheduler("edf"),
+                                   scheduler.EdfScheduler))
+        self.assertTrue(isinstance(scheduler.createScheduler(
+            "custom_burner.server.scheduler.MatchingScheduler"),
+                                   scheduler.MatchingScheduler))
+        self.assertRaises(ValueError, scheduler.createScheduler, "nope")
+        self.assertRaises(ValueError, scheduler.createScheduler,
+                          "custom_burner.server.scheduler.Nope")
+        self.assertRaises(ValueError, scheduler.createScheduler,
+                          "no_such_module.Scheduler")
+
+    def testFifoSkipsAvoided(self):
+        """Fifo gives each job the first burner it has not failed on."""
+        view = self.view([{"iso": "a", "avoid": ["b1"]}, {"iso": "a"}],
+                         ["b1", "b2"], {"b1": 10, "b2": 10})
+        self.assertEqual(scheduler.FifoScheduler().assign(view),
+                         [(0, "b2"), (1, "b1")])
+
+    def testMatchingRareIso(self):
+        """Matching keeps the only burner of a rare iso for it."""
+        jobs = [{"iso": "common"}, {"iso": "rare"}]
+        holders = {"common": ["b1", "b2"], "rare": ["b1"]}
+        view = scheduler.SchedulerView(jobs, ["b1", "b2"], holders,
+                                       [None, None], FixedDurations({}), 0)
+        self.assertEqual(sorted(scheduler.MatchingScheduler().assign(view)),
+                         [(0, "b2"), (1, "b1")])
+
+    def testEdfSlowestInTime(self):
+        """An iso that makes its deadline goes to the slowest burner that
+        makes it, within the most preferred tier."""
+        seconds = {"fast": 100, "slow": 500, "slower": 800, "late": 5000}
+        job = {"iso": "a", "deadline": 1000.0 + 1000}
+        tiers = {"fast": (0,), "slow": (0,), "slower": (1,), "late": (0,)}
+        view = self.view([job], ["fast", "slower", "slow", "late"], seconds,
+                         tiers)
+        self.assertEqual(scheduler.EdfScheduler().assign(view),
+                         [(0, "slow")])
+        self.assertEqual(view.atRisk(), [])
+        # Without tiers every burner is equally preferred
+        view = self.view([job], ["fast", "slower", "slow", "late"], seconds)
+        self.assertEqual(scheduler.EdfScheduler().assign(view),
+                         [(0, "slower")])
+
+    def testEdfAtRisk(self):
+        """An iso that misses its deadline everywhere goes to the fastest
+        burner, whatever its tier, and is reported."""
+        seconds = {"fast": 100, "slow": 500}
+        job = {"iso": "a", "deadline": 1000.0 + 50}
+        view = self.view([job], ["slow", "fast"], seconds,
+                         {"slow": (0,), "fast": (1,)})
+        self.assertEqual(scheduler.EdfScheduler().assign(view),
+                         [(0, "fast")])
+        self.assertEqual(view.atRisk(), [0])
+
+    def testEdfOrder(self):
+        """The earliest deadline is served first; no deadline comes
+        last."""
+        jobs = [{"iso": "a"}, {"iso": "b", "deadline": 5000.0},
+                {"iso": "c", "deadline": 3000.0}]
+        view = self.view(jobs, ["b1"], {"b1": 10})
+        self.assertEqual(scheduler.EdfScheduler().assign(view), [(2, "b1")])
+        self.assertEqual([job["iso"] for job in
+                          scheduler.EdfScheduler().order(jobs)],
+                         ["c", "b", "a"])
+
+
+class ManagerSchedulerTest(ManagerTestCase):
+    """Tests how the manager uses its scheduler."""
+
+    def testInvalidPairs(self):
+        """The manager ignores the pairs that give a burner more than one
+        iso, or an iso it does not have."""
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a"])
+        self.manager.registerBurner("b2", "127.0.0.1", 1, ["b"])
+        self.manager.setScheduler(BadScheduler())
+        self.assertEqual(self.manager.dispatchMode, "bad")
+        for iso in ("a", "b", "a"):
+            self.manager.queueIso(iso, "c1")
+        self.manager.refresh()
+        # b1 never got "b"
+        for (iso, committer) in self.manager.burners["b1"].jobs:
+            self.assertEqual(iso, "a")
+        self.assertEqual(self.manager.burners["b2"].jobs, [])
+
+    def testUnknownMode(self):
+        """Unknown dispatch modes are refused, and the scheduler is kept."""
+        self.assertRaises(ValueError, self.manager.setDispatchMode, "nope")
+        self.assertEqual(self.manager.dispatchMode, "fifo")
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class SetDispatchTest(ManagerTestCase):
+    """Tests the sets of isos that are started together."""
+
+    def pending(self):
+        """Returns the (iso, committer) pairs of the pending isos."""
+        return [(isoData["iso"], isoData["committer"])
+                for isoData in self.manager.getPendingIsos()]
+
+    def testTogether(self):
+        """The members start together on different burners, and the set
+        is forgotten when all of them are burnt."""
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b"])
+        self.manager.registerBurner("b2", "127.0.0.1", 1, ["a", "b"])
+        setId = self.manager.queueSet(["a", "a"], "c1")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a", "b2": "a"})
+        self.assertEqual([(entry["set"], entry["isos"], entry["burnt"])
+                          for entry in self.manager.getSets()],
+                         [(setId, ["a", "a"], 0)])
+        self.manager.reportCompletion("b1", "a")
+        self.assertEqual(self.manager.getSets()[0]["burnt"], 1)
+        self.manager.reportCompletion("b2", "a")
+        self.assertEqual(self.manager.getSets(), [])
+
+    def testWaitAndReserve(self):
+        """A set that cannot start yet keeps its members back, and the
+        idle burners it needs are not given to single isos."""
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "x"])
+        self.manager.registerBurner("b2", "127.0.0.1", 1, ["b", "x"])
+        self.manager.queueIso("b", "c0")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b2": "b"})
+        self.manager.queueSet(["a", "b"], "c1")
+        self.manager.queueIso("x", "c2")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b2": "b"})
+        self.assertEqual(self.pending(), [("a", "c1"), ("b", "c1"),
+                                          ("x", "c2")])
+        self.manager.reportCompletion("b2", "b")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a", "b2": "b"})
+        self.assertEqual(self.pending(), [("x", "c2")])
+
+    def testTooFewBurners(self):
+        """A set that the burners could never start together is
+        dispatched one member at a time."""
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a"])
+        self.manager.queueSet(["a", "a"], "c1")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a"})
+        self.assertEqual(self.pending(), [("a", "c1")])
+
+    def testRemoveMember(self):
+        """Removing the members that are left completes the set."""
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a"])
+        self.manager.queueSet(["a", "b"], "c1")
+        for isoData in self.manager.getPendingIsos():
+            self.manager.removeIso(isoData)
+        self.assertEqual(self.manager.getSets(), [])
+        self.assertEqual(self.pending(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import os
+import time
+import unittest
+import random
+
+from custom_burner import common
+from custom_burner.server.snapshot import QueueView, Snapshot
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class QueueViewTest(unittest.TestCase):
+    """Tests that snapshot.QueueView follows the operations of the
+    manager, and that its chunks share what did not change."""
+
+    def setUp(self):
+        """Makes the chunks short, so that they are split and merged."""
+        self.chunkSize = QueueView.chunkSize
+        QueueView.chunkSize = 2
+
+    def tearDown(self):
+        """Restores the length of the chunks."""
+        QueueView.chunkSize = self.chunkSize
+
+    def pending(self, view):
+        """Returns the pending jobs that view published."""
+        return list(Snapshot(1, view.published).pendingIsos)
+
+    def testRandomQueue(self):
+        """Random insertions, removals and updates give the same queue as
+        a list."""
+        for seed in range(10):
+            generator = random.Random(seed)
+            view = QueueView()
+            expected = []
+            for step in range(300):
+                action = generator.random()
+                if action < 0.5 or not expected:
+                    previous = generator.choice([None] + expected)
+                    job = dict(id=step, iso="a.iso")
+                    if previous is None:
+                        view.apply(("queued", job, None))
+                        expected.insert(0, job)
+                    else:
+                        view.apply(("queued", job, previous["id"]))
+                        expected.insert(expected.index(previous) + 1, job)
+                elif action < 0.8:
+                    job = generator.choice(expected)
+                    expected.remove(job)
+                    view.apply(("removed", job["id"]))
+                else:
+                    job = generator.choice(expected)
+                    newJob = dict(job, priority=step)
+                    expected[expected.index(job)] = newJob
+                    view.apply(("updated", newJob))
+                pending = self.pending(view)
+                self.assertEqual([job["id"] for job in pending],
+                                 [job["id"] for job in expected])
+                self.assertEqual(pending, expected)
+                for chunk in view.published[1]:
+                    self.assertTrue(0 < len(chunk) <= 4)
+
+    def testMoves(self):
+        """The jobs move between the queues as the operations say."""
+        view = QueueView()
+        job = dict(id=1, iso="a.iso")
+        view.apply(("queued", job, None))
+        view.apply(("failed", dict(job, notBefore=5.0)))
+        (backingOff, chunks, parked, beingBurnt, burnt, sets) = \
+                     view.published
+        self.assertEqual([job["notBefore"] for job in backingOff], [5.0])
+        self.assertEqual(chunks, ())
+        view.apply(("parked", job))
+        (backingOff, chunks, parked, beingBurnt, burnt, sets) = \
+                     view.published
+        self.assertEqual(backingOff, ())
+        self.assertEqual(parked, (dict(job, parked=True), ))
+        self.assertFalse(job.has_key("parked"))
+        view.apply(("assigned", dict(job, burner="b1")))
+        view.apply(("updated", dict(job, burner="b1", started=1.0)))
+        (backingOff, chunks, parked, beingBurnt, burnt, sets) = \
+                     view.published
+        self.assertEqual(parked, ())
+        self.assertEqual(beingBurnt, (dict(job, burner="b1", started=1.0), ))
+        view.apply(("completed", 1))
+        view.addBurnt(dict(job, finished=2.0))
+        self.assertEqual(view.published[3], ())
+        self.assertEqual(len(view.published[4]), 1)
+        view.forgetBurnt(1)
+        self.assertEqual(view.published[4], ())
+
+    def testSharing(self):
+        """A change replaces one chunk, and a snapshot of the same
+        publication shares the tuples of the previous one."""
+        view = QueueView()
+        for i in range(20):
+            view.apply(("queued", dict(id=i, iso="a.iso"), i - 1))
+        before = view.published[1]
+        view.apply(("removed", 0))
+        after = view.published[1]
+        self.assertEqual(len(before), len(after))
+        self.assertFalse(before[0] is after[0])
+        for i in range(1, len(before)):
+            self.assertTrue(before[i] is after[i])
+        first = Snapshot(1, view.published)
+        second = Snapshot(2, view.published, previous=first)
+        self.assertTrue(second.pendingIsos is first.pendingIsos)
+        view.apply(("removed", 1))
+        third = Snapshot(3, view.published, previous=second)
+        self.assertEqual(len(third.pendingIsos), 18)
+
+    def testSets(self):
+        """The sets are described when they change, in order of id."""
+        view = QueueView()
+        setData = {"date": "d", "committer": "me", "isos": ["a", "b"],
+                   "missing": set([0, 1])}
+        view.apply(("set", 2, setData))
+        view.apply(("set", 1, setData))
+        setData["missing"].discard(0)
+        self.assertEqual([entry["burnt"] for entry in view.published[5]],
+                         [0, 0])
+        view.apply(("set", 2, setData))
+        self.assertEqual([(entry["set"], entry["burnt"])
+                          for entry in view.published[5]], [(1, 0), (2, 1)])
+        view.apply(("set", 1, None))
+        self.assertEqual([entry["set"] for entry in view.published[5]], [2])
+
+
+
+class ManagerSnapshotTest(ManagerTestCase):
+    """Tests the versions and the snapshots of BurnerManager."""
+
+    def setUp(self):
+        """Registers b1, that has "a" and "b", and queues "a" and "b"."""
+        ManagerTestCase.setUp(self)
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b"])
+        self.manager.queueIso("a", "c1")
+        self.manager.queueIso("b", "c2")
+
+    def testShared(self):
+        """Until something changes, the readers share one snapshot, and
+        its entries are copies of the jobs."""
+        first = self.manager.getSnapshot()
+        self.assertTrue(self.manager.getSnapshot() is first)
+        self.assertFalse(self.manager.changedSince(first.version))
+        self.assertEqual([isoData["iso"] for isoData in first.pendingIsos],
+                         ["a", "b"])
+        self.assertFalse(first.pendingIsos[0] is
+                         self.manager.pendingIsos.first())
+        self.assertEqual(first.isos, ("a", "b"))
+        self.manager.refresh()
+        self.assertTrue(self.manager.changedSince(first.version))
+        second = self.manager.getSnapshot()
+        self.assertEqual([isoData["iso"] for isoData in second.pendingIsos],
+                         ["b"])
+        self.assertEqual([isoData["iso"]
+                          for isoData in second.isosBeingBurnt], ["a"])
+        self.assertEqual([burner["iso"] for burner in second.burners], ["a"])
+        # The old one does not change
+        self.assertEqual(len(first.pendingIsos), 2)
+
+    def testHeartbeat(self):
+        """A heartbeat, a media state that did not change and a refresh
+        that dispatches nothing leave the snapshot as it is."""
+        self.manager.refresh()
+        version = self.manager.version
+        journalFileName = self.manager.journalFileName
+        os.utime(journalFileName, (0, 0))
+        self.manager.renewLease("b1")
+        self.manager.reportMediaState("b1", self.manager.burners["b1"].media)
+        self.manager.refresh()
+        self.assertEqual(self.manager.version, version)
+        self.assertEqual(os.stat(journalFileName).st_mtime, 0)
+        self.manager.reportMediaState("b1", common.MEDIA_BLANK)
+        self.assertNotEqual(self.manager.version, version)
+        self.assertEqual(os.stat(journalFileName).st_mtime, 0)
+        self.assertEqual([burner["media"]
+                          for burner in self.manager.getBurners()],
+                         [common.MEDIA_BLANK])
+
+    def testSlack(self):
+        """The slack times are projected again only when the queues
+        change, or after slackRefresh seconds."""
+        self.manager.queueIso("a", "c3", deadline=time.time() + 3600)
+        slacks = [isoData["slack"]
+                  for isoData in self.manager.getPendingIsos(True)]
+        self.assertEqual(slacks[:2], [None, None])
+        self.assertTrue(slacks[2] is not None)
+        self.manager.durations.record("a", "b1", 1000)
+        self.assertEqual([isoData["slack"] for isoData
+                          in self.manager.getPendingIsos(True)], slacks)
+        self.manager.slackRefresh = 0
+        self.assertTrue(self.manager.getPendingIsos(True)[2]["slack"] <
+                        slacks[2])
+
+    def testWriting(self):
+        """The snapshot shows when a burner starts writing."""
+        self.manager.refresh()
+        version = self.manager.version
+        self.manager.reportBurnStarted("b1", "a")
+        self.assertNotEqual(self.manager.version, version)
+        self.assertTrue(self.manager.getIsosBeingBurnt()[0].has_key(
+            "writing"))
+
+    def testBurnt(self):
+        """The burnt isos of the snapshot are the same before and after
+        they are written."""
+        self.manager.refresh()
+        self.manager.reportCompletion("b1", "a")
+        burnt = self.manager.getBurntIsos()
+        self.assertEqual([isoData["iso"] for isoData in burnt], ["a"])
+        self.assertEqual(self.manager.getSnapshot().burnt, ())
+        self.assertEqual(self.manager.getBurntIsos(), burnt)
+
+if __name__ == "__main__":
+    unittest.main()
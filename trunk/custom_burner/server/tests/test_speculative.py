@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+
+from custom_burner.server.estimator import DurationEstimator
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class SpeculativeTest(ManagerTestCase):
+    """Tests the backup copies of the isos that are taking too long."""
+
+    def setUp(self):
+        """Starts "a" on b1, then registers the idle b2, which has it too."""
+        ManagerTestCase.setUp(self)
+        self.manager.setSpeculative(True)
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a"])
+        self.manager.queueIso("a", "c1")
+        self.manager.refresh()
+        self.manager.registerBurner("b2", "127.0.0.1", 1, ["a", "b"])
+
+    def makeLate(self):
+        """Makes the burn on b1 look like a straggler."""
+        self.manager.isosBeingBurnt.first()["started"] -= \
+            3 * DurationEstimator.defaultDuration
+
+    def testOnlyStragglers(self):
+        """Isos burning for the expected time get no backup."""
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a"})
+
+    def testOnlyWhenIdle(self):
+        """No backup is started while some iso is pending."""
+        self.makeLate()
+        self.manager.setSpeculative(False)
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a"})
+        self.manager.setSpeculative(True)
+        self.manager.queueIso("b", "c2")
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a", "b2": "b"})
+
+    def testFirstSuccessWins(self):
+        """The first copy completed goes into the history, the other one is
+        ignored."""
+        self.makeLate()
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a", "b2": "a"})
+        self.manager.reportCompletion("b2", "a")
+        self.assertEqual([isoData["burner"]
+                          for isoData in self.manager.getBurntIsos()], ["b2"])
+        self.manager.reportCompletion("b1", "a")
+        self.assertEqual(len(self.manager.getBurntIsos()), 1)
+        self.assertEqual(self.assigned(), {})
+
+    def testErrorOnOneCopy(self):
+        """An error does not requeue the iso while the other copy is still
+        being burnt."""
+        self.makeLate()
+        self.manager.refresh()
+        self.manager.reportBurningError("b1", "a")
+        self.assertEqual(len(self.manager.pendingIsos), 0)
+        self.assertEqual(self.assigned(), {"b2": "a"})
+        self.manager.reportBurningError("b2", "a")
+        self.assertEqual([isoData["iso"]
+                          for isoData in self.manager.getPendingIsos()],
+                         ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
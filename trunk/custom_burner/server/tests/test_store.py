@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+import os
+import time
+import logging
+import sqlite3
+
+from custom_burner.server import burner_manager
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class PickleSimulationTest(ManagerTestCase):
+    """Drives a manager through the life of a few jobs, restarting it after
+    each step: what it saved must always rebuild the same state."""
+
+    def setUp(self):
+        """Registers b1, that has "a" and "b", and b2, that has "a" and
+        "c", with the sizes of its isos."""
+        ManagerTestCase.setUp(self)
+        logging.getLogger("Journal").setLevel(logging.CRITICAL)
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b"])
+        self.manager.registerBurner("b2", "127.0.0.1", 2, ["a", "c"],
+                                    {"a": 1000, "c": 2000, "z": 3000})
+
+    def testSimulation(self):
+        """Register, queue, refresh, error, completion, set and restart."""
+        self.assertRestored()
+        self.assertEqual(self.manager.burners["b2"].isoSizes["z"], 3000)
+        for (iso, committer) in (("a", "c1"), ("b", "c1"), ("x", "c2"),
+                                 ("c", "c2")):
+            self.manager.queueIso(iso, committer)
+        self.assertRestored()
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"b1": "a", "b2": "c"})
+        self.assertRestored()
+        # Back in the queue, waiting for its backoff time
+        self.manager.retryDelay = 0.05
+        self.manager.reportBurningError("b1", "a")
+        self.assertEqual(len(self.manager.backingOffIsos), 1)
+        self.assertRestored()
+        self.manager.reportCompletion("b2", "c")
+        self.manager.queueSet(["a", "c"], "c3")
+        self.assertRestored()
+        time.sleep(0.1)
+        self.assertEqual(self.manager.wakeRetries(), 1)
+        for i in range(5):
+            self.manager.refresh()
+            self.assertRestored()
+            for (name, iso) in self.assigned().items():
+                self.manager.reportCompletion(name, iso)
+                self.assertRestored()
+        self.assertEqual(self.manager.sets, {})
+        self.assertEqual(list(self.manager.pendingIsos), [])
+        self.assertEqual(sorted([isoData["iso"] for isoData
+                                 in self.manager.getBurntIsos()]),
+                         ["a", "a", "b", "c", "c"])
+        # "x" waits for a burner that has it
+        self.assertEqual(self.manager.parkedIsos.keys(), ["x"])
+        self.manager.registerBurner("b3", "127.0.0.1", 3, ["x"])
+        self.assertEqual(self.manager.parkedIsos, {})
+        self.assertRestored()
+        self.manager.reportClosingBurner("b2")
+        self.assertRestored()
+        expected = self.state()
+        self.manager.close()
+        self.reload()
+        state = self.state()
+        self.assertEqual(state["burners"], {})
+        for key in ("pending", "backingOff", "burnt", "sets", "nextJobId",
+                    "statistics"):
+            self.assertEqual(state[key], expected[key])
+
+
+class SqliteSimulationTest(PickleSimulationTest):
+    """The same simulation, with the state saved in SQLite."""
+
+    storeBackend = "sqlite"
+
+
+class SqliteStoreTest(ManagerTestCase):
+    """Tests what is specific to the SQLite store."""
+
+    storeBackend = "sqlite"
+
+    def setUp(self):
+        """Registers b1, that has "a" and "b"."""
+        ManagerTestCase.setUp(self)
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b"])
+
+    def burn(self, iso, committer):
+        """Queues an iso, and lets b1 burn it."""
+        self.manager.queueIso(iso, committer)
+        self.manager.refresh()
+        self.manager.reportCompletion("b1", iso)
+
+    def query(self, statement):
+        """Returns the rows that a query reads from the database."""
+        connection = sqlite3.connect(self.manager.sqliteFileName)
+        try:
+            return connection.execute(statement).fetchall()
+        finally:
+            connection.close()
+
+    def testHistory(self):
+        """The burnt isos are forgotten once written, and read back from
+        the history table with filters."""
+        self.burn("a", "c1")
+        self.burn("b", "c2")
+        self.burn("a", "c2")
+        self.assertEqual(self.manager.isosBurnt, [])
+        self.assertEqual(self.query("SELECT count(*) FROM history"), [(3, )])
+        self.assertEqual([(isoData["iso"], isoData["committer"])
+                          for isoData in self.manager.getBurntIsos()],
+                         [("a", "c1"), ("b", "c2"), ("a", "c2")])
+        self.assertEqual([isoData["committer"] for isoData
+                          in self.manager.getBurntIsos(iso="a")],
+                         ["c1", "c2"])
+        self.assertEqual([isoData["iso"] for isoData
+                          in self.manager.getBurntIsos(committer="c2",
+                                                       limit=1)], ["a"])
+        self.assertEqual(self.manager.getBurntIsos(burner="b2"), [])
+        self.assertEqual(self.manager.getBurntIsos(since=time.time() + 60),
+                         [])
+
+    def testLinkedQueue(self):
+        """The rows of the pending queue are linked in its order, wherever
+        the jobs are put."""
+        for iso in ("a", "b", "a"):
+            self.manager.queueIso(iso, "c1")
+        self.manager.queueIso("b", "c2", priority=5)
+        self.manager.refresh()
+        self.manager.reportBurningError("b1", "b")
+        self.manager.retryDelay = 0
+        self.assertRestored()
+        rows = self.query("SELECT id, previous FROM jobs WHERE place = 0")
+        following = dict([(previous, jobId) for (jobId, previous) in rows])
+        queue = []
+        jobId = following.get(None)
+        while jobId is not None:
+            queue.append(jobId)
+            jobId = following.get(jobId)
+        self.assertEqual(queue, [isoData["id"] for isoData
+                                 in self.manager.pendingIsos])
+
+    def testCatalog(self):
+        """The catalog is only in its table, and is replaced when the
+        burner registers again."""
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["c"], {"d": 10})
+        self.assertEqual(sorted(self.query("SELECT iso, size, listed FROM "
+                                           "catalog")),
+                         [("c", None, 1), ("d", 10, 0)])
+        self.reload()
+        burner = self.manager.burners["b1"]
+        self.assertEqual((burner.isos, burner.isoSizes),
+                         (("c", ), {"d": 10}))
+        self.manager.reportClosingBurner("b1")
+        self.assertEqual(self.query("SELECT count(*) FROM catalog"), [(0, )])
+
+    def testImport(self):
+        """The first time, the state saved by the pickle store is imported,
+        with its burnt isos."""
+        self.manager.close()
+        os.remove(self.manager.sqliteFileName)
+        burner_manager.BurnerManager.storeBackend = "pickle"
+        self.reload()
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b"])
+        self.burn("a", "c1")
+        self.manager.queueIso("b", "c2")
+        self.manager.queueIso("x", "c3")
+        expected = self.state()
+        burner_manager.BurnerManager.storeBackend = "sqlite"
+        self.reload()
+        self.assertEqual(self.state(), expected)
+        # Written into the tables
+        self.assertEqual(self.query("SELECT count(*) FROM jobs"), [(2, )])
+        self.assertEqual(self.query("SELECT iso FROM history"), [("a", )])
+        self.assertRestored()
+
+
+if __name__ == "__main__":
+    unittest.main()
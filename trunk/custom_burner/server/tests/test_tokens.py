@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+SHARED = "nfs:server:/isos"
+
+
+class ReadTokensTest(ManagerTestCase):
+    """Tests the limit on the burners reading from the same storage."""
+
+    def setUp(self):
+        """Registers s1 and s2, which read from SHARED, and the local l1,
+        with one read token for each storage."""
+        ManagerTestCase.setUp(self)
+        self.manager.setReadTokens(1)
+        for name in ("s1", "s2"):
+            self.manager.registerBurner(name, "127.0.0.1", 1, ["a", "b"],
+                                        storage=SHARED)
+        self.manager.registerBurner("l1", "127.0.0.1", 1, ["b"])
+
+    def readers(self):
+        """Returns the names of the busy burners that read from SHARED."""
+        return sorted([name for name in self.assigned().keys()
+                       if name.startswith("s")])
+
+    def testLimits(self):
+        """limitsReads() tells whether any limit is set."""
+        self.assertTrue(self.manager.limitsReads())
+        self.manager.setReadTokens(0, {SHARED: 0})
+        self.assertFalse(self.manager.limitsReads())
+        self.manager.setReadTokens(0, {SHARED: 2})
+        self.assertTrue(self.manager.limitsReads())
+
+    def testOneReader(self):
+        """Only one burner reads from the storage; the local one is not
+        limited, and the token goes to the next iso when it is free."""
+        for committer in ("c1", "c2", "c3"):
+            self.manager.queueIso("a", committer)
+        self.manager.queueIso("b", "c4")
+        self.manager.refresh()
+        self.assertEqual(len(self.readers()), 1)
+        self.assertEqual(self.assigned()["l1"], "b")
+        reader = self.readers()[0]
+        self.manager.reportCompletion(reader, "a")
+        self.manager.refresh()
+        self.assertEqual(len(self.readers()), 1)
+        self.assertEqual(len(self.manager.getPendingIsos()), 1)
+
+    def testStorageLimit(self):
+        """A storage can have its own number of tokens."""
+        self.manager.setReadTokens(1, {SHARED: 2})
+        for committer in ("c1", "c2", "c3"):
+            self.manager.queueIso("a", committer)
+        self.manager.refresh()
+        self.assertEqual(self.readers(), ["s1", "s2"])
+
+    def testPassRunAgain(self):
+        """When a scheduler gives isos to more readers than there are
+        tokens, the pass runs again without them."""
+        self.manager.setDispatchMode("matching")
+        self.manager.queueIso("a", "c1")
+        self.manager.queueIso("b", "c2")
+        self.manager.refresh()
+        self.assertEqual(len(self.readers()), 1)
+        self.assertEqual(self.assigned()["l1"], "b")
+
+    def testSet(self):
+        """A set does not start on more readers than there are tokens."""
+        self.manager.queueSet(["a", "a"], "c1")
+        self.manager.refresh()
+        self.assertEqual(self.readers(), [])
+        self.manager.setReadTokens(2)
+        self.manager.refresh()
+        self.assertEqual(self.readers(), ["s1", "s2"])
+
+    def testCountKept(self):
+        """The readers are counted again after a cancellation, a burner
+        leaving, and a restart."""
+        self.manager.queueIso("a", "c1")
+        self.manager.queueIso("a", "c2")
+        self.manager.refresh()
+        self.manager.cancelIso(self.manager.getIsosBeingBurnt()[0])
+        self.manager.refresh()
+        self.assertEqual(len(self.readers()), 1)
+        self.reload()
+        self.manager.setReadTokens(1)
+        self.manager.queueIso("a", "c3")
+        self.manager.refresh()
+        self.assertEqual(len(self.readers()), 1)
+        reader = self.readers()[0]
+        self.manager.reportClosingBurner(reader)
+        self.manager.refresh()
+        self.assertEqual(len(self.readers()), 1)
+        self.assertNotEqual(self.readers()[0], reader)
+
+    def testNoSteal(self):
+        """An idle burner without a token does not steal isos."""
+        self.manager.setPushAhead(1)
+        self.manager.burners["s2"].isos = ["b"]
+        self.manager.queueIso("a", "c1")
+        self.manager.queueIso("a", "c2")
+        self.manager.refresh()
+        self.assertEqual(self.manager.burners["s1"].jobs,
+                         [("a", "c1"), ("a", "c2")])
+        self.manager.burners["s2"].isos = ["a", "b"]
+        self.manager.refresh()
+        self.assertEqual(self.assigned(), {"s1": "a"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import unittest
+import os
+import time
+import threading
+import logging
+
+from custom_burner.server.writer import WriterThread
+from custom_burner.server.tests.fakes import ManagerTestCase
+
+
+class WriterThreadTest(unittest.TestCase):
+    """Tests the group commit of writer.WriterThread."""
+
+    def setUp(self):
+        """Creates a writer that counts its writes."""
+        self.writes = 0
+        self.writer = WriterThread(self.write)
+
+    def tearDown(self):
+        """Stops the writer."""
+        self.writer.stop()
+
+    def write(self):
+        """Counts a write."""
+        self.writes += 1
+
+    def waitForWrites(self, writes):
+        """Waits up to 5 seconds for the given number of writes."""
+        deadline = time.time() + 5
+        while self.writes < writes and time.time() < deadline:
+            time.sleep(0.01)
+
+    def testImmediate(self):
+        """With an interval of 0, each change is written by the thread that
+        notifies it, and no thread is started."""
+        self.writer.setInterval(0)
+        self.writer.changed()
+        self.writer.changed()
+        self.assertEqual(self.writes, 2)
+        self.assertFalse(self.writer.isAlive())
+
+    def testGroupCommit(self):
+        """The changes of an interval are written together, in the
+        background."""
+        self.writer.setInterval(0.2)
+        for i in range(5):
+            self.writer.changed()
+        self.assertEqual(self.writes, 0)
+        self.waitForWrites(1)
+        time.sleep(0.1)
+        self.assertEqual(self.writes, 1)
+        self.writer.changed()
+        self.waitForWrites(2)
+        self.assertEqual(self.writes, 2)
+
+    def testFlush(self):
+        """flush() writes the pending changes at once, and nothing if there
+        are none."""
+        self.writer.setInterval(60)
+        self.writer.flush()
+        self.assertEqual(self.writes, 0)
+        self.writer.changed()
+        self.writer.flush()
+        self.assertEqual(self.writes, 1)
+        self.writer.flush()
+        self.assertEqual(self.writes, 1)
+
+    def testFlushFromManyThreads(self):
+        """Concurrent flushes write each change once, and each of them
+        returns after it is written."""
+        self.writer.setInterval(60)
+        self.writer.changed()
+        threads = [threading.Thread(target=self.writer.flush)
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.writes, 1)
+
+    def testStop(self):
+        """stop() writes the pending changes and ends the thread."""
+        self.writer.setInterval(60)
+        self.writer.changed()
+        self.writer.stop()
+        self.assertEqual(self.writes, 1)
+        self.assertFalse(self.writer.isAlive())
+
+
+class BackgroundSaveTest(ManagerTestCase):
+    """Tests how the manager saves its state through the writer."""
+
+    def setUp(self):
+        """Registers b1, that has "a" and "b"."""
+        ManagerTestCase.setUp(self)
+        logging.getLogger("Journal").setLevel(logging.CRITICAL)
+        self.manager.registerBurner("b1", "127.0.0.1", 1, ["a", "b"])
+
+    def queued(self):
+        """Returns the isos of the pending jobs."""
+        return [isoData["iso"] for isoData in self.manager.pendingIsos]
+
+    def testFlush(self):
+        """The changes reach the disk when the interval is over, or when
+        flush() is called."""
+        manager = self.manager
+        manager.setSaveInterval(60)
+        try:
+            size = os.path.getsize(manager.journalFileName)
+            manager.queueIso("a", "c1")
+            manager.queueIso("b", "c1")
+            self.assertEqual(os.path.getsize(manager.journalFileName), size)
+            manager.flush()
+            self.assertTrue(os.path.getsize(manager.journalFileName) > size)
+            self.reload()
+            self.assertEqual(self.queued(), ["a", "b"])
+        finally:
+            manager.close() # Stops its writer
+
+    def testCheckpoint(self):
+        """A checkpoint is renamed over the db file, and contains the burnt
+        isos; the journal is emptied."""
+        self.manager.queueIso("a", "c1")
+        self.manager.queueIso("b", "c1")
+        self.manager.refresh()
+        self.manager.reportCompletion("b1", "a")
+        self.manager.flush(checkpoint=True)
+        self.assertFalse(os.path.exists(self.manager.dbFileName + ".tmp"))
+        self.assertEqual(os.path.getsize(self.manager.journalFileName), 0)
+        self.reload()
+        self.assertEqual([isoData["iso"] for isoData
+                          in self.manager.getBurntIsos()], ["a"])
+        self.assertEqual(self.queued(), ["b"])
+
+    def testWriteError(self):
+        """When a checkpoint cannot be written, the journal is kept, and the
+        next change writes a checkpoint."""
+        logging.getLogger("BurnerManager").setLevel(logging.CRITICAL + 1)
+        dbFileName = self.manager.dbFileName
+        # The temporary file of the checkpoint cannot be created
+        os.mkdir(dbFileName + ".tmp")
+        self.manager.queueIso("a", "c1")
+        self.manager.flush(checkpoint=True)
+        self.assertTrue(os.path.getsize(self.manager.journalFileName) > 0)
+        self.assertFalse(os.path.exists(dbFileName))
+        os.rmdir(dbFileName + ".tmp")
+        self.manager.queueIso("b", "c1")
+        self.assertTrue(os.path.exists(dbFileName))
+        self.assertEqual(os.path.getsize(self.manager.journalFileName), 0)
+        self.reload()
+        self.assertEqual(self.queued(), ["a", "b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
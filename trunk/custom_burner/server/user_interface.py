@@ -25,7 +25,10 @@ Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 """
 
 import sys
+import time
 import csv
+from custom_burner import common
+from deadline import *
 
 class UserInterface:
     """The class that asks input from the user."""
@@ -35,20 +38,48 @@ class UserInterface:
         """
         self.burnerManager = burnerManager
 
+    def __askJobDetails(self):
+        """Asks for whom a job is, its priority, its deadline and the labels
+        of the burners that may burn it.
+
+        Returns the tuple (committer, priority, deadline, selector).
+
+        Raises ValueError if the user enters invalid data."""
+        print "For whom? ",
+        committer = sys.stdin.readline().strip()
+        print "Priority [0]: ",
+        temp = sys.stdin.readline().strip()
+        if temp:
+            priority = int(temp)
+        else:
+            priority = 0
+        print "Deadline (%s, empty for none): " % DEADLINE_HELP,
+        deadline = parseDeadline(sys.stdin.readline())
+        print "Burner labels (key=value,..., empty for any burner): ",
+        selector = common.parseLabels(sys.stdin.readline())
+        return (committer, priority, deadline, selector)
+
+    def __printIsos(self):
+        """Prints the numbered list of the available isos.
+
+        Returns the list, or an empty list if no isos are available."""
+        isos = self.burnerManager.getIsos()
+        if len(isos) == 0:
+            print "No isos available! You need to connect a burner!"
+            return isos
+        for i in range(len(isos)):
+            print "%2d: %s" % (i + 1, isos[i])
+        print
+        return isos
+
     def __isoMenu(self):
         """Shows a menu for burning an iso."""
         endMenu = False
         while not endMenu:
             print "Select an ISO from the list:"
-            i = 0
-            isos = self.burnerManager.getIsos()
-            isoNum = len(isos)
-            if isoNum == 0:
-                print "No isos available! You need to connect a burner!"
+            isos = self.__printIsos()
+            if len(isos) == 0:
                 return
-            for i in range(isoNum):
-                print "%2d: %s" % (i + 1, isos[i])
-            print
             print "Your selection (0 exits):",
             try:
                 temp = int(sys.stdin.readline())
@@ -56,27 +87,89 @@ class UserInterface:
                     endMenu = True
                 else:
                     iso = isos[temp - 1]
-                    print "For whom? ",
-                    committer = sys.stdin.readline().strip()
+                    (committer, priority, deadline,
+                     selector) = self.__askJobDetails()
                     print
                     print "Confirm burning %s for %s? (y/n):" % \
                           (iso, committer),
                     temp = sys.stdin.readline().strip()
                     if temp.lower() == "y":
-                        self.burnerManager.queueIso(iso, committer)
+                        self.burnerManager.queueIso(iso, committer, priority,
+                                                    deadline, selector)
                         endMenu = True
                     # Else just ask again
             except ValueError, e:
                 pass # We just show the menu again
 
+    def __setMenu(self):
+        """Shows a menu for burning a set of isos together."""
+        endMenu = False
+        while not endMenu:
+            print "Select the ISOs of the set from the list:"
+            isos = self.__printIsos()
+            if len(isos) == 0:
+                return
+            print "Your selection, separated by spaces (0 exits):",
+            try:
+                choices = [int(c) for c in sys.stdin.readline().split()]
+                if not choices or 0 in choices:
+                    endMenu = True
+                else:
+                    members = [isos[c - 1] for c in choices]
+                    (committer, priority, deadline,
+                     selector) = self.__askJobDetails()
+                    print
+                    print "Confirm burning %s for %s? (y/n):" % \
+                          (", ".join(members), committer),
+                    temp = sys.stdin.readline().strip()
+                    if temp.lower() == "y":
+                        self.burnerManager.queueSet(members, committer,
+                                                    priority, deadline,
+                                                    selector)
+                        endMenu = True
+            except (ValueError, IndexError):
+                pass # We just show the menu again
+
+    def __listSets(self):
+        """Lists the sets of isos that are not complete yet."""
+        sets = self.burnerManager.getSets()
+        print
+        if len(sets) > 0:
+            print "Incomplete sets:", len(sets)
+            for setData in sets:
+                print "Set %d:" % setData["set"], setData["date"], \
+                      setData["committer"], "%d/%d burnt:" % \
+                      (setData["burnt"], len(setData["isos"])), \
+                      ", ".join(setData["isos"])
+        else:
+            print "No incomplete sets."
+        print
+
     def __listPendingIsos(self):
         """Lists the isos waiting to be burnt."""
-        isos = self.burnerManager.getPendingIsos()
+        isos = self.burnerManager.getPendingIsos(withSlack=True)
         print
         if len(isos) > 0:
             print "Pending isos:", len(isos)
             for iso in isos:
-                print iso["date"], iso["iso"], iso["committer"]
+                print iso["date"], iso["iso"], iso["committer"],
+                if iso.get("set") is not None:
+                    print "(set %d)" % iso["set"],
+                if iso.get("selector"):
+                    print "[%s]" % common.formatLabels(iso["selector"]),
+                if iso.get("parked"):
+                    print "(no burner has it)",
+                elif iso.get("notBefore") is not None:
+                    print "(failed %d times, retry at %s)" % \
+                          (iso["retries"], time.strftime(
+                        "%H:%M", time.localtime(iso["notBefore"]))),
+                if iso.get("deadline") is not None:
+                    print "due", formatDeadline(iso["deadline"]),
+                    if iso["slack"] is not None:
+                        print "slack", formatSlack(iso["slack"]),
+                        if iso["slack"] < 0:
+                            print "LATE",
+                print
         else:
             print "No isos pending."
         print
@@ -105,8 +198,17 @@ class UserInterface:
         print
 
     def __listBurntIsos(self):
-        """Lists the isos that have been burnt."""
-        isos = self.burnerManager.getBurntIsos()
+        """Lists the isos that have been burnt, optionally only the ones
+        of a committer, iso or burner."""
+        print "Filter (committer=..., iso=..., burner=..., empty for all): ",
+        try:
+            filters = dict(common.parseLabels(sys.stdin.readline()))
+            isos = self.burnerManager.getBurntIsos(filters.get("committer"),
+                                                   filters.get("iso"),
+                                                   filters.get("burner"))
+        except ValueError, e:
+            print str(e)
+            return
         print
         if len(isos) > 0:
             print "Burnt isos:", len(isos)
@@ -121,8 +223,8 @@ class UserInterface:
         """Outputs a list of the isos that have been burnt in CSV format,
         together with some statistics."""
         fileName = "burntIsos.csv"
-        isos = self.burnerManager.getBurntIsos()
-        if len(isos) > 0:
+        statistics = self.burnerManager.getStatistics()
+        if statistics.isos:
             print "Filename [%s]: " % (fileName),
             c = sys.stdin.readline().strip()
             if c:
@@ -131,43 +233,71 @@ class UserInterface:
                 outFile = csv.writer(open(fileName, "w"))
                 outFile.writerow(["No.", "Req. date", "ISO", "Committer",
                                   "Burner"])
-                isosCounters = dict()
-                burnersCounters = dict()
                 i = 1
-                for iso in isos:
+                for iso in self.burnerManager.getBurntIsos():
                     outFile.writerow([i, iso["date"], iso["iso"],
                                       iso["committer"], iso["burner"]])
-                    if iso["iso"] in isosCounters:
-                        isosCounters[iso["iso"]] += 1
-                    else:
-                        isosCounters[iso["iso"]] = 1
-                    if iso["burner"] in burnersCounters:
-                        burnersCounters[iso["burner"]] += 1
-                    else:
-                        burnersCounters[iso["burner"]] = 1
                     i += 1
                 # Statistics
-                secondMember = lambda x:x[1] # Needed for sort() below
-                outFile.writerow([])
-                outFile.writerow(["ISO Statistics"])
-                outFile.writerow(["ISO", "Requests"])
-                items = isosCounters.items()
-                items.sort(key=secondMember, reverse=True)
-                for item in items:
-                    outFile.writerow(list(item))
-                outFile.writerow([])
-                outFile.writerow(["Burners Statistics"])
-                outFile.writerow(["Burner", "ISOs burnt"])
-                items = burnersCounters.items()
-                items.sort(key=secondMember, reverse=True)
-                for item in items:
-                    outFile.writerow(list(item))
+                for (title, header, counts, byTime) in \
+                        [("ISO Statistics", ["ISO", "Requests"],
+                          statistics.isos, False),
+                         ("Burners Statistics", ["Burner", "ISOs burnt"],
+                          statistics.burners, False),
+                         ("Committers Statistics", ["Committer", "ISOs burnt"],
+                          statistics.committers, False),
+                         ("Daily Statistics", ["Day", "ISOs burnt"],
+                          statistics.days, True),
+                         ("Hourly Statistics", ["Hour", "ISOs burnt"],
+                          statistics.hours, True)]:
+                    outFile.writerow([])
+                    outFile.writerow([title])
+                    outFile.writerow(header + ["Failures"])
+                    for (key, (burnt, failed)) in \
+                            self.__sortedCounts(counts, byTime):
+                        outFile.writerow([key, burnt, failed])
             except IOError, e:
                 sys.stderr.write(str(e) + "\n")
         else:
             print "No isos burnt."
         print
 
+    def __sortedCounts(self, counts, byTime=False):
+        """Returns the items of a dict of counts of a
+        burnstats.BurnStatistics: by key if byTime is True, otherwise
+        from the most burnt."""
+        items = counts.items()
+        if byTime:
+            items.sort()
+        else:
+            items.sort(key=lambda item: item[1][0], reverse=True)
+        return items
+
+    def __showStatistics(self):
+        """Shows how many isos the burners and the committers have burnt,
+        the most burnt isos and the last days."""
+        statistics = self.burnerManager.getStatistics()
+        print
+        if not statistics.isos:
+            print "No isos burnt."
+            print
+            return
+        for (title, counts, byTime, limit) in \
+                [("Burners", statistics.burners, False, None),
+                 ("Committers", statistics.committers, False, None),
+                 ("Most burnt isos", statistics.isos, False, 10),
+                 ("Last days", statistics.days, True, 7)]:
+            items = self.__sortedCounts(counts, byTime)
+            if limit is not None:
+                if byTime:
+                    items = items[-limit:]
+                else:
+                    items = items[:limit]
+            print "%s (burnt, failed):" % title
+            for (key, (burnt, failed)) in items:
+                print "  %s: %d, %d" % (key, burnt, failed)
+        print
+
     def __listWorkedIsos(self):
         """Lists the isos that are being burnt."""
         isos = self.burnerManager.getIsosBeingBurnt()
@@ -181,6 +311,32 @@ class UserInterface:
         print
     
 
+    def __cancelBurningIso(self):
+        """Lets the user stop an iso that has been assigned to a burner."""
+        isos = self.burnerManager.getIsosBeingBurnt()
+        print
+        if len(isos) > 0:
+            print "Isos currently being burnt:", len(isos)
+            for i in range(len(isos)):
+                iso = isos[i]
+                print i + 1, ":", iso["date"], iso["iso"], iso["committer"], \
+                      iso["burner"]
+            try:
+                choice = int(raw_input("ISO to cancel: ")) - 1
+                confirmation = raw_input("Confirm cancelling iso %s for %s "
+                                         "on %s (y/n): " %
+                                         (isos[choice]["iso"],
+                                          isos[choice]["committer"],
+                                          isos[choice]["burner"]))
+                if confirmation.lower() == "y":
+                    if not self.burnerManager.cancelIso(isos[choice]):
+                        print "The burner did not stop the iso."
+            except (ValueError, IndexError):
+                pass # Cancelled
+        else:
+            print "No isos currently being burnt."
+        print
+
     def __listBurners(self):
         """Lists the burners registered to this server."""
         burners = self.burnerManager.getBurners()
@@ -189,10 +345,23 @@ class UserInterface:
             print "Burners:", len(burners)
             for burner in burners:
                 print burner["name"], burner["ip"] + ":" + str(burner["port"]),
+                if burner["suspect"]:
+                    print "(SUSPECT: no signs of life)",
+                if burner["quarantined"]:
+                    print "(QUARANTINED)",
+                print "fails %d%%," % (100 * burner["failureRate"]),
+                print "burns %s," % "/".join(burner["capabilities"]),
+                if burner["labels"]:
+                    print "[%s]" % common.formatLabels(burner["labels"]),
+                if burner["storage"]:
+                    print "reads from %s," % burner["storage"],
                 if burner["iso"] != None:
-                    print "burning", burner["iso"], "for", burner["committer"]
+                    print "burning", burner["iso"], "for", burner["committer"],
+                    if burner["queued"] > 0:
+                        print "(%d more queued)" % burner["queued"],
+                    print
                 else:
-                    print "idle"
+                    print "idle, media: %s" % burner["media"]
         else:
             print "No burners registered."
         print
@@ -204,30 +373,42 @@ class UserInterface:
             print "Enter a command from the list:"
             print
             print "a : add an iso to the queue"
+            print "s : add a set of isos, to be burnt together, to the queue"
+            print "S : list incomplete sets"
             print "l : list queue of pending isos"
             print "w : list isos being burnt"
             print "d : list burnt isos"
             print "c : output burnt isos in CSV format"
+            print "t : show burn statistics"
             print "b : list burners"
             print "r : refresh queues, check for free burners and " \
                   "unassigned jobs."
             print "D : delete pending iso"
+            print "x : cancel an iso being burnt"
             print "q : quit"
             print
             print "Your choice:",
             c = sys.stdin.readline().strip()
             if c == "a":
                 self.__isoMenu()
+            elif c == "s":
+                self.__setMenu()
+            elif c == "S":
+                self.__listSets()
             elif c == "l":
                 self.__listPendingIsos()
             elif c == "w":
                 self.__listWorkedIsos()
             elif c == "c":
                 self.__outputCSV()
+            elif c == "t":
+                self.__showStatistics()
             elif c == "d":
                 self.__listBurntIsos()
             elif c == "D":
                 self.__deletePendingIso()
+            elif c == "x":
+                self.__cancelBurningIso()
             elif c == "b":
                 self.__listBurners()
             elif c == "r":
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""This file is part of:
+Custom Burner server
+Copyright 2008 Arrigo Marchiori
+This program is distributed under the terms of the GNU General Public
+License, as specified in the COPYING file.
+
+This file is part of Custom Burner.
+
+Custom Burner is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+Custom Burner is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Custom Burner; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import time
+import threading
+
+
+class WriterThread(threading.Thread):
+    """Thread that writes the state of the server to disk in the
+    background.
+
+    The changes are notified with changed(). The thread waits interval
+    seconds after the first change, and then writes all the changes of
+    that interval together (group commit), so that the threads that make
+    the changes never wait for the disk. With an interval of 0, each
+    change is written immediately by the thread that notifies it, and the
+    thread is not needed: setInterval() starts it.
+
+    Instance variables:
+
+    interval: how many seconds the changes are gathered for
+    """
+
+    def __init__(self, write, interval=1.0):
+        """Constructor.
+
+        write: function that writes the current state to disk. It is
+        called with no arguments, by one thread at a time."""
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.interval = interval
+        self.__write = write
+        self.__writeLock = threading.Lock()
+        self.__condition = threading.Condition()
+        # Changes notified, and changes written to disk
+        self.__changes = 0
+        self.__written = 0
+        self.__stopping = False
+        self.__started = False
+
+    def setInterval(self, interval):
+        """Changes interval, starting the thread if it is greater than 0
+        for the first time."""
+        self.interval = interval
+        if interval > 0 and not self.__started:
+            self.__started = True
+            self.start()
+
+    def changed(self):
+        """Notifies a change of the state."""
+        self.__condition.acquire()
+        try:
+            self.__changes += 1
+            self.__condition.notifyAll()
+        finally:
+            self.__condition.release()
+        if self.interval <= 0 or not self.isAlive():
+            self.flush()
+
+    def flush(self):
+        """Returns when all the changes notified so far have been written to
+        disk, writing them in the calling thread if needed."""
+        self.__writeLock.acquire()
+        try:
+            self.__condition.acquire()
+            try:
+                target = self.__changes
+                if self.__written >= target:
+                    return
+            finally:
+                self.__condition.release()
+            # The state is read after target: it contains those changes
+            self.__write()
+            self.__condition.acquire()
+            try:
+                self.__written = max(self.__written, target)
+            finally:
+                self.__condition.release()
+        finally:
+            self.__writeLock.release()
+
+    def stop(self):
+        """Writes the pending changes and ends the thread."""
+        self.__condition.acquire()
+        try:
+            self.__stopping = True
+            self.__condition.notifyAll()
+        finally:
+            self.__condition.release()
+        if self.isAlive():
+            self.join()
+        self.flush()
+
+    def run(self):
+        """Main loop."""
+        while True:
+            self.__condition.acquire()
+            try:
+                while self.__written >= self.__changes and \
+                          not self.__stopping:
+                    self.__condition.wait()
+                if self.__stopping:
+                    return # stop() writes what is left
+                # Gather the changes of the next interval
+                deadline = time.time() + self.interval
+                while not self.__stopping and time.time() < deadline:
+                    self.__condition.wait(deadline - time.time())
+            finally:
+                self.__condition.release()
+            self.flush()